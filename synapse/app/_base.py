@@ -31,6 +31,7 @@ from synapse.app import check_bind_error
 from synapse.crypto import context_factory
 from synapse.logging.context import PreserveLoggingContext
 from synapse.util.async_helpers import Linearizer
+from synapse.util.caches.lrucache import setup_expire_lru_cache_entries
 from synapse.util.rlimit import change_resource_limit
 from synapse.util.versionstring import get_version_string
 
@@ -277,6 +278,9 @@ def start(hs, listeners=None):
         hs.start_listening(listeners)
         hs.get_datastore().db.start_profiling()
 
+        # Start expiring idle entries from the caches.
+        setup_expire_lru_cache_entries(hs)
+
         setup_sentry(hs)
         setup_sdnotify(hs)
     except Exception:
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import sys
+
+from twisted.internet import reactor
+from twisted.web.resource import NoResource
+
+import synapse
+from synapse import events
+from synapse.app import _base
+from synapse.config._base import ConfigError
+from synapse.config.homeserver import HomeServerConfig
+from synapse.config.logger import setup_logging
+from synapse.http.server import JsonResource
+from synapse.http.site import SynapseSite
+from synapse.logging.context import LoggingContext
+from synapse.metrics import METRICS_PREFIX, MetricsResource, RegistryProxy
+from synapse.replication.http import REPLICATION_PREFIX
+from synapse.replication.http.persist_events import ReplicationPersistEventsRestServlet
+from synapse.replication.slave.storage._base import BaseSlavedStore, __func__
+from synapse.replication.slave.storage.devices import SlavedDeviceStore
+from synapse.replication.slave.storage.events import SlavedEventStore
+from synapse.replication.tcp.client import ReplicationClientHandler
+from synapse.server import HomeServer
+from synapse.storage.data_stores.main.cache import CacheInvalidationStore
+from synapse.storage.data_stores.main.event_push_actions import (
+    EventPushActionsWorkerStore,
+)
+from synapse.storage.data_stores.main.events import EventsStore
+from synapse.storage.data_stores.main.rejections import RejectionsStore
+from synapse.storage.data_stores.main.relations import RelationsStore
+from synapse.storage.data_stores.main.room import RoomStore
+from synapse.storage.data_stores.main.roommember import RoomMemberStore
+from synapse.storage.data_stores.main.signatures import SignatureStore
+from synapse.storage.data_stores.main.state import StateStore
+from synapse.storage.data_stores.main.stream import StreamWorkerStore
+from synapse.storage.data_stores.main.user_erasure_store import UserErasureWorkerStore
+from synapse.storage.database import Database
+from synapse.storage.util.id_generators import build_stream_id_generator
+from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.httpresourcetree import create_resource_tree
+from synapse.util.manhole import manhole
+from synapse.util.versionstring import get_version_string
+
+logger = logging.getLogger("synapse.app.event_persister")
+
+
+class EventPersisterSlavedStore(
+    EventsStore,
+    StateStore,
+    RoomMemberStore,
+    RoomStore,
+    RelationsStore,
+    RejectionsStore,
+    SignatureStore,
+    EventPushActionsWorkerStore,
+    StreamWorkerStore,
+    UserErasureWorkerStore,
+    SlavedDeviceStore,
+    BaseSlavedStore,
+):
+    def __init__(self, database: Database, db_conn, hs):
+        # Stream orderings are allocated from the database, as the master and
+        # any other event persisters are allocating them too.
+        self._stream_id_gen = build_stream_id_generator(
+            db_conn,
+            database,
+            "events",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.events,
+            "events",
+            "stream_ordering",
+            "events_stream_seq",
+            extra_tables=[("local_invites", "stream_id")],
+        )
+        self._backfill_id_gen = build_stream_id_generator(
+            db_conn,
+            database,
+            "backfill",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.events,
+            "events",
+            "stream_ordering",
+            "events_backfill_stream_seq",
+            step=-1,
+            extra_tables=[("ex_outlier_stream", "event_stream_ordering")],
+        )
+
+        super(EventPersisterSlavedStore, self).__init__(database, db_conn, hs)
+
+        self._curr_state_delta_stream_cache = StreamChangeCache(
+            "_curr_state_delta_stream_cache", self._stream_id_gen.get_current_token(),
+        )
+
+    # Changes to current state are streamed out by the master, which we ask to
+    # do so over replication.
+    _invalidate_state_caches_and_stream = __func__(
+        CacheInvalidationStore._invalidate_state_caches_and_stream
+    )
+
+    _process_event_stream_row = __func__(SlavedEventStore._process_event_stream_row)
+    invalidate_caches_for_event = __func__(SlavedEventStore.invalidate_caches_for_event)
+
+    def get_room_max_stream_ordering(self):
+        return self._stream_id_gen.get_current_token()
+
+    def get_room_min_stream_ordering(self):
+        return self._backfill_id_gen.get_current_token()
+
+    def stream_positions(self):
+        result = super(EventPersisterSlavedStore, self).stream_positions()
+        result["events"] = self._stream_id_gen.get_current_token()
+        result["backfill"] = -self._backfill_id_gen.get_current_token()
+        return result
+
+    def process_replication_rows(self, stream_name, token, rows):
+        # The master streams out all events, including those we persisted.
+        if stream_name == "events":
+            self._stream_id_gen.advance(token)
+            for row in rows:
+                self._process_event_stream_row(token, row)
+        elif stream_name == "backfill":
+            self._backfill_id_gen.advance(-token)
+            for row in rows:
+                self.invalidate_caches_for_event(
+                    -token,
+                    row.event_id,
+                    row.room_id,
+                    row.type,
+                    row.state_key,
+                    row.redacts,
+                    row.relates_to,
+                    backfilled=True,
+                )
+        return super(EventPersisterSlavedStore, self).process_replication_rows(
+            stream_name, token, rows
+        )
+
+
+class EventPersisterServer(HomeServer):
+    DATASTORE_CLASS = EventPersisterSlavedStore
+
+    def _listen_http(self, listener_config):
+        port = listener_config["port"]
+        bind_addresses = listener_config["bind_addresses"]
+        site_tag = listener_config.get("tag", port)
+        resources = {}
+        for res in listener_config["resources"]:
+            for name in res["names"]:
+                if name == "metrics":
+                    resources[METRICS_PREFIX] = MetricsResource(RegistryProxy)
+                elif name == "replication":
+                    resource = JsonResource(self, canonical_json=False)
+                    ReplicationPersistEventsRestServlet(self).register(resource)
+                    resources[REPLICATION_PREFIX] = resource
+
+        root_resource = create_resource_tree(resources, NoResource())
+
+        _base.listen_tcp(
+            bind_addresses,
+            port,
+            SynapseSite(
+                "synapse.access.http.%s" % (site_tag,),
+                site_tag,
+                listener_config,
+                root_resource,
+                self.version_string,
+            ),
+        )
+
+        logger.info("Synapse event persister now listening on port %d", port)
+
+    def start_listening(self, listeners):
+        for listener in listeners:
+            if listener["type"] == "http":
+                self._listen_http(listener)
+            elif listener["type"] == "manhole":
+                _base.listen_tcp(
+                    listener["bind_addresses"],
+                    listener["port"],
+                    manhole(
+                        username="matrix", password="rabbithole", globals={"hs": self}
+                    ),
+                )
+            elif listener["type"] == "metrics":
+                if not self.get_config().enable_metrics:
+                    logger.warning(
+                        (
+                            "Metrics listener configured, but "
+                            "enable_metrics is not True!"
+                        )
+                    )
+                else:
+                    _base.listen_metrics(listener["bind_addresses"], listener["port"])
+            else:
+                logger.warning("Unrecognized listener type: %s", listener["type"])
+
+        self.get_tcp_replication().start_replication(self)
+
+    def build_tcp_replication(self):
+        return ReplicationClientHandler(self.get_datastore())
+
+
+def start(config_options):
+    try:
+        config = HomeServerConfig.load_config("Synapse event persister", config_options)
+    except ConfigError as e:
+        sys.stderr.write("\n" + str(e) + "\n")
+        sys.exit(1)
+
+    assert config.worker_app == "synapse.app.event_persister"
+
+    if config.worker.instance_name not in config.worker.writers.events:
+        sys.stderr.write(
+            "\nWorker %r is not listed in 'stream_writers.events'\n"
+            % (config.worker.instance_name,)
+        )
+        sys.exit(1)
+
+    # This should only be done on the user directory worker or the master
+    config.update_user_directory = False
+
+    events.USE_FROZEN_DICTS = config.use_frozen_dicts
+
+    ss = EventPersisterServer(
+        config.server_name,
+        config=config,
+        version_string="Synapse/" + get_version_string(synapse),
+    )
+
+    setup_logging(ss, config, use_worker_options=True)
+
+    ss.setup()
+    reactor.addSystemEventTrigger(
+        "before", "startup", _base.start, ss, config.worker_listeners
+    )
+
+    _base.start_worker_reactor("synapse-event-persister", config)
+
+
+if __name__ == "__main__":
+    with LoggingContext("main"):
+        start(sys.argv[1:])
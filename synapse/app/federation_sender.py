@@ -21,6 +21,7 @@ from twisted.web.resource import NoResource
 
 import synapse
 from synapse import events
+from synapse.api.constants import EventTypes
 from synapse.app import _base
 from synapse.config._base import ConfigError
 from synapse.config.homeserver import HomeServerConfig
@@ -43,8 +44,9 @@ from synapse.replication.tcp.streams._base import (
     ReceiptsStream,
     ToDeviceStream,
 )
+from synapse.replication.tcp.streams.events import EventsStreamCurrentStateRow
 from synapse.server import HomeServer
-from synapse.storage.database import Database
+from synapse.storage.database import Database, LoggingTransaction
 from synapse.types import ReadReceipt
 from synapse.util.async_helpers import Linearizer
 from synapse.util.httpresourcetree import create_resource_tree
@@ -73,11 +75,23 @@ class FederationSenderSlaveStore(
         self.federation_out_pos_startup = self._get_federation_out_pos(db_conn)
 
     def _get_federation_out_pos(self, db_conn):
-        sql = "SELECT stream_id FROM federation_stream_position WHERE type = ?"
-        sql = self.database_engine.convert_param_style(sql)
+        txn = LoggingTransaction(
+            db_conn.cursor(),
+            name="_get_federation_out_pos",
+            database_engine=self.database_engine,
+        )
+
+        # Make sure the positions match the configured federation senders
+        # before reading ours, as a newly added instance won't have one yet.
+        if self._need_to_reset_federation_stream_positions:
+            self._reset_federation_positions_txn(txn)
+            self._need_to_reset_federation_stream_positions = False
 
-        txn = db_conn.cursor()
-        txn.execute(sql, ("federation",))
+        txn.execute(
+            "SELECT stream_id FROM federation_stream_position"
+            " WHERE type = ? AND instance_name = ?",
+            ("federation", self._instance_name),
+        )
         rows = txn.fetchall()
         txn.close()
 
@@ -192,6 +206,18 @@ def start(config_options):
         )
         sys.exit(1)
 
+    federation_sender_instances = config.worker.federation_shard_config.instances
+    if (
+        federation_sender_instances
+        and config.worker.instance_name not in federation_sender_instances
+    ):
+        sys.stderr.write(
+            "\nThis worker's worker_name (%s) must be listed in"
+            "\nfederation_sender_instances in the shared config.\n"
+            % (config.worker.instance_name,)
+        )
+        sys.exit(1)
+
     # Force the pushers to start since they will be disabled in the main config
     config.send_federation = True
 
@@ -220,7 +246,9 @@ class FederationSenderHandler(object):
         self.store = hs.get_datastore()
         self._is_mine_id = hs.is_mine_id
         self.federation_sender = hs.get_federation_sender()
+        self._presence_index = hs.get_presence_interest_index()
         self.replication_client = replication_client
+        self._instance_name = hs.config.worker.instance_name
 
         self.federation_position = self.store.federation_out_pos_startup
         self._fed_position_linearizer = Linearizer(name="_fed_position_linearizer")
@@ -254,6 +282,21 @@ class FederationSenderHandler(object):
         elif stream_name == "events":
             self.federation_sender.notify_new_events(token)
 
+            # ... and keep track of who is in which room, so we know where to
+            # send presence.
+            member_rows = [
+                row.data
+                for row in rows
+                if row.type == EventsStreamCurrentStateRow.TypeId
+                and row.data.type == EventTypes.Member
+            ]
+            if member_rows:
+                run_as_background_process(
+                    "process_membership_for_presence",
+                    self._on_new_memberships,
+                    member_rows,
+                )
+
         # ... and when new receipts happen
         elif stream_name == ReceiptsStream.NAME:
             run_as_background_process(
@@ -274,6 +317,18 @@ class FederationSenderHandler(object):
             for host in hosts:
                 self.federation_sender.send_device_messages(host)
 
+    @defer.inlineCallbacks
+    def _on_new_memberships(self, rows):
+        """
+        Args:
+            rows (iterable[EventsStreamCurrentStateRow]): changes to room
+                memberships
+        """
+        for row in rows:
+            yield self._presence_index.process_membership_delta(
+                row.room_id, row.state_key, row.event_id
+            )
+
     @defer.inlineCallbacks
     def _on_new_receipts(self, rows):
         """
@@ -309,7 +364,7 @@ class FederationSenderHandler(object):
                     # We ACK this token over replication so that the master can drop
                     # its in memory queues
                     self.replication_client.send_federation_ack(
-                        self.federation_position
+                        self._instance_name, self.federation_position
                     )
                     self._last_ack = self.federation_position
         except Exception:
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import sys
+
+from twisted.internet import reactor
+from twisted.web.resource import NoResource
+
+import synapse
+from synapse import events
+from synapse.app import _base
+from synapse.config._base import ConfigError
+from synapse.config.homeserver import HomeServerConfig
+from synapse.config.logger import setup_logging
+from synapse.handlers.presence import PresenceHandler
+from synapse.http.server import JsonResource
+from synapse.http.site import SynapseSite
+from synapse.logging.context import LoggingContext
+from synapse.metrics import METRICS_PREFIX, MetricsResource, RegistryProxy
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.replication.http import REPLICATION_PREFIX
+from synapse.replication.http.presence import (
+    ReplicationBumpPresenceActiveTimeRestServlet,
+    ReplicationIncomingPresenceRestServlet,
+    ReplicationPresenceClearSyncsRestServlet,
+    ReplicationPresenceSetStateRestServlet,
+    ReplicationPresenceUpdateRestServlet,
+    ReplicationPresenceUserSyncRestServlet,
+)
+from synapse.replication.slave.storage._base import BaseSlavedStore
+from synapse.replication.slave.storage.presence import SlavedPresenceStore
+from synapse.replication.tcp.client import ReplicationClientHandler
+from synapse.server import HomeServer
+from synapse.util.httpresourcetree import create_resource_tree
+from synapse.util.manhole import manhole
+from synapse.util.versionstring import get_version_string
+
+logger = logging.getLogger("synapse.app.presence_writer")
+
+
+class PresenceWriterSlavedStore(SlavedPresenceStore, BaseSlavedStore):
+    pass
+
+
+class PresenceWriterHandler(PresenceHandler):
+    """Handles the presence of the users assigned to this presence writer.
+
+    Other processes pass on anything which affects the presence of those users,
+    and we hand the resulting updates to the master to persist and send out.
+    """
+
+    def __init__(self, hs):
+        super(PresenceWriterHandler, self).__init__(hs)
+
+        self._send_update = ReplicationPresenceUpdateRestServlet.make_client(hs)
+
+    def _persist_states(self, states):
+        return self._send_update(action="persist", states=states)
+
+    def _persist_and_notify(self, states):
+        return self._send_update(action="notify", states=states)
+
+    def _push_to_remotes(self, states):
+        run_as_background_process(
+            "presence.push_to_remotes", self._send_update, action="ping", states=states
+        )
+
+
+class PresenceWriterServer(HomeServer):
+    DATASTORE_CLASS = PresenceWriterSlavedStore
+
+    def _listen_http(self, listener_config):
+        port = listener_config["port"]
+        bind_addresses = listener_config["bind_addresses"]
+        site_tag = listener_config.get("tag", port)
+        resources = {}
+        for res in listener_config["resources"]:
+            for name in res["names"]:
+                if name == "metrics":
+                    resources[METRICS_PREFIX] = MetricsResource(RegistryProxy)
+                elif name == "replication":
+                    resource = JsonResource(self, canonical_json=False)
+                    ReplicationPresenceSetStateRestServlet(self).register(resource)
+                    ReplicationBumpPresenceActiveTimeRestServlet(self).register(
+                        resource
+                    )
+                    ReplicationPresenceUserSyncRestServlet(self).register(resource)
+                    ReplicationPresenceClearSyncsRestServlet(self).register(resource)
+                    ReplicationIncomingPresenceRestServlet(self).register(resource)
+                    resources[REPLICATION_PREFIX] = resource
+
+        root_resource = create_resource_tree(resources, NoResource())
+
+        _base.listen_tcp(
+            bind_addresses,
+            port,
+            SynapseSite(
+                "synapse.access.http.%s" % (site_tag,),
+                site_tag,
+                listener_config,
+                root_resource,
+                self.version_string,
+            ),
+            reactor=self.get_reactor(),
+        )
+
+        logger.info("Synapse presence writer now listening on port %d", port)
+
+    def start_listening(self, listeners):
+        for listener in listeners:
+            if listener["type"] == "http":
+                self._listen_http(listener)
+            elif listener["type"] == "manhole":
+                _base.listen_tcp(
+                    listener["bind_addresses"],
+                    listener["port"],
+                    manhole(
+                        username="matrix", password="rabbithole", globals={"hs": self}
+                    ),
+                )
+            elif listener["type"] == "metrics":
+                if not self.get_config().enable_metrics:
+                    logger.warning(
+                        (
+                            "Metrics listener configured, but "
+                            "enable_metrics is not True!"
+                        )
+                    )
+                else:
+                    _base.listen_metrics(listener["bind_addresses"], listener["port"])
+            else:
+                logger.warning("Unrecognized listener type: %s", listener["type"])
+
+        self.get_tcp_replication().start_replication(self)
+
+    def build_tcp_replication(self):
+        return ReplicationClientHandler(self.get_datastore())
+
+    def build_presence_handler(self):
+        return PresenceWriterHandler(self)
+
+
+def start(config_options):
+    try:
+        config = HomeServerConfig.load_config("Synapse presence writer", config_options)
+    except ConfigError as e:
+        sys.stderr.write("\n" + str(e) + "\n")
+        sys.exit(1)
+
+    assert config.worker_app == "synapse.app.presence_writer"
+
+    if config.worker.instance_name not in config.worker.writers.presence:
+        sys.stderr.write(
+            "\nWorker %r is not listed in 'stream_writers.presence'\n"
+            % (config.worker.instance_name,)
+        )
+        sys.exit(1)
+
+    # This should only be done on the user directory worker or the master
+    config.update_user_directory = False
+
+    events.USE_FROZEN_DICTS = config.use_frozen_dicts
+
+    ps = PresenceWriterServer(
+        config.server_name,
+        config=config,
+        version_string="Synapse/" + get_version_string(synapse),
+    )
+
+    setup_logging(ps, config, use_worker_options=True)
+
+    ps.setup()
+    reactor.addSystemEventTrigger(
+        "before", "startup", _base.start, ps, config.worker_listeners
+    )
+
+    _base.start_worker_reactor("synapse-presence-writer", config)
+
+
+if __name__ == "__main__":
+    with LoggingContext("main"):
+        start(sys.argv[1:])
@@ -48,7 +48,11 @@ from synapse.replication.slave.storage.receipts import SlavedReceiptsStore
 from synapse.replication.slave.storage.registration import SlavedRegistrationStore
 from synapse.replication.slave.storage.room import RoomStore
 from synapse.replication.tcp.client import ReplicationClientHandler
-from synapse.replication.tcp.streams.events import EventsStreamEventRow, EventsStreamRow
+from synapse.replication.tcp.streams.events import (
+    EventsStreamCurrentStateRow,
+    EventsStreamEventRow,
+    EventsStreamRow,
+)
 from synapse.rest.client.v1 import events
 from synapse.rest.client.v1.initial_sync import InitialSyncRestServlet
 from synapse.rest.client.v1.room import RoomInitialSyncRestServlet
@@ -98,6 +102,7 @@ class SynchrotronPresence(object):
         self.user_to_num_current_syncs = {}
         self.clock = hs.get_clock()
         self.notifier = hs.get_notifier()
+        self._presence_index = hs.get_presence_interest_index()
 
         active_presence = self.store.take_presence_startup_info()
         self.user_to_current_state = {state.user_id: state for state in active_presence}
@@ -156,6 +161,11 @@ class SynchrotronPresence(object):
         # TODO Hows this supposed to work?
         return defer.succeed(None)
 
+    def _is_presence_writer_for(self, user_id):
+        # We keep the presence of every user up to date from replication, so
+        # can use `user_to_current_state` for all of them.
+        return True
+
     get_states = __func__(PresenceHandler.get_states)
     get_state = __func__(PresenceHandler.get_state)
     current_state_for_users = __func__(PresenceHandler.current_state_for_users)
@@ -191,7 +201,7 @@ class SynchrotronPresence(object):
 
     @defer.inlineCallbacks
     def notify_from_replication(self, states, stream_id):
-        parties = yield get_interested_parties(self.store, states)
+        parties = yield get_interested_parties(self._presence_index, states)
         room_ids_to_states, users_to_states = parties
 
         self.notifier.on_new_event(
@@ -360,6 +370,7 @@ class SyncReplicationHandler(ReplicationClientHandler):
         self.typing_handler = hs.get_typing_handler()
         # NB this is a SynchrotronPresence, not a normal PresenceHandler
         self.presence_handler = hs.get_presence_handler()
+        self.presence_index = hs.get_presence_interest_index()
         self.notifier = hs.get_notifier()
 
     async def on_rdata(self, stream_name, token, rows):
@@ -380,6 +391,12 @@ class SyncReplicationHandler(ReplicationClientHandler):
                 # We shouldn't get multiple rows per token for events stream, so
                 # we don't need to optimise this for multiple rows.
                 for row in rows:
+                    if row.type == EventsStreamCurrentStateRow.TypeId:
+                        if row.data.type == EventTypes.Member:
+                            await self.presence_index.process_membership_delta(
+                                row.data.room_id, row.data.state_key, row.data.event_id
+                            )
+                        continue
                     if row.type != EventsStreamEventRow.TypeId:
                         continue
                     assert isinstance(row, EventsStreamRow)
@@ -3,6 +3,7 @@ from typing import Any, List, Optional
 from synapse.config import (
     api,
     appservice,
+    cache,
     captcha,
     cas,
     consent_config,
@@ -45,6 +46,7 @@ class RootConfig:
     server: server.ServerConfig
     tls: tls.TlsConfig
     database: database.DatabaseConfig
+    caches: cache.CacheConfig
     logging: logger.LoggingConfig
     ratelimit: ratelimiting.RatelimitConfig
     media: repository.ContentRepositoryConfig
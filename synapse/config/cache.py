@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches import set_cache_expiry_times
+
+from ._base import Config, ConfigError
+
+
+class CacheConfig(Config):
+    section = "caches"
+
+    def read_config(self, config, **kwargs):
+        cache_config = config.get("caches") or {}
+
+        self.cache_expiry_time_msec = None
+        expiry_time = cache_config.get("expiry_time")
+        if expiry_time is not None:
+            self.cache_expiry_time_msec = self.parse_duration(expiry_time)
+
+        per_cache_expiry_time = cache_config.get("per_cache_expiry_time") or {}
+        if not isinstance(per_cache_expiry_time, dict):
+            raise ConfigError("caches.per_cache_expiry_time must be a dictionary")
+
+        self.cache_expiry_time_msec_by_name = {
+            cache_name: self.parse_duration(expiry_time)
+            for cache_name, expiry_time in per_cache_expiry_time.items()
+        }
+
+        set_cache_expiry_times(
+            self.cache_expiry_time_msec, self.cache_expiry_time_msec_by_name
+        )
+
+    def generate_config_section(self, **kwargs):
+        return """\
+        ## Caching ##
+
+        # Entries in the caches are normally only evicted once a cache is full.
+        # Setting an expiry time also removes entries which have not been used
+        # for that long, so that memory is given back after a burst of
+        # activity.
+        #
+        #caches:
+        #  # How long entries may go unused before they are expired from the
+        #  # caches. By default, entries do not expire.
+        #  #
+        #  expiry_time: 30m
+        #
+        #  # Expiry times for individual caches, by cache name, overriding
+        #  # expiry_time.
+        #  #
+        #  per_cache_expiry_time:
+        #    get_users_in_room: 5m
+        """
@@ -156,7 +156,26 @@ class ContentRepositoryConfig(Config):
                 (provider_class, parsed_config, wrapper_config)
             )
 
+        self.media_cache_max_size = None
+        if config.get("media_cache_max_size") is not None:
+            if not self.media_storage_providers:
+                raise ConfigError(
+                    "'media_cache_max_size' requires 'media_storage_providers'"
+                )
+            self.media_cache_max_size = self.parse_size(config["media_cache_max_size"])
+
         self.dynamic_thumbnails = config.get("dynamic_thumbnails", False)
+
+        self.enable_media_deduplication = config.get(
+            "enable_media_deduplication", False
+        )
+
+        self.thumbnail_processes = config.get("thumbnail_processes", 2)
+        if not isinstance(self.thumbnail_processes, int) or (
+            self.thumbnail_processes < 0
+        ):
+            raise ConfigError("thumbnail_processes must be a non-negative integer")
+
         self.thumbnail_requirements = parse_thumbnail_requirements(
             config.get("thumbnail_sizes", DEFAULT_THUMBNAIL_SIZES)
         )
@@ -230,6 +249,14 @@ class ContentRepositoryConfig(Config):
         #    config:
         #       directory: /mnt/some/other/directory
 
+        # The maximum size of the local media store, when it is being used as a
+        # cache in front of the storage providers. Once it is bigger than this,
+        # the least recently used files are deleted from it, as long as they
+        # are in one of the storage providers. Only files stored after this is
+        # set are counted. By default the local media store is unbounded.
+        #
+        #media_cache_max_size: 10G
+
         # The largest allowed upload size in bytes
         #
         #max_upload_size: 10M
@@ -246,6 +273,19 @@ class ContentRepositoryConfig(Config):
         #
         #dynamic_thumbnails: false
 
+        # The number of processes to generate thumbnails in, so that
+        # thumbnailing large images doesn't hold up the rest of the server.
+        # If 0, thumbnails are generated in threads in this process instead.
+        #
+        #thumbnail_processes: 2
+
+        # Whether to store media which has the same content as media we
+        # already have as a hard link to the existing file, rather than as a
+        # separate copy. The existing thumbnails are reused too. Only media
+        # stored after this is enabled is deduplicated.
+        #
+        #enable_media_deduplication: false
+
         # List of thumbnails to precalculate when an image is uploaded.
         #
         #thumbnail_sizes:
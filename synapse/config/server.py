@@ -417,6 +417,12 @@ class ServerConfig(Config):
 
         self.gc_thresholds = read_gc_thresholds(config.get("gc_thresholds", None))
 
+        # The number of processes to resolve large state conflicts in. Zero
+        # means that state resolution happens in the main process.
+        self.state_resolution_processes = int(
+            config.get("state_resolution_processes", 0)
+        )
+
         @attr.s
         class LimitRemoteRoomsConfig(object):
             enabled = attr.ib(
@@ -667,6 +673,12 @@ class ServerConfig(Config):
         #
         #gc_thresholds: [700, 10, 10]
 
+        # The number of separate processes to resolve large state conflicts
+        # in, so that doing so doesn't hold up other requests. By default,
+        # state resolution happens in the main process.
+        #
+        #state_resolution_processes: 2
+
         # Set the limit on the returned events in the timeline in the get
         # and sync operations. The default value is -1, means no upper limit.
         #
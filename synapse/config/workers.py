@@ -13,7 +13,82 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from ._base import Config
+import hashlib
+from typing import List
+
+import attr
+
+from ._base import Config, ConfigError
+
+
+@attr.s
+class InstanceLocationConfig:
+    """The host and port to talk to an instance via HTTP replication.
+    """
+
+    host = attr.ib(type=str)
+    port = attr.ib(type=int)
+
+
+@attr.s
+class WriterLocations:
+    """Specifies the instances that write various streams.
+
+    Attributes:
+        events: The instances that write to the event and backfill streams.
+        account_data: The instances that write to the account data stream.
+        receipts: The instances that write to the receipts stream.
+        to_device: The instances that write to the to-device stream.
+        presence: The instances that handle presence, each for a share of the
+            users.
+    """
+
+    events = attr.ib(default=["master"], type=List[str])
+    account_data = attr.ib(default=["master"], type=List[str])
+    receipts = attr.ib(default=["master"], type=List[str])
+    to_device = attr.ib(default=["master"], type=List[str])
+    presence = attr.ib(default=["master"], type=List[str])
+
+
+@attr.s
+class ShardedWorkerHandlingConfig:
+    """Algorithm for choosing which instance is responsible for handling some
+    sharded work.
+
+    For example, the event persisters are sharded by room ID, so that all
+    events in a room are persisted by the same instance.
+    """
+
+    instances = attr.ib(type=List[str])
+
+    def should_handle(self, instance_name: str, key: str) -> bool:
+        """Whether this instance is responsible for handling the given key.
+
+        If no instances are configured then the work isn't sharded, and
+        whichever instance does it handles every key.
+        """
+        if not self.instances:
+            return True
+
+        return self.get_instance(key) == instance_name
+
+    def get_instance(self, key: str) -> str:
+        """Get the instance responsible for handling the given key.
+
+        We use a stable hash (rather than python's `hash`, which is randomised
+        per process) so that every process agrees on the answer.
+        """
+        if len(self.instances) == 1:
+            return self.instances[0]
+
+        dest_hash = hashlib.sha256(key.encode("utf8")).digest()
+        dest_int = int.from_bytes(dest_hash, byteorder="little")
+        return self.instances[dest_int % len(self.instances)]
+
+
+# The modes of the TCP replication protocol, in order of preference. C.f.
+# `synapse.replication.tcp.framing`.
+_REPLICATION_MODES = ("binary-zlib", "binary", "text")
 
 
 class WorkerConfig(Config):
@@ -44,10 +119,84 @@ class WorkerConfig(Config):
         # The port on the main synapse for HTTP replication endpoint
         self.worker_replication_http_port = config.get("worker_replication_http_port")
 
+        # The mode of the TCP replication protocol to ask the main synapse for:
+        # "text", or one of the binary modes, in which case we also offer it
+        # the less preferred ones.
+        self.worker_replication_mode = config.get(
+            "worker_replication_mode", _REPLICATION_MODES[0]
+        )
+        if self.worker_replication_mode not in _REPLICATION_MODES:
+            raise ConfigError(
+                "worker_replication_mode must be one of: %s"
+                % (", ".join(_REPLICATION_MODES),)
+            )
+
         self.worker_name = config.get("worker_name", self.worker_app)
 
+        # When using redis, each process publishes its replication commands on
+        # a channel named after its instance name, so workers can't share the
+        # default name.
+        redis_enabled = (config.get("redis") or {}).get("enabled", False)
+        if redis_enabled and self.worker_app is not None:
+            if "worker_name" not in config:
+                raise ConfigError("worker_name must be set when redis is enabled")
+            if self.worker_name == "master":
+                raise ConfigError(
+                    "worker_name must not be 'master', which is the name of the"
+                    " main process"
+                )
+
+        # The name of this instance, as used in `instance_map` and
+        # `stream_writers`. The main process is always called "master".
+        self.instance_name = "master" if self.worker_app is None else self.worker_name
+
         self.worker_main_http_uri = config.get("worker_main_http_uri", None)
 
+        # A map from instance name to host/port of their HTTP replication
+        # endpoint.
+        instance_map = config.get("instance_map") or {}
+        self.instance_map = {
+            name: InstanceLocationConfig(**c) for name, c in instance_map.items()
+        }
+
+        # Map from type of streams to source, c.f. WriterLocations.
+        writers = config.get("stream_writers") or {}
+        self.writers = WriterLocations(**writers)
+
+        for stream_name, instances in attr.asdict(self.writers).items():
+            if not instances:
+                raise ConfigError(
+                    "Must specify at least one writer for %s" % (stream_name,)
+                )
+
+        # Check that the configured writers for events and presence also
+        # appear in `instance_map`, so that we know where to send work to them.
+        for stream_name in ("events", "presence"):
+            for instance in getattr(self.writers, stream_name):
+                if instance != "master" and instance not in self.instance_map:
+                    raise ConfigError(
+                        "Instance %r is configured to write %s but does not"
+                        " appear in `instance_map` config." % (instance, stream_name)
+                    )
+
+        self.events_shard_config = ShardedWorkerHandlingConfig(self.writers.events)
+
+        # Presence is sharded by user ID between the presence writers.
+        self.presence_shard_config = ShardedWorkerHandlingConfig(self.writers.presence)
+
+        # The federation sender instances, between which the destinations are
+        # sharded. If empty, a single instance (either the main process or a
+        # federation sender worker) sends to every destination.
+        federation_sender_instances = config.get("federation_sender_instances") or []
+        if not isinstance(federation_sender_instances, list) or not all(
+            isinstance(i, str) for i in federation_sender_instances
+        ):
+            raise ConfigError("federation_sender_instances must be a list of names")
+
+        self.federation_shard_config = ShardedWorkerHandlingConfig(
+            federation_sender_instances
+        )
+
         # This option is really only here to support `--manhole` command line
         # argument.
         manhole = config.get("worker_manhole")
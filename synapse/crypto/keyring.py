@@ -21,6 +21,7 @@ import six
 from six.moves import urllib
 
 import attr
+from prometheus_client import Counter, Histogram
 from signedjson.key import (
     decode_verify_key_bytes,
     encode_verify_key_base64,
@@ -35,6 +36,7 @@ from signedjson.sign import (
 from unpaddedbase64 import decode_base64
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 from synapse.api.errors import (
     Codes,
@@ -45,18 +47,52 @@ from synapse.api.errors import (
 from synapse.logging.context import (
     LoggingContext,
     PreserveLoggingContext,
+    defer_to_thread,
     make_deferred_yieldable,
     preserve_fn,
     run_in_background,
 )
+from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage.keys import FetchKeyResult
 from synapse.util import unwrapFirstError
 from synapse.util.async_helpers import yieldable_gather_results
+from synapse.util.caches import register_cache
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.metrics import Measure
 from synapse.util.retryutils import NotRetryingDestination
 
 logger = logging.getLogger(__name__)
 
+# The maximum number of signatures to check in each call out to the thread pool.
+# Large batches are split up so that they are checked in parallel.
+VERIFY_BATCH_SIZE = 100
+
+# The maximum number of keys to keep in the in-memory key cache.
+KEY_CACHE_SIZE = 10000
+
+# How often we look for keys which need refreshing.
+KEY_REFRESH_INTERVAL_MS = 60 * 1000
+
+# How long before a key expires we try to refresh it...
+KEY_REFRESH_BEFORE_EXPIRY_MS = 30 * 60 * 1000
+
+# ... if it has been used within this long.
+KEY_ACTIVE_WINDOW_MS = 60 * 60 * 1000
+
+# How long we wait before trying to refresh a key again if we didn't manage to
+# get a fresh enough copy.
+KEY_REFRESH_RETRY_MS = 5 * 60 * 1000
+
+key_refresh_counter = Counter(
+    "synapse_keyring_key_refreshes", "Refreshes of server keys", ["outcome"]
+)
+
+key_refresh_lag = Histogram(
+    "synapse_keyring_key_refresh_lag_seconds",
+    "How long after a key became due for refresh it was refreshed",
+    buckets=(1, 5, 30, 60, 120, 300, 600, 1800, "+Inf"),
+)
+
 
 @attr.s(slots=True, cmp=False)
 class VerifyJsonRequest(object):
@@ -99,7 +135,19 @@ class KeyLookupError(ValueError):
 
 
 class Keyring(object):
-    def __init__(self, hs, key_fetchers=None):
+    """Verifies signatures on JSON objects, fetching the keys as necessary.
+
+    Args:
+        hs (HomeServer)
+        key_fetchers (Iterable[KeyFetcher]|None): the fetchers to try, in
+            order. Defaults to the store, the configured key servers and then
+            the origin server.
+        batch_verify (bool): whether `verify_json_objects_for_server` should
+            check signatures in batches on the reactor's thread pool, rather
+            than one at a time on the reactor.
+    """
+
+    def __init__(self, hs, key_fetchers=None, batch_verify=True):
         self.clock = hs.get_clock()
 
         if key_fetchers is None:
@@ -110,6 +158,29 @@ class Keyring(object):
             )
         self._key_fetchers = key_fetchers
 
+        self._batch_verifier = _BatchVerifier(hs) if batch_verify else None
+
+        # In-memory cache of the keys returned by any of the fetchers, so that
+        # we only go to the fetchers for keys we don't have a recent enough
+        # copy of:
+        #    (server_name, key_id) -> FetchKeyResult
+        self._key_cache = LruCache(KEY_CACHE_SIZE)
+        self._key_cache_metrics = register_cache(
+            "cache", "server_verify_keys", self._key_cache
+        )
+
+        # When each cached key was last used to satisfy a request, so that we
+        # can refresh the keys of active servers before they expire:
+        #    (server_name, key_id) -> ts
+        self._key_last_used = {}
+
+        # When we last tried and failed to refresh each key:
+        #    (server_name, key_id) -> ts
+        self._key_refresh_attempts = {}
+
+        self._refreshing_keys = False
+        self.clock.looping_call(self._start_refresh_keys, KEY_REFRESH_INTERVAL_MS)
+
         # map from server name to Deferred. Has an entry for each server with
         # an ongoing key download; the Deferred completes once the download
         # completes.
@@ -156,6 +227,10 @@ class Keyring(object):
                 request_name is an identifier for this json object (eg, an event id)
                 for logging.
 
+        Unless disabled, the signatures are checked in batches on the reactor's
+        thread pool, so that checking a whole transaction (or `/send_join`
+        response) doesn't block the reactor.
+
         Returns:
             List<Deferred[None]>: for each input triplet, a deferred indicating success
                 or failure to verify each json object's signature for the given
@@ -163,17 +238,23 @@ class Keyring(object):
                 logcontext.
         """
         return self._verify_objects(
-            VerifyJsonRequest(server_name, json_object, validity_time, request_name)
-            for server_name, json_object, validity_time, request_name in server_and_json
+            (
+                VerifyJsonRequest(server_name, json_object, validity_time, request_name)
+                for server_name, json_object, validity_time, request_name in server_and_json
+            ),
+            batch_verifier=self._batch_verifier,
         )
 
-    def _verify_objects(self, verify_requests):
+    def _verify_objects(self, verify_requests, batch_verifier=None):
         """Does the work of verify_json_[objects_]for_server
 
 
         Args:
             verify_requests (iterable[VerifyJsonRequest]):
                 Iterable of verification requests.
+            batch_verifier (_BatchVerifier|None): the verifier to check the
+                signatures with once the keys are available, or None to check
+                them inline.
 
         Returns:
             List<Deferred[None]>: for each input item, a deferred indicating success
@@ -216,7 +297,7 @@ class Keyring(object):
             #
             # We want _handle_key_request to log to the right context, so we
             # wrap it with preserve_fn (aka run_in_background)
-            return handle(verify_request)
+            return handle(verify_request, batch_verifier)
 
         results = [process(r) for r in verify_requests]
 
@@ -333,6 +414,8 @@ class Keyring(object):
         @defer.inlineCallbacks
         def do_iterations():
             with Measure(self.clock, "get_server_verify_keys"):
+                self._satisfy_requests_from_cache(remaining_requests)
+
                 for f in self._key_fetchers:
                     if not remaining_requests:
                         return
@@ -366,6 +449,157 @@ class Keyring(object):
 
         run_in_background(do_iterations).addErrback(on_err)
 
+    def _satisfy_requests_from_cache(self, remaining_requests):
+        """Complete any key requests which can be satisfied by the key cache
+
+        Args:
+            remaining_requests (set[VerifyJsonRequest]): outstanding key requests.
+                Any successfully-completed requests will be removed from the list.
+        """
+        completed = []
+        for verify_request in remaining_requests:
+            server_name = verify_request.server_name
+            for key_id in verify_request.key_ids:
+                fetch_key_result = self._key_cache.get((server_name, key_id))
+                if (
+                    fetch_key_result is None
+                    or fetch_key_result.valid_until_ts
+                    < verify_request.minimum_valid_until_ts
+                ):
+                    continue
+
+                self._key_last_used[(server_name, key_id)] = self.clock.time_msec()
+                with PreserveLoggingContext():
+                    verify_request.key_ready.callback(
+                        (server_name, key_id, fetch_key_result.verify_key)
+                    )
+                completed.append(verify_request)
+                break
+
+        for _ in completed:
+            self._key_cache_metrics.inc_hits()
+        for _ in range(len(remaining_requests) - len(completed)):
+            self._key_cache_metrics.inc_misses()
+
+        remaining_requests.difference_update(completed)
+
+    def _cache_fetched_keys(self, results):
+        """Add the results of a key fetch to the key cache
+
+        Args:
+            results (dict[str, dict[str, FetchKeyResult|None]]): the result of
+                KeyFetcher.get_keys
+        """
+        for server_name, keys in results.items():
+            for key_id, fetch_key_result in keys.items():
+                if not fetch_key_result:
+                    continue
+
+                cache_key = (server_name, key_id)
+                existing = self._key_cache.get(cache_key)
+                if (
+                    existing is None
+                    or existing.valid_until_ts < fetch_key_result.valid_until_ts
+                ):
+                    self._key_cache[cache_key] = fetch_key_result
+
+    def _start_refresh_keys(self):
+        if self._refreshing_keys:
+            return
+
+        return run_as_background_process("refresh_server_keys", self._refresh_keys)
+
+    @defer.inlineCallbacks
+    def _refresh_keys(self):
+        """Re-fetch any recently used keys which are about to expire, so that
+        requests from those servers don't have to wait for the keys to be
+        fetched once they have.
+        """
+        self._refreshing_keys = True
+        try:
+            now = self.clock.time_msec()
+
+            # server_name -> key_id -> min_valid_ts
+            keys_to_fetch = defaultdict(dict)
+            # (server_name, key_id) -> when the key became due for refresh
+            due_ts = {}
+
+            for cache_key, last_used in list(self._key_last_used.items()):
+                if last_used < now - KEY_ACTIVE_WINDOW_MS:
+                    self._key_last_used.pop(cache_key)
+                    self._key_refresh_attempts.pop(cache_key, None)
+                    continue
+
+                fetch_key_result = self._key_cache.get(cache_key)
+                if fetch_key_result is None:
+                    continue
+
+                # there's no point refreshing keys which have already expired:
+                # they are only used to check old objects.
+                valid_until_ts = fetch_key_result.valid_until_ts
+                refresh_ts = valid_until_ts - KEY_REFRESH_BEFORE_EXPIRY_MS
+                if not refresh_ts <= now < valid_until_ts:
+                    continue
+
+                last_attempt = self._key_refresh_attempts.get(cache_key, 0)
+                if last_attempt > now - KEY_REFRESH_RETRY_MS:
+                    continue
+
+                server_name, key_id = cache_key
+                keys_to_fetch[server_name][key_id] = now + KEY_REFRESH_BEFORE_EXPIRY_MS
+                due_ts[cache_key] = refresh_ts
+
+            if not keys_to_fetch:
+                return
+
+            logger.info("Refreshing keys for %i servers", len(keys_to_fetch))
+
+            with Measure(self.clock, "refresh_server_keys"):
+                for fetcher in self._key_fetchers:
+                    if not keys_to_fetch:
+                        break
+
+                    try:
+                        results = yield fetcher.get_keys(
+                            {s: dict(keys) for s, keys in keys_to_fetch.items()}
+                        )
+                    except Exception:
+                        logger.exception("Error refreshing keys with %s", fetcher)
+                        continue
+
+                    self._cache_fetched_keys(results)
+
+                    for server_name, keys in results.items():
+                        for key_id, fetch_key_result in keys.items():
+                            min_valid_ts = keys_to_fetch[server_name].get(key_id)
+                            if (
+                                min_valid_ts is None
+                                or not fetch_key_result
+                                or fetch_key_result.valid_until_ts < min_valid_ts
+                            ):
+                                continue
+
+                            del keys_to_fetch[server_name][key_id]
+                            cache_key = (server_name, key_id)
+                            self._key_refresh_attempts.pop(cache_key, None)
+                            key_refresh_counter.labels("success").inc()
+                            key_refresh_lag.observe(
+                                (self.clock.time_msec() - due_ts[cache_key]) / 1000.0
+                            )
+
+                        if not keys_to_fetch[server_name]:
+                            del keys_to_fetch[server_name]
+
+            for server_name, keys in keys_to_fetch.items():
+                for key_id in keys:
+                    logger.warning(
+                        "Failed to refresh key %s for %s", key_id, server_name
+                    )
+                    self._key_refresh_attempts[(server_name, key_id)] = now
+                    key_refresh_counter.labels("failure").inc()
+        finally:
+            self._refreshing_keys = False
+
     @defer.inlineCallbacks
     def _attempt_key_fetches_with_fetcher(self, fetcher, remaining_requests):
         """Use a key fetcher to attempt to satisfy some key requests
@@ -395,6 +629,7 @@ class Keyring(object):
                 )
 
         results = yield fetcher.get_keys(missing_keys)
+        self._cache_fetched_keys(results)
 
         completed = list()
         for verify_request in remaining_requests:
@@ -416,6 +651,7 @@ class Keyring(object):
                     # key was not valid at this point
                     continue
 
+                self._key_last_used[(server_name, key_id)] = self.clock.time_msec()
                 with PreserveLoggingContext():
                     verify_request.key_ready.callback(
                         (server_name, key_id, fetch_key_result.verify_key)
@@ -843,11 +1079,13 @@ class ServerKeyFetcher(BaseV2KeyFetcher):
 
 
 @defer.inlineCallbacks
-def _handle_key_deferred(verify_request):
+def _handle_key_deferred(verify_request, batch_verifier=None):
     """Waits for the key to become available, and then performs a verification
 
     Args:
         verify_request (VerifyJsonRequest):
+        batch_verifier (_BatchVerifier|None): the verifier to queue the check
+            on, or None to check the signature inline.
 
     Returns:
         Deferred[None]
@@ -861,20 +1099,121 @@ def _handle_key_deferred(verify_request):
 
     json_object = verify_request.json_object
 
-    try:
-        verify_signed_json(json_object, server_name, verify_key)
-    except SignatureVerifyException as e:
+    if batch_verifier is not None:
+        with PreserveLoggingContext():
+            error = yield batch_verifier.verify(json_object, server_name, verify_key)
+    else:
+        error = _verify_signed_json(json_object, server_name, verify_key)
+
+    if error is not None:
         logger.debug(
             "Error verifying signature for %s:%s:%s with key %s: %s",
             server_name,
             verify_key.alg,
             verify_key.version,
             encode_verify_key_base64(verify_key),
-            str(e),
+            error,
         )
         raise SynapseError(
             401,
             "Invalid signature for server %s with key %s:%s: %s"
-            % (server_name, verify_key.alg, verify_key.version, str(e)),
+            % (server_name, verify_key.alg, verify_key.version, error),
             Codes.UNAUTHORIZED,
         )
+
+
+def _verify_signed_json(json_object, server_name, verify_key):
+    """Checks the signature on a JSON object.
+
+    Returns:
+        str|None: a description of the problem if the signature is invalid,
+            otherwise None.
+    """
+    try:
+        verify_signed_json(json_object, server_name, verify_key)
+    except SignatureVerifyException as e:
+        return str(e)
+    return None
+
+
+def _verify_signed_json_batch(batch):
+    """Checks the signatures on a list of JSON objects. Called on a thread.
+
+    Args:
+        batch (list[Tuple[dict, str, nacl.signing.VerifyKey]]): the
+            (json_object, server_name, verify_key) to check
+
+    Returns:
+        list[str|None]: for each input, the result of `_verify_signed_json`
+    """
+    return [
+        _verify_signed_json(json_object, server_name, verify_key)
+        for json_object, server_name, verify_key in batch
+    ]
+
+
+class _BatchVerifier(object):
+    """Collects the signatures whose keys have become available and checks
+    them in batches on the reactor's thread pool.
+
+    Keys tend to become available for many objects at once (eg, when the keys
+    for the origin of a transaction have been fetched), so we gather up all the
+    checks queued in the same reactor tick, and then check them in chunks of
+    VERIFY_BATCH_SIZE.
+    """
+
+    def __init__(self, hs):
+        self._reactor = hs.get_reactor()
+        self._clock = hs.get_clock()
+
+        # list of (json_object, server_name, verify_key, Deferred) waiting to be
+        # checked
+        self._pending = []
+
+    def verify(self, json_object, server_name, verify_key):
+        """Queues up a signature check.
+
+        Returns:
+            Deferred[str|None]: resolves with a description of the problem if
+                the signature is invalid, otherwise None. Runs its callbacks in
+                the sentinel logcontext.
+        """
+        if not self._pending:
+            self._clock.call_later(0, self._flush)
+
+        d = defer.Deferred()
+        self._pending.append((json_object, server_name, verify_key, d))
+        return d
+
+    def _flush(self):
+        pending = self._pending
+        self._pending = []
+
+        for i in range(0, len(pending), VERIFY_BATCH_SIZE):
+            run_as_background_process(
+                "verify_signatures",
+                self._verify_batch,
+                pending[i : i + VERIFY_BATCH_SIZE],
+            )
+
+    @defer.inlineCallbacks
+    def _verify_batch(self, batch):
+        try:
+            results = yield defer_to_thread(
+                self._reactor,
+                _verify_signed_json_batch,
+                [
+                    (json_object, server_name, key)
+                    for json_object, server_name, key, _ in batch
+                ],
+            )
+        except Exception:
+            f = Failure()
+            with PreserveLoggingContext():
+                for _, _, _, d in batch:
+                    d.errback(f)
+            return
+
+        with PreserveLoggingContext():
+            for (_, _, _, d), result in zip(batch, results):
+                d.callback(result)
@@ -21,6 +21,8 @@ from typing import Optional, Type
 
 import six
 
+from canonicaljson import encode_canonical_json, json
+from frozendict import frozendict
 from unpaddedbase64 import encode_base64
 
 from synapse.api.room_versions import EventFormatVersions, RoomVersion, RoomVersions
@@ -97,6 +99,35 @@ class DefaultDictProperty(DictProperty):
         return instance._dict.get(self.key, self.default)
 
 
+class _CompactableDictProperty(DictProperty):
+    """A DictProperty for a field which may be held encoded by
+    `EventBase.compact`, in which case accessing it decodes the event's
+    compacted fields.
+    """
+
+    __slots__ = []  # type: list
+
+    def __get__(self, instance, owner=None):
+        if instance is not None and instance._compacted_json is not None:
+            instance._expand()
+        return super().__get__(instance, owner)
+
+    def __set__(self, instance, v):
+        if instance._compacted_json is not None:
+            instance._expand()
+        super().__set__(instance, v)
+
+    def __delete__(self, instance):
+        if instance._compacted_json is not None:
+            instance._expand()
+        super().__delete__(instance)
+
+
+# The keys of the event dict which `EventBase.compact` encodes (along with the
+# signatures). The content is read far too often to be worth encoding.
+_COMPACTED_KEYS = ("hashes",)
+
+
 class _EventInternalMetadata(object):
     __slots__ = ["_dict"]
 
@@ -200,6 +231,15 @@ class _EventInternalMetadata(object):
 
 
 class EventBase(object):
+    __slots__ = [
+        "_dict",
+        "_signatures",
+        "_compacted_json",
+        "unsigned",
+        "rejected_reason",
+        "internal_metadata",
+    ]
+
     def __init__(
         self,
         event_dict,
@@ -208,18 +248,22 @@ class EventBase(object):
         internal_metadata_dict={},
         rejected_reason=None,
     ):
-        self.signatures = signatures
+        self._signatures = signatures
         self.unsigned = unsigned
         self.rejected_reason = rejected_reason
 
         self._dict = event_dict
 
+        # The encoded hashes and signatures, if the event has been
+        # compacted.
+        self._compacted_json = None  # type: Optional[bytes]
+
         self.internal_metadata = _EventInternalMetadata(internal_metadata_dict)
 
     auth_events = DictProperty("auth_events")
     depth = DictProperty("depth")
     content = DictProperty("content")
-    hashes = DictProperty("hashes")
+    hashes = _CompactableDictProperty("hashes")
     origin = DictProperty("origin")
     origin_server_ts = DictProperty("origin_server_ts")
     prev_events = DictProperty("prev_events")
@@ -234,6 +278,18 @@ class EventBase(object):
     def event_id(self) -> str:
         raise NotImplementedError()
 
+    @property
+    def signatures(self):
+        if self._compacted_json is not None:
+            self._expand()
+        return self._signatures
+
+    @signatures.setter
+    def signatures(self, signatures):
+        if self._compacted_json is not None:
+            self._expand()
+        self._signatures = signatures
+
     @property
     def membership(self):
         return self.content["membership"]
@@ -241,13 +297,68 @@ class EventBase(object):
     def is_state(self):
         return hasattr(self, "state_key") and self.state_key is not None
 
+    def compact(self):
+        """Encodes the hashes and signatures of the event, which are a large
+        part of its size but are rarely needed once it has been persisted, to
+        cut the memory used by the event while it is cached.
+
+        They are decoded for good when next accessed. Getting the whole event
+        as a dict (e.g. to serialize it) decodes a fresh copy of them without
+        keeping it, so that the event stays compact.
+        """
+        if self._compacted_json is not None:
+            return
+
+        fields = {"signatures": self._signatures}
+        for key in _COMPACTED_KEYS:
+            if key in self._dict:
+                fields[key] = self._dict[key]
+
+        self._compacted_json = encode_canonical_json(fields)
+        self._signatures = None
+        self._dict = type(self._dict)(
+            (key, value)
+            for key, value in self._dict.items()
+            if key not in _COMPACTED_KEYS
+        )
+
+    def _decode_compacted(self) -> JsonDict:
+        """Decodes the fields encoded by `compact`."""
+        fields = json.loads(self._compacted_json)
+        if USE_FROZEN_DICTS:
+            for key in _COMPACTED_KEYS:
+                if key in fields:
+                    fields[key] = freeze(fields[key])
+        return fields
+
+    def _expand(self):
+        """Reverses `compact`."""
+        fields = self._decode_compacted()
+
+        self._signatures = fields.pop("signatures")
+        if isinstance(self._dict, frozendict):
+            self._dict = frozendict(self._dict, **fields)
+        else:
+            self._dict.update(fields)
+
+        self._compacted_json = None
+
     def get_dict(self) -> JsonDict:
         d = dict(self._dict)
-        d.update({"signatures": self.signatures, "unsigned": dict(self.unsigned)})
+        if self._compacted_json is not None:
+            fields = self._decode_compacted()
+            signatures = fields.pop("signatures")
+            d.update(fields)
+        else:
+            signatures = self._signatures
+
+        d.update({"signatures": signatures, "unsigned": dict(self.unsigned)})
 
         return d
 
     def get(self, key, default=None):
+        if self._compacted_json is not None and key in _COMPACTED_KEYS:
+            self._expand()
         return self._dict.get(key, default)
 
     def get_internal_metadata_dict(self):
@@ -270,15 +381,23 @@ class EventBase(object):
         raise AttributeError("Unrecognized attribute %s" % (instance,))
 
     def __getitem__(self, field):
+        if self._compacted_json is not None and field in _COMPACTED_KEYS:
+            self._expand()
         return self._dict[field]
 
     def __contains__(self, field):
+        if self._compacted_json is not None and field in _COMPACTED_KEYS:
+            self._expand()
         return field in self._dict
 
     def items(self):
+        if self._compacted_json is not None:
+            self._expand()
         return list(self._dict.items())
 
     def keys(self):
+        if self._compacted_json is not None:
+            self._expand()
         return six.iterkeys(self._dict)
 
     def prev_event_ids(self):
@@ -301,6 +420,8 @@ class EventBase(object):
 
 
 class FrozenEvent(EventBase):
+    __slots__ = ["_event_id"]
+
     format_version = EventFormatVersions.V1  # All events of this type are V1
 
     def __init__(self, event_dict, internal_metadata_dict={}, rejected_reason=None):
@@ -350,6 +471,8 @@ class FrozenEvent(EventBase):
 
 
 class FrozenEventV2(EventBase):
+    __slots__ = ["_event_id"]
+
     format_version = EventFormatVersions.V2  # All events of this type are V2
 
     def __init__(self, event_dict, internal_metadata_dict={}, rejected_reason=None):
@@ -429,6 +552,8 @@ class FrozenEventV2(EventBase):
 class FrozenEventV3(FrozenEventV2):
     """FrozenEventV3, which differs from FrozenEventV2 only in the event_id format"""
 
+    __slots__ = []  # type: list
+
     format_version = EventFormatVersions.V3  # All events of this type are V3
 
     @property
@@ -31,6 +31,7 @@ Events are replicated via a separate events stream.
 
 import logging
 from collections import namedtuple
+from typing import Dict
 
 from six import iteritems
 
@@ -72,6 +73,14 @@ class FederationRemoteSendQueue(object):
         self.pos = 1
         self.pos_time = SortedDict()
 
+        # The federation sender instances (if there are several), and how far
+        # each has acknowledged processing the stream. We can only drop data
+        # from the queues once they have all processed it.
+        self._federation_sender_instances = (
+            hs.config.worker.federation_shard_config.instances
+        )
+        self._federation_acks = {}  # type: Dict[str, int]
+
         # EVERYTHING IS SAD. In particular, python only makes new scopes when
         # we make a new function, so we need to make a new function so the inner
         # lambda binds to the queue rather than to the name of the queue which
@@ -246,8 +255,24 @@ class FederationRemoteSendQueue(object):
     def get_current_token(self):
         return self.pos - 1
 
-    def federation_ack(self, token):
-        self._clear_queue_before_pos(token)
+    def federation_ack(self, instance_name, token):
+        """A federation sender instance has processed the stream up to the
+        given token.
+        """
+        if not self._federation_sender_instances:
+            # there is a single federation sender, so we can clear the queues
+            # straight away.
+            self._clear_queue_before_pos(token)
+            return
+
+        self._federation_acks[instance_name] = token
+
+        acks = [
+            self._federation_acks.get(instance)
+            for instance in self._federation_sender_instances
+        ]
+        if None not in acks:
+            self._clear_queue_before_pos(min(acks))
 
     async def get_replication_rows(
         self, from_token, to_token, limit, federation_ack=None
@@ -16,7 +16,7 @@
 import logging
 from typing import Dict, Hashable, Iterable, List, Optional, Set
 
-from six import itervalues
+from six import iteritems, itervalues
 
 from prometheus_client import Counter
 
@@ -57,6 +57,14 @@ sent_pdus_destination_dist_total = Counter(
     "Total number of PDUs queued for sending across all destinations",
 )
 
+# Time (in s) after startup that we start waking up destinations which have
+# events we haven't been able to send them.
+CATCH_UP_STARTUP_DELAY_SEC = 15
+
+# Time (in s) to wait between waking up each batch of those destinations, so
+# that we don't try to send to all of them at once.
+CATCH_UP_STARTUP_INTERVAL_SEC = 5
+
 
 class FederationSender(object):
     def __init__(self, hs: "synapse.server.HomeServer"):
@@ -65,10 +73,16 @@ class FederationSender(object):
 
         self.store = hs.get_datastore()
         self.state = hs.get_state_handler()
+        self._presence_index = hs.get_presence_interest_index()
 
         self.clock = hs.get_clock()
         self.is_mine_id = hs.is_mine_id
 
+        # If there are several federation sender instances, each one sends to
+        # its own share of the destinations.
+        self._instance_name = hs.config.worker.instance_name
+        self._federation_shard_config = hs.config.worker.federation_shard_config
+
         self._transaction_manager = TransactionManager(hs)
 
         # map from destination to PerDestinationQueue
@@ -126,6 +140,23 @@ class FederationSender(object):
             1000.0 / hs.config.federation_rr_transactions_per_room_per_second
         )
 
+        # Once we've started up, wake up the destinations which have events we
+        # haven't been able to send them, e.g. because we were down.
+        self.clock.call_later(
+            CATCH_UP_STARTUP_DELAY_SEC,
+            run_as_background_process,
+            "wake_destinations_needing_catchup",
+            self._wake_destinations_needing_catchup,
+        )
+
+    def _should_send_to(self, destination: str) -> bool:
+        """Whether this instance is responsible for sending to the given
+        destination.
+        """
+        return self._federation_shard_config.should_handle(
+            self._instance_name, destination
+        )
+
     def _get_per_destination_queue(self, destination: str) -> PerDestinationQueue:
         """Get or create a PerDestinationQueue for the given destination
 
@@ -203,7 +234,7 @@ class FederationSender(object):
 
                     logger.debug("Sending %s to %r", event, destinations)
 
-                    self._send_pdu(event, destinations)
+                    await self._send_pdu(event, destinations)
 
                 async def handle_room_events(events: Iterable[EventBase]) -> None:
                     with Measure(self.clock, "handle_room_events"):
@@ -252,7 +283,7 @@ class FederationSender(object):
         finally:
             self._is_processing = False
 
-    def _send_pdu(self, pdu: EventBase, destinations: Iterable[str]) -> None:
+    async def _send_pdu(self, pdu: EventBase, destinations: Iterable[str]) -> None:
         # We loop through all destinations to see whether we already have
         # a transaction in progress. If we do, stick it in the pending_pdus
         # table and we'll get back to it later.
@@ -260,8 +291,9 @@ class FederationSender(object):
         order = self._order
         self._order += 1
 
-        destinations = set(destinations)
-        destinations.discard(self.server_name)
+        destinations = {
+            d for d in destinations if d != self.server_name and self._should_send_to(d)
+        }
         logger.debug("Sending to: %s", str(destinations))
 
         if not destinations:
@@ -270,6 +302,12 @@ class FederationSender(object):
         sent_pdus_destination_dist_total.inc(len(destinations))
         sent_pdus_destination_dist_count.inc()
 
+        # Record that the destinations should have this event, so that we can
+        # catch them up on the room if we fail to send it.
+        await self.store.store_destination_rooms_entries(
+            destinations, pdu.room_id, pdu.internal_metadata.stream_ordering
+        )
+
         for destination in destinations:
             self._get_per_destination_queue(destination).send_pdu(pdu, order)
 
@@ -316,7 +354,9 @@ class FederationSender(object):
 
         # Work out which remote servers should be poked and poke them.
         domains = yield self.state.get_current_hosts_in_room(room_id)
-        domains = [d for d in domains if d != self.server_name]
+        domains = [
+            d for d in domains if d != self.server_name and self._should_send_to(d)
+        ]
         if not domains:
             return
 
@@ -421,6 +461,8 @@ class FederationSender(object):
         for destination in destinations:
             if destination == self.server_name:
                 continue
+            if not self._should_send_to(destination):
+                continue
             self._get_per_destination_queue(destination).send_presence(states)
 
     @measure_func("txnqueue._process_presence")
@@ -429,13 +471,14 @@ class FederationSender(object):
         """Given a list of states populate self.pending_presence_by_dest and
         poke to send a new transaction to each destination
         """
-        hosts_and_states = yield get_interested_remotes(self.store, states, self.state)
+        states_by_host = yield get_interested_remotes(self._presence_index, states)
 
-        for destinations, states in hosts_and_states:
-            for destination in destinations:
-                if destination == self.server_name:
-                    continue
-                self._get_per_destination_queue(destination).send_presence(states)
+        for destination, states in iteritems(states_by_host):
+            if destination == self.server_name:
+                continue
+            if not self._should_send_to(destination):
+                continue
+            self._get_per_destination_queue(destination).send_presence(states)
 
     def build_and_send_edu(
         self,
@@ -472,6 +515,9 @@ class FederationSender(object):
             edu: edu to send
             key: clobbering key for this edu
         """
+        if not self._should_send_to(edu.destination):
+            return
+
         queue = self._get_per_destination_queue(edu.destination)
         if key:
             queue.send_keyed_edu(edu, key)
@@ -483,6 +529,9 @@ class FederationSender(object):
             logger.warning("Not sending device update to ourselves")
             return
 
+        if not self._should_send_to(destination):
+            return
+
         self._get_per_destination_queue(destination).attempt_new_transaction()
 
     def wake_destination(self, destination: str):
@@ -496,7 +545,31 @@ class FederationSender(object):
             logger.warning("Not waking up ourselves")
             return
 
+        if not self._should_send_to(destination):
+            return
+
         self._get_per_destination_queue(destination).attempt_new_transaction()
 
+    async def _wake_destinations_needing_catchup(self) -> None:
+        """Wakes up the destinations which have events we haven't been able to
+        send them, a batch at a time, so that they get caught up.
+        """
+        last_processed = None  # type: Optional[str]
+
+        while True:
+            destinations = await self.store.get_catch_up_outstanding_destinations(
+                last_processed
+            )
+            if not destinations:
+                break
+
+            last_processed = destinations[-1]
+
+            for destination in destinations:
+                logger.info("Waking up %s so that it catches up", destination)
+                self.wake_destination(destination)
+
+            await self.clock.sleep(CATCH_UP_STARTUP_INTERVAL_SEC)
+
     def get_current_token(self) -> int:
         return 0
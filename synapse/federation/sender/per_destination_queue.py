@@ -15,7 +15,7 @@
 # limitations under the License.
 import datetime
 import logging
-from typing import Dict, Hashable, Iterable, List, Tuple
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
 
 from prometheus_client import Counter
 
@@ -37,6 +37,9 @@ from synapse.util.retryutils import NotRetryingDestination, get_retry_limiter
 # This is defined in the Matrix spec and enforced by the receiver.
 MAX_EDUS_PER_TRANSACTION = 100
 
+# The maximum number of PDUs in each transaction, also defined by the spec.
+MAX_PDUS_PER_TRANSACTION = 50
+
 logger = logging.getLogger(__name__)
 
 
@@ -76,6 +79,24 @@ class PerDestinationQueue(object):
         self._destination = destination
         self.transmission_loop_running = False
 
+        # True if we may have failed to send this destination some events. While
+        # we are catching up, we don't queue PDUs in memory: instead, when the
+        # destination is reachable, we send it the latest event in each room
+        # which it missed (see `destination_rooms`), and it can fill in any gaps
+        # itself.
+        #
+        # We start off catching up, in case we were restarted before sending
+        # everything.
+        self._catching_up = True
+
+        # The stream ordering of the last event we successfully sent to the
+        # destination, or None if we haven't yet looked it up.
+        self._last_successful_stream_ordering = None  # type: Optional[int]
+
+        # Whether we've skipped queuing any PDUs since we last looked for what
+        # to send to catch up.
+        self._catchup_skipped_pdus = False
+
         # a list of tuples of (pending pdu, order)
         self._pending_pdus = []  # type: List[Tuple[EventBase, int]]
         self._pending_edus = []  # type: List[Edu]
@@ -120,7 +141,11 @@ class PerDestinationQueue(object):
             pdu: pdu to send
             order
         """
-        self._pending_pdus.append((pdu, order))
+        if self._catching_up and self._last_successful_stream_ordering is not None:
+            # We'll send it (or a newer event in the room) when we catch up.
+            self._catchup_skipped_pdus = True
+        else:
+            self._pending_pdus.append((pdu, order))
         self.attempt_new_transaction()
 
     def send_presence(self, states: Iterable[UserPresenceState]) -> None:
@@ -192,6 +217,13 @@ class PerDestinationQueue(object):
             # hence why we throw the result away.
             await get_retry_limiter(self._destination, self._clock, self._store)
 
+            if self._catching_up:
+                await self._catch_up_transmission_loop()
+                if self._catching_up:
+                    # We failed to send some of what we missed, so try again
+                    # later.
+                    return
+
             pending_pdus = []
             while True:
                 # We have to keep 2 free slots for presence and rr_edus
@@ -221,8 +253,10 @@ class PerDestinationQueue(object):
 
                 pending_pdus = self._pending_pdus
 
-                # We can only include at most 50 PDUs per transactions
-                pending_pdus, self._pending_pdus = pending_pdus[:50], pending_pdus[50:]
+                pending_pdus, self._pending_pdus = (
+                    pending_pdus[:MAX_PDUS_PER_TRANSACTION],
+                    pending_pdus[MAX_PDUS_PER_TRANSACTION:],
+                )
 
                 pending_edus.extend(self._get_rr_edus(force_flush=False))
                 pending_presence = self._pending_presence
@@ -299,7 +333,16 @@ class PerDestinationQueue(object):
 
                     self._last_device_stream_id = device_stream_id
                     self._last_device_list_stream_id = dev_list_id
+
+                    if pending_pdus:
+                        await self._set_last_successful_stream_ordering(
+                            max(
+                                pdu.internal_metadata.stream_ordering
+                                for pdu, _ in pending_pdus
+                            )
+                        )
                 else:
+                    self._start_catching_up(pending_pdus)
                     break
         except NotRetryingDestination as e:
             logger.debug(
@@ -310,6 +353,7 @@ class PerDestinationQueue(object):
                     (e.retry_last_ts + e.retry_interval) / 1000.0
                 ),
             )
+            self._start_catching_up(pending_pdus)
         except FederationDeniedError as e:
             logger.info(e)
         except HttpResponseException as e:
@@ -319,6 +363,7 @@ class PerDestinationQueue(object):
                 e.code,
                 e,
             )
+            self._start_catching_up(pending_pdus)
         except RequestSendFailed as e:
             logger.warning(
                 "TX [%s] Failed to send transaction: %s", self._destination, e
@@ -328,16 +373,107 @@ class PerDestinationQueue(object):
                 logger.info(
                     "Failed to send event %s to %s", p.event_id, self._destination
                 )
+            self._start_catching_up(pending_pdus)
         except Exception:
             logger.exception("TX [%s] Failed to send transaction", self._destination)
             for p, _ in pending_pdus:
                 logger.info(
                     "Failed to send event %s to %s", p.event_id, self._destination
                 )
+            self._start_catching_up(pending_pdus)
         finally:
             # We want to be *very* sure we clear this after we stop processing
             self.transmission_loop_running = False
 
+    async def _catch_up_transmission_loop(self) -> None:
+        """Sends the destination the latest event in each room which it has
+        missed, and clears `_catching_up` once it has them all.
+        """
+        if self._last_successful_stream_ordering is None:
+            store = self._store
+            stream_ordering = await store.get_destination_last_successful_stream_ordering(
+                self._destination
+            )
+            if stream_ordering is None:
+                # We've never sent this destination anything, so we don't know
+                # of anything it has missed.
+                self._catching_up = False
+                return
+            self._last_successful_stream_ordering = stream_ordering
+
+        while True:
+            # Any PDUs skipped before now will have been recorded in the
+            # database, so will be picked up by this query.
+            self._catchup_skipped_pdus = False
+            rows = await self._store.get_catch_up_room_event_ids(
+                self._destination,
+                self._last_successful_stream_ordering,
+                limit=MAX_PDUS_PER_TRANSACTION,
+            )
+
+            if not rows:
+                if self._catchup_skipped_pdus:
+                    # We skipped some while we were looking, so look again.
+                    continue
+
+                logger.info("TX [%s] Caught up", self._destination)
+                self._catching_up = False
+                # Anything which was queued in memory before we knew we were
+                # catching up has now been superseded.
+                self._pending_pdus = []
+                return
+
+            pdus = await self._store.get_events_as_list(
+                [event_id for event_id, _ in rows]
+            )
+            if pdus:
+                logger.info(
+                    "TX [%s] Sending %d events to catch up",
+                    self._destination,
+                    len(pdus),
+                )
+                success = await self._transaction_manager.send_new_transaction(
+                    self._destination,
+                    [(pdu, pdu.internal_metadata.stream_ordering) for pdu in pdus],
+                    [],
+                )
+                if not success:
+                    return
+                sent_transactions_counter.inc()
+
+            # Any events we didn't get back have been purged or rejected, so
+            # there's no point in sending them.
+            await self._set_last_successful_stream_ordering(rows[-1][1])
+
+    async def _set_last_successful_stream_ordering(self, stream_ordering: int) -> None:
+        self._last_successful_stream_ordering = stream_ordering
+        await self._store.set_destination_last_successful_stream_ordering(
+            self._destination, stream_ordering
+        )
+
+    def _start_catching_up(self, failed_pdus: List[Tuple[EventBase, int]]) -> None:
+        """Called when we fail to send to the destination. Drops the queued
+        PDUs, which we'll catch up on once the destination is reachable again.
+
+        Args:
+            failed_pdus: the PDUs we were trying to send when we failed
+        """
+        if self._catching_up:
+            return
+
+        if self._last_successful_stream_ordering is None:
+            # We've never managed to send this destination anything, so catch
+            # up from just before the earliest PDU we're dropping.
+            dropped = list(failed_pdus) + self._pending_pdus
+            if not dropped:
+                return
+            self._last_successful_stream_ordering = (
+                min(pdu.internal_metadata.stream_ordering for pdu, _ in dropped) - 1
+            )
+
+        self._catching_up = True
+        self._pending_pdus = []
+
     def _get_rr_edus(self, force_flush: bool) -> Iterable[Edu]:
         if not self._pending_rrs:
             return
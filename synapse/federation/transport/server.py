@@ -274,6 +274,10 @@ class BaseFederationServlet(object):
 
     PREFIX = FEDERATION_V1_PREFIX  # Allows specifying the API version
 
+    # Whether to encode and write out the response a chunk at a time, for
+    # servlets that may return very large responses.
+    STREAM_RESPONSE = False
+
     def __init__(self, handler, authenticator, ratelimiter, server_name):
         self.handler = handler
         self.authenticator = authenticator
@@ -366,6 +370,7 @@ class BaseFederationServlet(object):
                 self._wrap(code),
                 self.__class__.__name__,
                 trace=False,
+                streaming=self.STREAM_RESPONSE,
             )
 
 
@@ -440,6 +445,7 @@ class FederationEventServlet(BaseFederationServlet):
 
 class FederationStateV1Servlet(BaseFederationServlet):
     PATH = "/state/(?P<context>[^/]*)/?"
+    STREAM_RESPONSE = True
 
     # This is when someone asks for all data for a given context.
     async def on_GET(self, origin, content, query, context):
@@ -452,6 +458,7 @@ class FederationStateV1Servlet(BaseFederationServlet):
 
 class FederationStateIdsServlet(BaseFederationServlet):
     PATH = "/state_ids/(?P<room_id>[^/]*)/?"
+    STREAM_RESPONSE = True
 
     async def on_GET(self, origin, content, query, room_id):
         return await self.handler.on_state_ids_request(
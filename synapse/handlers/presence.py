@@ -24,7 +24,7 @@ The methods that define policy are:
 
 import logging
 from contextlib import contextmanager
-from typing import Dict, Set
+from typing import Dict, List, Set, Tuple
 
 from six import iteritems, itervalues
 
@@ -39,10 +39,18 @@ from synapse.logging.context import run_in_background
 from synapse.logging.utils import log_function
 from synapse.metrics import LaterGauge
 from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.replication.http.presence import (
+    ReplicationBumpPresenceActiveTimeRestServlet,
+    ReplicationIncomingPresenceRestServlet,
+    ReplicationPresenceClearSyncsRestServlet,
+    ReplicationPresenceSetStateRestServlet,
+    ReplicationPresenceUserSyncRestServlet,
+)
 from synapse.storage.presence import UserPresenceState
 from synapse.types import UserID, get_domain_from_id
 from synapse.util.async_helpers import Linearizer
-from synapse.util.caches.descriptors import cachedInlineCallbacks
+from synapse.util.caches import get_cache_factor_for
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.metrics import Measure
 from synapse.util.wheel_timer import WheelTimer
 
@@ -104,14 +112,35 @@ class PresenceHandler(object):
         self.store = hs.get_datastore()
         self.wheel_timer = WheelTimer()
         self.notifier = hs.get_notifier()
-        self.federation = hs.get_federation_sender()
         self.state = hs.get_state_handler()
+        self._presence_index = hs.get_presence_interest_index()
+
+        # Presence writer workers hand the updates they produce to the master
+        # to persist and send out, c.f. `synapse.app.presence_writer`.
+        self.federation = None
+        if not hs.config.worker_app:
+            self.federation = hs.get_federation_sender()
+
+        # The presence of each user is handled by one of the presence writers,
+        # and the others pass on anything which affects it.
+        self._instance_name = hs.config.worker.instance_name
+        self._presence_shard_config = hs.config.worker.presence_shard_config
+
+        self._send_set_state = ReplicationPresenceSetStateRestServlet.make_client(hs)
+        self._send_bump = ReplicationBumpPresenceActiveTimeRestServlet.make_client(hs)
+        self._send_sync_row = ReplicationPresenceUserSyncRestServlet.make_client(hs)
+        self._send_clear = ReplicationPresenceClearSyncsRestServlet.make_client(hs)
+        self._send_incoming = ReplicationIncomingPresenceRestServlet.make_client(hs)
 
         federation_registry = hs.get_federation_registry()
 
         federation_registry.register_edu_handler("m.presence", self.incoming_presence)
 
-        active_presence = self.store.take_presence_startup_info()
+        active_presence = [
+            state
+            for state in self.store.take_presence_startup_info()
+            if self._is_presence_writer_for(state.user_id)
+        ]
 
         # A dictionary of the current state of users. This is prefilled with
         # non-offline presence from the DB. We should fetch from the DB if
@@ -205,14 +234,25 @@ class PresenceHandler(object):
         )
 
         # Used to handle sending of presence to newly joined users/servers
-        if hs.config.use_presence:
+        if hs.config.use_presence and not hs.config.worker_app:
             self.notifier.add_replication_callback(self.notify_new_event)
 
-        # Presence is best effort and quickly heals itself, so lets just always
-        # stream from the current state when we restart.
-        self._event_pos = self.store.get_current_events_token()
+            # Presence is best effort and quickly heals itself, so lets just
+            # always stream from the current state when we restart.
+            self._event_pos = self.store.get_current_events_token()
         self._event_processing = False
 
+    def _is_presence_writer_for(self, user_id):
+        """Whether this process handles the presence of the given user.
+        """
+        return self._presence_shard_config.should_handle(self._instance_name, user_id)
+
+    def _get_presence_writer(self, user_id):
+        """Gets the name of the instance which handles the presence of the given
+        user.
+        """
+        return self._presence_shard_config.get_instance(user_id)
+
     @defer.inlineCallbacks
     def _on_shutdown(self):
         """Gets called when shutting down. This lets us persist any updates that
@@ -235,7 +275,7 @@ class PresenceHandler(object):
 
         if self.unpersisted_users_changes:
 
-            yield self.store.update_presence(
+            yield self._persist_states(
                 [
                     self.user_to_current_state[user_id]
                     for user_id in self.unpersisted_users_changes
@@ -253,10 +293,18 @@ class PresenceHandler(object):
 
         if unpersisted:
             logger.info("Persisting %d unpersisted presence updates", len(unpersisted))
-            yield self.store.update_presence(
+            yield self._persist_states(
                 [self.user_to_current_state[user_id] for user_id in unpersisted]
             )
 
+    def _persist_states(self, states):
+        """Persists presence states which don't need sending to anyone.
+
+        Returns:
+            Deferred
+        """
+        return self.store.update_presence(states)
+
     @defer.inlineCallbacks
     def _update_states(self, new_states):
         """Updates presence of users. Sets the appropriate timeouts. Pokes
@@ -381,6 +429,12 @@ class PresenceHandler(object):
 
         user_id = user.to_string()
 
+        if not self._is_presence_writer_for(user_id):
+            yield self._send_bump(
+                instance_name=self._get_presence_writer(user_id), user_id=user_id
+            )
+            return
+
         bump_active_time_counter.inc()
 
         prev_state = yield self.current_state_for_user(user_id)
@@ -411,7 +465,18 @@ class PresenceHandler(object):
         if not self.hs.config.use_presence:
             affect_presence = False
 
-        if affect_presence:
+        # If another process handles the user's presence, we tell it when the
+        # user starts and stops syncing here, in the same way as other workers
+        # tell the master.
+        is_writer = self._is_presence_writer_for(user_id)
+
+        if affect_presence and not is_writer:
+            curr_sync = self.user_to_num_current_syncs.get(user_id, 0)
+            self.user_to_num_current_syncs[user_id] = curr_sync + 1
+
+            if curr_sync == 0:
+                yield self._send_user_sync(user_id, True)
+        elif affect_presence:
             curr_sync = self.user_to_num_current_syncs.get(user_id, 0)
             self.user_to_num_current_syncs[user_id] = curr_sync + 1
 
@@ -442,6 +507,11 @@ class PresenceHandler(object):
             try:
                 self.user_to_num_current_syncs[user_id] -= 1
 
+                if not is_writer:
+                    if not self.user_to_num_current_syncs[user_id]:
+                        yield self._send_user_sync(user_id, False)
+                    return
+
                 prev_state = yield self.current_state_for_user(user_id)
                 yield self._update_states(
                     [
@@ -463,6 +533,28 @@ class PresenceHandler(object):
 
         return _user_syncing()
 
+    @defer.inlineCallbacks
+    def _send_user_sync(self, user_id, is_syncing):
+        """Tells the presence writer for a user that they have started or
+        stopped syncing against this process.
+        """
+        writer = self._get_presence_writer(user_id)
+        try:
+            yield self._send_sync_row(
+                instance_name=writer,
+                user_id=user_id,
+                process_id=self._instance_name,
+                is_syncing=is_syncing,
+                sync_time_msec=self.clock.time_msec(),
+            )
+        except Exception as e:
+            logger.warning(
+                "Failed to tell presence writer %s about %s syncing: %s",
+                writer,
+                user_id,
+                e,
+            )
+
     def get_currently_syncing_users(self):
         """Get the set of user ids that are currently syncing on this HS.
         Returns:
@@ -494,6 +586,16 @@ class PresenceHandler(object):
             is_syncing (bool): Whether or not the user is now syncing
             sync_time_msec(int): Time in ms when the user was last syncing
         """
+        if not self._is_presence_writer_for(user_id):
+            yield self._send_sync_row(
+                instance_name=self._get_presence_writer(user_id),
+                user_id=user_id,
+                process_id=process_id,
+                is_syncing=is_syncing,
+                sync_time_msec=sync_time_msec,
+            )
+            return
+
         with (yield self.external_sync_linearizer.queue(process_id)):
             prev_state = yield self.current_state_for_user(user_id)
 
@@ -536,6 +638,25 @@ class PresenceHandler(object):
 
         Used when the process has stopped/disappeared.
         """
+        if not self.hs.config.worker_app:
+            # The master passes on the syncs of other processes to the
+            # presence writers, so they need to know too.
+            for instance in self._presence_shard_config.instances:
+                if instance == self._instance_name:
+                    continue
+
+                try:
+                    yield self._send_clear(
+                        instance_name=instance, process_id=process_id
+                    )
+                except Exception as e:
+                    logger.warning(
+                        "Failed to tell presence writer %s that %s has gone: %s",
+                        instance,
+                        process_id,
+                        e,
+                    )
+
         with (yield self.external_sync_linearizer.queue(process_id)):
             process_presence = self.external_process_to_current_syncs.pop(
                 process_id, set()
@@ -565,10 +686,13 @@ class PresenceHandler(object):
         Returns:
             dict: `user_id` -> `UserPresenceState`
         """
-        states = {
-            user_id: self.user_to_current_state.get(user_id, None)
-            for user_id in user_ids
-        }
+        states = {}
+        other_writers_user_ids = []
+        for user_id in user_ids:
+            if self._is_presence_writer_for(user_id):
+                states[user_id] = self.user_to_current_state.get(user_id, None)
+            else:
+                other_writers_user_ids.append(user_id)
 
         missing = [user_id for user_id, state in iteritems(states) if not state]
         if missing:
@@ -585,6 +709,13 @@ class PresenceHandler(object):
                 states.update(new)
                 self.user_to_current_state.update(new)
 
+        if other_writers_user_ids:
+            # Another process handles the presence of these users, so we use
+            # what it has persisted.
+            res = yield self.store.get_presence_for_users(other_writers_user_ids)
+            for user_id in other_writers_user_ids:
+                states[user_id] = res.get(user_id) or UserPresenceState.default(user_id)
+
         return states
 
     @defer.inlineCallbacks
@@ -594,7 +725,7 @@ class PresenceHandler(object):
         """
         stream_id, max_token = yield self.store.update_presence(states)
 
-        parties = yield get_interested_parties(self.store, states)
+        parties = yield get_interested_parties(self._presence_index, states)
         room_ids_to_states, users_to_states = parties
 
         self.notifier.on_new_event(
@@ -608,7 +739,7 @@ class PresenceHandler(object):
 
     @defer.inlineCallbacks
     def notify_for_states(self, state, stream_id):
-        parties = yield get_interested_parties(self.store, [state])
+        parties = yield get_interested_parties(self._presence_index, [state])
         room_ids_to_states, users_to_states = parties
 
         self.notifier.on_new_event(
@@ -618,6 +749,25 @@ class PresenceHandler(object):
             users=[UserID.from_string(u) for u in users_to_states],
         )
 
+    @defer.inlineCallbacks
+    def update_from_writer(self, action, states):
+        """Called on the master with the presence updates produced by a
+        presence writer worker.
+
+        Args:
+            action (str): what needs doing with the updates, c.f.
+                `ReplicationPresenceUpdateRestServlet`.
+            states (list(UserPresenceState))
+        """
+        if action == "notify":
+            yield self._persist_and_notify(states)
+        elif action == "persist":
+            yield self.store.update_presence(states)
+        elif action == "ping":
+            self._push_to_remotes(states)
+        else:
+            raise SynapseError(400, "Unknown presence update action %r" % (action,))
+
     def _push_to_remotes(self, states):
         """Sends state updates to remote servers.
 
@@ -632,6 +782,7 @@ class PresenceHandler(object):
         """
         now = self.clock.time_msec()
         updates = []
+        pushes_by_writer = {}  # type: Dict[str, List[dict]]
         for push in content.get("push", []):
             # A "push" contains a list of presence that we are probably interested
             # in.
@@ -652,6 +803,12 @@ class PresenceHandler(object):
                 )
                 continue
 
+            if not self._is_presence_writer_for(user_id):
+                pushes_by_writer.setdefault(
+                    self._get_presence_writer(user_id), []
+                ).append(push)
+                continue
+
             presence_state = push.get("presence", None)
             if not presence_state:
                 logger.info(
@@ -673,6 +830,11 @@ class PresenceHandler(object):
             prev_state = yield self.current_state_for_user(user_id)
             updates.append(prev_state.copy_and_replace(**new_fields))
 
+        for writer, pushes in pushes_by_writer.items():
+            yield self._send_incoming(
+                instance_name=writer, origin=origin, content={"push": pushes}
+            )
+
         if updates:
             federation_presence_counter.inc(len(updates))
             yield self._update_states(updates)
@@ -730,6 +892,15 @@ class PresenceHandler(object):
 
         user_id = target_user.to_string()
 
+        if not self._is_presence_writer_for(user_id):
+            yield self._send_set_state(
+                instance_name=self._get_presence_writer(user_id),
+                user_id=user_id,
+                state=state,
+                ignore_status_msg=ignore_status_msg,
+            )
+            return
+
         prev_state = yield self.current_state_for_user(user_id)
 
         new_fields = {"state": presence}
@@ -841,6 +1012,10 @@ class PresenceHandler(object):
             if typ != EventTypes.Member:
                 continue
 
+            yield self._presence_index.process_membership_delta(
+                room_id, state_key, event_id
+            )
+
             if event_id is None:
                 # state has been deleted, so this is not a join. We only care about
                 # joins.
@@ -995,6 +1170,7 @@ class PresenceEventSource(object):
         self.clock = hs.get_clock()
         self.store = hs.get_datastore()
         self.state = hs.get_state_handler()
+        self._presence_index = hs.get_presence_interest_index()
 
     @defer.inlineCallbacks
     @log_function
@@ -1045,8 +1221,7 @@ class PresenceEventSource(object):
             presence = self.get_presence_handler()
             stream_change_cache = self.store.presence_stream_cache
 
-            users_interested_in = yield self._get_interested_in(user, explicit_room_id)
-
+            user_id = user.to_string()
             user_ids_changed = set()
             changed = None
             if from_key:
@@ -1057,13 +1232,20 @@ class PresenceEventSource(object):
                 # work out if we share a room or they're in our presence list
                 get_updates_counter.labels("stream").inc()
                 for other_user_id in changed:
-                    if other_user_id in users_interested_in:
+                    interested = yield self._is_interested_in(
+                        user_id, other_user_id, explicit_room_id
+                    )
+                    if interested:
                         user_ids_changed.add(other_user_id)
             else:
                 # Too many possible updates. Find all users we can see and check
                 # if any of them have changed.
                 get_updates_counter.labels("full").inc()
 
+                users_interested_in = yield self._get_interested_in(
+                    user_id, explicit_room_id
+                )
+
                 if from_key:
                     user_ids_changed = stream_change_cache.get_entities_changed(
                         users_interested_in, from_key
@@ -1087,29 +1269,294 @@ class PresenceEventSource(object):
     def get_pagination_rows(self, user, pagination_config, key):
         return self.get_new_events(user, from_key=None, include_offline=False)
 
-    @cachedInlineCallbacks(num_args=2, cache_context=True)
-    def _get_interested_in(self, user, explicit_room_id, cache_context):
+    @defer.inlineCallbacks
+    def _is_interested_in(self, user_id, other_user_id, explicit_room_id):
+        """Returns whether the given user should see presence updates for the
+        other user, i.e. if they share a room (or they are the same user).
+        """
+        if user_id == other_user_id:
+            return True
+
+        room_ids = yield self._presence_index.get_rooms_for_user(user_id)
+        other_room_ids = yield self._presence_index.get_rooms_for_user(other_user_id)
+        if not room_ids.isdisjoint(other_room_ids):
+            return True
+
+        if explicit_room_id:
+            return explicit_room_id in other_room_ids
+
+        return False
+
+    @defer.inlineCallbacks
+    def _get_interested_in(self, user_id, explicit_room_id):
         """Returns the set of users that the given user should see presence
         updates for
         """
-        user_id = user.to_string()
-        users_interested_in = set()
-        users_interested_in.add(user_id)  # So that we receive our own presence
+        index = self._presence_index
 
-        users_who_share_room = yield self.store.get_users_who_share_room_with_user(
-            user_id, on_invalidate=cache_context.invalidate
-        )
-        users_interested_in.update(users_who_share_room)
+        users_interested_in = yield index.get_users_who_share_room_with_user(user_id)
+        users_interested_in.add(user_id)  # So that we receive our own presence
 
         if explicit_room_id:
-            user_ids = yield self.store.get_users_in_room(
-                explicit_room_id, on_invalidate=cache_context.invalidate
-            )
+            user_ids = yield index.get_users_in_room(explicit_room_id)
             users_interested_in.update(user_ids)
 
         return users_interested_in
 
 
+class _RoomMembers(object):
+    """The users joined to a room, and the number of them on each server."""
+
+    __slots__ = ["users", "hosts"]
+
+    def __init__(self, user_ids):
+        self.users = set()
+        self.hosts = {}  # type: Dict[str, int]
+        for user_id in user_ids:
+            self.update(user_id, True)
+
+    def update(self, user_id, joined):
+        if joined == (user_id in self.users):
+            return
+
+        host = get_domain_from_id(user_id)
+        if joined:
+            self.users.add(user_id)
+            self.hosts[host] = self.hosts.get(host, 0) + 1
+        else:
+            self.users.discard(user_id)
+            self.hosts[host] -= 1
+            if not self.hosts[host]:
+                del self.hosts[host]
+
+
+class PresenceInterestIndex(object):
+    """Tracks which rooms users are in, and who is in those rooms, so that we
+    can quickly work out who should be sent a user's presence.
+
+    Entries are loaded from the database the first time they're needed, and
+    are then kept up to date from the membership changes in the current state
+    delta stream (c.f. `process_membership_delta`) rather than being reloaded
+    each time the membership of a room changes. The least recently used
+    entries are evicted once there are too many.
+
+    The sets returned must not be modified by the caller.
+    """
+
+    def __init__(self, hs):
+        self.store = hs.get_datastore()
+
+        cache_factor = get_cache_factor_for("presence_interest_index")
+
+        # Map from user ID to the set of rooms they're joined to.
+        self._rooms_for_user = LruCache(int(100000 * cache_factor))
+
+        # Map from room ID to the `_RoomMembers` of the room.
+        self._room_members = LruCache(int(50000 * cache_factor))
+
+        # The membership changes which have arrived while we're loading entries
+        # from the database, which need applying to what we load. Maps from user
+        # or room ID to a list of changes for each load in progress.
+        self._user_loads = {}  # type: Dict[str, List[List[Tuple[str, bool]]]]
+        self._room_loads = {}  # type: Dict[str, List[List[Tuple[str, bool]]]]
+
+        self._delta_linearizer = Linearizer(name="presence_interest_index")
+
+        LaterGauge(
+            "synapse_handlers_presence_interest_index_users",
+            "",
+            [],
+            lambda: len(self._rooms_for_user),
+        )
+        LaterGauge(
+            "synapse_handlers_presence_interest_index_rooms",
+            "",
+            [],
+            lambda: len(self._room_members),
+        )
+
+    @defer.inlineCallbacks
+    def get_rooms_for_user(self, user_id):
+        """Get the rooms the given user is joined to.
+
+        Args:
+            user_id (str)
+
+        Returns:
+            Deferred[set[str]]
+        """
+        rooms = self._rooms_for_user.get(user_id)
+        if rooms is not None:
+            return rooms
+
+        with self._record_changes(self._user_loads, user_id) as changes:
+            room_ids = yield self.store.get_rooms_for_user(user_id)
+
+        rooms = set(room_ids)
+        for room_id, joined in changes:
+            if joined:
+                rooms.add(room_id)
+            else:
+                rooms.discard(room_id)
+
+        self._rooms_for_user.set(user_id, rooms)
+        return rooms
+
+    @defer.inlineCallbacks
+    def get_users_in_room(self, room_id):
+        """Get the users joined to the given room.
+
+        Args:
+            room_id (str)
+
+        Returns:
+            Deferred[set[str]]
+        """
+        members = yield self._get_room_members(room_id)
+        return members.users
+
+    @defer.inlineCallbacks
+    def get_hosts_in_room(self, room_id):
+        """Get the servers with users joined to the given room.
+
+        Args:
+            room_id (str)
+
+        Returns:
+            Deferred[Iterable[str]]
+        """
+        members = yield self._get_room_members(room_id)
+        return members.hosts.keys()
+
+    @defer.inlineCallbacks
+    def get_users_who_share_room_with_user(self, user_id):
+        """Get the users who share a room with the given user, including the
+        user themselves if they are in any rooms.
+
+        Args:
+            user_id (str)
+
+        Returns:
+            Deferred[set[str]]
+        """
+        room_ids = yield self.get_rooms_for_user(user_id)
+
+        user_ids = set()
+        for room_id in room_ids:
+            users = yield self.get_users_in_room(room_id)
+            user_ids.update(users)
+
+        return user_ids
+
+    @defer.inlineCallbacks
+    def _get_room_members(self, room_id):
+        members = self._room_members.get(room_id)
+        if members is not None:
+            return members
+
+        with self._record_changes(self._room_loads, room_id) as changes:
+            user_ids = yield self.store.get_users_in_room(room_id)
+
+        members = _RoomMembers(user_ids)
+        for user_id, joined in changes:
+            members.update(user_id, joined)
+
+        self._room_members.set(room_id, members)
+        return members
+
+    @contextmanager
+    def _record_changes(self, loads, key):
+        """Records the membership changes for the given user or room which
+        arrive while we're loading it from the database.
+
+        Args:
+            loads (dict): `_user_loads` or `_room_loads`
+            key (str): the user or room being loaded
+
+        Returns:
+            ContextManager[list[tuple[str, bool]]]: the changes, as pairs of
+            room or user ID, and whether the user is now joined to the room.
+        """
+        changes = []
+        loads.setdefault(key, []).append(changes)
+        try:
+            yield changes
+        finally:
+            loads[key].remove(changes)
+            if not loads[key]:
+                del loads[key]
+
+    @defer.inlineCallbacks
+    def process_membership_delta(self, room_id, user_id, event_id):
+        """Called with each change to the membership of a room in the current
+        state delta stream.
+
+        Args:
+            room_id (str)
+            user_id (str)
+            event_id (str|None): The new membership event for the user, or
+                None if their membership state has been deleted.
+
+        Returns:
+            Deferred
+        """
+        # Most deltas are for users and rooms we don't know about, and we
+        # don't want to look up the event for every membership change on the
+        # server.
+        if not self._is_interested(room_id, user_id):
+            return
+
+        # Replication hands us the deltas in the background, so we make sure
+        # they're applied in the order they arrive.
+        with (yield self._delta_linearizer.queue(None)):
+            membership = None
+            if event_id is not None:
+                event = yield self.store.get_event(event_id, allow_none=True)
+                if event:
+                    membership = event.content.get("membership")
+
+            self.update_membership(room_id, user_id, membership == Membership.JOIN)
+
+    def _is_interested(self, room_id, user_id):
+        """Whether a change to the user's membership of the room would change
+        the index, i.e. the user or room is loaded or being loaded.
+        """
+        return (
+            user_id in self._rooms_for_user
+            or room_id in self._room_members
+            or user_id in self._user_loads
+            or room_id in self._room_loads
+        )
+
+    def update_membership(self, room_id, user_id, joined):
+        """Update the index to reflect the user joining or leaving the room.
+
+        We only update the entries we've already loaded, or are loading, the
+        rest will be fetched from the database when needed.
+
+        Args:
+            room_id (str)
+            user_id (str)
+            joined (bool): Whether the user is now joined to the room.
+        """
+        rooms = self._rooms_for_user.get(user_id)
+        if rooms is not None:
+            if joined:
+                rooms.add(room_id)
+            else:
+                rooms.discard(room_id)
+
+        for changes in self._user_loads.get(user_id, ()):
+            changes.append((room_id, joined))
+
+        members = self._room_members.get(room_id)
+        if members is not None:
+            members.update(user_id, joined)
+
+        for changes in self._room_loads.get(room_id, ()):
+            changes.append((user_id, joined))
+
+
 def handle_timeouts(user_states, is_mine_fn, syncing_user_ids, now):
     """Checks the presence of users that have timed out and updates as
     appropriate.
@@ -1266,11 +1713,12 @@ def handle_update(prev_state, new_state, is_mine, wheel_timer, now):
 
 
 @defer.inlineCallbacks
-def get_interested_parties(store, states):
+def get_interested_parties(index, states):
     """Given a list of states return which entities (rooms, users)
     are interested in the given states.
 
     Args:
+        index (PresenceInterestIndex)
         states (list(UserPresenceState))
 
     Returns:
@@ -1280,7 +1728,7 @@ def get_interested_parties(store, states):
     room_ids_to_states = {}
     users_to_states = {}
     for state in states:
-        room_ids = yield store.get_rooms_for_user(state.user_id)
+        room_ids = yield index.get_rooms_for_user(state.user_id)
         for room_id in room_ids:
             room_ids_to_states.setdefault(room_id, []).append(state)
 
@@ -1291,34 +1739,32 @@ def get_interested_parties(store, states):
 
 
 @defer.inlineCallbacks
-def get_interested_remotes(store, states, state_handler):
+def get_interested_remotes(index, states):
     """Given a list of presence states figure out which remote servers
     should be sent which.
 
     All the presence states should be for local users only.
 
     Args:
-        store (DataStore)
+        index (PresenceInterestIndex)
         states (list(UserPresenceState))
 
     Returns:
-        Deferred list of ([destinations], [UserPresenceState]), where for
-        each row the list of UserPresenceState should be sent to each
-        destination
+        Deferred[dict[str, list[UserPresenceState]]]: map from destination to
+        the presence states that should be sent to it.
     """
-    hosts_and_states = []
-
-    # First we look up the rooms each user is in (as well as any explicit
-    # subscriptions), then for each distinct room we look up the remote
-    # hosts in those rooms.
-    room_ids_to_states, users_to_states = yield get_interested_parties(store, states)
-
-    for room_id, states in iteritems(room_ids_to_states):
-        hosts = yield state_handler.get_current_hosts_in_room(room_id)
-        hosts_and_states.append((hosts, states))
+    states_by_host = {}
+    for state in states:
+        # Work out the distinct servers which share a room with the user (as
+        # well as the user's own server), so that each server gets each
+        # state at most once.
+        hosts = {get_domain_from_id(state.user_id)}
+        room_ids = yield index.get_rooms_for_user(state.user_id)
+        for room_id in room_ids:
+            room_hosts = yield index.get_hosts_in_room(room_id)
+            hosts.update(room_hosts)
 
-    for user_id, states in iteritems(users_to_states):
-        host = get_domain_from_id(user_id)
-        hosts_and_states.append(([host], states))
+        for host in hosts:
+            states_by_host.setdefault(host, []).append(state)
 
-    return hosts_and_states
+    return states_by_host
@@ -39,6 +39,7 @@ from synapse.types import (
     UserID,
 )
 from synapse.util.async_helpers import concurrently_execute
+from synapse.util.caches import get_cache_factor_for
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.caches.lrucache import LruCache
 from synapse.util.caches.response_cache import ResponseCache
@@ -71,6 +72,12 @@ LAZY_LOADED_MEMBERS_CACHE_MAX_AGE = 30 * 60 * 1000
 # avoiding redundantly sending the same lazy-loaded members to the client
 LAZY_LOADED_MEMBERS_CACHE_MAX_SIZE = 100
 
+# Keep the snapshot of the last sync of each device until it hasn't been used
+# for 10 minutes, and keep no more than this many rooms' entries across all of
+# the snapshots (before applying the cache factor).
+SYNC_SNAPSHOT_CACHE_MAX_AGE = 10 * 60 * 1000
+SYNC_SNAPSHOT_CACHE_MAX_ROOMS = 100000
+
 
 @attr.s(slots=True, frozen=True)
 class SyncConfig:
@@ -191,6 +198,57 @@ class _RoomChanges:
     newly_left_rooms = attr.ib(type=List[str])
 
 
+@attr.s(slots=True, frozen=True)
+class _RoomSnapshot:
+    """The parts of a room's entry in a sync response that are expensive to
+    compute, so that they can be reused if the room hasn't changed.
+
+    Attributes:
+        key: Identifies the range and type of the entry, so that we only reuse
+            it for an identical entry.
+        timeline: The timeline of the room.
+        state: The state to include in the room's entry.
+        summary: The room summary, if any.
+    """
+
+    key = attr.ib(type=Tuple[Any, ...])
+    timeline = attr.ib(type=TimelineBatch)
+    state = attr.ib(type=StateMap[EventBase])
+    summary = attr.ib(type=Optional[JsonDict])
+
+
+@attr.s(slots=True, frozen=True)
+class _SyncSnapshot:
+    """The computed room entries of the last sync of a device.
+
+    When a client makes a sync request with the same parameters again (e.g.
+    because it never received the response, or it keeps making full state
+    syncs), we only need to recompute the entries of rooms that have changed
+    since `now_token`.
+
+    Attributes:
+        since_token: The since token of the sync
+        full_state: The full_state flag of the sync
+        filter_json: The filter used for the sync
+        ignored_users: The users the user was ignoring at the time of the sync
+        now_token: The token the sync was computed up to
+        rooms: The entries of the joined and archived rooms in the sync.
+    """
+
+    since_token = attr.ib(type=Optional[StreamToken])
+    full_state = attr.ib(type=bool)
+    filter_json = attr.ib(type=JsonDict)
+    ignored_users = attr.ib(type=Optional[FrozenSet[str]])
+    now_token = attr.ib(type=StreamToken)
+    rooms = attr.ib(type=Dict[str, _RoomSnapshot])
+
+    def __len__(self) -> int:
+        """The size of the snapshot in the sync snapshot cache: one for each
+        room, plus one so that a snapshot without any rooms still counts.
+        """
+        return len(self.rooms) + 1
+
+
 @attr.s(slots=True, frozen=True)
 class SyncResult:
     """
@@ -260,6 +318,17 @@ class SyncHandler(object):
             expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE,
         )
 
+        # LruCache((User, Device)) -> _SyncSnapshot, sized by the number of
+        # rooms in the snapshots.
+        self.sync_snapshot_cache = LruCache(
+            int(
+                SYNC_SNAPSHOT_CACHE_MAX_ROOMS
+                * get_cache_factor_for("sync_snapshot_cache")
+            ),
+            size_callback=len,
+            expiry_ms=SYNC_SNAPSHOT_CACHE_MAX_AGE,
+        )
+
     async def wait_for_sync_for_user(
         self,
         sync_config: SyncConfig,
@@ -986,12 +1055,24 @@ class SyncHandler(object):
             joined_room_ids = await self.get_rooms_for_user_at(
                 user_id, now_token.room_stream_id
             )
+
+        snapshot_key = (user_id, sync_config.device_id)
+        filter_json = sync_config.filter_collection.get_filter_json()
+        previous_snapshot = self.sync_snapshot_cache.get(snapshot_key)
+        if previous_snapshot is not None and (
+            previous_snapshot.since_token != since_token
+            or previous_snapshot.full_state != full_state
+            or previous_snapshot.filter_json != filter_json
+        ):
+            previous_snapshot = None
+
         sync_result_builder = SyncResultBuilder(
             sync_config,
             full_state,
             since_token=since_token,
             now_token=now_token,
             joined_room_ids=joined_room_ids,
+            previous_snapshot=previous_snapshot,
         )
 
         account_data_by_room = await self._generate_sync_entry_for_account_data(
@@ -1031,6 +1112,15 @@ class SyncHandler(object):
 
         await self._generate_sync_entry_for_groups(sync_result_builder)
 
+        self.sync_snapshot_cache[snapshot_key] = _SyncSnapshot(
+            since_token=since_token,
+            full_state=full_state,
+            filter_json=filter_json,
+            ignored_users=sync_result_builder.ignored_users,
+            now_token=sync_result_builder.now_token,
+            rooms=sync_result_builder.room_snapshots,
+        )
+
         # debug for https://github.com/matrix-org/synapse/issues/4422
         for joined_room in sync_result_builder.joined:
             room_id = joined_room.room_id
@@ -1385,6 +1475,8 @@ class SyncHandler(object):
         else:
             ignored_users = frozenset()
 
+        sync_result_builder.ignored_users = frozenset(ignored_users)
+
         if since_token:
             room_changes = await self._get_rooms_changed(
                 sync_result_builder, ignored_users
@@ -1791,14 +1883,27 @@ class SyncHandler(object):
         since_token = room_builder.since_token
         upto_token = room_builder.upto_token
 
-        batch = await self._load_filtered_recents(
-            room_id,
-            sync_config,
-            now_token=upto_token,
-            since_token=since_token,
-            potential_recents=events,
-            newly_joined_room=newly_joined,
+        # We don't need to include the upto token, as that only differs if the
+        # room has changed.
+        snapshot_key = (
+            room_builder.rtype,
+            newly_joined,
+            full_state,
+            since_token.room_key if since_token else None,
         )
+        snapshot = self._get_room_snapshot(sync_result_builder, room_id, snapshot_key)
+
+        if snapshot:
+            batch = snapshot.timeline
+        else:
+            batch = await self._load_filtered_recents(
+                room_id,
+                sync_config,
+                now_token=upto_token,
+                since_token=since_token,
+                potential_recents=events,
+                newly_joined_room=newly_joined,
+            )
 
         # Note: `batch` can be both empty and limited here in the case where
         # `_load_filtered_recents` can't find any events the user should see
@@ -1843,33 +1948,19 @@ class SyncHandler(object):
         ):
             return
 
-        state = await self.compute_state_delta(
-            room_id, batch, sync_config, since_token, now_token, full_state=full_state
-        )
-
-        summary = {}  # type: Optional[JsonDict]
-
-        # we include a summary in room responses when we're lazy loading
-        # members (as the client otherwise doesn't have enough info to form
-        # the name itself).
-        if sync_config.filter_collection.lazy_load_members() and (
-            # we recalulate the summary:
-            #   if there are membership changes in the timeline, or
-            #   if membership has changed during a gappy sync, or
-            #   if this is an initial sync.
-            any(ev.type == EventTypes.Member for ev in batch.events)
-            or (
-                # XXX: this may include false positives in the form of LL
-                # members which have snuck into state
-                batch.limited
-                and any(t == EventTypes.Member for (t, k) in state)
+        if snapshot:
+            state = snapshot.state
+            summary = snapshot.summary
+        else:
+            state, summary = await self._compute_state_and_summary(
+                room_id, batch, sync_config, since_token, now_token, full_state
             )
-            or since_token is None
-        ):
-            summary = await self.compute_summary(
-                room_id, sync_config, batch, state, now_token
+            snapshot = _RoomSnapshot(
+                key=snapshot_key, timeline=batch, state=state, summary=summary
             )
 
+        sync_result_builder.room_snapshots[room_id] = snapshot
+
         if room_builder.rtype == "joined":
             unread_notifications = {}  # type: Dict[str, str]
             room_sync = JoinedSyncResult(
@@ -1909,6 +2000,79 @@ class SyncHandler(object):
         else:
             raise Exception("Unrecognized rtype: %r", room_builder.rtype)
 
+    async def _compute_state_and_summary(
+        self,
+        room_id: str,
+        batch: TimelineBatch,
+        sync_config: SyncConfig,
+        since_token: Optional[StreamToken],
+        now_token: StreamToken,
+        full_state: bool,
+    ) -> Tuple[StateMap[EventBase], Optional[JsonDict]]:
+        """Works out the state and summary to include in a room's entry.
+
+        Returns:
+            The state and the summary of the room
+        """
+        state = await self.compute_state_delta(
+            room_id, batch, sync_config, since_token, now_token, full_state=full_state
+        )
+
+        summary = {}  # type: Optional[JsonDict]
+
+        # we include a summary in room responses when we're lazy loading
+        # members (as the client otherwise doesn't have enough info to form
+        # the name itself).
+        if sync_config.filter_collection.lazy_load_members() and (
+            # we recalulate the summary:
+            #   if there are membership changes in the timeline, or
+            #   if membership has changed during a gappy sync, or
+            #   if this is an initial sync.
+            any(ev.type == EventTypes.Member for ev in batch.events)
+            or (
+                # XXX: this may include false positives in the form of LL
+                # members which have snuck into state
+                batch.limited
+                and any(t == EventTypes.Member for (t, k) in state)
+            )
+            or since_token is None
+        ):
+            summary = await self.compute_summary(
+                room_id, sync_config, batch, state, now_token
+            )
+
+        return state, summary
+
+    def _get_room_snapshot(
+        self,
+        sync_result_builder: "SyncResultBuilder",
+        room_id: str,
+        snapshot_key: Tuple[Any, ...],
+    ) -> Optional[_RoomSnapshot]:
+        """Gets the room's entry from the previous sync, if it can be reused.
+
+        It can be reused if the previous sync was for the same range and the
+        room hasn't changed since it was computed.
+        """
+        previous_snapshot = sync_result_builder.previous_snapshot
+        if previous_snapshot is None:
+            return None
+
+        if previous_snapshot.ignored_users != sync_result_builder.ignored_users:
+            return None
+
+        snapshot = previous_snapshot.rooms.get(room_id)
+        if not snapshot or snapshot.key != snapshot_key:
+            return None
+
+        stream_id = RoomStreamToken.parse_stream_token(
+            previous_snapshot.now_token.room_key
+        ).stream
+        if self.store.has_room_changed_since(room_id, stream_id):
+            return None
+
+        return snapshot
+
     async def get_rooms_for_user_at(
         self, user_id: str, stream_ordering: int
     ) -> FrozenSet[str]:
@@ -2028,6 +2192,11 @@ class SyncResultBuilder:
         since_token: The token supplied by user, or None.
         now_token: The token to sync up to.
         joined_room_ids: List of rooms the user is joined to
+        previous_snapshot: The snapshot of the last sync with the same
+            parameters, whose room entries we may be able to reuse.
+        ignored_users: The users the user is ignoring, or None if we haven't
+            looked them up.
+        room_snapshots: The room entries computed for this sync
 
         # The following mirror the fields in a sync response
         presence (list)
@@ -2044,6 +2213,9 @@ class SyncResultBuilder:
     since_token = attr.ib(type=Optional[StreamToken])
     now_token = attr.ib(type=StreamToken)
     joined_room_ids = attr.ib(type=FrozenSet[str])
+    previous_snapshot = attr.ib(type=Optional[_SyncSnapshot], default=None)
+    ignored_users = attr.ib(type=Optional[FrozenSet[str]], default=None)
+    room_snapshots = attr.ib(type=Dict[str, _RoomSnapshot], default=attr.Factory(dict))
 
     presence = attr.ib(type=List[JsonDict], default=attr.Factory(list))
     account_data = attr.ib(type=List[JsonDict], default=attr.Factory(list))
@@ -17,14 +17,17 @@
 import collections
 import html
 import http.client
+import itertools
+import json as stdlib_json
 import logging
 import types
 import urllib
 from io import BytesIO
 
 from canonicaljson import encode_canonical_json, encode_pretty_printed_json, json
+from zope.interface import implementer
 
-from twisted.internet import defer
+from twisted.internet import defer, interfaces
 from twisted.python import failure
 from twisted.web import resource
 from twisted.web.server import NOT_DONE_YET
@@ -43,9 +46,25 @@ from synapse.api.errors import (
 from synapse.logging.context import preserve_fn
 from synapse.logging.opentracing import trace_servlet
 from synapse.util.caches import intern_dict
+from synapse.util.frozenutils import _handle_frozendict
 
 logger = logging.getLogger(__name__)
 
+# The encoders for JSON responses that are streamed. These come from the
+# standard library rather than simplejson (which canonicaljson uses), as
+# simplejson's C encoder produces the whole encoding in one piece even from
+# iterencode. The canonical and pretty printed ones match canonicaljson's.
+_canonical_streaming_encoder = stdlib_json.JSONEncoder(
+    ensure_ascii=False,
+    separators=(",", ":"),
+    sort_keys=True,
+    default=_handle_frozendict,
+)
+_pretty_streaming_encoder = stdlib_json.JSONEncoder(
+    ensure_ascii=False, indent=4, sort_keys=True, default=_handle_frozendict
+)
+_streaming_encoder = stdlib_json.JSONEncoder(default=_handle_frozendict)
+
 HTML_ERROR_TEMPLATE = """<!DOCTYPE html>
 <html lang=en>
   <head>
@@ -252,7 +271,7 @@ class JsonResource(HttpServer, resource.Resource):
     isLeaf = True
 
     _PathEntry = collections.namedtuple(
-        "_PathEntry", ["pattern", "callback", "servlet_classname"]
+        "_PathEntry", ["pattern", "callback", "servlet_classname", "streaming"]
     )
 
     def __init__(self, hs, canonical_json=True):
@@ -264,7 +283,13 @@ class JsonResource(HttpServer, resource.Resource):
         self.hs = hs
 
     def register_paths(
-        self, method, path_patterns, callback, servlet_classname, trace=True
+        self,
+        method,
+        path_patterns,
+        callback,
+        servlet_classname,
+        trace=True,
+        streaming=False,
     ):
         """
         Registers a request handler against a regular expression. Later request URLs are
@@ -283,6 +308,10 @@ class JsonResource(HttpServer, resource.Resource):
                 and opentracing logs.
 
             trace (bool): Whether we should start a span to trace the servlet.
+
+            streaming (bool): Whether the JSON response should be encoded and
+                written a chunk at a time, rather than all at once. Only worth
+                it for handlers that may return very large responses.
         """
         method = method.encode("utf-8")  # method is bytes on py3
 
@@ -294,7 +323,7 @@ class JsonResource(HttpServer, resource.Resource):
         for path_pattern in path_patterns:
             logger.debug("Registering for %s %s", method, path_pattern.pattern)
             self.path_regexs.setdefault(method, []).append(
-                self._PathEntry(path_pattern, callback, servlet_classname)
+                self._PathEntry(path_pattern, callback, servlet_classname, streaming)
             )
 
     def render(self, request):
@@ -309,7 +338,12 @@ class JsonResource(HttpServer, resource.Resource):
             This checks if anyone has registered a callback for that method and
             path.
         """
-        callback, servlet_classname, group_dict = self._get_handler_for_request(request)
+        (
+            callback,
+            servlet_classname,
+            streaming,
+            group_dict,
+        ) = self._get_handler_for_request(request)
 
         # Make sure we have a name for this handler in prometheus.
         request.request_metrics.name = servlet_classname
@@ -332,7 +366,7 @@ class JsonResource(HttpServer, resource.Resource):
 
         if callback_return is not None:
             code, response = callback_return
-            self._send_response(request, code, response)
+            self._send_response(request, code, response, streaming=streaming)
 
     def _get_handler_for_request(self, request):
         """Finds a callback method to handle the given request
@@ -341,17 +375,17 @@ class JsonResource(HttpServer, resource.Resource):
             request (twisted.web.http.Request):
 
         Returns:
-            Tuple[Callable, str, dict[unicode, unicode]]: callback method, the
-                label to use for that method in prometheus metrics, and the
-                dict mapping keys to path components as specified in the
-                handler's path match regexp.
+            Tuple[Callable, str, bool, dict[unicode, unicode]]: callback method,
+                the label to use for that method in prometheus metrics, whether
+                to stream the response, and the dict mapping keys to path
+                components as specified in the handler's path match regexp.
 
                 The callback will normally be a method registered via
                 register_paths, so will return (possibly via Deferred) either
                 None, or a tuple of (http code, response body).
         """
         if request.method == b"OPTIONS":
-            return _options_handler, "options_request_handler", {}
+            return _options_handler, "options_request_handler", False, {}
 
         request_path = request.path.decode("ascii")
 
@@ -361,13 +395,23 @@ class JsonResource(HttpServer, resource.Resource):
             m = path_entry.pattern.match(request_path)
             if m:
                 # We found a match!
-                return path_entry.callback, path_entry.servlet_classname, m.groupdict()
+                return (
+                    path_entry.callback,
+                    path_entry.servlet_classname,
+                    path_entry.streaming,
+                    m.groupdict(),
+                )
 
         # Huh. No one wanted to handle that? Fiiiiiine. Send 400.
-        return _unrecognised_request_handler, "unrecognised_request_handler", {}
+        return _unrecognised_request_handler, "unrecognised_request_handler", False, {}
 
     def _send_response(
-        self, request, code, response_json_object, response_code_message=None
+        self,
+        request,
+        code,
+        response_json_object,
+        response_code_message=None,
+        streaming=False,
     ):
         # TODO: Only enable CORS for the requests that need it.
         respond_with_json(
@@ -378,6 +422,7 @@ class JsonResource(HttpServer, resource.Resource):
             response_code_message=response_code_message,
             pretty_print=_request_user_agent_is_curl(request),
             canonical_json=self.canonical_json,
+            streaming=streaming,
         )
 
 
@@ -456,6 +501,7 @@ def respond_with_json(
     response_code_message=None,
     pretty_print=False,
     canonical_json=True,
+    streaming=False,
 ):
     # could alternatively use request.notifyFinish() and flip a flag when
     # the Deferred fires, but since the flag is RIGHT THERE it seems like
@@ -466,6 +512,28 @@ def respond_with_json(
         )
         return
 
+    if streaming:
+        if pretty_print:
+            encoder = _pretty_streaming_encoder
+        elif canonical_json or synapse.events.USE_FROZEN_DICTS:
+            encoder = _canonical_streaming_encoder
+        else:
+            encoder = _streaming_encoder
+
+        json_chunks = (
+            chunk.encode("utf-8") for chunk in encoder.iterencode(json_object)
+        )
+        if pretty_print:
+            json_chunks = itertools.chain(json_chunks, (b"\n",))
+
+        return respond_with_json_chunks(
+            request,
+            code,
+            json_chunks,
+            send_cors=send_cors,
+            response_code_message=response_code_message,
+        )
+
     if pretty_print:
         json_bytes = encode_pretty_printed_json(json_object) + b"\n"
     else:
@@ -515,6 +583,93 @@ def respond_with_json_bytes(
     return NOT_DONE_YET
 
 
+def respond_with_json_chunks(
+    request, code, json_chunks, send_cors=False, response_code_message=None
+):
+    """Sends JSON in response to the given request, encoding it as it is
+    written out.
+
+    This avoids holding the whole encoded response in memory, and lets the
+    reactor get on with other things between chunks, which matters for very
+    large responses. The response is sent without a Content-Length, so will
+    use chunked transfer encoding.
+
+    Args:
+        request (twisted.web.http.Request): The http request to respond to.
+        code (int): The HTTP response code.
+        json_chunks (Iterator[bytes]): The encoded json, in pieces.
+        send_cors (bool): Whether to send Cross-Origin Resource Sharing headers
+            http://www.w3.org/TR/cors/
+    Returns:
+        twisted.web.server.NOT_DONE_YET"""
+
+    request.setResponseCode(code, message=response_code_message)
+    request.setHeader(b"Content-Type", b"application/json")
+    request.setHeader(b"Cache-Control", b"no-cache, no-store, must-revalidate")
+
+    if send_cors:
+        set_cors_headers(request)
+
+    producer = _ChunkedJsonProducer(request, json_chunks)
+    producer.start()
+    return NOT_DONE_YET
+
+
+@implementer(interfaces.IPullProducer)
+class _ChunkedJsonProducer(object):
+    """Writes the chunks of an encoded JSON object to a request, a batch of
+    chunks at a time.
+
+    This is a pull producer, so the next batch is only encoded once the
+    previous one has been written to the transport.
+    """
+
+    # The JSON encoder produces many tiny chunks, so we coalesce them into
+    # writes of at least this many bytes.
+    min_write_size = 64 * 1024
+
+    def __init__(self, request, json_chunks):
+        self.request = request
+        self.json_chunks = json_chunks
+
+    def start(self):
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if not self.request:
+            return
+
+        data = []
+        size = 0
+        try:
+            while size < self.min_write_size:
+                chunk = next(self.json_chunks)
+                data.append(chunk)
+                size += len(chunk)
+        except StopIteration:
+            if data:
+                self.request.write(b"".join(data))
+            self.request.unregisterProducer()
+            finish_request(self.request)
+            self.stopProducing()
+            return
+        except Exception:
+            # We've already sent the headers, so all we can do is drop the
+            # connection so that the client doesn't mistake the truncated
+            # response for a complete one.
+            logger.exception("Failed to encode response to %s", self.request)
+            self.request.unregisterProducer()
+            self.request.loseConnection()
+            self.stopProducing()
+            return
+
+        self.request.write(b"".join(data))
+
+    def stopProducing(self):
+        self.request = None
+        self.json_chunks = None
+
+
 def set_cors_headers(request):
     """Set the CORs headers so that javascript running in a web browsers can
     use this API
@@ -285,8 +285,14 @@ class RestServlet(object):
 
     Automatically handles turning CodeMessageExceptions thrown by these methods
     into the appropriate HTTP response.
+
+    Servlets that may return very large responses can set the `STREAM_RESPONSE`
+    class attribute, so that their responses are encoded and written out a
+    chunk at a time.
     """
 
+    STREAM_RESPONSE = False
+
     def register(self, http_server):
         """ Register this servlet with the given HTTP server. """
         if hasattr(self, "PATTERNS"):
@@ -297,7 +303,11 @@ class RestServlet(object):
                     servlet_classname = self.__class__.__name__
                     method_handler = getattr(self, "on_%s" % (method,))
                     http_server.register_paths(
-                        method, patterns, method_handler, servlet_classname
+                        method,
+                        patterns,
+                        method_handler,
+                        servlet_classname,
+                        streaming=self.STREAM_RESPONSE,
                     )
 
         else:
@@ -19,6 +19,8 @@ from collections import namedtuple
 
 from six import iteritems, itervalues
 
+import attr
+from canonicaljson import json
 from prometheus_client import Counter
 
 from twisted.internet import defer
@@ -27,8 +29,9 @@ from synapse.api.constants import EventTypes, Membership
 from synapse.event_auth import get_user_power_level
 from synapse.state import POWER_KEY
 from synapse.util.async_helpers import Linearizer
-from synapse.util.caches import register_cache
+from synapse.util.caches import CACHE_SIZE_FACTOR, register_cache
 from synapse.util.caches.descriptors import cached
+from synapse.util.caches.lrucache import LruCache
 
 from .push_rule_evaluator import PushRuleEvaluatorForEvent
 
@@ -145,7 +148,6 @@ class BulkPushRuleEvaluator(object):
             Deferred
         """
         rules_by_user = yield self._get_rules_for_event(event, context)
-        actions_by_user = {}
 
         room_members = yield self.store.get_joined_users_from_context(event, context)
 
@@ -158,7 +160,7 @@ class BulkPushRuleEvaluator(object):
             event, len(room_members), sender_power_level, power_levels
         )
 
-        condition_cache = {}
+        users = []
 
         for uid, rules in iteritems(rules_by_user):
             if event.sender == uid:
@@ -180,19 +182,9 @@ class BulkPushRuleEvaluator(object):
                 if event.type == EventTypes.Member and event.state_key == uid:
                     display_name = event.content.get("displayname", None)
 
-            for rule in rules:
-                if "enabled" in rule and not rule["enabled"]:
-                    continue
+            users.append((uid, display_name, rules))
 
-                matches = _condition_checker(
-                    evaluator, rule["conditions"], uid, display_name, condition_cache
-                )
-                if matches:
-                    actions = [x for x in rule["actions"] if x != "dont_notify"]
-                    if actions and "notify" in actions:
-                        # Push rules say we should notify the user of this event
-                        actions_by_user[uid] = actions
-                    break
+        actions_by_user = evaluate_push_rules_for_users(evaluator, users)
 
         # Mark in the DB staging area the push actions for users who should be
         # notified for this event. (This will then get handled when we persist
@@ -200,19 +192,220 @@ class BulkPushRuleEvaluator(object):
         yield self.store.add_push_actions_to_staging(event.event_id, actions_by_user)
 
 
-def _condition_checker(evaluator, conditions, uid, display_name, cache):
-    for cond in conditions:
-        _id = cond.get("_id", None)
-        if _id:
-            res = cache.get(_id, None)
-            if res is False:
-                return False
-            elif res is True:
+def evaluate_push_rules_for_users(evaluator, users):
+    """Works out which of the given users should be notified about an event.
+
+    Users with identical push rules (which is most of them, as most users
+    stick with the defaults) share a compiled rule set, so we group them up
+    and evaluate each rule set for all of its users at once.
+
+    Args:
+        evaluator (PushRuleEvaluatorForEvent): The evaluator for the event.
+        users (list[tuple[str, str|None, list[dict]]]): The user ID, display
+            name and push rules of each user to evaluate the event for.
+
+    Returns:
+        dict[str, list]: Map from user ID to actions, for the users that should
+        be notified.
+    """
+    users_by_rule_set = {}
+    for uid, display_name, rules in users:
+        rule_set = compile_push_rules(rules)
+        users_by_rule_set.setdefault(rule_set, []).append((uid, display_name))
+
+    # The result of each condition that only depends on the event, shared
+    # across all rule sets.
+    condition_cache = {}
+
+    actions_by_user = {}
+    for rule_set, rule_set_users in iteritems(users_by_rule_set):
+        actions_by_user.update(
+            rule_set.evaluate(evaluator, rule_set_users, condition_cache)
+        )
+
+    return actions_by_user
+
+
+# Caches id(rules) -> (rules, CompiledRuleSet). We keep a reference to the
+# rules list so that its id can't be reused while it is in the cache.
+compiled_rules_by_id_cache = LruCache(50000 * CACHE_SIZE_FACTOR)
+register_cache("cache", "compiled_push_rules_by_id", compiled_rules_by_id_cache)
+
+# Caches rule set fingerprint -> CompiledRuleSet, so that users with identical
+# rules share one compiled rule set.
+compiled_rules_cache = LruCache(5000 * CACHE_SIZE_FACTOR)
+register_cache("cache", "compiled_push_rules", compiled_rules_cache)
+
+
+def compile_push_rules(rules):
+    """Gets the compiled form of a user's push rules.
+
+    Args:
+        rules (list[dict]): The user's push rules, as returned by
+            `get_push_rules_for_user`.
+
+    Returns:
+        CompiledRuleSet: A rule set shared with every other user with the same
+        rules.
+    """
+    entry = compiled_rules_by_id_cache.get(id(rules))
+    if entry and entry[0] is rules:
+        return entry[1]
+
+    fingerprint = json.dumps(
+        [
+            (rule.get("enabled", True), rule["conditions"], rule["actions"])
+            for rule in rules
+        ],
+        sort_keys=True,
+    )
+
+    rule_set = compiled_rules_cache.get(fingerprint)
+    if rule_set is None:
+        rule_set = CompiledRuleSet.compile(rules)
+        compiled_rules_cache[fingerprint] = rule_set
+
+    compiled_rules_by_id_cache[id(rules)] = (rules, rule_set)
+    return rule_set
+
+
+def _is_user_condition(condition):
+    """Whether the outcome of the condition depends on the user whose rule it
+    is, rather than just the event.
+    """
+    kind = condition.get("kind")
+    if kind == "contains_display_name":
+        return True
+
+    # event_match conditions without an explicit pattern match against the
+    # user's ID or localpart.
+    return kind == "event_match" and not condition.get("pattern")
+
+
+@attr.s(slots=True, frozen=True)
+class CompiledRule(object):
+    """A push rule with its conditions split by whether they depend on the
+    user.
+
+    Attributes:
+        event_conditions (tuple[tuple[str, dict]]): The conditions that only
+            depend on the event, with a key identifying each condition.
+        user_conditions (tuple[dict]): The conditions that need evaluating for
+            each user.
+        actions (list|None): The actions if the rule notifies, or None.
+    """
+
+    event_conditions = attr.ib()
+    user_conditions = attr.ib()
+    actions = attr.ib()
+
+    @classmethod
+    def compile(cls, rule):
+        event_conditions = []
+        user_conditions = []
+        for condition in rule["conditions"]:
+            if _is_user_condition(condition):
+                user_conditions.append(condition)
+            else:
+                key = json.dumps(condition, sort_keys=True)
+                event_conditions.append((key, condition))
+
+        actions = [x for x in rule["actions"] if x != "dont_notify"]
+        if not actions or "notify" not in actions:
+            actions = None
+
+        return cls(
+            event_conditions=tuple(event_conditions),
+            user_conditions=tuple(user_conditions),
+            actions=actions,
+        )
+
+
+class CompiledRuleSet(object):
+    """The enabled push rules of a set of users with identical push rules.
+    """
+
+    __slots__ = ["rules"]
+
+    def __init__(self, rules):
+        """
+        Args:
+            rules (list[CompiledRule])
+        """
+        self.rules = rules
+
+    @classmethod
+    def compile(cls, rules):
+        return cls(
+            [
+                CompiledRule.compile(rule)
+                for rule in rules
+                if "enabled" not in rule or rule["enabled"]
+            ]
+        )
+
+    def evaluate(self, evaluator, users, condition_cache):
+        """Evaluates the rules for the event for all of the given users.
+
+        The first rule that matches for a user decides the outcome for that
+        user, so we walk the rules in order with the shrinking set of users
+        that haven't matched yet.
+
+        Args:
+            evaluator (PushRuleEvaluatorForEvent)
+            users (list[tuple[str, str|None]]): The user IDs and display names
+                of the users who have these rules.
+            condition_cache (dict[str, bool]): The results of conditions that
+                only depend on the event, keyed by condition key. This is
+                shared across rule sets for the same event.
+
+        Returns:
+            dict[str, list]: Map from user ID to actions, for the users that
+            should be notified.
+        """
+        actions_by_user = {}
+
+        remaining = users
+        for rule in self.rules:
+            if not remaining:
+                break
+
+            if not _check_event_conditions(evaluator, rule, condition_cache):
                 continue
 
-        res = evaluator.matches(cond, uid, display_name)
-        if _id:
-            cache[_id] = bool(res)
+            if rule.user_conditions:
+                matched = []
+                unmatched = []
+                for user in remaining:
+                    uid, display_name = user
+                    if all(
+                        evaluator.matches(condition, uid, display_name)
+                        for condition in rule.user_conditions
+                    ):
+                        matched.append(user)
+                    else:
+                        unmatched.append(user)
+            else:
+                matched = remaining
+                unmatched = []
+
+            if rule.actions:
+                # Push rules say we should notify the user of this event
+                for uid, _ in matched:
+                    actions_by_user[uid] = rule.actions
+
+            remaining = unmatched
+
+        return actions_by_user
+
+
+def _check_event_conditions(evaluator, rule, cache):
+    for key, condition in rule.event_conditions:
+        res = cache.get(key)
+        if res is None:
+            # The user doesn't matter for these conditions.
+            res = bool(evaluator.matches(condition, None, None))
+            cache[key] = res
 
         if not res:
             return False
@@ -19,6 +19,8 @@ from synapse.replication.http import (
     federation,
     login,
     membership,
+    persist_events,
+    presence,
     register,
     send_event,
 )
@@ -38,3 +40,5 @@ class ReplicationRestResource(JsonResource):
         login.register_servlets(hs, self)
         register.register_servlets(hs, self)
         devices.register_servlets(hs, self)
+        persist_events.register_servlets(hs, self)
+        presence.register_servlets(hs, self)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from synapse.events import event_type_from_format_version
+from synapse.events.snapshot import EventContext
+from synapse.http.servlet import parse_json_object_from_request
+from synapse.replication.http._base import ReplicationEndpoint
+from synapse.replication.http.federation import (
+    ReplicationFederationSendEventsRestServlet,
+)
+from synapse.util.metrics import Measure
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicationPersistEventsRestServlet(ReplicationEndpoint):
+    """Asks an event persister to persist a batch of events for a room which
+    it is responsible for.
+
+    The API looks like:
+
+        POST /_synapse/replication/persist_events/:txn_id
+
+        {
+            "events": [{
+                "event": { .. serialized event .. },
+                "internal_metadata": { .. serialized internal_metadata .. },
+                "rejected_reason": ..,   // The event.rejected_reason field
+                "context": { .. serialized event context .. },
+            }],
+            "backfilled": false
+        }
+
+        200 OK
+
+        {
+            "stream_orderings": { "$event_id": 1234, .. }
+        }
+    """
+
+    NAME = "persist_events"
+    PATH_ARGS = ()
+
+    def __init__(self, hs):
+        super(ReplicationPersistEventsRestServlet, self).__init__(hs)
+
+        self.storage = hs.get_storage()
+        self.clock = hs.get_clock()
+
+    # The events are sent in the same way as for `fed_send_events`.
+    _serialize_payload = staticmethod(
+        ReplicationFederationSendEventsRestServlet._serialize_payload
+    )
+
+    async def _handle_request(self, request):
+        with Measure(self.clock, "repl_persist_events_parse"):
+            content = parse_json_object_from_request(request)
+
+            backfilled = content["backfilled"]
+
+            event_and_contexts = []
+            for event_payload in content["events"]:
+                event_dict = event_payload["event"]
+                format_ver = event_payload["event_format_version"]
+                internal_metadata = event_payload["internal_metadata"]
+                rejected_reason = event_payload["rejected_reason"]
+
+                EventType = event_type_from_format_version(format_ver)
+                event = EventType(event_dict, internal_metadata, rejected_reason)
+
+                context = EventContext.deserialize(
+                    self.storage, event_payload["context"]
+                )
+
+                event_and_contexts.append((event, context))
+
+        logger.info("Got %d events to persist", len(event_and_contexts))
+
+        await self.storage.persistence.persist_events(event_and_contexts, backfilled)
+
+        stream_orderings = {
+            event.event_id: event.internal_metadata.stream_ordering
+            for event, _ in event_and_contexts
+        }
+
+        return 200, {"stream_orderings": stream_orderings}
+
+
+def register_servlets(hs, http_server):
+    ReplicationPersistEventsRestServlet(hs).register(http_server)
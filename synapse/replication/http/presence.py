@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Endpoints used to shard presence between presence writers.
+
+The first set are served by the instance handling the presence of a given user
+(see `stream_writers.presence`), and are used by other processes to pass on
+things which change that user's presence. The last is served by the master,
+which persists and sends out the updates the presence writers produce.
+"""
+
+import logging
+
+from synapse.http.servlet import parse_json_object_from_request
+from synapse.replication.http._base import ReplicationEndpoint
+from synapse.storage.presence import UserPresenceState
+from synapse.types import UserID
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicationPresenceSetStateRestServlet(ReplicationEndpoint):
+    """Set the presence state of a user, as per `PresenceHandler.set_state`.
+
+    Request format:
+
+        POST /_synapse/replication/presence_set_state/:user_id
+
+        {
+            "state": { ... },
+            "ignore_status_msg": false,
+        }
+
+    Response is empty.
+    """
+
+    NAME = "presence_set_state"
+    PATH_ARGS = ("user_id",)
+    CACHE = False
+
+    def __init__(self, hs):
+        super(ReplicationPresenceSetStateRestServlet, self).__init__(hs)
+
+        self._presence_handler = hs.get_presence_handler()
+
+    @staticmethod
+    def _serialize_payload(user_id, state, ignore_status_msg=False):
+        return {"state": state, "ignore_status_msg": ignore_status_msg}
+
+    async def _handle_request(self, request, user_id):
+        content = parse_json_object_from_request(request)
+
+        await self._presence_handler.set_state(
+            UserID.from_string(user_id), content["state"], content["ignore_status_msg"],
+        )
+
+        return 200, {}
+
+
+class ReplicationBumpPresenceActiveTimeRestServlet(ReplicationEndpoint):
+    """Record that we've seen a user interacting with the server, as per
+    `PresenceHandler.bump_presence_active_time`.
+
+    Request format:
+
+        POST /_synapse/replication/bump_presence_active_time/:user_id
+
+        {}
+
+    Response is empty.
+    """
+
+    NAME = "bump_presence_active_time"
+    PATH_ARGS = ("user_id",)
+    CACHE = False
+
+    def __init__(self, hs):
+        super(ReplicationBumpPresenceActiveTimeRestServlet, self).__init__(hs)
+
+        self._presence_handler = hs.get_presence_handler()
+
+    @staticmethod
+    def _serialize_payload(user_id):
+        return {}
+
+    async def _handle_request(self, request, user_id):
+        await self._presence_handler.bump_presence_active_time(
+            UserID.from_string(user_id)
+        )
+
+        return 200, {}
+
+
+class ReplicationPresenceUserSyncRestServlet(ReplicationEndpoint):
+    """Record that a user has started or stopped syncing on a process, as per
+    `PresenceHandler.update_external_syncs_row`.
+
+    Request format:
+
+        POST /_synapse/replication/presence_user_sync/:user_id
+
+        {
+            "process_id": "...",
+            "is_syncing": true,
+            "sync_time_msec": 1234,
+        }
+
+    Response is empty.
+    """
+
+    NAME = "presence_user_sync"
+    PATH_ARGS = ("user_id",)
+    CACHE = False
+
+    def __init__(self, hs):
+        super(ReplicationPresenceUserSyncRestServlet, self).__init__(hs)
+
+        self._presence_handler = hs.get_presence_handler()
+
+    @staticmethod
+    def _serialize_payload(user_id, process_id, is_syncing, sync_time_msec):
+        return {
+            "process_id": process_id,
+            "is_syncing": is_syncing,
+            "sync_time_msec": sync_time_msec,
+        }
+
+    async def _handle_request(self, request, user_id):
+        content = parse_json_object_from_request(request)
+
+        await self._presence_handler.update_external_syncs_row(
+            content["process_id"],
+            user_id,
+            content["is_syncing"],
+            content["sync_time_msec"],
+        )
+
+        return 200, {}
+
+
+class ReplicationPresenceClearSyncsRestServlet(ReplicationEndpoint):
+    """Forget the users syncing on a process which has gone away, as per
+    `PresenceHandler.update_external_syncs_clear`.
+
+    Request format:
+
+        POST /_synapse/replication/presence_clear_syncs/:txn_id
+
+        {
+            "process_id": "...",
+        }
+
+    Response is empty.
+    """
+
+    NAME = "presence_clear_syncs"
+    PATH_ARGS = ()
+
+    def __init__(self, hs):
+        super(ReplicationPresenceClearSyncsRestServlet, self).__init__(hs)
+
+        self._presence_handler = hs.get_presence_handler()
+
+    @staticmethod
+    def _serialize_payload(process_id):
+        return {"process_id": process_id}
+
+    async def _handle_request(self, request):
+        content = parse_json_object_from_request(request)
+
+        await self._presence_handler.update_external_syncs_clear(content["process_id"])
+
+        return 200, {}
+
+
+class ReplicationIncomingPresenceRestServlet(ReplicationEndpoint):
+    """Handle presence updates received over federation, as per
+    `PresenceHandler.incoming_presence`.
+
+    Request format:
+
+        POST /_synapse/replication/incoming_presence/:origin
+
+        {
+            "push": [ ... ],
+        }
+
+    Response is empty.
+    """
+
+    NAME = "incoming_presence"
+    PATH_ARGS = ("origin",)
+    CACHE = False
+
+    def __init__(self, hs):
+        super(ReplicationIncomingPresenceRestServlet, self).__init__(hs)
+
+        self._presence_handler = hs.get_presence_handler()
+
+    @staticmethod
+    def _serialize_payload(origin, content):
+        return content
+
+    async def _handle_request(self, request, origin):
+        content = parse_json_object_from_request(request)
+
+        await self._presence_handler.incoming_presence(origin, content)
+
+        return 200, {}
+
+
+class ReplicationPresenceUpdateRestServlet(ReplicationEndpoint):
+    """Handles presence updates produced by a presence writer. Only served by
+    the master.
+
+    The action is one of:
+
+        * "notify": the updates should be persisted, and sent to clients and
+          remote servers.
+        * "persist": the updates only need persisting.
+        * "ping": the updates only need sending to remote servers, to keep
+          them from timing out the users.
+
+    Request format:
+
+        POST /_synapse/replication/presence_update/:txn_id
+
+        {
+            "action": "notify",
+            "states": [ { .. serialized UserPresenceState .. } ],
+        }
+
+    Response is empty.
+    """
+
+    NAME = "presence_update"
+    PATH_ARGS = ()
+
+    def __init__(self, hs):
+        super(ReplicationPresenceUpdateRestServlet, self).__init__(hs)
+
+        self._presence_handler = hs.get_presence_handler()
+
+    @staticmethod
+    def _serialize_payload(action, states):
+        return {"action": action, "states": [state.as_dict() for state in states]}
+
+    async def _handle_request(self, request):
+        content = parse_json_object_from_request(request)
+
+        states = [UserPresenceState.from_dict(d) for d in content["states"]]
+        await self._presence_handler.update_from_writer(content["action"], states)
+
+        return 200, {}
+
+
+def register_servlets(hs, http_server):
+    ReplicationPresenceSetStateRestServlet(hs).register(http_server)
+    ReplicationBumpPresenceActiveTimeRestServlet(hs).register(http_server)
+    ReplicationPresenceUserSyncRestServlet(hs).register(http_server)
+    ReplicationPresenceClearSyncsRestServlet(hs).register(http_server)
+    ReplicationIncomingPresenceRestServlet(hs).register(http_server)
+    ReplicationPresenceUpdateRestServlet(hs).register(http_server)
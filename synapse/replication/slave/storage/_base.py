@@ -79,7 +79,15 @@ class BaseSlavedStore(SQLBaseStore):
 
     def _invalidate_cache_and_stream(self, txn, cache_func, keys):
         txn.call_after(cache_func.invalidate, keys)
-        txn.call_after(self._send_invalidation_poke, cache_func, keys)
+        self._send_invalidation_to_replication(txn, cache_func.__name__, keys)
 
-    def _send_invalidation_poke(self, cache_func, keys):
-        self.hs.get_tcp_replication().send_invalidate_cache(cache_func, keys)
+    def _send_invalidation_to_replication(self, txn, cache_name, keys):
+        """Asks the master to stream out the invalidation to other workers,
+        once the transaction has completed.
+        """
+        if keys is not None:
+            keys = list(keys)
+        txn.call_after(self._send_invalidation_poke, cache_name, keys)
+
+    def _send_invalidation_poke(self, cache_name, keys):
+        self.hs.get_tcp_replication().send_invalidate_cache(cache_name, keys)
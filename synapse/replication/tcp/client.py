@@ -22,12 +22,15 @@ from twisted.internet import defer
 from twisted.internet.protocol import ReconnectingClientFactory
 
 from synapse.replication.slave.storage._base import BaseSlavedStore
+from synapse.replication.tcp.framing import SUPPORTED_MODES
 from synapse.replication.tcp.protocol import (
     AbstractReplicationClientHandler,
     ClientReplicationStreamProtocol,
 )
+from synapse.replication.tcp.redis import RedisPubSub
 
 from .commands import (
+    VALID_PUBSUB_COMMANDS,
     Command,
     FederationAckCommand,
     InvalidateCacheCommand,
@@ -57,6 +60,13 @@ class ReplicationClientFactory(ReconnectingClientFactory):
         self.server_name = hs.config.server_name
         self._clock = hs.get_clock()  # As self.clock is defined in super class
 
+        # The binary modes to offer the server, in order of preference.
+        mode = hs.config.worker_replication_mode
+        if mode in SUPPORTED_MODES:
+            self.modes = SUPPORTED_MODES[SUPPORTED_MODES.index(mode) :]
+        else:
+            self.modes = ()
+
         hs.get_reactor().addSystemEventTrigger("before", "shutdown", self.stopTrying)
 
     def startedConnecting(self, connector):
@@ -65,7 +75,7 @@ class ReplicationClientFactory(ReconnectingClientFactory):
     def buildProtocol(self, addr):
         logger.info("Connected to replication: %r", addr)
         return ClientReplicationStreamProtocol(
-            self.client_name, self.server_name, self._clock, self.handler
+            self.client_name, self.server_name, self._clock, self.handler, self.modes
         )
 
     def clientConnectionLost(self, connector, reason):
@@ -101,6 +111,10 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
         # The factory used to create connections.
         self.factory = None  # type: Optional[ReplicationClientFactory]
 
+        # The pub/sub transport used to send commands to other processes, if
+        # enabled.
+        self.pubsub = None  # type: Optional[RedisPubSub]
+
     def start_replication(self, hs):
         """Helper method to start a replication connection to the remote server
         using TCP.
@@ -111,6 +125,10 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
         port = hs.config.worker_replication_port
         hs.get_reactor().connectTCP(host, port, self.factory)
 
+        if hs.config.redis_enabled:
+            self.pubsub = RedisPubSub(hs, self)
+            self.pubsub.start()
+
     async def on_rdata(self, stream_name, token, rows):
         """Called to handle a batch of replication data with a given stream token.
 
@@ -147,6 +165,18 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
     def on_remote_server_up(self, server: str):
         """Called when get a new REMOTE_SERVER_UP command."""
 
+    async def on_pubsub_command(self, instance_name: str, cmd: Command):
+        """Called when another process has published a command over pub/sub.
+
+        Most of these are only of interest to the master, but we can act on
+        remote servers coming back up, and invalidate our caches without
+        waiting for the master to stream the invalidation back to us.
+        """
+        if isinstance(cmd, RemoteServerUpCommand):
+            self.on_remote_server_up(cmd.data)
+        elif isinstance(cmd, InvalidateCacheCommand):
+            self.store._attempt_to_invalidate_cache(cmd.cache_func, tuple(cmd.keys))
+
     def get_streams_to_replicate(self) -> Dict[str, int]:
         """Called when a new connection has been established and we need to
         subscribe to streams.
@@ -175,18 +205,27 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
     def send_command(self, cmd):
         """Send a command to master (when we get establish a connection if we
         don't have one already.)
+
+        If pub/sub is enabled, commands which can be are published there
+        instead.
         """
-        if self.connection:
+        if self.pubsub and cmd.NAME in VALID_PUBSUB_COMMANDS:
+            self.pubsub.send_command(cmd)
+        elif self.connection:
             self.connection.send_command(cmd)
         else:
             logger.warning("Queuing command as not connected: %r", cmd.NAME)
             self.pending_commands.append(cmd)
 
-    def send_federation_ack(self, token):
+    def send_federation_ack(self, instance_name, token):
         """Ack data for the federation stream. This allows the master to drop
         data stored purely in memory.
+
+        Args:
+            instance_name (str): the federation sender instance acking
+            token (int): how far it has processed the stream
         """
-        self.send_command(FederationAckCommand(token))
+        self.send_command(FederationAckCommand(instance_name, token))
 
     def send_user_sync(self, user_id, is_syncing, last_sync_ms):
         """Poke the master that a user has started/stopped syncing.
@@ -199,10 +238,10 @@ class ReplicationClientHandler(AbstractReplicationClientHandler):
         cmd = RemovePusherCommand(app_id, push_key, user_id)
         self.send_command(cmd)
 
-    def send_invalidate_cache(self, cache_func, keys):
+    def send_invalidate_cache(self, cache_name, keys):
         """Poke the master to invalidate a cache.
         """
-        cmd = InvalidateCacheCommand(cache_func.__name__, keys)
+        cmd = InvalidateCacheCommand(cache_name, keys)
         self.send_command(cmd)
 
     def send_user_ip(self, user_id, access_token, ip, user_agent, device_id, last_seen):
@@ -15,7 +15,8 @@
 """Defines the various valid commands
 
 The VALID_SERVER_COMMANDS and VALID_CLIENT_COMMANDS define which commands are
-allowed to be sent by which side.
+allowed to be sent by which side, and VALID_PUBSUB_COMMANDS which can be sent
+over a pub/sub broker.
 """
 
 import logging
@@ -172,11 +173,52 @@ class PingCommand(Command):
 
 class NameCommand(Command):
     """Sent by client to inform the server of the client's identity. The data
-    is the name
+    is the name.
+
+    The client may also list the binary modes of the protocol it supports (see
+    `synapse.replication.tcp.framing`), in order of preference.
+
+    Format::
+
+        NAME <name> [modes=<mode>,...]
+
+    Servers which don't support binary modes will treat the list as part of the
+    name.
     """
 
     NAME = "NAME"
 
+    def __init__(self, data, modes=()):
+        self.data = data
+        self.modes = tuple(modes)
+
+    @classmethod
+    def from_line(cls, line):
+        name, sep, modes = line.rpartition(" modes=")
+        if not sep:
+            return cls(line)
+
+        return cls(name, modes.split(","))
+
+    def to_line(self):
+        if not self.modes:
+            return self.data
+
+        return "%s modes=%s" % (self.data, ",".join(self.modes))
+
+
+class ModeCommand(Command):
+    """Sent by the server in response to a `NAME` command listing a binary
+    mode which it supports, and then by the client in acknowledgement.
+    Everything a side sends after its `MODE` command is in that mode.
+
+    Format::
+
+        MODE <mode>
+    """
+
+    NAME = "MODE"
+
 
 class ReplicateCommand(Command):
     """Sent by the client to subscribe to the stream.
@@ -257,28 +299,29 @@ class UserSyncCommand(Command):
 
 
 class FederationAckCommand(Command):
-    """Sent by the client when it has processed up to a given point in the
-    federation stream. This allows the master to drop in-memory caches of the
-    federation stream.
-
-    This must only be sent from one worker (i.e. the one sending federation)
+    """Sent by a federation sender instance when it has processed up to a
+    given point in the federation stream. This allows the master to drop
+    in-memory caches of the federation stream, once every federation sender
+    instance has processed them.
 
     Format::
 
-        FEDERATION_ACK <token>
+        FEDERATION_ACK <instance_name> <token>
     """
 
     NAME = "FEDERATION_ACK"
 
-    def __init__(self, token):
+    def __init__(self, instance_name, token):
+        self.instance_name = instance_name
         self.token = token
 
     @classmethod
     def from_line(cls, line):
-        return cls(int(line))
+        instance_name, token = line.split(" ", 1)
+        return cls(instance_name, int(token))
 
     def to_line(self):
-        return str(self.token)
+        return "%s %s" % (self.instance_name, self.token)
 
 
 class SyncCommand(Command):
@@ -391,7 +434,8 @@ class RemoteServerUpCommand(Command):
     """Sent when a worker has detected that a remote server is no longer
     "down" and retry timings should be reset.
 
-    If sent from a client the server will relay to all other workers.
+    If sent from a client the server will relay to all other workers. If sent
+    over pub/sub it is received by every other process directly.
 
     Format::
 
@@ -408,6 +452,7 @@ _COMMANDS = (
     ErrorCommand,
     PingCommand,
     NameCommand,
+    ModeCommand,
     ReplicateCommand,
     UserSyncCommand,
     FederationAckCommand,
@@ -430,6 +475,7 @@ VALID_SERVER_COMMANDS = (
     PingCommand.NAME,
     SyncCommand.NAME,
     RemoteServerUpCommand.NAME,
+    ModeCommand.NAME,
 )
 
 # The commands the client is allowed to send
@@ -444,4 +490,16 @@ VALID_CLIENT_COMMANDS = (
     UserIpCommand.NAME,
     ErrorCommand.NAME,
     RemoteServerUpCommand.NAME,
+    ModeCommand.NAME,
+)
+
+# The commands that can be sent over a pub/sub broker, rather than to the master
+# over a replication connection. These are received by every other process.
+VALID_PUBSUB_COMMANDS = (
+    UserSyncCommand.NAME,
+    FederationAckCommand.NAME,
+    RemovePusherCommand.NAME,
+    InvalidateCacheCommand.NAME,
+    UserIpCommand.NAME,
+    RemoteServerUpCommand.NAME,
 )
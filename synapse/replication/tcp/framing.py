@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The binary modes of the replication protocol.
+
+A client can offer binary modes in its `NAME` command, and if the server
+supports one of them it replies with a `MODE` command. Each side switches to
+the binary mode for everything it sends after its `MODE` command, so the
+client acknowledges the server's `MODE` with its own.
+
+In binary mode each command is sent as a frame: a four byte big-endian length
+followed by a msgpack encoded array. `RDATA` commands are encoded as
+`["RDATA", <stream_name>, <token>, <row>]` (with a null token for a batch),
+so that rows don't need to be encoded as JSON; other commands are encoded as
+`[<NAME>, <rest of line>]`.
+
+In `binary-zlib` mode the stream of frames is compressed, with the compression
+context carrying over between writes.
+"""
+
+import struct
+import zlib
+from typing import List
+
+import msgpack
+
+from synapse.replication.tcp.commands import COMMAND_MAP, Command, RdataCommand
+
+# The modes we support, in order of preference.
+MODE_BINARY = "binary"
+MODE_BINARY_ZLIB = "binary-zlib"
+SUPPORTED_MODES = (MODE_BINARY_ZLIB, MODE_BINARY)
+
+_FRAME_HEADER = struct.Struct(">I")
+
+
+class FrameTooLongError(Exception):
+    """The remote sent a frame longer than we allow."""
+
+
+def encode_frame(cmd: Command) -> bytes:
+    """Encodes a command as a frame to send in binary mode."""
+    if isinstance(cmd, RdataCommand):
+        payload = [cmd.NAME, cmd.stream_name, cmd.token, cmd.row]
+    else:
+        payload = [cmd.NAME, cmd.to_line()]
+
+    data = msgpack.packb(payload, use_bin_type=True)
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+def decode_frame(data: bytes) -> Command:
+    """Decodes the body of a frame into a command.
+
+    Raises:
+        KeyError if the command is unknown
+    """
+    payload = msgpack.unpackb(data, raw=False)
+    cmd_name = payload[0]
+
+    if cmd_name == RdataCommand.NAME:
+        _, stream_name, token, row = payload
+        return RdataCommand(stream_name, token, row)
+
+    return COMMAND_MAP[cmd_name].from_line(payload[1])
+
+
+class FrameWriter(object):
+    """Prepares frames to be written to the transport in a given mode.
+
+    Args:
+        mode (str): one of SUPPORTED_MODES
+    """
+
+    def __init__(self, mode):
+        self._compressor = None
+        if mode == MODE_BINARY_ZLIB:
+            self._compressor = zlib.compressobj()
+
+    def write(self, frames: bytes) -> bytes:
+        """Returns the bytes to write to the transport for the given frames.
+        """
+        if self._compressor is None:
+            return frames
+
+        return self._compressor.compress(frames) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+
+class FrameReader(object):
+    """Splits the data received in a given mode into frames.
+
+    Args:
+        mode (str): one of SUPPORTED_MODES
+        max_length (int): the maximum length of a frame
+    """
+
+    def __init__(self, mode, max_length):
+        self._max_length = max_length
+        self._buffer = b""
+
+        self._decompressor = None
+        if mode == MODE_BINARY_ZLIB:
+            self._decompressor = zlib.decompressobj()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Feed in data received from the transport, returning the bodies of
+        any frames which are now complete.
+
+        Raises:
+            FrameTooLongError if the remote sent a frame longer than
+            `max_length`.
+        """
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(data)
+
+        self._buffer += data
+
+        frames = []
+        pos = 0
+        header_size = _FRAME_HEADER.size
+        while len(self._buffer) - pos >= header_size:
+            (length,) = _FRAME_HEADER.unpack_from(self._buffer, pos)
+            if length > self._max_length:
+                raise FrameTooLongError(length)
+
+            end = pos + header_size + length
+            if len(self._buffer) < end:
+                break
+
+            frames.append(self._buffer[pos + header_size : end])
+            pos = end
+
+        self._buffer = self._buffer[pos:]
+        return frames
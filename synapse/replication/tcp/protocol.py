@@ -47,20 +47,33 @@ indicate which side is sending, these are *not* included on the wire::
     < PING 1490197675618
     > ERROR server stopping
     * connection closed by server *
+
+# Binary modes
+
+A client may offer binary modes of the protocol in its `NAME` command, in which
+case the server may switch to one of them with a `MODE` command, which the
+client acknowledges. After that, commands are sent as length-prefixed frames,
+optionally compressed. See `synapse.replication.tcp.framing` for details::
+
+    > SERVER localhost:8823
+    < NAME synapse.app.appservice modes=binary-zlib,binary
+    > MODE binary-zlib
+    < MODE binary-zlib
+    * all further commands in both directions are compressed frames *
 """
 import abc
 import fcntl
 import logging
 import struct
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, Set, Tuple
+from typing import Any, DefaultDict, Dict, List, Optional, Set, Tuple
 
 from six import iteritems, iterkeys
 
 from prometheus_client import Counter
 
 from twisted.internet import defer
-from twisted.protocols.basic import LineOnlyReceiver
+from twisted.protocols.basic import LineReceiver
 from twisted.python.failure import Failure
 
 from synapse.logging.context import make_deferred_yieldable, run_in_background
@@ -72,6 +85,7 @@ from synapse.replication.tcp.commands import (
     VALID_SERVER_COMMANDS,
     Command,
     ErrorCommand,
+    ModeCommand,
     NameCommand,
     PingCommand,
     PositionCommand,
@@ -82,6 +96,14 @@ from synapse.replication.tcp.commands import (
     SyncCommand,
     UserSyncCommand,
 )
+from synapse.replication.tcp.framing import (
+    SUPPORTED_MODES,
+    FrameReader,
+    FrameTooLongError,
+    FrameWriter,
+    decode_frame,
+    encode_frame,
+)
 from synapse.replication.tcp.streams import STREAMS_MAP
 from synapse.types import Collection
 from synapse.util import Clock
@@ -104,6 +126,82 @@ PING_TIMEOUT_MULTIPLIER = 5
 PING_TIMEOUT_MS = PING_TIME * PING_TIMEOUT_MULTIPLIER
 
 
+def encode_command(cmd):
+    """Encodes a command as a line to send over the wire, without the
+    delimiter.
+
+    Args:
+        cmd (Command)
+
+    Returns:
+        bytes
+    """
+    string = "%s %s" % (cmd.NAME, cmd.to_line())
+    if "\n" in string:
+        raise Exception("Unexpected newline in command: %r", string)
+
+    return string.encode("utf-8")
+
+
+class EncodedRdataBatch(object):
+    """A batch of updates to a stream, encoded once as RDATA commands so that
+    the same bytes can be written to every connection subscribed to the
+    stream.
+
+    Args:
+        stream_name (str)
+        updates (list[tuple[int|None, Any]]): the (token, row) pairs to send,
+            as passed to `RdataCommand`.
+        max_length (int): the maximum length of a line. Updates which would
+            be longer than this are dropped.
+    """
+
+    __slots__ = ["stream_name", "updates", "data", "num_lines", "_frames"]
+
+    def __init__(self, stream_name, updates, max_length):
+        self.stream_name = stream_name
+
+        # The updates which we managed to encode, for connections which aren't
+        # ready to have them written out yet.
+        self.updates = []
+
+        lines = []
+        for token, row in updates:
+            line = encode_command(RdataCommand(stream_name, token, row))
+            if len(line) > max_length:
+                logger.error(
+                    "Failed to replicate RDATA for %s as too long (%d > %d)",
+                    stream_name,
+                    len(line),
+                    max_length,
+                )
+                continue
+
+            lines.append(line)
+            self.updates.append((token, row))
+
+        lines.append(b"")
+        self.data = BaseReplicationStreamProtocol.delimiter.join(lines)
+        self.num_lines = len(self.updates)
+
+        self._frames = None
+
+    @property
+    def frames(self):
+        """The updates encoded as frames, for connections in a binary mode.
+        This is only calculated if needed.
+
+        Returns:
+            bytes
+        """
+        if self._frames is None:
+            self._frames = b"".join(
+                encode_frame(RdataCommand(self.stream_name, token, row))
+                for token, row in self.updates
+            )
+        return self._frames
+
+
 class ConnectionStates(object):
     CONNECTING = "connecting"
     ESTABLISHED = "established"
@@ -111,12 +209,12 @@ class ConnectionStates(object):
     CLOSED = "closed"
 
 
-class BaseReplicationStreamProtocol(LineOnlyReceiver):
+class BaseReplicationStreamProtocol(LineReceiver):
     """Base replication protocol shared between client and server.
 
-    Reads lines (ignoring blank ones) and parses them into command classes,
-    asserting that they are valid for the given direction, i.e. server commands
-    are only sent by the server.
+    Reads lines (ignoring blank ones), or frames once we've switched to a binary
+    mode, and parses them into command classes, asserting that they are valid
+    for the given direction, i.e. server commands are only sent by the server.
 
     On receiving a new command it calls `on_<COMMAND_NAME>` with the parsed
     command.
@@ -149,12 +247,26 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         self.name = "anon"  # The name sent by a client.
         self.conn_id = random_string(5)  # To dedupe in case of name clashes.
 
-        # List of pending commands to send once we've established the connection
-        self.pending_commands = []  # type: List[Command]
+        # List of pending commands (and batches of RDATA commands) to send once
+        # we've established the connection, or the remote has caught up.
+        self.pending_commands = []  # type: List[Any]
+
+        # The number of lines in `pending_commands`.
+        self._pending_lines = 0
 
         # The LoopingCall for sending pings.
         self._send_ping_loop = None
 
+        # The binary mode we have asked the remote to switch to (or agreed to
+        # switch to), if any.
+        self.mode = None
+
+        # Set once we have sent our MODE command, and are sending frames.
+        self._frame_writer = None  # type: Optional[FrameWriter]
+
+        # Set once the remote has sent us a MODE command, and is sending frames.
+        self._frame_reader = None  # type: Optional[FrameReader]
+
         self.inbound_commands_counter = defaultdict(int)  # type: DefaultDict[str, int]
         self.outbound_commands_counter = defaultdict(int)  # type: DefaultDict[str, int]
 
@@ -213,17 +325,9 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         line = line.decode("utf-8")
         cmd_name, rest_of_line = line.split(" ", 1)
 
-        if cmd_name not in self.VALID_INBOUND_COMMANDS:
-            logger.error("[%s] invalid command %s", self.id(), cmd_name)
-            self.send_error("invalid command: %s", cmd_name)
+        if not self._check_inbound_command(cmd_name):
             return
 
-        self.last_received_command = self.clock.time_msec()
-
-        self.inbound_commands_counter[cmd_name] = (
-            self.inbound_commands_counter[cmd_name] + 1
-        )
-
         cmd_cls = COMMAND_MAP[cmd_name]
         try:
             cmd = cmd_cls.from_line(rest_of_line)
@@ -236,11 +340,91 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
             )
             return
 
+        self._dispatch_command(cmd)
+
+    def rawDataReceived(self, data):
+        """Called with the data we've received once the remote has switched to a
+        binary mode.
+        """
+        try:
+            frames = self._frame_reader.feed(data)
+        except FrameTooLongError:
+            self.send_error("Frame length exceeded")
+            return
+        except Exception as e:
+            logger.exception("[%s] failed to read frames", self.id())
+            self.send_error("failed to read frames: %r" % (e,))
+            return
+
+        for frame in frames:
+            try:
+                cmd = decode_frame(frame)
+            except Exception as e:
+                logger.exception("[%s] failed to parse frame %r", self.id(), frame)
+                self.send_error("failed to parse frame: %r" % (e,))
+                return
+
+            if not self._check_inbound_command(cmd.NAME):
+                return
+
+            self._dispatch_command(cmd)
+
+    def _check_inbound_command(self, cmd_name):
+        """Checks that the remote is allowed to send us the given command, and
+        records that we've received it.
+
+        Returns:
+            bool: whether the command is valid. If it isn't, the connection is
+            closed.
+        """
+        if cmd_name not in self.VALID_INBOUND_COMMANDS:
+            logger.error("[%s] invalid command %s", self.id(), cmd_name)
+            self.send_error("invalid command: %s", cmd_name)
+            return False
+
+        self.last_received_command = self.clock.time_msec()
+
+        self.inbound_commands_counter[cmd_name] = (
+            self.inbound_commands_counter[cmd_name] + 1
+        )
+        return True
+
+    def _dispatch_command(self, cmd):
+        if isinstance(cmd, ModeCommand):
+            # Anything after this is in the new mode, so we need to switch
+            # before we read any more.
+            self._switch_inbound_mode(cmd.data)
+            return
+
         # Now lets try and call on_<CMD_NAME> function
         run_as_background_process(
             "replication-" + cmd.get_logcontext_id(), self.handle_command, cmd
         )
 
+    def _switch_inbound_mode(self, mode):
+        """Called when the remote has switched to sending in the given mode."""
+        if mode not in SUPPORTED_MODES or self._frame_reader:
+            self.send_error("unexpected mode: %s", mode)
+            return
+
+        if self.mode is None:
+            # The remote is asking us to switch, so acknowledge it.
+            self.request_mode(mode)
+        elif self.mode != mode:
+            self.send_error("unexpected mode: %s", mode)
+            return
+
+        logger.info("[%s] Remote switched to mode %s", self.id(), mode)
+        self._frame_reader = FrameReader(mode, self.MAX_LENGTH)
+        self.setRawMode()
+
+    def request_mode(self, mode):
+        """Switch to sending in the given binary mode, once any commands that we
+        have queued have been sent.
+        """
+        self.mode = mode
+        self.send_command(ModeCommand(mode))
+
     async def handle_command(self, cmd: Command):
         """Handle a command we have received over the replication stream.
 
@@ -285,11 +469,11 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         self.outbound_commands_counter[cmd.NAME] = (
             self.outbound_commands_counter[cmd.NAME] + 1
         )
-        string = "%s %s" % (cmd.NAME, cmd.to_line())
-        if "\n" in string:
-            raise Exception("Unexpected newline in command: %r", string)
 
-        encoded_string = string.encode("utf-8")
+        if self._frame_writer:
+            encoded_string = encode_frame(cmd)
+        else:
+            encoded_string = encode_command(cmd)
 
         if len(encoded_string) > self.MAX_LENGTH:
             raise Exception(
@@ -297,17 +481,52 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
                 % (cmd.NAME, len(encoded_string), self.MAX_LENGTH)
             )
 
-        self.sendLine(encoded_string)
+        if self._frame_writer:
+            self.transport.write(self._frame_writer.write(encoded_string))
+        else:
+            self.sendLine(encoded_string)
+
+            if isinstance(cmd, ModeCommand):
+                # Everything we send from now on is in the new mode.
+                self._frame_writer = FrameWriter(cmd.data)
+
+        self.last_sent_command = self.clock.time_msec()
+
+    def send_rdata_batch(self, batch):
+        """Send a batch of pre-encoded RDATA commands if the connection has
+        been established, otherwise queue it.
+
+        Args:
+            batch (EncodedRdataBatch)
+        """
+        if self.state == ConnectionStates.CLOSED:
+            logger.debug("[%s] Not sending, connection closed", self.id())
+            return
+
+        if self.state != ConnectionStates.ESTABLISHED:
+            self._queue_command(batch)
+            return
+
+        if not batch.num_lines:
+            return
+
+        self.outbound_commands_counter[RdataCommand.NAME] += batch.num_lines
+        if self._frame_writer:
+            self.transport.write(self._frame_writer.write(batch.frames))
+        else:
+            self.transport.write(batch.data)
 
         self.last_sent_command = self.clock.time_msec()
 
     def _queue_command(self, cmd):
-        """Queue the command until the connection is ready to write to again.
+        """Queue the command (or batch of RDATA commands) until the connection
+        is ready to write to again.
         """
         logger.debug("[%s] Queing as conn %r, cmd: %r", self.id(), self.state, cmd)
         self.pending_commands.append(cmd)
+        self._pending_lines += getattr(cmd, "num_lines", 1)
 
-        if len(self.pending_commands) > self.max_line_buffer:
+        if self._pending_lines > self.max_line_buffer:
             # The other side is failing to keep up and out buffers are becoming
             # full, so lets close the connection.
             # XXX: should we squawk more loudly?
@@ -320,8 +539,12 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
         """
         pending = self.pending_commands
         self.pending_commands = []
+        self._pending_lines = 0
         for cmd in pending:
-            self.send_command(cmd)
+            if isinstance(cmd, EncodedRdataBatch):
+                self.send_rdata_batch(cmd)
+            else:
+                self.send_command(cmd)
 
     async def on_PING(self, line):
         self.received_ping = True
@@ -378,6 +601,7 @@ class BaseReplicationStreamProtocol(LineOnlyReceiver):
 
         self.state = ConnectionStates.CLOSED
         self.pending_commands = []
+        self._pending_lines = 0
 
         if self.transport:
             self.transport.unregisterProducer()
@@ -430,9 +654,19 @@ class ServerReplicationStreamProtocol(BaseReplicationStreamProtocol):
         logger.info("[%s] Renamed to %r", self.id(), cmd.data)
         self.name = cmd.data
 
+        # Switch to the client's most preferred binary mode that we support,
+        # if any.
+        for mode in cmd.modes:
+            if mode in SUPPORTED_MODES:
+                self.request_mode(mode)
+                break
+
     async def on_USER_SYNC(self, cmd):
         await self.streamer.on_user_sync(
-            self.conn_id, cmd.user_id, cmd.is_syncing, cmd.last_sync_ms
+            self.streamer.get_sync_process_id(self),
+            cmd.user_id,
+            cmd.is_syncing,
+            cmd.last_sync_ms,
         )
 
     async def on_REPLICATE(self, cmd):
@@ -453,7 +687,7 @@ class ServerReplicationStreamProtocol(BaseReplicationStreamProtocol):
             await self.subscribe_to_stream(stream_name, token)
 
     async def on_FEDERATION_ACK(self, cmd):
-        self.streamer.federation_ack(cmd.token)
+        self.streamer.federation_ack(cmd.instance_name, cmd.token)
 
     async def on_REMOVE_PUSHER(self, cmd):
         await self.streamer.on_remove_pusher(cmd.app_id, cmd.push_key, cmd.user_id)
@@ -540,21 +774,27 @@ class ServerReplicationStreamProtocol(BaseReplicationStreamProtocol):
         finally:
             self.connecting_streams.discard(stream_name)
 
-    def stream_update(self, stream_name, token, data):
-        """Called when a new update is available to stream to clients.
+    def stream_updates(self, batch):
+        """Called when a batch of new updates is available to stream to
+        clients. The batch has already been encoded, and is shared between all
+        connections.
 
         We need to check if the client is interested in the stream or not
+
+        Args:
+            batch (EncodedRdataBatch)
         """
+        stream_name = batch.stream_name
         if stream_name in self.replication_streams:
             # The client is subscribed to the stream
-            self.send_command(RdataCommand(stream_name, token, data))
+            self.send_rdata_batch(batch)
         elif stream_name in self.connecting_streams:
             # The client is being subscribed to the stream
-            logger.debug("[%s] Queuing RDATA %r %r", self.id(), stream_name, token)
-            self.pending_rdata.setdefault(stream_name, []).append((token, data))
+            logger.debug("[%s] Queuing RDATA for %r", self.id(), stream_name)
+            self.pending_rdata.setdefault(stream_name, []).extend(batch.updates)
         else:
             # The client isn't subscribed
-            logger.debug("[%s] Dropping RDATA %r %r", self.id(), stream_name, token)
+            logger.debug("[%s] Dropping RDATA for %r", self.id(), stream_name)
 
     def send_sync(self, data):
         self.send_command(SyncCommand(data))
@@ -642,12 +882,22 @@ class ClientReplicationStreamProtocol(BaseReplicationStreamProtocol):
         server_name: str,
         clock: Clock,
         handler: AbstractReplicationClientHandler,
+        modes: Collection[str] = (),
     ):
+        """
+        Args:
+            client_name: the name to give the server
+            server_name: the name of the server we expect to connect to
+            clock
+            handler
+            modes: the binary modes we offer the server, in order of preference
+        """
         BaseReplicationStreamProtocol.__init__(self, clock)
 
         self.client_name = client_name
         self.server_name = server_name
         self.handler = handler
+        self.modes = modes
 
         # Set of stream names that have been subscribe to, but haven't yet
         # caught up with. This is used to track when the client has been fully
@@ -659,7 +909,7 @@ class ClientReplicationStreamProtocol(BaseReplicationStreamProtocol):
         self.pending_batches = {}  # type: Dict[str, Any]
 
     def connectionMade(self):
-        self.send_command(NameCommand(self.client_name))
+        self.send_command(NameCommand(self.client_name, self.modes))
         BaseReplicationStreamProtocol.connectionMade(self)
 
         # Once we've connected subscribe to the necessary streams
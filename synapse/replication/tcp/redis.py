@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A transport for replication commands which uses a pub/sub broker speaking
+the redis protocol, rather than relaying them through the master.
+
+Each process publishes the commands it sends to its own channel,
+`<server_name>/<instance_name>`, and subscribes to `<server_name>/*` to receive
+the commands sent by every other process. Only the commands in
+`VALID_PUBSUB_COMMANDS` are sent this way: streams are still replicated from
+the master over the TCP replication connection.
+
+We only need a tiny subset of the redis protocol (`AUTH`, `PSUBSCRIBE` and
+`PUBLISH`), so we implement that here rather than pulling in a client library.
+"""
+
+import logging
+from collections import deque
+from typing import Any, Deque, Optional, Tuple
+
+from prometheus_client import Counter
+
+from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.replication.tcp.commands import COMMAND_MAP, VALID_PUBSUB_COMMANDS, Command
+from synapse.replication.tcp.protocol import encode_command
+
+logger = logging.getLogger(__name__)
+
+inbound_pubsub_commands_counter = Counter(
+    "synapse_replication_tcp_redis_inbound_commands", "", ["command"]
+)
+outbound_pubsub_commands_counter = Counter(
+    "synapse_replication_tcp_redis_outbound_commands", "", ["command"]
+)
+
+
+class RedisError(Exception):
+    """An error reply from redis"""
+
+
+class _IncompleteReply(Exception):
+    """We haven't yet received all of a reply"""
+
+
+def encode_redis_command(*args):
+    """Encodes a command to send to redis.
+
+    Args:
+        *args (str|bytes): the command name and its arguments
+
+    Returns:
+        bytes
+    """
+    parts = [b"*%d\r\n" % (len(args),)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def parse_redis_reply(buf: bytes, pos: int = 0) -> Tuple[Any, int]:
+    """Parses a single reply from redis.
+
+    Args:
+        buf: the received data
+        pos: the offset in `buf` that the reply starts at
+
+    Returns:
+        The reply, and the offset just after it. Error replies are returned as
+        instances of RedisError.
+
+    Raises:
+        _IncompleteReply if `buf` doesn't contain the whole reply.
+    """
+    end = buf.find(b"\r\n", pos)
+    if end == -1:
+        raise _IncompleteReply()
+
+    kind = buf[pos : pos + 1]
+    line = buf[pos + 1 : end]
+    pos = end + 2
+
+    if kind == b"+":
+        return line, pos
+    elif kind == b"-":
+        return RedisError(line.decode("utf-8", "replace")), pos
+    elif kind == b":":
+        return int(line), pos
+    elif kind == b"$":
+        length = int(line)
+        if length < 0:
+            return None, pos
+        if len(buf) < pos + length + 2:
+            raise _IncompleteReply()
+        return buf[pos : pos + length], pos + length + 2
+    elif kind == b"*":
+        length = int(line)
+        if length < 0:
+            return None, pos
+        items = []
+        for _ in range(length):
+            item, pos = parse_redis_reply(buf, pos)
+            items.append(item)
+        return items, pos
+    else:
+        raise Exception("Unexpected reply type %r" % (kind,))
+
+
+class RedisProtocol(Protocol):
+    """A minimal client for the redis protocol.
+
+    Args:
+        pubsub (RedisPubSub)
+        password (str|None): the password to AUTH with, if any.
+    """
+
+    def __init__(self, pubsub, password=None):
+        self.pubsub = pubsub
+        self._password = password
+        self._buffer = b""
+
+    def connectionMade(self):
+        logger.info("Connected to redis: %r", self.transport.getPeer())
+        if self._password:
+            self.send_redis_command("AUTH", self._password)
+
+    def send_redis_command(self, *args):
+        self.transport.write(encode_redis_command(*args))
+
+    def dataReceived(self, data):
+        self._buffer += data
+
+        pos = 0
+        while pos < len(self._buffer):
+            try:
+                reply, pos = parse_redis_reply(self._buffer, pos)
+            except _IncompleteReply:
+                break
+            except Exception:
+                logger.exception("Failed to parse reply from redis")
+                self.transport.loseConnection()
+                return
+
+            if isinstance(reply, RedisError):
+                logger.error("Error from redis: %s", reply)
+                continue
+
+            self.replyReceived(reply)
+
+        self._buffer = self._buffer[pos:]
+
+    def replyReceived(self, reply):
+        """Called with each (non-error) reply from redis"""
+        pass
+
+
+class RedisSubscriber(RedisProtocol):
+    """A connection which subscribes to the commands published by all other
+    processes.
+    """
+
+    def connectionMade(self):
+        RedisProtocol.connectionMade(self)
+        self.send_redis_command("PSUBSCRIBE", self.pubsub.channel_pattern)
+
+    def replyReceived(self, reply):
+        if not isinstance(reply, list) or not reply:
+            return
+
+        kind = reply[0]
+        if kind == b"pmessage" and len(reply) == 4:
+            self.pubsub.on_message(reply[2], reply[3])
+        elif kind == b"psubscribe":
+            self.pubsub.on_subscribed()
+
+
+class RedisPublisher(RedisProtocol):
+    """A connection used to publish our commands. (Redis doesn't let us publish
+    on a connection which is subscribed to anything.)
+    """
+
+    def connectionMade(self):
+        RedisProtocol.connectionMade(self)
+        self.pubsub.update_publisher(self)
+
+    def connectionLost(self, reason):
+        logger.info("Lost redis publisher connection: %r", reason)
+        self.pubsub.update_publisher(None)
+
+    def publish(self, channel, message):
+        self.send_redis_command("PUBLISH", channel, message)
+
+
+class RedisClientFactory(ReconnectingClientFactory):
+    """Factory for connections to redis, which reconnects if the connection is
+    lost.
+    """
+
+    initialDelay = 0.1
+    maxDelay = 5
+
+    def __init__(self, hs, pubsub, protocol_class):
+        self.pubsub = pubsub
+        self.protocol_class = protocol_class
+        self.password = hs.config.redis_password
+
+        hs.get_reactor().addSystemEventTrigger("before", "shutdown", self.stopTrying)
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return self.protocol_class(self.pubsub, self.password)
+
+    def clientConnectionLost(self, connector, reason):
+        logger.error("Lost redis connection: %r", reason)
+        ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        logger.error("Failed to connect to redis: %r", reason)
+        ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
+
+
+class RedisPubSub(object):
+    """Sends replication commands to, and receives them from, all other
+    processes via a redis pub/sub broker.
+
+    Args:
+        hs (HomeServer)
+        handler: the object to pass received commands to. Must have an
+            `async on_pubsub_command(instance_name, cmd)` method, which is
+            called with each command received along with the name of the
+            instance which sent it.
+    """
+
+    # The maximum number of commands to queue while we're not connected to
+    # redis. Beyond that the oldest are dropped.
+    max_pending_commands = 10000
+
+    def __init__(self, hs, handler):
+        self._reactor = hs.get_reactor()
+        self._hs = hs
+        self.handler = handler
+
+        self.instance_name = hs.config.instance_name
+
+        self.channel_prefix = "%s/" % (hs.config.server_name,)
+        self.channel_pattern = self.channel_prefix + "*"
+        self.outbound_channel = self.channel_prefix + self.instance_name
+
+        # The connection we publish commands on. None if we are currently
+        # (re)connecting.
+        self._publisher = None  # type: Optional[RedisPublisher]
+
+        # Encoded commands to publish once we've (re)connected.
+        self._pending_commands = deque(
+            maxlen=self.max_pending_commands
+        )  # type: Deque[bytes]
+
+        # The number of commands dropped from `_pending_commands` since we were
+        # last connected.
+        self._dropped_commands = 0
+
+    def start(self):
+        """Start connecting to redis."""
+        host = self._hs.config.redis_host
+        port = self._hs.config.redis_port
+
+        logger.info("Connecting to redis (host=%r port=%r)", host, port)
+
+        for protocol_class in (RedisSubscriber, RedisPublisher):
+            factory = RedisClientFactory(self._hs, self, protocol_class)
+            self._reactor.connectTCP(host, port, factory)
+
+    def send_command(self, cmd: Command):
+        """Publish a command to all other processes."""
+        if cmd.NAME not in VALID_PUBSUB_COMMANDS:
+            raise Exception("Command %s can't be sent over pub/sub" % (cmd.NAME,))
+
+        outbound_pubsub_commands_counter.labels(cmd.NAME).inc()
+        encoded = encode_command(cmd)
+
+        if self._publisher:
+            self._publisher.publish(self.outbound_channel, encoded)
+        else:
+            logger.warning("Queuing command as not connected to redis: %r", cmd.NAME)
+            if len(self._pending_commands) == self._pending_commands.maxlen:
+                self._dropped_commands += 1
+            self._pending_commands.append(encoded)
+
+    def update_publisher(self, publisher: Optional[RedisPublisher]):
+        """Called when the publishing connection has been established (or lost
+        with None).
+        """
+        self._publisher = publisher
+        if publisher:
+            if self._dropped_commands:
+                logger.error(
+                    "Dropped %d commands while not connected to redis",
+                    self._dropped_commands,
+                )
+                self._dropped_commands = 0
+
+            while self._pending_commands:
+                publisher.publish(
+                    self.outbound_channel, self._pending_commands.popleft()
+                )
+
+    def on_subscribed(self):
+        """Called when we've (re)subscribed to the other processes' commands.
+        """
+        logger.info("Subscribed to replication commands on redis")
+
+    def on_message(self, channel: bytes, message: bytes):
+        """Called when a command has been published to one of the channels we
+        are subscribed to.
+        """
+        channel_str = channel.decode("utf-8")
+        if not channel_str.startswith(self.channel_prefix):
+            return
+
+        instance_name = channel_str[len(self.channel_prefix) :]
+        if instance_name == self.instance_name:
+            # We sent this one.
+            return
+
+        line = message.decode("utf-8")
+        cmd_name, rest_of_line = line.split(" ", 1)
+
+        if cmd_name not in VALID_PUBSUB_COMMANDS:
+            logger.error(
+                "Invalid command %s from %s via redis", cmd_name, instance_name
+            )
+            return
+
+        try:
+            cmd = COMMAND_MAP[cmd_name].from_line(rest_of_line)
+        except Exception:
+            logger.exception(
+                "Failed to parse line from %s via redis %r: %r",
+                instance_name,
+                cmd_name,
+                rest_of_line,
+            )
+            return
+
+        inbound_pubsub_commands_counter.labels(cmd_name).inc()
+
+        run_as_background_process(
+            "replication-" + cmd.get_logcontext_id(),
+            self.handler.on_pubsub_command,
+            instance_name,
+            cmd,
+        )
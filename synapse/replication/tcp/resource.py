@@ -17,7 +17,7 @@
 
 import logging
 import random
-from typing import Any, List
+from typing import Any, List, Optional
 
 from six import itervalues
 
@@ -29,7 +29,17 @@ from synapse.metrics import LaterGauge
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.util.metrics import Measure, measure_func
 
-from .protocol import ServerReplicationStreamProtocol
+from .commands import (
+    Command,
+    FederationAckCommand,
+    InvalidateCacheCommand,
+    RemoteServerUpCommand,
+    RemovePusherCommand,
+    UserIpCommand,
+    UserSyncCommand,
+)
+from .protocol import EncodedRdataBatch, ServerReplicationStreamProtocol
+from .redis import RedisPubSub
 from .streams import STREAMS_MAP
 from .streams.federation import FederationStream
 
@@ -119,6 +129,20 @@ class ReplicationStreamer(object):
         if not hs.config.send_federation:
             self.federation_sender = hs.get_federation_sender()
 
+        # If enabled, workers send us commands over pub/sub rather than over
+        # their replication connections, and send commands meant for other
+        # workers to them directly.
+        self._pubsub = None  # type: Optional[RedisPubSub]
+        self._local_federation_sender = None
+        if hs.config.redis_enabled:
+            self._pubsub = RedisPubSub(hs, self)
+            self._pubsub.start()
+
+            # The federation sender to wake up when a worker tells us that a
+            # remote server is back up, if we send federation ourselves.
+            if hs.should_send_federation():
+                self._local_federation_sender = hs.get_federation_sender()
+
         self.notifier.add_replication_callback(self.on_notifier_poke)
         self.notifier.add_remote_server_up_callback(self.send_remote_server_up)
 
@@ -219,12 +243,23 @@ class ReplicationStreamer(object):
                         # token. See RdataCommand for more details.
                         batched_updates = _batch_updates(updates)
 
+                        if not batched_updates or not self.connections:
+                            continue
+
+                        # We encode the updates once, and write the same bytes
+                        # to every connection.
+                        with Measure(self.clock, "repl.stream.encode_updates"):
+                            batch = EncodedRdataBatch(
+                                stream.NAME,
+                                batched_updates,
+                                ServerReplicationStreamProtocol.MAX_LENGTH,
+                            )
+
                         for conn in self.connections:
-                            for token, row in batched_updates:
-                                try:
-                                    conn.stream_update(stream.NAME, token, row)
-                                except Exception:
-                                    logger.exception("Failed to replicate")
+                            try:
+                                conn.stream_updates(batch)
+                            except Exception:
+                                logger.exception("Failed to replicate")
 
             logger.debug("No more pending updates, breaking poke loop")
         finally:
@@ -243,12 +278,12 @@ class ReplicationStreamer(object):
         return await stream.get_updates_since(token)
 
     @measure_func("repl.federation_ack")
-    def federation_ack(self, token):
+    def federation_ack(self, instance_name, token):
         """We've received an ack for federation stream from a client.
         """
         federation_ack_counter.inc()
         if self.federation_sender:
-            self.federation_sender.federation_ack(token)
+            self.federation_sender.federation_ack(instance_name, token)
 
     @measure_func("repl.on_user_sync")
     async def on_user_sync(self, conn_id, user_id, is_syncing, last_sync_ms):
@@ -297,9 +332,41 @@ class ReplicationStreamer(object):
         self.notifier.notify_remote_server_up(server)
 
     def send_remote_server_up(self, server: str):
+        if self._pubsub:
+            self._pubsub.send_command(RemoteServerUpCommand(server))
+            return
+
         for conn in self.connections:
             conn.send_remote_server_up(server)
 
+    async def on_pubsub_command(self, instance_name: str, cmd: Command):
+        """A worker has published a command over pub/sub.
+        """
+        if isinstance(cmd, UserSyncCommand):
+            await self.on_user_sync(
+                instance_name, cmd.user_id, cmd.is_syncing, cmd.last_sync_ms
+            )
+        elif isinstance(cmd, FederationAckCommand):
+            self.federation_ack(cmd.instance_name, cmd.token)
+        elif isinstance(cmd, RemovePusherCommand):
+            await self.on_remove_pusher(cmd.app_id, cmd.push_key, cmd.user_id)
+        elif isinstance(cmd, InvalidateCacheCommand):
+            await self.on_invalidate_cache(cmd.cache_func, cmd.keys)
+        elif isinstance(cmd, UserIpCommand):
+            await self.on_user_ip(
+                cmd.user_id,
+                cmd.access_token,
+                cmd.ip,
+                cmd.user_agent,
+                cmd.device_id,
+                cmd.last_seen,
+            )
+        elif isinstance(cmd, RemoteServerUpCommand):
+            # The other workers will have seen this too, so unlike when it
+            # comes over a replication connection we don't relay it.
+            if self._local_federation_sender:
+                self._local_federation_sender.wake_destination(cmd.data)
+
     def send_sync_to_all_connections(self, data):
         """Sends a SYNC command to all clients.
 
@@ -308,6 +375,17 @@ class ReplicationStreamer(object):
         for conn in self.connections:
             conn.send_sync(data)
 
+    def get_sync_process_id(self, connection):
+        """Get the ID to track the users syncing via the worker at the other end
+        of a connection against.
+
+        If workers send us USER_SYNC commands over pub/sub then we can't tell
+        which connection those came from, so we use the worker's name instead.
+        """
+        if self._pubsub:
+            return connection.name
+        return connection.conn_id
+
     def new_connection(self, connection):
         """A new client connection has been established
         """
@@ -323,7 +401,9 @@ class ReplicationStreamer(object):
 
         # We need to tell the presence handler that the connection has been
         # lost so that it can handle any ongoing syncs on that connection.
-        self.presence_handler.update_external_syncs_clear(connection.conn_id)
+        self.presence_handler.update_external_syncs_clear(
+            self.get_sync_process_id(connection)
+        )
 
 
 def _batch_updates(updates):
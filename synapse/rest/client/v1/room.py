@@ -509,6 +509,7 @@ class JoinedRoomMemberListRestServlet(RestServlet):
 # TODO: Needs better unit testing
 class RoomMessageListRestServlet(RestServlet):
     PATTERNS = client_patterns("/rooms/(?P<room_id>[^/]*)/messages$", v1=True)
+    STREAM_RESPONSE = True
 
     def __init__(self, hs):
         super(RoomMessageListRestServlet, self).__init__()
@@ -546,6 +547,7 @@ class RoomMessageListRestServlet(RestServlet):
 # TODO: Needs unit testing
 class RoomStateRestServlet(RestServlet):
     PATTERNS = client_patterns("/rooms/(?P<room_id>[^/]*)/state$", v1=True)
+    STREAM_RESPONSE = True
 
     def __init__(self, hs):
         super(RoomStateRestServlet, self).__init__()
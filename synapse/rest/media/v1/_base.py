@@ -179,11 +179,71 @@ def _can_encode_filename_as_token(x):
     return True
 
 
+class UnsatisfiableRangeError(Exception):
+    """The requested byte range doesn't overlap the file."""
+
+
+def parse_byte_range(range_header, file_size):
+    """Parses the value of a Range header.
+
+    Only a single byte range is supported: anything else (including multiple
+    ranges, or a header we can't parse) is ignored, in which case the whole
+    file should be sent, as allowed by RFC7233.
+
+    Args:
+        range_header (bytes|None): the value of the Range header, if any
+        file_size (int): the size of the file in bytes
+
+    Returns:
+        tuple[int, int]|None: The offset and length of the requested range, or
+        None if the whole file should be sent.
+
+    Raises:
+        UnsatisfiableRangeError if the range starts after the end of the file.
+    """
+    if not range_header:
+        return None
+
+    unit, _, ranges = range_header.partition(b"=")
+    if unit.strip().lower() != b"bytes" or b"," in ranges:
+        return None
+
+    first, sep, last = ranges.strip().partition(b"-")
+    if not sep:
+        return None
+
+    try:
+        if not first:
+            # A suffix range: the last N bytes of the file.
+            suffix_length = int(last)
+            if suffix_length <= 0:
+                raise UnsatisfiableRangeError()
+            start = max(file_size - suffix_length, 0)
+            end = file_size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+    except ValueError:
+        return None
+
+    if start >= file_size:
+        raise UnsatisfiableRangeError()
+
+    if end < start:
+        return None
+
+    end = min(end, file_size - 1)
+    return start, end - start + 1
+
+
 @defer.inlineCallbacks
 def respond_with_responder(request, responder, media_type, file_size, upload_name=None):
     """Responds to the request with given responder. If responder is None then
     returns 404.
 
+    If the size of the file is known and the responder supports it, a request
+    for a single byte range gets a 206 response with just that range.
+
     Args:
         request (twisted.web.http.Request)
         responder (Responder|None)
@@ -195,11 +255,37 @@ def respond_with_responder(request, responder, media_type, file_size, upload_nam
         respond_404(request)
         return
 
+    byte_range = None
+    if file_size is not None and responder.supports_ranges():
+        request.setHeader(b"Accept-Ranges", b"bytes")
+        try:
+            byte_range = parse_byte_range(request.getHeader(b"Range"), file_size)
+        except UnsatisfiableRangeError:
+            with responder:
+                request.setResponseCode(416)
+                request.setHeader(b"Content-Range", b"bytes */%d" % (file_size,))
+                request.setHeader(b"Content-Length", b"0")
+                finish_request(request)
+            return
+
     logger.debug("Responding to media request with responder %s", responder)
     add_file_headers(request, media_type, file_size, upload_name)
+
+    if byte_range is not None:
+        offset, length = byte_range
+        request.setResponseCode(206)
+        request.setHeader(
+            b"Content-Range",
+            b"bytes %d-%d/%d" % (offset, offset + length - 1, file_size),
+        )
+        request.setHeader(b"Content-Length", b"%d" % (length,))
+
     try:
         with responder:
-            yield responder.write_to_consumer(request)
+            if byte_range is None:
+                yield responder.write_to_consumer(request)
+            else:
+                yield responder.write_range_to_consumer(request, offset, length)
     except Exception as e:
         # The majority of the time this will be due to the client having gone
         # away. Unfortunately, Twisted simply throws a generic exception at us
@@ -231,6 +317,27 @@ class Responder(object):
         """
         pass
 
+    def supports_ranges(self):
+        """Whether `write_range_to_consumer` is implemented.
+
+        Returns:
+            bool
+        """
+        return False
+
+    def write_range_to_consumer(self, consumer, offset, length):
+        """Stream part of the response into consumer
+
+        Args:
+            consumer (IConsumer)
+            offset (int): the offset of the first byte to write
+            length (int): the number of bytes to write
+
+        Returns:
+            Deferred: Resolves once the response has finished being written
+        """
+        pass
+
     def __enter__(self):
         pass
 
@@ -16,8 +16,11 @@
 
 import errno
 import logging
+import multiprocessing
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from typing import Dict, Tuple
 
 from six import iteritems
@@ -25,6 +28,7 @@ from six import iteritems
 import twisted.internet.error
 import twisted.web.http
 from twisted.internet import defer
+from twisted.python.failure import Failure
 from twisted.web.resource import Resource
 
 from synapse.api.errors import (
@@ -35,7 +39,7 @@ from synapse.api.errors import (
     SynapseError,
 )
 from synapse.config._base import ConfigError
-from synapse.logging.context import defer_to_thread
+from synapse.logging.context import defer_to_thread, make_deferred_yieldable
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.util.async_helpers import Linearizer
 from synapse.util.retryutils import NotRetryingDestination
@@ -54,13 +58,14 @@ from .media_storage import MediaStorage
 from .preview_url_resource import PreviewUrlResource
 from .storage_provider import StorageProviderWrapper
 from .thumbnail_resource import ThumbnailResource
-from .thumbnailer import Thumbnailer
+from .thumbnailer import Thumbnailer, generate_thumbnails
 from .upload_resource import UploadResource
 
 logger = logging.getLogger(__name__)
 
 
 UPDATE_RECENTLY_ACCESSED_TS = 60 * 1000
+EVICT_LOCAL_CACHE_TS = 60 * 1000
 
 
 class MediaRepository(object):
@@ -79,6 +84,22 @@ class MediaRepository(object):
 
         self.dynamic_thumbnails = hs.config.dynamic_thumbnails
         self.thumbnail_requirements = hs.config.thumbnail_requirements
+        self.enable_media_deduplication = hs.config.enable_media_deduplication
+
+        # The pool of processes to generate thumbnails in, if any. The
+        # processes are only started when they are first needed. As with the
+        # state resolution pool, we spawn fresh processes rather than forking,
+        # as forking a process with other threads running can leave locks held
+        # in the child.
+        self._thumbnail_pool = None
+        if hs.config.thumbnail_processes:
+            self._thumbnail_pool = ProcessPoolExecutor(
+                max_workers=hs.config.thumbnail_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            hs.get_reactor().addSystemEventTrigger(
+                "before", "shutdown", self._thumbnail_pool.shutdown, wait=False
+            )
 
         self.remote_media_linearizer = Linearizer(name="media_remote")
 
@@ -109,6 +130,10 @@ class MediaRepository(object):
             self._start_update_recently_accessed, UPDATE_RECENTLY_ACCESSED_TS
         )
 
+        self._evicting_local_cache = False
+        if hs.config.media_cache_max_size is not None:
+            self.clock.looping_call(self._start_evict_local_cache, EVICT_LOCAL_CACHE_TS)
+
     def _start_update_recently_accessed(self):
         return run_as_background_process(
             "update_recently_accessed_media", self._update_recently_accessed
@@ -126,6 +151,23 @@ class MediaRepository(object):
             local_media, remote_media, self.clock.time_msec()
         )
 
+    def _start_evict_local_cache(self):
+        # Don't start another run if the last one is still going.
+        if self._evicting_local_cache:
+            return
+
+        return run_as_background_process(
+            "evict_local_media_cache", self._evict_local_cache
+        )
+
+    @defer.inlineCallbacks
+    def _evict_local_cache(self):
+        self._evicting_local_cache = True
+        try:
+            yield self.media_storage.evict_local_cache()
+        finally:
+            self._evicting_local_cache = False
+
     def mark_recently_accessed(self, server_name, media_id):
         """Mark the given media as recently accessed.
 
@@ -171,7 +213,11 @@ class MediaRepository(object):
             user_id=auth_user,
         )
 
-        yield self._generate_thumbnails(None, media_id, media_id, media_type)
+        deduplicated = yield self._deduplicate_media(
+            None, media_id, media_id, media_type
+        )
+        if not deduplicated:
+            yield self._generate_thumbnails(None, media_id, media_id, media_type)
 
         return "mxc://%s/%s" % (self.server_name, media_id)
 
@@ -423,14 +469,196 @@ class MediaRepository(object):
             "filesystem_id": file_id,
         }
 
-        yield self._generate_thumbnails(server_name, media_id, file_id, media_type)
+        deduplicated = yield self._deduplicate_media(
+            server_name, media_id, file_id, media_type
+        )
+        if not deduplicated:
+            yield self._generate_thumbnails(server_name, media_id, file_id, media_type)
 
         return media_info
 
+    @defer.inlineCallbacks
+    def _deduplicate_media(self, server_name, media_id, file_id, media_type):
+        """If media deduplication is enabled, check whether we already have
+        media with the same content as some newly stored media. If so the new
+        file is replaced with a hard link to the existing one, so that the
+        content is only stored once, and the existing thumbnails are linked
+        to as well.
+
+        Args:
+            server_name (str|None): The server name if remote media, else None
+                if local
+            media_id (str): The media ID of the content
+            file_id (str): Local file ID
+            media_type (str): The content type of the file
+
+        Returns:
+            Deferred[bool]: True if the thumbnails of the existing media were
+            reused, so don't need generating.
+        """
+        if not self.enable_media_deduplication:
+            return False
+
+        file_info = FileInfo(server_name, file_id)
+        content_hash = yield self.media_storage.get_content_hash(file_info)
+
+        existing_media = yield self.store.get_media_by_content_hash(content_hash)
+        yield self.store.store_media_content_hash(
+            content_hash, server_name, media_id, file_id, media_type
+        )
+
+        for existing in existing_media:
+            existing_file_info = FileInfo(
+                existing["media_origin"], existing["filesystem_id"]
+            )
+            linked = yield self.media_storage.link_file(
+                existing_file_info, file_info, store_in_providers=False
+            )
+            if not linked:
+                # Probably it's not in the local media store any more.
+                continue
+
+            logger.info(
+                "Linked media %s/%s to existing media with the same content %s/%s",
+                server_name,
+                media_id,
+                existing["media_origin"],
+                existing["media_id"],
+            )
+
+            # The thumbnails we generate depend on the media type.
+            if existing["media_type"] != media_type:
+                return False
+
+            thumbnails_linked = yield self._link_thumbnails(
+                existing, server_name, media_id, file_id
+            )
+            return thumbnails_linked
+
+        return False
+
+    @defer.inlineCallbacks
+    def _link_thumbnails(self, existing, server_name, media_id, file_id):
+        """Store the thumbnails of some existing media as the thumbnails of new
+        media with the same content, by hard linking to them.
+
+        Args:
+            existing (dict): the existing media, as returned by
+                `get_media_by_content_hash`
+            server_name (str|None): The server name if remote media, else None
+                if local
+            media_id (str): The media ID of the new content
+            file_id (str): Local file ID of the new content
+
+        Returns:
+            Deferred[bool]: False if the existing media has no thumbnails or
+            they couldn't all be linked.
+        """
+        if existing["media_origin"]:
+            thumbnails = yield self.store.get_remote_media_thumbnails(
+                existing["media_origin"], existing["media_id"]
+            )
+        else:
+            thumbnails = yield self.store.get_local_media_thumbnails(
+                existing["media_id"]
+            )
+
+        if not thumbnails:
+            return False
+
+        for thumbnail in thumbnails:
+            linked = yield self.media_storage.link_file(
+                FileInfo(
+                    existing["media_origin"],
+                    existing["filesystem_id"],
+                    thumbnail=True,
+                    thumbnail_width=thumbnail["thumbnail_width"],
+                    thumbnail_height=thumbnail["thumbnail_height"],
+                    thumbnail_method=thumbnail["thumbnail_method"],
+                    thumbnail_type=thumbnail["thumbnail_type"],
+                ),
+                FileInfo(
+                    server_name,
+                    file_id,
+                    thumbnail=True,
+                    thumbnail_width=thumbnail["thumbnail_width"],
+                    thumbnail_height=thumbnail["thumbnail_height"],
+                    thumbnail_method=thumbnail["thumbnail_method"],
+                    thumbnail_type=thumbnail["thumbnail_type"],
+                ),
+            )
+            if not linked:
+                return False
+
+        for thumbnail in thumbnails:
+            if server_name:
+                yield self.store.store_remote_media_thumbnail(
+                    server_name,
+                    media_id,
+                    file_id,
+                    thumbnail["thumbnail_width"],
+                    thumbnail["thumbnail_height"],
+                    thumbnail["thumbnail_type"],
+                    thumbnail["thumbnail_method"],
+                    thumbnail["thumbnail_length"],
+                )
+            else:
+                yield self.store.store_local_thumbnail(
+                    media_id,
+                    thumbnail["thumbnail_width"],
+                    thumbnail["thumbnail_height"],
+                    thumbnail["thumbnail_type"],
+                    thumbnail["thumbnail_method"],
+                    thumbnail["thumbnail_length"],
+                )
+
+        return True
+
     def _get_thumbnail_requirements(self, media_type):
         return self.thumbnail_requirements.get(media_type, ())
 
-    def _generate_thumbnail(self, thumbnailer, t_width, t_height, t_method, t_type):
+    def _run_thumbnailer(self, input_path, thumbnails):
+        """Generate thumbnails of an image, in the thumbnailing process pool
+        if there is one, otherwise in the reactor's threadpool.
+
+        Args:
+            input_path (str): the path to the image
+            thumbnails (list[tuple[int, int, str, str]]): see
+                `Thumbnailer.generate_thumbnails`
+
+        Returns:
+            Deferred[list[bytes]]: the encoded thumbnails
+        """
+        reactor = self.hs.get_reactor()
+        if self._thumbnail_pool is None:
+            return defer_to_thread(reactor, generate_thumbnails, input_path, thumbnails)
+
+        d = defer.Deferred()
+
+        def _on_done(future):
+            # This is called on one of the pool's threads.
+            try:
+                result = future.result()
+            except Exception:
+                reactor.callFromThread(d.errback, Failure())
+            else:
+                reactor.callFromThread(d.callback, result)
+
+        future = self._thumbnail_pool.submit(
+            generate_thumbnails, input_path, thumbnails
+        )
+        future.add_done_callback(_on_done)
+        return make_deferred_yieldable(d)
+
+    @defer.inlineCallbacks
+    def _generate_thumbnail(self, input_path, t_width, t_height, t_method, t_type):
+        """Generate a single thumbnail of an image.
+
+        Returns:
+            Deferred[BytesIO|None]: the encoded thumbnail, or None if the image
+            is too large to thumbnail or the method is unrecognised.
+        """
+        thumbnailer = Thumbnailer(input_path)
         m_width = thumbnailer.width
         m_height = thumbnailer.height
 
@@ -441,22 +669,21 @@ class MediaRepository(object):
                 m_height,
                 self.max_image_pixels,
             )
-            return
+            return None
 
-        if thumbnailer.transpose_method is not None:
-            m_width, m_height = thumbnailer.transpose()
+        m_width, m_height = thumbnailer.transposed_size()
 
-        if t_method == "crop":
-            t_byte_source = thumbnailer.crop(t_width, t_height, t_type)
-        elif t_method == "scale":
+        if t_method == "scale":
             t_width, t_height = thumbnailer.aspect(t_width, t_height)
             t_width = min(m_width, t_width)
             t_height = min(m_height, t_height)
-            t_byte_source = thumbnailer.scale(t_width, t_height, t_type)
-        else:
-            t_byte_source = None
+        elif t_method != "crop":
+            return None
 
-        return t_byte_source
+        (t_bytes,) = yield self._run_thumbnailer(
+            input_path, [(t_width, t_height, t_method, t_type)]
+        )
+        return BytesIO(t_bytes)
 
     @defer.inlineCallbacks
     def generate_local_exact_thumbnail(
@@ -466,15 +693,8 @@ class MediaRepository(object):
             FileInfo(None, media_id, url_cache=url_cache)
         )
 
-        thumbnailer = Thumbnailer(input_path)
-        t_byte_source = yield defer_to_thread(
-            self.hs.get_reactor(),
-            self._generate_thumbnail,
-            thumbnailer,
-            t_width,
-            t_height,
-            t_method,
-            t_type,
+        t_byte_source = yield self._generate_thumbnail(
+            input_path, t_width, t_height, t_method, t_type
         )
 
         if t_byte_source:
@@ -514,15 +734,8 @@ class MediaRepository(object):
             FileInfo(server_name, file_id, url_cache=False)
         )
 
-        thumbnailer = Thumbnailer(input_path)
-        t_byte_source = yield defer_to_thread(
-            self.hs.get_reactor(),
-            self._generate_thumbnail,
-            thumbnailer,
-            t_width,
-            t_height,
-            t_method,
-            t_type,
+        t_byte_source = yield self._generate_thumbnail(
+            input_path, t_width, t_height, t_method, t_type
         )
 
         if t_byte_source:
@@ -599,10 +812,7 @@ class MediaRepository(object):
             )
             return
 
-        if thumbnailer.transpose_method is not None:
-            m_width, m_height = yield defer_to_thread(
-                self.hs.get_reactor(), thumbnailer.transpose
-            )
+        m_width, m_height = thumbnailer.transposed_size()
 
         # We deduplicate the thumbnail sizes by ignoring the cropped versions if
         # they have the same dimensions of a scaled one.
@@ -615,25 +825,22 @@ class MediaRepository(object):
                 t_width = min(m_width, t_width)
                 t_height = min(m_height, t_height)
                 thumbnails[(t_width, t_height, r_type)] = r_method
-
-        # Now we generate the thumbnails for each dimension, store it
-        for (t_width, t_height, t_type), t_method in iteritems(thumbnails):
-            # Generate the thumbnail
-            if t_method == "crop":
-                t_byte_source = yield defer_to_thread(
-                    self.hs.get_reactor(), thumbnailer.crop, t_width, t_height, t_type
-                )
-            elif t_method == "scale":
-                t_byte_source = yield defer_to_thread(
-                    self.hs.get_reactor(), thumbnailer.scale, t_width, t_height, t_type
-                )
             else:
-                logger.error("Unrecognized method: %r", t_method)
-                continue
-
-            if not t_byte_source:
-                continue
-
+                logger.error("Unrecognized method: %r", r_method)
+
+        # We generate all the thumbnails in one go, so that the image only
+        # needs decoding once.
+        to_generate = [
+            (t_width, t_height, t_method, t_type)
+            for (t_width, t_height, t_type), t_method in iteritems(thumbnails)
+        ]
+        generated = yield self._run_thumbnailer(input_path, to_generate)
+
+        # Now store each of them
+        for (t_width, t_height, t_method, t_type), t_bytes in zip(
+            to_generate, generated
+        ):
+            t_byte_source = BytesIO(t_bytes)
             try:
                 file_info = FileInfo(
                     server_name=server_name,
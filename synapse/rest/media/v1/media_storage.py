@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import contextlib
+import errno
+import hashlib
 import logging
 import os
 import shutil
@@ -21,13 +23,15 @@ import sys
 
 import six
 
-from twisted.internet import defer
+from zope.interface import implementer
+
+from twisted.internet import defer, interfaces, threads
 from twisted.protocols.basic import FileSender
 
 from synapse.logging.context import defer_to_thread, make_deferred_yieldable
 from synapse.util.file_consumer import BackgroundFileConsumer
 
-from ._base import Responder
+from ._base import FileInfo, Responder
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +53,13 @@ class MediaStorage(object):
         self.filepaths = filepaths
         self.storage_providers = storage_providers
 
+        self.store = hs.get_datastore()
+        self.clock = hs.get_clock()
+
+        # The maximum size of the local media store, if it's a cache in front
+        # of the storage providers.
+        self.cache_max_size = hs.config.media_cache_max_size
+
     @defer.inlineCallbacks
     def store_file(self, source, file_info):
         """Write `source` to the on disk media store, and also any other
@@ -104,17 +115,29 @@ class MediaStorage(object):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-        finished_called = [False]
+        # If there's already a file here it may be a hard link to another
+        # piece of media (see `link_file`), so we make sure to write to a new
+        # file rather than overwriting that one.
+        _remove_file(fname)
 
-        @defer.inlineCallbacks
-        def finish():
-            for provider in self.storage_providers:
-                yield provider.store_file(path, file_info)
-
-            finished_called[0] = True
+        finished_called = [False]
 
         try:
             with open(fname, "wb") as f:
+
+                @defer.inlineCallbacks
+                def finish():
+                    # Make sure everything written so far is in the file, before
+                    # the storage providers copy it.
+                    f.flush()
+
+                    for provider in self.storage_providers:
+                        yield provider.store_file(path, file_info)
+
+                    yield self._record_cached_file(path, file_info)
+
+                    finished_called[0] = True
+
                 yield f, fname, finish
         except Exception:
             t, v, tb = sys.exc_info()
@@ -127,6 +150,55 @@ class MediaStorage(object):
         if not finished_called:
             raise Exception("Finished callback not called")
 
+    def get_content_hash(self, file_info):
+        """Calculate the hash of a file in the local media store.
+
+        Args:
+            file_info (FileInfo)
+
+        Returns:
+            Deferred[str]: the hex encoded SHA-256 of the file's content
+        """
+        path = self._file_info_to_path(file_info)
+        local_path = os.path.join(self.local_media_directory, path)
+        return defer_to_thread(self.hs.get_reactor(), _hash_file, local_path)
+
+    @defer.inlineCallbacks
+    def link_file(self, existing_file_info, file_info, store_in_providers=True):
+        """Store a file in the local media store as a hard link to an existing
+        file with the same content, rather than as a copy. Any file already
+        stored at that location is replaced.
+
+        Args:
+            existing_file_info (FileInfo): the file to link to
+            file_info (FileInfo): the file to store
+            store_in_providers (bool): whether to also store the file with the
+                storage providers, as `store_file` would.
+
+        Returns:
+            Deferred[bool]: False if the existing file isn't in the local media
+            store, or it couldn't be linked to.
+        """
+        existing_path = os.path.join(
+            self.local_media_directory, self._file_info_to_path(existing_file_info)
+        )
+        path = self._file_info_to_path(file_info)
+        local_path = os.path.join(self.local_media_directory, path)
+
+        linked = yield defer_to_thread(
+            self.hs.get_reactor(), _link_file, existing_path, local_path
+        )
+        if not linked:
+            return False
+
+        if store_in_providers:
+            for provider in self.storage_providers:
+                yield provider.store_file(path, file_info)
+
+        yield self._record_cached_file(path, file_info)
+
+        return True
+
     @defer.inlineCallbacks
     def fetch_media(self, file_info):
         """Attempts to fetch media described by file_info from the local cache
@@ -143,7 +215,7 @@ class MediaStorage(object):
         path = self._file_info_to_path(file_info)
         local_path = os.path.join(self.local_media_directory, path)
         if os.path.exists(local_path):
-            return FileResponder(open(local_path, "rb"))
+            return FileResponder(open(local_path, "rb"), self.hs.get_reactor())
 
         for provider in self.storage_providers:
             res = yield provider.fetch(path, file_info)
@@ -182,10 +254,108 @@ class MediaStorage(object):
                     )
                     yield res.write_to_consumer(consumer)
                     yield consumer.wait()
+                yield self._record_cached_file(path, file_info)
                 return local_path
 
         raise Exception("file could not be found")
 
+    @defer.inlineCallbacks
+    def _record_cached_file(self, path, file_info):
+        """Record that a file has been stored in the local media store, if it
+        is being used as a bounded cache.
+
+        Args:
+            path (str): the path of the file, relative to the media store
+            file_info (FileInfo)
+
+        Returns:
+            Deferred
+        """
+        # The URL cache has its own expiry.
+        if self.cache_max_size is None or file_info.url_cache:
+            return
+
+        length = yield defer_to_thread(
+            self.hs.get_reactor(),
+            os.path.getsize,
+            os.path.join(self.local_media_directory, path),
+        )
+        yield self.store.record_local_media_cache_file(
+            path,
+            file_info.server_name,
+            file_info.file_id,
+            length,
+            self.clock.time_msec(),
+        )
+
+    @defer.inlineCallbacks
+    def evict_local_cache(self):
+        """Delete the least recently used files from the local media store
+        until it is no bigger than `media_cache_max_size`. Files which aren't
+        in any of the storage providers are kept.
+
+        Deleting a file which is hard linked to other media (see `link_file`)
+        frees no space until the last of them is deleted, so such files
+        aren't counted towards the space freed until then.
+
+        Returns:
+            Deferred[int]: the number of bytes freed
+        """
+        total_size = yield self.store.get_local_media_cache_size()
+        to_free = total_size - self.cache_max_size
+
+        freed = 0
+        after = None
+        while freed < to_free:
+            files = yield self.store.get_least_recently_used_local_media_cache(
+                after, limit=100
+            )
+            if not files:
+                break
+
+            for cached_file in files:
+                if freed >= to_free:
+                    break
+
+                after = (cached_file["last_access_ts"], cached_file["path"])
+                evicted = yield self._evict_cached_file(cached_file)
+                freed += evicted
+
+        if freed:
+            logger.info("Evicted %d bytes from the local media cache", freed)
+
+        return freed
+
+    @defer.inlineCallbacks
+    def _evict_cached_file(self, cached_file):
+        """Delete a file from the local media store, if it is in one of the
+        storage providers.
+
+        Args:
+            cached_file (dict): as returned by
+                `get_least_recently_used_local_media_cache`
+
+        Returns:
+            Deferred[int]: the number of bytes freed
+        """
+        path = cached_file["path"]
+        file_info = FileInfo(cached_file["media_origin"], cached_file["filesystem_id"])
+
+        for provider in self.storage_providers:
+            has_file = yield provider.has_file(path, file_info)
+            if has_file:
+                break
+        else:
+            logger.debug("Not evicting %s as no storage provider has it", path)
+            return 0
+
+        local_path = os.path.join(self.local_media_directory, path)
+        freed = yield defer_to_thread(
+            self.hs.get_reactor(), _remove_cached_file, local_path
+        )
+        yield self.store.delete_local_media_cache_file(path)
+        return freed
+
     def _file_info_to_path(self, file_info):
         """Converts file_info into a relative path.
 
@@ -246,21 +416,241 @@ def _write_file_synchronously(source, dest):
     shutil.copyfileobj(source, dest)
 
 
+def _hash_file(path):
+    """Calculate the hex encoded SHA-256 of a file. Should be called from a
+    thread.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 16), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _remove_file(path):
+    """Remove a file, if it exists. Should be called from a thread."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _remove_cached_file(path):
+    """Remove a file from the local media store, if it exists. Should be
+    called from a thread.
+
+    Returns:
+        int: the number of bytes freed, which is zero if the file is still hard
+        linked elsewhere.
+    """
+    try:
+        stat = os.stat(path)
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return 0
+
+    return stat.st_size if stat.st_nlink == 1 else 0
+
+
+def _link_file(source, dest):
+    """Atomically replace `dest` with a hard link to `source`. Should be
+    called from a thread.
+
+    Returns:
+        bool: False if the link couldn't be made, e.g. because `source` doesn't
+        exist or is on a different filesystem.
+    """
+    dirname = os.path.dirname(dest)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    tmp_dest = dest + ".link"
+    try:
+        os.remove(tmp_dest)
+    except OSError:
+        pass
+
+    try:
+        os.link(source, tmp_dest)
+    except OSError as e:
+        logger.info("Failed to link %r to %r: %s", dest, source, e)
+        return False
+
+    os.replace(tmp_dest, dest)
+    return True
+
+
 class FileResponder(Responder):
     """Wraps an open file that can be sent to a request.
 
     Args:
         open_file (file): A file like object to be streamed ot the client,
             is closed when finished streaming.
+        reactor (twisted.internet.reactor|None): If given, the file is read
+            using the reactor's threadpool, so that a slow disk doesn't block
+            the reactor.
     """
 
-    def __init__(self, open_file):
+    def __init__(self, open_file, reactor=None):
         self.open_file = open_file
+        self.reactor = reactor
 
     def write_to_consumer(self, consumer):
+        if self.reactor is None:
+            return make_deferred_yieldable(
+                FileSender().beginFileTransfer(self.open_file, consumer)
+            )
+
         return make_deferred_yieldable(
-            FileSender().beginFileTransfer(self.open_file, consumer)
+            ThreadedFileSender(self.reactor).beginFileTransfer(self.open_file, consumer)
+        )
+
+    def supports_ranges(self):
+        return self.reactor is not None
+
+    def write_range_to_consumer(self, consumer, offset, length):
+        return make_deferred_yieldable(
+            ThreadedFileSender(self.reactor).beginFileTransfer(
+                self.open_file, consumer, offset=offset, length=length
+            )
         )
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.open_file.close()
+
+
+@implementer(interfaces.IPushProducer)
+class ThreadedFileSender(object):
+    """Streams a file to a consumer, like twisted's FileSender, except that
+    the file is read in chunks using the reactor's threadpool rather than on
+    the reactor thread.
+
+    This is a push producer: we only read the next chunk once the previous one
+    has been written, and stop reading while the consumer has paused us.
+
+    Args:
+        reactor (twisted.internet.reactor)
+    """
+
+    CHUNK_SIZE = 2 ** 16
+
+    def __init__(self, reactor):
+        self._reactor = reactor
+
+        self._file = None
+        self._consumer = None
+
+        # The number of bytes left to send, or None to send until EOF.
+        self._remaining = None
+
+        self._paused = False
+
+        # Whether there is a read in progress in the threadpool.
+        self._reading = False
+
+        # Whether we have finished (or been stopped).
+        self._finished = False
+
+        self._deferred = None
+
+    def beginFileTransfer(self, file, consumer, offset=0, length=None):
+        """Start streaming the file to the consumer.
+
+        Args:
+            file (file): the file to read from
+            consumer (IConsumer)
+            offset (int): the position in the file to start reading from
+            length (int|None): the number of bytes to send, or None to send
+                until the end of the file
+
+        Returns:
+            Deferred: resolves once the file has been sent, or fails if the
+            consumer stops the transfer. Does *not* follow the synapse
+            logcontext rules.
+        """
+        self._file = file
+        self._consumer = consumer
+        self._remaining = length
+
+        self._deferred = defer.Deferred()
+        consumer.registerProducer(self, True)
+
+        if offset:
+            self._run_in_thread(self._on_seek, file.seek, offset)
+        else:
+            self._read_next_chunk()
+
+        return self._deferred
+
+    def _run_in_thread(self, callback, f, *args):
+        self._reading = True
+        d = threads.deferToThreadPool(
+            self._reactor, self._reactor.getThreadPool(), f, *args
+        )
+        d.addCallbacks(callback, self._on_error)
+
+    def _read_next_chunk(self):
+        if self._paused or self._reading or self._finished:
+            return
+
+        size = self.CHUNK_SIZE
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+
+        self._run_in_thread(self._on_read, self._file.read, size)
+
+    def _on_seek(self, _):
+        self._reading = False
+        self._read_next_chunk()
+
+    def _on_read(self, chunk):
+        self._reading = False
+        if self._finished:
+            return
+
+        if not chunk:
+            self._finish()
+            return
+
+        if self._remaining is not None:
+            self._remaining -= len(chunk)
+
+        # This may call pauseProducing.
+        self._consumer.write(chunk)
+
+        if self._remaining == 0:
+            self._finish()
+            return
+
+        self._read_next_chunk()
+
+    def _on_error(self, failure):
+        self._reading = False
+        if self._finished:
+            return
+
+        self._finished = True
+        self._consumer.unregisterProducer()
+        self._deferred.errback(failure)
+
+    def _finish(self):
+        self._finished = True
+        self._consumer.unregisterProducer()
+        self._deferred.callback(None)
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self._read_next_chunk()
+
+    def stopProducing(self):
+        if self._finished:
+            return
+
+        self._finished = True
+        self._deferred.errback(Exception("Consumer asked us to stop producing"))
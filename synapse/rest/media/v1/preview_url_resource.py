@@ -43,7 +43,11 @@ from synapse.http.server import (
     wrap_json_request_handler,
 )
 from synapse.http.servlet import parse_integer, parse_string
-from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.logging.context import (
+    defer_to_thread,
+    make_deferred_yieldable,
+    run_in_background,
+)
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.rest.media.v1._base import get_filename_from_headers
 from synapse.util.async_helpers import ObservableDeferred
@@ -60,6 +64,13 @@ _content_type_match = re.compile(r'.*; *charset="?(.*?)"?(;|$)', flags=re.I)
 OG_TAG_NAME_MAXLEN = 50
 OG_TAG_VALUE_MAXLEN = 1000
 
+# How long a process may spend previewing a URL before other processes stop
+# waiting for it and try themselves.
+URL_PREVIEW_LOCK_TIMEOUT_MS = 60 * 1000
+
+# How often a process waiting for another to preview a URL checks the cache.
+URL_PREVIEW_POLL_INTERVAL_SECS = 0.5
+
 
 class PreviewUrlResource(DirectServeResource):
     isLeaf = True
@@ -69,6 +80,8 @@ class PreviewUrlResource(DirectServeResource):
 
         self.auth = hs.get_auth()
         self.clock = hs.get_clock()
+        self.reactor = hs.get_reactor()
+        self.instance_name = hs.config.instance_name
         self.filepaths = media_repo.filepaths
         self.max_spider_size = hs.config.max_spider_size
         self.server_name = hs.hostname
@@ -169,6 +182,9 @@ class PreviewUrlResource(DirectServeResource):
     def _do_preview(self, url, user, ts):
         """Check the db, and download the URL and build a preview
 
+        Only one process previews a given URL at a time: if another process
+        is already doing so, we wait for its result to appear in the db.
+
         Args:
             url (str):
             user (str):
@@ -179,6 +195,45 @@ class PreviewUrlResource(DirectServeResource):
         """
         # check the URL cache in the DB (which will also provide us with
         # historical previews, if we have any)
+        og = yield self._get_cached_preview(url, ts)
+        if og is not None:
+            return og
+
+        while True:
+            lock_token = random_string(16)
+            now = self.clock.time_msec()
+            acquired = yield self.store.try_acquire_url_preview_lock(
+                url,
+                self.instance_name,
+                lock_token,
+                now,
+                now + URL_PREVIEW_LOCK_TIMEOUT_MS,
+            )
+            if acquired:
+                try:
+                    # Another process may have stored a preview between our
+                    # last check and taking the lock.
+                    og = yield self._get_cached_preview(url, now)
+                    if og is None:
+                        og = yield self._generate_preview(url, user)
+                finally:
+                    yield self.store.release_url_preview_lock(url, lock_token)
+                return og
+
+            og = yield self._wait_for_preview(url)
+            if og is not None:
+                return og
+
+            # The other process gave up without storing a preview, so have a
+            # go ourselves.
+
+    @defer.inlineCallbacks
+    def _get_cached_preview(self, url, ts):
+        """Get the preview of a URL from the db, if it's valid at the given time.
+
+        Returns:
+            Deferred[bytes|None]: json-encoded og data
+        """
         cache_result = yield self.store.get_url_cache(url, ts)
         if (
             cache_result
@@ -192,6 +247,35 @@ class PreviewUrlResource(DirectServeResource):
                 og = og.encode("utf8")
             return og
 
+        return None
+
+    @defer.inlineCallbacks
+    def _wait_for_preview(self, url):
+        """Wait for another process to finish previewing a URL.
+
+        Returns:
+            Deferred[bytes|None]: json-encoded og data, or None if the other
+            process released or lost its lock without storing a preview.
+        """
+        while True:
+            yield self.clock.sleep(URL_PREVIEW_POLL_INTERVAL_SECS)
+
+            now = self.clock.time_msec()
+            og = yield self._get_cached_preview(url, now)
+            if og is not None:
+                return og
+
+            expires_ts = yield self.store.get_url_preview_lock_expiry(url)
+            if expires_ts is None or expires_ts <= now:
+                return None
+
+    @defer.inlineCallbacks
+    def _generate_preview(self, url, user):
+        """Download the URL and build a preview, storing it in the db.
+
+        Returns:
+            Deferred[bytes]: json-encoded og data
+        """
         media_info = yield self._download_url(url, user)
 
         logger.debug("got media_info of '%s'", media_info)
@@ -220,28 +304,14 @@ class PreviewUrlResource(DirectServeResource):
         elif _is_html(media_info["media_type"]):
             # TODO: somehow stop a big HTML tree from exploding synapse's RAM
 
-            with open(media_info["filename"], "rb") as file:
-                body = file.read()
-
-            encoding = None
-
-            # Let's try and figure out if it has an encoding set in a meta tag.
-            # Limit it to the first 1kb, since it ought to be in the meta tags
-            # at the top.
-            match = _charset_match.search(body[:1000])
-
-            # If we find a match, it should take precedence over the
-            # Content-Type header, so set it here.
-            if match:
-                encoding = match.group(1).decode("ascii")
-
-            # If we don't find a match, we'll look at the HTTP Content-Type, and
-            # if that doesn't exist, we'll fall back to UTF-8.
-            if not encoding:
-                content_match = _content_type_match.match(media_info["media_type"])
-                encoding = content_match.group(1) if content_match else "utf-8"
-
-            og = decode_and_calc_og(body, media_info["uri"], encoding)
+            # Parsing a large page can take a while, so do it off the reactor.
+            og = yield defer_to_thread(
+                self.reactor,
+                _calc_og_from_file,
+                media_info["filename"],
+                media_info["media_type"],
+                media_info["uri"],
+            )
 
             # pre-cache the image for posterity
             # FIXME: it might be cleaner to use the same flow as the main /preview_url
@@ -483,6 +553,41 @@ class PreviewUrlResource(DirectServeResource):
         logger.info("Deleted %d media from url cache", len(removed_media))
 
 
+def _calc_og_from_file(filename, media_type, media_uri):
+    """Reads a downloaded HTML page and calculates its OG data.
+
+    Args:
+        filename (str): the path to the downloaded page
+        media_type (str): the Content-Type the page was served with
+        media_uri (str): the URI the page was downloaded from
+
+    Returns:
+        dict: the OG data
+    """
+    with open(filename, "rb") as file:
+        body = file.read()
+
+    encoding = None
+
+    # Let's try and figure out if it has an encoding set in a meta tag.
+    # Limit it to the first 1kb, since it ought to be in the meta tags
+    # at the top.
+    match = _charset_match.search(body[:1000])
+
+    # If we find a match, it should take precedence over the
+    # Content-Type header, so set it here.
+    if match:
+        encoding = match.group(1).decode("ascii")
+
+    # If we don't find a match, we'll look at the HTTP Content-Type, and
+    # if that doesn't exist, we'll fall back to UTF-8.
+    if not encoding:
+        content_match = _content_type_match.match(media_type)
+        encoding = content_match.group(1) if content_match else "utf-8"
+
+    return decode_and_calc_og(body, media_uri, encoding)
+
+
 def decode_and_calc_og(body, media_uri, request_encoding=None):
     from lxml import etree
 
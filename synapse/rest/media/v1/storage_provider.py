@@ -59,6 +59,23 @@ class StorageProvider(object):
         """
         pass
 
+    def has_file(self, path, file_info):
+        """Check whether the provider has the file described by file_info,
+        without fetching it.
+
+        Providers which don't implement this are assumed not to have the file,
+        so files are never evicted from the local media cache on their
+        account.
+
+        Args:
+            path (str): Relative path of file in local cache
+            file_info (FileInfo)
+
+        Returns:
+            Deferred[bool]
+        """
+        return defer.succeed(False)
+
 
 class StorageProviderWrapper(StorageProvider):
     """Wraps a storage provider and provides various config options
@@ -103,6 +120,13 @@ class StorageProviderWrapper(StorageProvider):
     def fetch(self, path, file_info):
         return self.backend.fetch(path, file_info)
 
+    def has_file(self, path, file_info):
+        # Third party providers may not implement `has_file`.
+        has_file = getattr(self.backend, "has_file", None)
+        if has_file is None:
+            return defer.succeed(False)
+        return has_file(path, file_info)
+
 
 class FileStorageProviderBackend(StorageProvider):
     """A storage provider that stores files in a directory on a filesystem.
@@ -139,7 +163,13 @@ class FileStorageProviderBackend(StorageProvider):
 
         backup_fname = os.path.join(self.base_directory, path)
         if os.path.isfile(backup_fname):
-            return FileResponder(open(backup_fname, "rb"))
+            return FileResponder(open(backup_fname, "rb"), self.hs.get_reactor())
+
+    def has_file(self, path, file_info):
+        """See StorageProvider.has_file"""
+
+        backup_fname = os.path.join(self.base_directory, path)
+        return defer_to_thread(self.hs.get_reactor(), os.path.isfile, backup_fname)
 
     @staticmethod
     def parse_config(config):
@@ -31,6 +31,14 @@ EXIF_TRANSPOSE_MAPPINGS = {
     8: Image.ROTATE_90,
 }
 
+# The transpositions which swap the width and height of the image.
+_SWAPPING_TRANSPOSITIONS = (
+    Image.TRANSPOSE,
+    Image.ROTATE_270,
+    Image.TRANSVERSE,
+    Image.ROTATE_90,
+)
+
 
 class Thumbnailer(object):
 
@@ -64,6 +72,17 @@ class Thumbnailer(object):
             self.image.info["exif"] = None
         return self.image.size
 
+    def transposed_size(self):
+        """Get the size of the image once it has been transposed using its EXIF
+        Orientation tag, without decoding the image.
+
+        Returns:
+            Tuple[int, int]: (width, height) of the transposed image in pixels.
+        """
+        if self.transpose_method in _SWAPPING_TRANSPOSITIONS:
+            return self.height, self.width
+        return self.width, self.height
+
     def aspect(self, max_width, max_height):
         """Calculate the largest size that preserves aspect ratio which
         fits within the given rectangle::
@@ -77,10 +96,11 @@ class Thumbnailer(object):
             max_height: The larget possible height.
         """
 
-        if max_width * self.height < max_height * self.width:
-            return max_width, (max_width * self.height) // self.width
+        width, height = self.transposed_size()
+        if max_width * height < max_height * width:
+            return max_width, (max_width * height) // width
         else:
-            return (max_height * self.width) // self.height, max_height
+            return (max_height * width) // height, max_height
 
     def _resize(self, width, height):
         # 1-bit or 8-bit color palette images need converting to RGB
@@ -113,19 +133,100 @@ class Thumbnailer(object):
         Returns:
             BytesIO: the bytes of the encoded image ready to be written to disk
         """
+        scaled_size, crop_box = self._crop_dimensions(width, height)
+        scaled_image = self._resize(*scaled_size)
+        cropped = scaled_image.crop(crop_box)
+        return self._encode_image(cropped, output_type)
+
+    def _crop_dimensions(self, width, height):
+        """Work out how to scale and crop the image for `crop`.
+
+        Returns:
+            Tuple[Tuple[int, int], Tuple[int, int, int, int]]: the size to scale
+            the image to, and the box to crop the scaled image to.
+        """
         if width * self.height > height * self.width:
             scaled_height = (width * self.height) // self.width
-            scaled_image = self._resize(width, scaled_height)
             crop_top = (scaled_height - height) // 2
             crop_bottom = height + crop_top
-            cropped = scaled_image.crop((0, crop_top, width, crop_bottom))
+            return (width, scaled_height), (0, crop_top, width, crop_bottom)
         else:
             scaled_width = (height * self.width) // self.height
-            scaled_image = self._resize(scaled_width, height)
             crop_left = (scaled_width - width) // 2
             crop_right = width + crop_left
-            cropped = scaled_image.crop((crop_left, 0, crop_right, height))
-        return self._encode_image(cropped, output_type)
+            return (scaled_width, height), (crop_left, 0, crop_right, height)
+
+    def generate_thumbnails(self, thumbnails):
+        """Generates several thumbnails of the image, only decoding it once.
+
+        If possible the image is decoded at a reduced resolution which is still
+        large enough for the biggest thumbnail. The thumbnails are then
+        generated from largest to smallest, each being scaled from the
+        previous one rather than from the full size image.
+
+        Args:
+            thumbnails (list[tuple[int, int, str, str]]): the width, height,
+                method ("crop" or "scale") and media type of each thumbnail.
+                For "scale" the width and height should already have been
+                adjusted to preserve the aspect ratio.
+
+        Returns:
+            list[bytes]: the encoded thumbnails, in the same order as
+            `thumbnails`.
+        """
+        # All the scaled (but not yet cropped) images have the same aspect
+        # ratio as the transposed image, so we can order them by width.
+        width, height = self.transposed_size()
+        scaled_sizes = []
+        for t_width, t_height, t_method, _ in thumbnails:
+            if t_method == "crop":
+                scaled_width = max(t_width, (t_height * width) // height)
+                scaled_height = max(t_height, (t_width * height) // width)
+                scaled_sizes.append((scaled_width, scaled_height))
+            else:
+                scaled_sizes.append((t_width, t_height))
+
+        if scaled_sizes:
+            self._draft(
+                max(w for w, _ in scaled_sizes), max(h for _, h in scaled_sizes)
+            )
+        self.transpose()
+
+        results = [None] * len(thumbnails)
+        order = sorted(
+            range(len(thumbnails)), key=lambda i: scaled_sizes[i], reverse=True
+        )
+        for i in order:
+            t_width, t_height, t_method, t_type = thumbnails[i]
+            if t_method == "crop":
+                scaled_size, crop_box = self._crop_dimensions(t_width, t_height)
+            else:
+                scaled_size, crop_box = (t_width, t_height), None
+
+            scaled_image = self._resize(*scaled_size)
+            output_image = scaled_image
+            if crop_box:
+                output_image = scaled_image.crop(crop_box)
+            results[i] = self._encode_image(output_image, t_type).getvalue()
+
+            # The next thumbnail is no bigger, so we can scale it from this one
+            # (unless we had to scale the image up for this one).
+            if scaled_size[0] <= self.width and scaled_size[1] <= self.height:
+                self.image = scaled_image
+                self.width, self.height = scaled_size
+
+        return results
+
+    def _draft(self, width, height):
+        """Ask the decoder to decode the image at a lower resolution, if it
+        can, as long as the result is at least the given size once transposed.
+        Only JPEGs support this.
+        """
+        if self.transpose_method in _SWAPPING_TRANSPOSITIONS:
+            width, height = height, width
+
+        self.image.draft(None, (width, height))
+        self.width, self.height = self.image.size
 
     def _encode_image(self, output_image, output_type):
         output_bytes_io = BytesIO()
@@ -134,3 +235,19 @@ class Thumbnailer(object):
             output_image = output_image.convert("RGB")
         output_image.save(output_bytes_io, fmt, quality=80)
         return output_bytes_io
+
+
+def generate_thumbnails(input_path, thumbnails):
+    """Generates several thumbnails of the image at the given path.
+
+    This is a separate function so that it can be run in a process pool.
+
+    Args:
+        input_path (str): the path to the image
+        thumbnails (list[tuple[int, int, str, str]]): see
+            `Thumbnailer.generate_thumbnails`
+
+    Returns:
+        list[bytes]: the encoded thumbnails, in the same order as `thumbnails`.
+    """
+    return Thumbnailer(input_path).generate_thumbnails(thumbnails)
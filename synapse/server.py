@@ -66,7 +66,7 @@ from synapse.handlers.groups_local import GroupsLocalHandler, GroupsLocalWorkerH
 from synapse.handlers.initial_sync import InitialSyncHandler
 from synapse.handlers.message import EventCreationHandler, MessageHandler
 from synapse.handlers.pagination import PaginationHandler
-from synapse.handlers.presence import PresenceHandler
+from synapse.handlers.presence import PresenceHandler, PresenceInterestIndex
 from synapse.handlers.profile import BaseProfileHandler, MasterProfileHandler
 from synapse.handlers.read_marker import ReadMarkerHandler
 from synapse.handlers.receipts import ReceiptsHandler
@@ -140,6 +140,7 @@ class HomeServer(object):
         "state_handler",
         "state_resolution_handler",
         "presence_handler",
+        "presence_interest_index",
         "sync_handler",
         "typing_handler",
         "room_list_handler",
@@ -338,6 +339,9 @@ class HomeServer(object):
     def build_presence_handler(self):
         return PresenceHandler(self)
 
+    def build_presence_interest_index(self):
+        return PresenceInterestIndex(self)
+
     def build_typing_handler(self):
         return TypingHandler(self)
 
@@ -97,6 +97,10 @@ class HomeServer(object):
         pass
     def get_presence_handler(self) -> synapse.handlers.presence.PresenceHandler:
         pass
+    def get_presence_interest_index(
+        self,
+    ) -> synapse.handlers.presence.PresenceInterestIndex:
+        pass
     def get_clock(self) -> synapse.util.Clock:
         pass
     def get_reactor(self) -> twisted.internet.base.ReactorBase:
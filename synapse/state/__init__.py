@@ -32,10 +32,13 @@ from synapse.events import EventBase
 from synapse.events.snapshot import EventContext
 from synapse.logging.utils import log_function
 from synapse.state import v1, v2
+from synapse.state.pool import StateResolutionPool
 from synapse.storage.data_stores.main.events_worker import EventRedactBehaviour
+from synapse.storage.state import StateFilter
 from synapse.types import StateMap
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches import get_cache_factor_for
+from synapse.util.caches.descriptors import cachedInlineCallbacks
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.metrics import Measure, measure_func
 
@@ -211,10 +214,58 @@ class StateHandler(object):
         Returns:
             Deferred[list[str]]: the hosts in the room at the given events
         """
+        event_to_groups = yield self.store._get_state_group_for_events(event_ids)
+        state_groups = set(itervalues(event_to_groups))
+        if len(state_groups) == 1:
+            # The common case: there's no need to resolve the state, and we can
+            # look the hosts up by state group.
+            (state_group,) = state_groups
+            joined_hosts = yield self._get_hosts_in_room_for_state_group(
+                room_id, state_group
+            )
+            return joined_hosts
+
         entry = yield self.resolve_state_groups_for_events(room_id, event_ids)
         joined_hosts = yield self.store.get_joined_hosts(room_id, entry)
         return joined_hosts
 
+    @cachedInlineCallbacks(num_args=2, max_entries=10000, iterable=True)
+    def _get_hosts_in_room_for_state_group(self, room_id, state_group):
+        """Get the hosts in a room at the given state group.
+
+        State groups which don't change the membership of the room share the
+        result for their previous group, so only membership changes mean we
+        have to work the hosts out again.
+
+        Returns:
+            Deferred[frozenset[str]]
+        """
+        prev_group, delta_ids = yield self.state_store.get_state_group_delta(
+            state_group
+        )
+
+        if prev_group is not None and all(
+            typ != EventTypes.Member for typ, _ in delta_ids
+        ):
+            joined_hosts = yield self._get_hosts_in_room_for_state_group(
+                room_id, prev_group
+            )
+            return joined_hosts
+
+        # Only the membership matters, so don't bother loading the rest of the
+        # state.
+        state_ids = yield self.state_store.get_state_ids_for_group(
+            state_group, StateFilter.from_types([(EventTypes.Member, None)])
+        )
+        entry = _StateCacheEntry(
+            state=state_ids,
+            state_group=state_group,
+            prev_group=prev_group,
+            delta_ids=delta_ids,
+        )
+        joined_hosts = yield self.store.get_joined_hosts(room_id, entry)
+        return joined_hosts
+
     @defer.inlineCallbacks
     def compute_event_context(
         self, event: EventBase, old_state: Optional[Iterable[EventBase]] = None
@@ -453,6 +504,12 @@ class StateResolutionHandler(object):
             reset_expiry_on_get=True,
         )
 
+        self._state_res_pool = None
+        if hs.config.state_resolution_processes:
+            self._state_res_pool = StateResolutionPool(
+                hs.get_reactor(), num_processes=hs.config.state_resolution_processes
+            )
+
     @defer.inlineCallbacks
     @log_function
     def resolve_state_groups(
@@ -518,8 +575,17 @@ class StateResolutionHandler(object):
 
             if conflicted_state:
                 logger.info("Resolving conflicted state for %r", room_id)
+                state_res_version = KNOWN_ROOM_VERSIONS[room_version].state_res
+                if (
+                    self._state_res_pool is not None
+                    and state_res_version == StateResolutionVersions.V2
+                ):
+                    resolve = self._state_res_pool.resolve_events_with_store
+                else:
+                    resolve = resolve_events_with_store
+
                 with Measure(self.clock, "state._resolve_events"):
-                    new_state = yield resolve_events_with_store(
+                    new_state = yield resolve(
                         room_id,
                         room_version,
                         list(itervalues(state_groups_ids)),
@@ -682,3 +748,21 @@ class StateResolutionStore(object):
         """
 
         return self.store.get_auth_chain_ids(event_ids, include_given=True)
+
+    def get_auth_chain_difference(self, state_sets):
+        """Given sets of state events figure out the auth chain difference (as
+        per state res v2 algorithm).
+
+        This is equivalent to fetching the full auth chain for each set of state
+        and returning the events that don't appear in each and every auth
+        chain.
+
+        Args:
+            state_sets (list[set[str]]): The sets of state event IDs. Each set
+                is included in its own auth chain.
+
+        Returns:
+            Deferred[set[str]]: Set of event IDs.
+        """
+
+        return self.store.get_auth_chain_difference(state_sets)
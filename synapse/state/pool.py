@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs state resolution in a pool of separate processes.
+
+State resolution is pure CPU work once the events involved have been fetched,
+and can take seconds in large rooms. Rather than blocking the reactor for that
+long, `StateResolutionPool` fetches the events up front and ships them, with
+the rest of the input, to a worker process which runs the same v2 algorithm
+and returns the resolved state as event IDs.
+"""
+
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from six import iteritems, itervalues
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+import synapse.state
+from synapse import event_auth
+from synapse.api.constants import EventTypes
+from synapse.events import EventBase, event_type_from_format_version
+from synapse.logging.context import make_deferred_yieldable
+from synapse.state import v2
+from synapse.types import StateMap
+from synapse.util.frozenutils import frozendict_json_encoder
+
+logger = logging.getLogger(__name__)
+
+# Conflicts with fewer events than this are resolved in the main process, as
+# the cost of shipping them to a worker outweighs the cost of resolving them.
+MIN_EVENTS_FOR_POOL = 50
+
+# The number of times we go back to the database for events that a worker
+# found it needed but which we didn't send it, before giving up and resolving
+# in the main process.
+MAX_ATTEMPTS = 5
+
+POWER_KEY = (EventTypes.PowerLevels, "")
+
+
+class _MissingEventsError(Exception):
+    """Raised in a worker when state resolution needs events which were not
+    sent to it.
+    """
+
+    def __init__(self, event_ids):
+        super(_MissingEventsError, self).__init__()
+        self.event_ids = event_ids
+
+
+class _WorkerStateResolutionStore(object):
+    """The StateResolutionStore used by workers, which answers from the events
+    and auth chain difference sent to it rather than the database.
+
+    Args:
+        event_map (dict[str, FrozenEvent]): the events which were sent
+        absent_event_ids (set[str]): events which are known not to be in the
+            database
+        auth_difference (set[str]): the auth chain difference of the state
+            sets being resolved
+    """
+
+    def __init__(self, event_map, absent_event_ids, auth_difference):
+        self._event_map = event_map
+        self._absent_event_ids = absent_event_ids
+        self._auth_difference = auth_difference
+
+    def get_events(self, event_ids, allow_rejected=False):
+        missing = [
+            eid
+            for eid in event_ids
+            if eid not in self._event_map and eid not in self._absent_event_ids
+        ]
+        if missing:
+            raise _MissingEventsError(missing)
+
+        events = {}
+        for eid in event_ids:
+            ev = self._event_map.get(eid)
+            if ev is not None and (allow_rejected or not ev.rejected_reason):
+                events[eid] = ev
+        return defer.succeed(events)
+
+    def get_auth_chain_difference(self, state_sets):
+        return defer.succeed(set(self._auth_difference))
+
+
+def _serialize_event(event):
+    """Serializes an event to send it to a worker.
+
+    Args:
+        event (FrozenEvent)
+
+    Returns:
+        str
+    """
+    event_dict = event.get_dict()
+    event_dict.pop("unsigned", None)
+    return frozendict_json_encoder.encode(
+        [event.format_version, event_dict, event.rejected_reason]
+    )
+
+
+def _deserialize_event(serialized):
+    format_version, event_dict, rejected_reason = json.loads(serialized)
+    event_type = event_type_from_format_version(format_version)
+    return event_type(event_dict, rejected_reason=rejected_reason)
+
+
+def resolve_state_in_worker(
+    room_id, room_version, state_sets, serialized_events, absent_event_ids, auth_diff
+):
+    """The entry point for state resolution in a worker process.
+
+    Args:
+        room_id (str)
+        room_version (str)
+        state_sets (list[list[tuple[str, str, str]]]): the state sets to
+            resolve, as lists of (type, state_key, event_id).
+        serialized_events (list[str]): the events that resolution may need, as
+            serialized by `_serialize_event`.
+        absent_event_ids (list[str]): events which are known not to be in the
+            database.
+        auth_diff (list[str]): the auth chain difference of the state sets.
+
+    Returns:
+        tuple[list[str]|None, list[tuple[str, str, str]]|None]: either a list
+        of event IDs which resolution needs but which were not sent (and no
+        result), or None and the resolved state as (type, state_key, event_id).
+    """
+    event_map = {}
+    for serialized in serialized_events:
+        event = _deserialize_event(serialized)
+        event_map[event.event_id] = event
+
+    store = _WorkerStateResolutionStore(
+        dict(event_map), set(absent_event_ids), set(auth_diff)
+    )
+
+    # All of the store's answers are already available, so this completes
+    # synchronously.
+    results = []
+    v2.resolve_events_with_store(
+        room_id,
+        room_version,
+        [{(t, s): eid for t, s, eid in state_set} for state_set in state_sets],
+        event_map,
+        store,
+    ).addBoth(results.append)
+
+    (result,) = results
+    if isinstance(result, Failure):
+        if result.check(_MissingEventsError):
+            return result.value.event_ids, None
+        result.raiseException()
+
+    return None, [(t, s, eid) for (t, s), eid in iteritems(result)]
+
+
+class StateResolutionPool(object):
+    """Resolves state using the v2 algorithm in a pool of worker processes.
+
+    Args:
+        reactor (twisted.internet.interfaces.IReactorThreads)
+        executor (concurrent.futures.Executor|None): the pool to run
+            resolution in. Defaults to a ProcessPoolExecutor.
+        num_processes (int): the number of processes to use if creating the
+            pool.
+    """
+
+    def __init__(self, reactor, executor=None, num_processes=1):
+        self._reactor = reactor
+
+        if executor is None:
+            # We spawn fresh processes rather than forking, as forking a process
+            # with other threads running can leave locks held in the child.
+            #
+            # The workers import the storage layer before anything else, as
+            # importing synapse.state on its own hits an import cycle.
+            executor = ProcessPoolExecutor(
+                max_workers=num_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=importlib.import_module,
+                initargs=("synapse.storage",),
+            )
+        self._executor = executor
+
+    def shutdown(self):
+        """Stops the worker processes, once they are idle."""
+        self._executor.shutdown()
+
+    def _run_in_pool(self, f, *args):
+        """Runs the function in the pool, returning a Deferred which follows
+        the synapse logcontext rules.
+        """
+        d = defer.Deferred()
+
+        def fire(future):
+            e = future.exception()
+            if e is not None:
+                d.errback(Failure(e))
+            else:
+                d.callback(future.result())
+
+        future = self._executor.submit(f, *args)
+        future.add_done_callback(
+            lambda future: self._reactor.callFromThread(fire, future)
+        )
+        return make_deferred_yieldable(d)
+
+    @defer.inlineCallbacks
+    def resolve_events_with_store(
+        self,
+        room_id: str,
+        room_version: str,
+        state_sets: List[StateMap[str]],
+        event_map: Optional[Dict[str, EventBase]],
+        state_res_store: "synapse.state.StateResolutionStore",
+    ):
+        """Resolves the state using the v2 state resolution algorithm, in the
+        pool if the conflict is large enough.
+
+        Takes the same arguments as `synapse.state.v2.resolve_events_with_store`
+        and gives the same result.
+
+        Returns:
+            Deferred[dict[(str, str), str]]:
+                a map from (type, state_key) to event_id.
+        """
+        if event_map is None:
+            event_map = {}
+
+        unconflicted_state, conflicted_state = v2._seperate(state_sets)
+        if not conflicted_state:
+            return unconflicted_state
+
+        auth_diff = yield v2._get_auth_chain_difference(
+            state_sets, event_map, state_res_store
+        )
+
+        full_conflicted_set = set(
+            itertools.chain(
+                itertools.chain.from_iterable(itervalues(conflicted_state)), auth_diff
+            )
+        )
+
+        if len(full_conflicted_set) < MIN_EVENTS_FOR_POOL:
+            result = yield v2.resolve_events_with_store(
+                room_id, room_version, state_sets, event_map, state_res_store
+            )
+            return result
+
+        absent_event_ids = set()
+        yield self._prefetch_events(
+            full_conflicted_set,
+            unconflicted_state,
+            conflicted_state,
+            event_map,
+            absent_event_ids,
+            state_res_store,
+        )
+
+        serialized_state_sets = [
+            [(t, s, eid) for (t, s), eid in iteritems(state_set)]
+            for state_set in state_sets
+        ]
+
+        # We keep hold of the serialized events so that we only serialize each
+        # event once, however many times we go to the pool.
+        serialized_events = {}
+
+        for _ in range(MAX_ATTEMPTS):
+            for event_id, event in iteritems(event_map):
+                if event_id not in serialized_events:
+                    serialized_events[event_id] = _serialize_event(event)
+
+            try:
+                missing, resolved = yield self._run_in_pool(
+                    resolve_state_in_worker,
+                    room_id,
+                    room_version,
+                    serialized_state_sets,
+                    list(itervalues(serialized_events)),
+                    list(absent_event_ids),
+                    list(auth_diff),
+                )
+            except Exception:
+                logger.exception(
+                    "Failed to resolve state for %s in pool; resolving locally",
+                    room_id,
+                )
+                break
+
+            if resolved is not None:
+                return {(t, s): eid for t, s, eid in resolved}
+
+            logger.debug("Fetching %d more events for state res", len(missing))
+            yield self._fetch_events(
+                missing, event_map, absent_event_ids, state_res_store
+            )
+
+        result = yield v2.resolve_events_with_store(
+            room_id, room_version, state_sets, event_map, state_res_store
+        )
+        return result
+
+    @defer.inlineCallbacks
+    def _prefetch_events(
+        self,
+        full_conflicted_set,
+        unconflicted_state,
+        conflicted_state,
+        event_map,
+        absent_event_ids,
+        state_res_store,
+    ):
+        """Fetches the events which v2 state resolution is likely to look at,
+        so that workers rarely have to come back for more.
+
+        These are the events in the full conflicted set, their auth events, the
+        unconflicted state they are authed against, and the chains of power
+        level events which make up the candidate mainlines.
+        """
+        yield self._fetch_events(
+            full_conflicted_set, event_map, absent_event_ids, state_res_store
+        )
+
+        auth_event_ids = set()
+        for event_id in full_conflicted_set:
+            event = event_map.get(event_id)
+            if event is None:
+                continue
+
+            auth_event_ids.update(event.auth_event_ids())
+            for key in event_auth.auth_types_for_event(event):
+                if key in unconflicted_state:
+                    auth_event_ids.add(unconflicted_state[key])
+
+        yield self._fetch_events(
+            auth_event_ids, event_map, absent_event_ids, state_res_store
+        )
+
+        power_level_ids = set(conflicted_state.get(POWER_KEY, ()))
+        if POWER_KEY in unconflicted_state:
+            power_level_ids.add(unconflicted_state[POWER_KEY])
+
+        seen = set()
+        while power_level_ids:
+            seen.update(power_level_ids)
+
+            yield self._fetch_events(
+                power_level_ids, event_map, absent_event_ids, state_res_store
+            )
+            auth_event_ids = set()
+            for event_id in power_level_ids:
+                event = event_map.get(event_id)
+                if event is not None:
+                    auth_event_ids.update(event.auth_event_ids())
+
+            yield self._fetch_events(
+                auth_event_ids, event_map, absent_event_ids, state_res_store
+            )
+            power_level_ids = set()
+            for event_id in auth_event_ids:
+                event = event_map.get(event_id)
+                if (
+                    event is not None
+                    and (event.type, event.state_key) == POWER_KEY
+                    and event_id not in seen
+                ):
+                    power_level_ids.add(event_id)
+
+    @defer.inlineCallbacks
+    def _fetch_events(self, event_ids, event_map, absent_event_ids, state_res_store):
+        """Adds the given events to the event map, noting any that don't exist.
+        """
+        to_fetch = [
+            eid
+            for eid in event_ids
+            if eid not in event_map and eid not in absent_event_ids
+        ]
+        if not to_fetch:
+            return
+
+        events = yield state_res_store.get_events(to_fetch, allow_rejected=True)
+        event_map.update(events)
+        absent_event_ids.update(eid for eid in to_fetch if eid not in events)
@@ -26,6 +26,7 @@ from synapse.storage.util.id_generators import (
     ChainedIdGenerator,
     IdGenerator,
     StreamIdGenerator,
+    build_stream_id_generator,
 )
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 
@@ -127,24 +128,43 @@ class DataStore(
                 % (hs.hostname,)
             )
 
-        self._stream_id_gen = StreamIdGenerator(
+        # If events are persisted by other processes then stream orderings are
+        # allocated from sequences in the database.
+        self._stream_id_gen = build_stream_id_generator(
             db_conn,
+            database,
+            "events",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.events,
             "events",
             "stream_ordering",
+            "events_stream_seq",
             extra_tables=[("local_invites", "stream_id")],
         )
-        self._backfill_id_gen = StreamIdGenerator(
+        self._backfill_id_gen = build_stream_id_generator(
             db_conn,
+            database,
+            "backfill",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.events,
             "events",
             "stream_ordering",
+            "events_backfill_stream_seq",
             step=-1,
             extra_tables=[("ex_outlier_stream", "event_stream_ordering")],
         )
         self._presence_id_gen = StreamIdGenerator(
             db_conn, "presence_stream", "stream_id"
         )
-        self._device_inbox_id_gen = StreamIdGenerator(
-            db_conn, "device_max_stream_id", "stream_id"
+        self._device_inbox_id_gen = build_stream_id_generator(
+            db_conn,
+            database,
+            "to_device",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.to_device,
+            "device_max_stream_id",
+            "stream_id",
+            "device_inbox_sequence",
         )
         self._public_room_id_gen = StreamIdGenerator(
             db_conn, "public_room_list_stream", "stream_id"
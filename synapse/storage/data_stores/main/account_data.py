@@ -23,7 +23,7 @@ from twisted.internet import defer
 
 from synapse.storage._base import SQLBaseStore
 from synapse.storage.database import Database
-from synapse.storage.util.id_generators import StreamIdGenerator
+from synapse.storage.util.id_generators import build_stream_id_generator
 from synapse.util.caches.descriptors import cached, cachedInlineCallbacks
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 
@@ -272,8 +272,15 @@ class AccountDataWorkerStore(SQLBaseStore):
 
 class AccountDataStore(AccountDataWorkerStore):
     def __init__(self, database: Database, db_conn, hs):
-        self._account_data_id_gen = StreamIdGenerator(
-            db_conn, "account_data_max_stream_id", "stream_id"
+        self._account_data_id_gen = build_stream_id_generator(
+            db_conn,
+            database,
+            "account_data",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.account_data,
+            "account_data_max_stream_id",
+            "stream_id",
+            "account_data_sequence",
         )
 
         super(AccountDataStore, self).__init__(database, db_conn, hs)
@@ -299,12 +306,14 @@ class AccountDataStore(AccountDataWorkerStore):
         """
         content_json = json.dumps(content)
 
-        with self._account_data_id_gen.get_next() as next_id:
+        def add_account_data_txn(txn):
+            next_id = self._account_data_id_gen.get_next_txn(txn)
+
             # no need to lock here as room_account_data has a unique constraint
             # on (user_id, room_id, account_data_type) so simple_upsert will
             # retry if there is a conflict.
-            yield self.db.simple_upsert(
-                desc="add_room_account_data",
+            self.db.simple_upsert_txn(
+                txn,
                 table="room_account_data",
                 keyvalues={
                     "user_id": user_id,
@@ -315,20 +324,22 @@ class AccountDataStore(AccountDataWorkerStore):
                 lock=False,
             )
 
-            # it's theoretically possible for the above to succeed and the
-            # below to fail - in which case we might reuse a stream id on
-            # restart, and the above update might not get propagated. That
-            # doesn't sound any worse than the whole update getting lost,
-            # which is what would happen if we combined the two into one
-            # transaction.
-            yield self._update_max_stream_id(next_id)
-
-            self._account_data_stream_cache.entity_has_changed(user_id, next_id)
-            self.get_account_data_for_user.invalidate((user_id,))
-            self.get_account_data_for_room.invalidate((user_id, room_id))
-            self.get_account_data_for_room_and_type.prefill(
-                (user_id, room_id, account_data_type), content
+            self._update_max_stream_id_txn(txn, next_id)
+
+            txn.call_after(
+                self._account_data_stream_cache.entity_has_changed, user_id, next_id
+            )
+            txn.call_after(self.get_account_data_for_user.invalidate, (user_id,))
+            txn.call_after(
+                self.get_account_data_for_room.invalidate, (user_id, room_id)
             )
+            txn.call_after(
+                self.get_account_data_for_room_and_type.prefill,
+                (user_id, room_id, account_data_type),
+                content,
+            )
+
+        yield self.db.runInteraction("add_room_account_data", add_account_data_txn)
 
         result = self._account_data_id_gen.get_current_token()
         return result
@@ -345,48 +356,46 @@ class AccountDataStore(AccountDataWorkerStore):
         """
         content_json = json.dumps(content)
 
-        with self._account_data_id_gen.get_next() as next_id:
+        def add_account_data_txn(txn):
+            next_id = self._account_data_id_gen.get_next_txn(txn)
+
             # no need to lock here as account_data has a unique constraint on
             # (user_id, account_data_type) so simple_upsert will retry if
             # there is a conflict.
-            yield self.db.simple_upsert(
-                desc="add_user_account_data",
+            self.db.simple_upsert_txn(
+                txn,
                 table="account_data",
                 keyvalues={"user_id": user_id, "account_data_type": account_data_type},
                 values={"stream_id": next_id, "content": content_json},
                 lock=False,
             )
 
-            # it's theoretically possible for the above to succeed and the
-            # below to fail - in which case we might reuse a stream id on
-            # restart, and the above update might not get propagated. That
-            # doesn't sound any worse than the whole update getting lost,
-            # which is what would happen if we combined the two into one
-            # transaction.
-            yield self._update_max_stream_id(next_id)
-
-            self._account_data_stream_cache.entity_has_changed(user_id, next_id)
-            self.get_account_data_for_user.invalidate((user_id,))
-            self.get_global_account_data_by_type_for_user.invalidate(
-                (account_data_type, user_id)
+            self._update_max_stream_id_txn(txn, next_id)
+
+            txn.call_after(
+                self._account_data_stream_cache.entity_has_changed, user_id, next_id
+            )
+            txn.call_after(self.get_account_data_for_user.invalidate, (user_id,))
+            txn.call_after(
+                self.get_global_account_data_by_type_for_user.invalidate,
+                (account_data_type, user_id),
             )
 
+        yield self.db.runInteraction("add_user_account_data", add_account_data_txn)
+
         result = self._account_data_id_gen.get_current_token()
         return result
 
-    def _update_max_stream_id(self, next_id):
+    def _update_max_stream_id_txn(self, txn, next_id):
         """Update the max stream_id
 
         Args:
+            txn: The database cursor
             next_id(int): The the revision to advance to.
         """
-
-        def _update(txn):
-            update_max_id_sql = (
-                "UPDATE account_data_max_stream_id"
-                " SET stream_id = ?"
-                " WHERE stream_id < ?"
-            )
-            txn.execute(update_max_id_sql, (next_id, next_id))
-
-        return self.db.runInteraction("update_account_data_max_stream_id", _update)
+        update_max_id_sql = (
+            "UPDATE account_data_max_stream_id"
+            " SET stream_id = ?"
+            " WHERE stream_id < ?"
+        )
+        txn.execute(update_max_id_sql, (next_id, next_id))
@@ -41,15 +41,27 @@ class CacheInvalidationStore(SQLBaseStore):
         otherwise know from other replication streams that the cache should
         be invalidated.
         """
-        cache_func = getattr(self, cache_name, None)
-        if not cache_func:
-            return
+        if cache_name == CURRENT_STATE_CACHE_NAME:
+            # This comes from an event persister worker which has updated the
+            # current state of a room.
+            room_id = keys[0]
+            members_changed = set(keys[1:])
+            self._invalidate_state_caches(room_id, members_changed)
+            for member in members_changed:
+                self._attempt_to_invalidate_cache(
+                    "get_rooms_for_user_with_stream_ordering", (member,)
+                )
+        else:
+            cache_func = getattr(self, cache_name, None)
+            if not cache_func:
+                return
+
+            cache_func.invalidate(keys)
 
-        cache_func.invalidate(keys)
-        await self.runInteraction(
+        await self.db.runInteraction(
             "invalidate_cache_and_stream",
             self._send_invalidation_to_replication,
-            cache_func.__name__,
+            cache_name,
             keys,
         )
 
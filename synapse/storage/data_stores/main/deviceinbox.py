@@ -272,7 +272,9 @@ class DeviceInboxStore(DeviceInboxWorkerStore, DeviceInboxBackgroundUpdateStore)
             inserted.
         """
 
-        def add_messages_txn(txn, now_ms, stream_id):
+        def add_messages_txn(txn, now_ms):
+            stream_id = self._device_inbox_id_gen.get_next_txn(txn)
+
             # Add the local messages directly to the local inbox.
             self._add_messages_to_local_device_inbox_txn(
                 txn, stream_id, local_messages_by_user_then_device
@@ -292,25 +294,33 @@ class DeviceInboxStore(DeviceInboxWorkerStore, DeviceInboxBackgroundUpdateStore)
                 rows.append((destination, stream_id, now_ms, edu_json))
             txn.executemany(sql, rows)
 
-        with self._device_inbox_id_gen.get_next() as stream_id:
-            now_ms = self.clock.time_msec()
-            yield self.db.runInteraction(
-                "add_messages_to_device_inbox", add_messages_txn, now_ms, stream_id
-            )
             for user_id in local_messages_by_user_then_device.keys():
-                self._device_inbox_stream_cache.entity_has_changed(user_id, stream_id)
+                txn.call_after(
+                    self._device_inbox_stream_cache.entity_has_changed,
+                    user_id,
+                    stream_id,
+                )
             for destination in remote_messages_by_destination.keys():
-                self._device_federation_outbox_stream_cache.entity_has_changed(
-                    destination, stream_id
+                txn.call_after(
+                    self._device_federation_outbox_stream_cache.entity_has_changed,
+                    destination,
+                    stream_id,
                 )
 
+        now_ms = self.clock.time_msec()
+        yield self.db.runInteraction(
+            "add_messages_to_device_inbox", add_messages_txn, now_ms
+        )
+
         return self._device_inbox_id_gen.get_current_token()
 
     @defer.inlineCallbacks
     def add_messages_from_remote_to_device_inbox(
         self, origin, message_id, local_messages_by_user_then_device
     ):
-        def add_messages_txn(txn, now_ms, stream_id):
+        def add_messages_txn(txn, now_ms):
+            stream_id = self._device_inbox_id_gen.get_next_txn(txn)
+
             # Check if we've already inserted a matching message_id for that
             # origin. This can happen if the origin doesn't receive our
             # acknowledgement from the first time we received the message.
@@ -322,7 +332,7 @@ class DeviceInboxStore(DeviceInboxWorkerStore, DeviceInboxBackgroundUpdateStore)
                 allow_none=True,
             )
             if already_inserted is not None:
-                return
+                return stream_id
 
             # Add an entry for this message_id so that we know we've processed
             # it.
@@ -342,16 +352,19 @@ class DeviceInboxStore(DeviceInboxWorkerStore, DeviceInboxBackgroundUpdateStore)
                 txn, stream_id, local_messages_by_user_then_device
             )
 
-        with self._device_inbox_id_gen.get_next() as stream_id:
-            now_ms = self.clock.time_msec()
-            yield self.db.runInteraction(
-                "add_messages_from_remote_to_device_inbox",
-                add_messages_txn,
-                now_ms,
-                stream_id,
-            )
             for user_id in local_messages_by_user_then_device.keys():
-                self._device_inbox_stream_cache.entity_has_changed(user_id, stream_id)
+                txn.call_after(
+                    self._device_inbox_stream_cache.entity_has_changed,
+                    user_id,
+                    stream_id,
+                )
+
+            return stream_id
+
+        now_ms = self.clock.time_msec()
+        stream_id = yield self.db.runInteraction(
+            "add_messages_from_remote_to_device_inbox", add_messages_txn, now_ms
+        )
 
         return stream_id
 
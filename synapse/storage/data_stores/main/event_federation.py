@@ -14,7 +14,9 @@
 # limitations under the License.
 import itertools
 import logging
+from typing import Dict, List, Tuple
 
+from six import iteritems, itervalues
 from six.moves import range
 from six.moves.queue import Empty, PriorityQueue
 
@@ -26,11 +28,63 @@ from synapse.storage._base import SQLBaseStore, make_in_list_sql_clause
 from synapse.storage.data_stores.main.events_worker import EventsWorkerStore
 from synapse.storage.data_stores.main.signatures import SignatureWorkerStore
 from synapse.storage.database import Database
+from synapse.storage.util.sequence import build_sequence_generator
 from synapse.util.caches.descriptors import cached
+from synapse.util.iterutils import batch_iter
 
 logger = logging.getLogger(__name__)
 
 
+class _LinkMap(object):
+    """A helper type for tracking links between chains in the chain cover
+    index.
+    """
+
+    def __init__(self):
+        # Map from origin chain ID to target chain ID to list of
+        # (origin sequence number, target sequence number).
+        self.maps = {}  # type: Dict[int, Dict[int, List[Tuple[int, int]]]]
+
+        # Links that have been added since the map was loaded, as tuples of
+        # (origin chain, origin seq, target chain, target seq).
+        self.additions = []  # type: List[Tuple[int, int, int, int]]
+
+    def add_link(self, src_tuple, target_tuple, new=True):
+        """Add a new link between two chains.
+
+        Args:
+            src_tuple (tuple[int, int]): The chain ID and sequence number of
+                the origin of the link.
+            target_tuple (tuple[int, int]): The chain ID and sequence number of
+                the target of the link.
+            new (bool): Whether this is a link that still needs persisting.
+        """
+        src_chain, src_seq = src_tuple
+        target_chain, target_seq = target_tuple
+
+        self.maps.setdefault(src_chain, {}).setdefault(target_chain, []).append(
+            (src_seq, target_seq)
+        )
+        if new:
+            self.additions.append((src_chain, src_seq, target_chain, target_seq))
+
+    def get_reachable(self, chain_id, seq_no):
+        """Gets the chain positions reachable via links from the given
+        position. Positions on the same chain are not included.
+
+        Returns:
+            dict[int, int]: Map from target chain ID to the maximum reachable
+            sequence number on that chain.
+        """
+        reachable = {}
+        for target_chain, links in iteritems(self.maps.get(chain_id, {})):
+            for src_seq, target_seq in links:
+                if src_seq <= seq_no and reachable.get(target_chain, 0) < target_seq:
+                    reachable[target_chain] = target_seq
+
+        return reachable
+
+
 class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBaseStore):
     def get_auth_chain(self, event_ids, include_given=False):
         """Get auth events for given event_ids. The events *must* be state events.
@@ -61,6 +115,15 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
         )
 
     def _get_auth_chain_ids_txn(self, txn, event_ids, include_given):
+        results = self._get_auth_chain_ids_using_cover_index_txn(
+            txn, event_ids, include_given
+        )
+        if results is not None:
+            return list(results)
+
+        # Not all of the events are in the chain cover index (e.g. because the
+        # background update hasn't processed the room yet), so we fall back to
+        # walking the auth graph.
         if include_given:
             results = set(event_ids)
         else:
@@ -87,6 +150,222 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
 
         return list(results)
 
+    def _get_auth_chain_ids_using_cover_index_txn(self, txn, event_ids, include_given):
+        """Calculates the auth chain IDs using the chain cover index.
+
+        Returns:
+            set[str]|None: The auth chain, or None if not all of the given
+            events are in the index.
+        """
+        chain_positions = self._get_event_chain_positions_txn(txn, event_ids)
+        if len(chain_positions) != len(set(event_ids)):
+            return None
+
+        link_map = self._get_chain_links_txn(
+            txn, set(chain_id for chain_id, _ in itervalues(chain_positions))
+        )
+
+        # A map from chain ID to the maximum sequence number in the auth chain.
+        # Everything on a chain up to that point is in the auth chain.
+        chain_to_max_seq = {}
+        for chain_id, seq_no in itervalues(chain_positions):
+            reachable = link_map.get_reachable(chain_id, seq_no)
+
+            # Every earlier event on the same chain is in the auth chain.
+            reachable[chain_id] = max(reachable.get(chain_id, 0), seq_no - 1)
+
+            for target_chain_id, target_seq_no in iteritems(reachable):
+                if chain_to_max_seq.get(target_chain_id, 0) < target_seq_no:
+                    chain_to_max_seq[target_chain_id] = target_seq_no
+
+        results = self._get_events_in_chain_ranges_txn(
+            txn,
+            {
+                chain_id: (0, max_seq)
+                for chain_id, max_seq in iteritems(chain_to_max_seq)
+            },
+        )
+
+        if include_given:
+            results.update(event_ids)
+
+        return results
+
+    def get_auth_chain_difference(self, state_sets):
+        """Given sets of state events figure out the auth chain difference (as
+        per state res v2 algorithm).
+
+        This is equivalent to fetching the full auth chain for each set of state
+        and returning the events that don't appear in each and every auth
+        chain.
+
+        Args:
+            state_sets (list[set[str]]): The sets of state event IDs. Each set
+                is included in its own auth chain.
+
+        Returns:
+            Deferred[set[str]]
+        """
+        return self.db.runInteraction(
+            "get_auth_chain_difference",
+            self._get_auth_chain_difference_txn,
+            state_sets,
+        )
+
+    def _get_auth_chain_difference_txn(self, txn, state_sets):
+        result = self._get_auth_chain_difference_using_cover_index_txn(txn, state_sets)
+        if result is not None:
+            return result
+
+        auth_sets = [
+            set(self._get_auth_chain_ids_txn(txn, state_set, include_given=True))
+            for state_set in state_sets
+        ]
+
+        intersection = set(auth_sets[0]).intersection(*auth_sets[1:])
+        union = set().union(*auth_sets)
+
+        return union - intersection
+
+    def _get_auth_chain_difference_using_cover_index_txn(self, txn, state_sets):
+        """Calculates the auth chain difference using the chain cover index.
+
+        Since the auth chain of each state set is everything on each chain up
+        to some maximum sequence number, the difference on a chain is the
+        range between the smallest and largest of those maxima across the
+        state sets.
+
+        Returns:
+            set[str]|None: The auth chain difference, or None if not all of
+            the given events are in the index.
+        """
+        all_event_ids = set().union(*state_sets)
+
+        chain_positions = self._get_event_chain_positions_txn(txn, all_event_ids)
+        if len(chain_positions) != len(all_event_ids):
+            return None
+
+        link_map = self._get_chain_links_txn(
+            txn, set(chain_id for chain_id, _ in itervalues(chain_positions))
+        )
+
+        # For each state set, a map from chain ID to the maximum sequence
+        # number in the set's auth chain.
+        set_to_chain = []
+        for state_set in state_sets:
+            chain_to_max_seq = {}
+            for event_id in state_set:
+                chain_id, seq_no = chain_positions[event_id]
+
+                reachable = link_map.get_reachable(chain_id, seq_no)
+                reachable[chain_id] = max(reachable.get(chain_id, 0), seq_no)
+
+                for target_chain_id, target_seq_no in iteritems(reachable):
+                    if chain_to_max_seq.get(target_chain_id, 0) < target_seq_no:
+                        chain_to_max_seq[target_chain_id] = target_seq_no
+
+            set_to_chain.append(chain_to_max_seq)
+
+        chain_ranges = {}
+        for chain_id in set().union(*set_to_chain):
+            seq_nos = [
+                chain_to_max_seq.get(chain_id, 0) for chain_to_max_seq in set_to_chain
+            ]
+
+            min_seq_no = min(seq_nos)
+            max_seq_no = max(seq_nos)
+            if min_seq_no < max_seq_no:
+                chain_ranges[chain_id] = (min_seq_no, max_seq_no)
+
+        return self._get_events_in_chain_ranges_txn(txn, chain_ranges)
+
+    def _get_event_chain_positions_txn(self, txn, event_ids):
+        """Fetches the chain cover index position of the given events.
+
+        Returns:
+            dict[str, tuple[int, int]]: Map from event ID to chain ID and
+            sequence number, for those events that are in the index.
+        """
+        results = {}
+        for batch in batch_iter(event_ids, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "event_id", batch
+            )
+            txn.execute(
+                "SELECT event_id, chain_id, sequence_number FROM event_auth_chains"
+                " WHERE " + clause,
+                args,
+            )
+            results.update(
+                (event_id, (chain_id, seq_no)) for event_id, chain_id, seq_no in txn
+            )
+
+        return results
+
+    def _get_chain_links_txn(self, txn, chain_ids, link_map=None):
+        """Loads the links with an origin on any of the given chains.
+
+        Args:
+            txn
+            chain_ids (Iterable[int])
+            link_map (_LinkMap|None): A map to add the links to. If None, a
+                new map is created.
+
+        Returns:
+            _LinkMap
+        """
+        if link_map is None:
+            link_map = _LinkMap()
+
+        sql = """
+            SELECT
+                origin_chain_id, origin_sequence_number,
+                target_chain_id, target_sequence_number
+            FROM event_auth_chain_links
+            WHERE
+        """
+        for batch in batch_iter(chain_ids, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "origin_chain_id", batch
+            )
+            txn.execute(sql + clause, args)
+
+            for origin_id, origin_seq, target_id, target_seq in txn:
+                link_map.add_link(
+                    (origin_id, origin_seq), (target_id, target_seq), new=False
+                )
+
+        return link_map
+
+    def _get_events_in_chain_ranges_txn(self, txn, chain_ranges):
+        """Fetches the events in the given ranges of chains.
+
+        Args:
+            txn
+            chain_ranges (dict[int, tuple[int, int]]): Map from chain ID to the
+                range of sequence numbers to fetch. The lower bound is
+                exclusive and the upper bound inclusive.
+
+        Returns:
+            set[str]
+        """
+        results = set()
+        for batch in batch_iter(iteritems(chain_ranges), 100):
+            clause = " OR ".join(
+                "(chain_id = ? AND ? < sequence_number AND sequence_number <= ?)"
+                for _ in batch
+            )
+            args = [
+                arg
+                for chain_id, (min_seq_no, max_seq_no) in batch
+                for arg in (chain_id, min_seq_no, max_seq_no)
+            ]
+
+            txn.execute("SELECT event_id FROM event_auth_chains WHERE " + clause, args)
+            results.update(event_id for event_id, in txn)
+
+        return results
+
     def get_oldest_events_in_room(self, room_id):
         return self.db.runInteraction(
             "get_oldest_events_in_room", self._get_oldest_events_in_room_txn, room_id
@@ -455,14 +734,29 @@ class EventFederationStore(EventFederationWorkerStore):
     """
 
     EVENT_AUTH_STATE_ONLY = "event_auth_state_only"
+    EVENT_AUTH_CHAIN_INDEX = "event_auth_chain_index"
 
     def __init__(self, database: Database, db_conn, hs):
         super(EventFederationStore, self).__init__(database, db_conn, hs)
 
+        def get_max_chain_id_txn(txn):
+            txn.execute("SELECT COALESCE(MAX(chain_id), 0) FROM event_auth_chains")
+            return txn.fetchone()[0]
+
+        # Chain IDs come from a sequence, as events may be persisted by more
+        # than one process.
+        self._event_auth_chain_id_gen = build_sequence_generator(
+            self.database_engine, get_max_chain_id_txn, "event_auth_chain_id"
+        )
+
         self.db.updates.register_background_update_handler(
             self.EVENT_AUTH_STATE_ONLY, self._background_delete_non_state_event_auth
         )
 
+        self.db.updates.register_background_update_handler(
+            self.EVENT_AUTH_CHAIN_INDEX, self._background_index_auth_chains
+        )
+
         hs.get_clock().looping_call(
             self._delete_old_forward_extrem_cache, 60 * 60 * 1000
         )
@@ -502,6 +796,289 @@ class EventFederationStore(EventFederationWorkerStore):
 
         self._update_backward_extremeties(txn, events)
 
+    def _persist_event_auth_chain_txn(self, txn, events):
+        """Adds the given state events to the chain cover index.
+
+        Events in rooms that have not yet been processed by the
+        `event_auth_chain_index` background update are only added if their
+        auth events are already in the index.
+
+        Args:
+            txn
+            events (list[FrozenEvent]): The events being persisted. Non-state
+                events are ignored.
+        """
+        state_events = [event for event in events if event.is_state()]
+        if not state_events:
+            return
+
+        rows = self.db.simple_select_many_txn(
+            txn,
+            table="rooms",
+            column="room_id",
+            iterable=set(event.room_id for event in state_events),
+            keyvalues={},
+            retcols=("room_id", "has_auth_chain_index"),
+        )
+        indexed_rooms = set(
+            row["room_id"] for row in rows if row["has_auth_chain_index"]
+        )
+
+        self._add_chain_cover_index_txn(
+            txn,
+            indexed_rooms,
+            {event.event_id: (event.type, event.state_key) for event in state_events},
+            {event.event_id: event.auth_event_ids() for event in state_events},
+        )
+
+    def _add_chain_cover_index_txn(
+        self, txn, indexed_rooms, event_to_types, event_to_auth_ids
+    ):
+        """Calculates and persists the chain cover index positions and links
+        for the given events.
+
+        Auth events that have been persisted but aren't in the index yet are
+        added to the index too if they are in one of `indexed_rooms`;
+        otherwise, events that depend on them are skipped. Auth events that we
+        don't have are ignored.
+
+        Args:
+            txn
+            indexed_rooms (set[str]): Rooms for which we should pull in any
+                auth events that are missing from the index.
+            event_to_types (dict[str, tuple[str, str|None]]): Map from event
+                ID to type and state key. The state key may be None if not
+                known, e.g. for rejected events.
+            event_to_auth_ids (dict[str, Iterable[str]]): Map from event ID to
+                its auth event IDs.
+
+        Returns:
+            int: The number of events added to the index.
+        """
+        event_to_types = dict(event_to_types)
+        event_to_auth_ids = {
+            event_id: set(auth_ids)
+            for event_id, auth_ids in iteritems(event_to_auth_ids)
+        }
+
+        # Map from event ID to chain ID and sequence number, for auth events
+        # already in the index.
+        chain_map = {}  # type: Dict[str, Tuple[int, int]]
+
+        # Auth events that we have persisted but which aren't in the index and
+        # which we're not going to add now.
+        unindexable = set()
+
+        # Step 1: fetch the index positions of the auth events, pulling in
+        # any that are missing.
+        seen = set(event_to_auth_ids)
+        to_fetch = set(itertools.chain.from_iterable(itervalues(event_to_auth_ids)))
+        to_fetch -= seen
+        while to_fetch:
+            seen.update(to_fetch)
+
+            for batch in batch_iter(to_fetch, 100):
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "c.event_id", batch
+                )
+                txn.execute(
+                    """
+                    SELECT c.event_id, chain_id, sequence_number, type, state_key
+                    FROM event_auth_chains AS c
+                    LEFT JOIN state_events AS s USING (event_id)
+                    WHERE
+                    """
+                    + clause,
+                    args,
+                )
+                for event_id, chain_id, seq_no, etype, state_key in txn:
+                    chain_map[event_id] = (chain_id, seq_no)
+                    event_to_types[event_id] = (etype, state_key)
+
+            missing = to_fetch.difference(chain_map)
+            to_fetch = set()
+
+            for batch in batch_iter(missing, 100):
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "e.event_id", batch
+                )
+                txn.execute(
+                    """
+                    SELECT e.event_id, e.room_id, e.type, s.state_key
+                    FROM events AS e
+                    LEFT JOIN state_events AS s USING (event_id)
+                    WHERE
+                    """
+                    + clause,
+                    args,
+                )
+                to_add = []
+                for event_id, room_id, etype, state_key in txn.fetchall():
+                    if room_id not in indexed_rooms:
+                        unindexable.add(event_id)
+                        continue
+
+                    event_to_types[event_id] = (etype, state_key)
+                    event_to_auth_ids[event_id] = set()
+                    to_add.append(event_id)
+
+                for event_id, auth_id in self._get_event_auth_rows_txn(txn, to_add):
+                    event_to_auth_ids[event_id].add(auth_id)
+                    if auth_id not in seen:
+                        to_fetch.add(auth_id)
+
+        # Step 2: sort the events so that auth events come before the events
+        # that reference them, dropping any events that depend (transitively)
+        # on an event we can't index. Events involved in cycles are dropped
+        # too, as they never become ready.
+        pending = {
+            event_id: auth_ids.intersection(event_to_auth_ids)
+            for event_id, auth_ids in iteritems(event_to_auth_ids)
+        }
+        dependents = {}  # type: Dict[str, List[str]]
+        for event_id, auth_ids in iteritems(pending):
+            for auth_id in auth_ids:
+                dependents.setdefault(auth_id, []).append(event_id)
+
+        ready = sorted(
+            event_id for event_id, auth_ids in iteritems(pending) if not auth_ids
+        )
+        sorted_event_ids = []
+        while ready:
+            event_id = ready.pop()
+            if unindexable.isdisjoint(event_to_auth_ids[event_id]):
+                sorted_event_ids.append(event_id)
+            else:
+                unindexable.add(event_id)
+
+            for dependent_id in dependents.get(event_id, ()):
+                pending[dependent_id].discard(event_id)
+                if not pending[dependent_id]:
+                    ready.append(dependent_id)
+
+        if not sorted_event_ids:
+            return 0
+
+        # Step 3: fetch the current tip of each chain we might extend, and the
+        # links from the chains of the auth events.
+        existing_chain_ids = set(chain_id for chain_id, _ in itervalues(chain_map))
+
+        chain_tips = {}  # type: Dict[int, int]
+        for batch in batch_iter(existing_chain_ids, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "chain_id", batch
+            )
+            txn.execute(
+                "SELECT chain_id, MAX(sequence_number) FROM event_auth_chains"
+                " WHERE %s GROUP BY chain_id" % (clause,),
+                args,
+            )
+            chain_tips.update(txn)
+
+        link_map = self._get_chain_links_txn(txn, existing_chain_ids)
+
+        # Step 4: assign each event a position. An event extends the chain of
+        # its auth event with the same type and state key if that auth event
+        # is the tip of its chain; otherwise it starts a new chain.
+        new_positions = []
+        for event_id in sorted_event_ids:
+            auth_ids = [a for a in event_to_auth_ids[event_id] if a in chain_map]
+            event_type = event_to_types[event_id]
+
+            position = None
+            if event_type[1] is not None:
+                for auth_id in auth_ids:
+                    if event_to_types.get(auth_id) != event_type:
+                        continue
+
+                    auth_chain_id, auth_seq_no = chain_map[auth_id]
+                    if chain_tips[auth_chain_id] == auth_seq_no:
+                        position = (auth_chain_id, auth_seq_no + 1)
+                        break
+
+            if position is None:
+                position = (self._event_auth_chain_id_gen.get_next_id_txn(txn), 1)
+
+            chain_id, seq_no = position
+            chain_map[event_id] = position
+            chain_tips[chain_id] = seq_no
+            new_positions.append((event_id, chain_id, seq_no))
+
+            # Now work out which links we need to add. Everything reachable
+            # from the auth events is reachable from this event, apart from
+            # things that are already reachable from the previous event on the
+            # same chain.
+            reachable = {}  # type: Dict[int, int]
+            for auth_id in auth_ids:
+                auth_chain_id, auth_seq_no = chain_map[auth_id]
+
+                auth_reachable = link_map.get_reachable(auth_chain_id, auth_seq_no)
+                auth_reachable[auth_chain_id] = max(
+                    auth_reachable.get(auth_chain_id, 0), auth_seq_no
+                )
+
+                for target_chain_id, target_seq_no in iteritems(auth_reachable):
+                    if reachable.get(target_chain_id, 0) < target_seq_no:
+                        reachable[target_chain_id] = target_seq_no
+
+            already_reachable = link_map.get_reachable(chain_id, seq_no - 1)
+            for target_chain_id, target_seq_no in sorted(iteritems(reachable)):
+                if target_chain_id == chain_id:
+                    continue
+                if already_reachable.get(target_chain_id, 0) >= target_seq_no:
+                    continue
+
+                link_map.add_link((chain_id, seq_no), (target_chain_id, target_seq_no))
+
+        # Step 5: persist the new positions and links.
+        self.db.simple_insert_many_txn(
+            txn,
+            table="event_auth_chains",
+            values=[
+                {"event_id": event_id, "chain_id": chain_id, "sequence_number": seq_no}
+                for event_id, chain_id, seq_no in new_positions
+            ],
+        )
+
+        self.db.simple_insert_many_txn(
+            txn,
+            table="event_auth_chain_links",
+            values=[
+                {
+                    "origin_chain_id": origin_chain_id,
+                    "origin_sequence_number": origin_seq_no,
+                    "target_chain_id": target_chain_id,
+                    "target_sequence_number": target_seq_no,
+                }
+                for (
+                    origin_chain_id,
+                    origin_seq_no,
+                    target_chain_id,
+                    target_seq_no,
+                ) in link_map.additions
+            ],
+        )
+
+        return len(new_positions)
+
+    def _get_event_auth_rows_txn(self, txn, event_ids):
+        """Fetches the `event_auth` rows for the given events.
+
+        Returns:
+            list[tuple[str, str]]: List of (event ID, auth event ID)
+        """
+        results = []
+        for batch in batch_iter(event_ids, 100):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "event_id", batch
+            )
+            txn.execute(
+                "SELECT event_id, auth_id FROM event_auth WHERE " + clause, args
+            )
+            results.extend(txn)
+
+        return results
+
     def _update_backward_extremeties(self, txn, events):
         """Updates the event_backward_extremities tables based on the new/updated
         events being persisted.
@@ -585,6 +1162,101 @@ class EventFederationStore(EventFederationWorkerStore):
         txn.execute(query, (room_id,))
         txn.call_after(self.get_latest_event_ids_in_room.invalidate, (room_id,))
 
+    @defer.inlineCallbacks
+    def _background_index_auth_chains(self, progress, batch_size):
+        """Background update handler which adds the state events of existing
+        rooms to the chain cover index, a room at a time.
+        """
+        last_room_id = progress.get("room_id", "")
+
+        def _index_auth_chains_txn(txn):
+            txn.execute(
+                "SELECT room_id FROM rooms WHERE room_id > ?"
+                " ORDER BY room_id ASC LIMIT ?",
+                (last_room_id, batch_size),
+            )
+            room_ids = [room_id for room_id, in txn.fetchall()]
+
+            num_processed = 0
+            for room_id in room_ids:
+                num_processed += 1 + self._index_room_auth_chains_txn(txn, room_id)
+
+                # Big rooms can have hundreds of thousands of state events, so
+                # we stop early once we've done a decent amount of work.
+                if num_processed >= batch_size:
+                    break
+
+            if room_ids:
+                self.db.updates._background_update_progress_txn(
+                    txn, self.EVENT_AUTH_CHAIN_INDEX, {"room_id": room_id}
+                )
+
+            return num_processed
+
+        count = yield self.db.runInteraction(
+            self.EVENT_AUTH_CHAIN_INDEX, _index_auth_chains_txn
+        )
+
+        if not count:
+            yield self.db.updates._end_background_update(self.EVENT_AUTH_CHAIN_INDEX)
+
+        return count
+
+    def _index_room_auth_chains_txn(self, txn, room_id):
+        """Adds all state events in the room to the chain cover index, and
+        marks the room as indexed.
+
+        Returns:
+            int: The number of events added to the index.
+        """
+        # Mark the room as indexed first, so that any events persisted
+        # concurrently will pull in missing auth events themselves.
+        self.db.simple_update_txn(
+            txn,
+            table="rooms",
+            keyvalues={"room_id": room_id},
+            updatevalues={"has_auth_chain_index": True},
+        )
+
+        # We need both the accepted state events and any rejected ones, as
+        # rejected events can still appear in auth chains.
+        txn.execute(
+            """
+            SELECT s.event_id, s.type, s.state_key FROM state_events AS s
+            LEFT JOIN event_auth_chains AS c USING (event_id)
+            WHERE s.room_id = ? AND c.event_id IS NULL
+            """,
+            (room_id,),
+        )
+        event_to_types = {
+            event_id: (etype, state_key) for event_id, etype, state_key in txn
+        }
+
+        txn.execute(
+            """
+            SELECT e.event_id, e.type FROM events AS e
+            INNER JOIN rejections USING (event_id)
+            LEFT JOIN event_auth_chains AS c USING (event_id)
+            WHERE e.room_id = ? AND c.event_id IS NULL AND EXISTS (
+                SELECT 1 FROM event_auth AS a WHERE a.event_id = e.event_id
+            )
+            """,
+            (room_id,),
+        )
+        for event_id, etype in txn:
+            event_to_types.setdefault(event_id, (etype, None))
+
+        if not event_to_types:
+            return 0
+
+        event_to_auth_ids = {event_id: [] for event_id in event_to_types}
+        for event_id, auth_id in self._get_event_auth_rows_txn(txn, event_to_types):
+            event_to_auth_ids[event_id].append(auth_id)
+
+        return self._add_chain_cover_index_txn(
+            txn, {room_id}, event_to_types, event_to_auth_ids
+        )
+
     @defer.inlineCallbacks
     def _background_delete_non_state_event_auth(self, progress, batch_size):
         def delete_event_auth(txn):
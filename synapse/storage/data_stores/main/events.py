@@ -178,10 +178,12 @@ class EventsStore(
 
         # We want to calculate the stream orderings as late as possible, as
         # we only notify after all events with a lesser stream ordering have
-        # been persisted. I.e. if we spend 10s inside the with block then
-        # that will delay all subsequent events from being notified about.
-        # Hence why we do it down here rather than wrapping the entire
-        # function.
+        # been persisted. I.e. if we spend 10s waiting for the transaction
+        # then that will delay all subsequent events from being notified about.
+        # Hence why we allocate them inside the transaction itself rather than
+        # wrapping the entire function. (Allocating them in the transaction
+        # also means they can come from a database sequence shared with other
+        # event persisters.)
         #
         # Its safe to do this after calculating the state deltas etc as we
         # only need to protect the *persistence* of the events. This is to
@@ -193,56 +195,56 @@ class EventsStore(
         # Note: Multiple instances of this function cannot be in flight at
         # the same time for the same room.
         if backfilled:
-            stream_ordering_manager = self._backfill_id_gen.get_next_mult(
-                len(events_and_contexts)
-            )
+            stream_id_gen = self._backfill_id_gen
         else:
-            stream_ordering_manager = self._stream_id_gen.get_next_mult(
-                len(events_and_contexts)
-            )
+            stream_id_gen = self._stream_id_gen
 
-        with stream_ordering_manager as stream_orderings:
+        def persist_events_txn(txn):
+            stream_orderings = stream_id_gen.get_next_mult_txn(
+                txn, len(events_and_contexts)
+            )
             for (event, context), stream in zip(events_and_contexts, stream_orderings):
                 event.internal_metadata.stream_ordering = stream
 
-            yield self.db.runInteraction(
-                "persist_events",
-                self._persist_events_txn,
+            self._persist_events_txn(
+                txn,
                 events_and_contexts=events_and_contexts,
                 backfilled=backfilled,
                 delete_existing=delete_existing,
                 state_delta_for_room=state_delta_for_room,
                 new_forward_extremeties=new_forward_extremeties,
             )
-            persist_event_counter.inc(len(events_and_contexts))
 
-            if not backfilled:
-                # backfilled events have negative stream orderings, so we don't
-                # want to set the event_persisted_position to that.
-                synapse.metrics.event_persisted_position.set(
-                    events_and_contexts[-1][0].internal_metadata.stream_ordering
-                )
+        yield self.db.runInteraction("persist_events", persist_events_txn)
+        persist_event_counter.inc(len(events_and_contexts))
 
-            for event, context in events_and_contexts:
-                if context.app_service:
-                    origin_type = "local"
-                    origin_entity = context.app_service.id
-                elif self.hs.is_mine_id(event.sender):
-                    origin_type = "local"
-                    origin_entity = "*client*"
-                else:
-                    origin_type = "remote"
-                    origin_entity = get_domain_from_id(event.sender)
+        if not backfilled:
+            # backfilled events have negative stream orderings, so we don't
+            # want to set the event_persisted_position to that.
+            synapse.metrics.event_persisted_position.set(
+                events_and_contexts[-1][0].internal_metadata.stream_ordering
+            )
 
-                event_counter.labels(event.type, origin_type, origin_entity).inc()
+        for event, context in events_and_contexts:
+            if context.app_service:
+                origin_type = "local"
+                origin_entity = context.app_service.id
+            elif self.hs.is_mine_id(event.sender):
+                origin_type = "local"
+                origin_entity = "*client*"
+            else:
+                origin_type = "remote"
+                origin_entity = get_domain_from_id(event.sender)
 
-            for room_id, new_state in iteritems(current_state_for_room):
-                self.get_current_state_ids.prefill((room_id,), new_state)
+            event_counter.labels(event.type, origin_type, origin_entity).inc()
 
-            for room_id, latest_event_ids in iteritems(new_forward_extremeties):
-                self.get_latest_event_ids_in_room.prefill(
-                    (room_id,), list(latest_event_ids)
-                )
+        for room_id, new_state in iteritems(current_state_for_room):
+            self.get_current_state_ids.prefill((room_id,), new_state)
+
+        for room_id, latest_event_ids in iteritems(new_forward_extremeties):
+            self.get_latest_event_ids_in_room.prefill(
+                (room_id,), list(latest_event_ids)
+            )
 
     @defer.inlineCallbacks
     def _get_events_which_are_prevs(self, event_ids):
@@ -439,6 +441,12 @@ class EventsStore(
             ],
         )
 
+        # Add the state events to the chain cover index. As with event_auth,
+        # this includes rejected events.
+        self._persist_event_auth_chain_txn(
+            txn, [event for event, _ in events_and_contexts]
+        )
+
         # _store_rejected_events_txn filters out any events which were
         # rejected, and returns the filtered list.
         events_and_contexts = self._store_rejected_events_txn(
@@ -816,6 +824,7 @@ class EventsStore(
         for table in (
             "events",
             "event_auth",
+            "event_auth_chains",
             "event_json",
             "event_edges",
             "event_forward_extremities",
@@ -1263,6 +1272,119 @@ class EventsStore(
         ret = yield self.db.runInteraction("count_daily_active_rooms", _count)
         return ret
 
+    async def persist_events_via_writer(
+        self,
+        events_and_contexts: List[Tuple[EventBase, EventContext]],
+        backfilled: bool,
+        persist_func,
+    ):
+        """Has another process (an event persister) persist the given events,
+        keeping our stream position and caches consistent with what it wrote.
+
+        Only used when event persistence is sharded, which means the stream
+        id generators are `MultiWriterIdGenerator`s.
+
+        Args:
+            events_and_contexts: the events being persisted
+            backfilled: True if the events were backfilled
+            persist_func: called with no arguments to have the writer persist
+                the events. Should return an awaitable which resolves to a
+                dict mapping event ID to the stream ordering it was given.
+        """
+        if backfilled:
+            stream_id_gen = self._backfill_id_gen
+        else:
+            stream_id_gen = self._stream_id_gen
+
+        # We mustn't advance our view of the stream position past any of the
+        # events until we've heard back about them.
+        with stream_id_gen.get_next_from_writer() as stream_orderings:
+            orderings_by_event_id = await persist_func()
+
+            # The writer won't have persisted any events that it had already
+            # seen.
+            persisted = []
+            for event, context in events_and_contexts:
+                if event.event_id in orderings_by_event_id:
+                    event.internal_metadata.stream_ordering = orderings_by_event_id[
+                        event.event_id
+                    ]
+                    persisted.append((event, context))
+
+            self._invalidate_caches_for_events_persisted_elsewhere(
+                persisted, backfilled
+            )
+
+            stream_orderings.extend(orderings_by_event_id.values())
+
+    def _invalidate_caches_for_events_persisted_elsewhere(
+        self,
+        events_and_contexts: List[Tuple[EventBase, EventContext]],
+        backfilled: bool,
+    ):
+        """Invalidates the caches that we would have invalidated had we
+        persisted the events ourselves.
+
+        The writer also sends the current state invalidations over
+        replication, but we can't rely on them arriving before we notify about
+        the new events.
+        """
+        events_by_room = {}  # type: Dict[str, List[EventBase]]
+        for event, _ in events_and_contexts:
+            events_by_room.setdefault(event.room_id, []).append(event)
+
+            stream_ordering = event.internal_metadata.stream_ordering
+
+            self._invalidate_get_event_cache(event.event_id)
+            self._get_state_group_for_event.invalidate((event.event_id,))
+            self.get_latest_event_ids_in_room.invalidate((event.room_id,))
+            self.get_unread_event_push_actions_by_room_for_user.invalidate_many(
+                (event.room_id,)
+            )
+
+            if not backfilled:
+                self._events_stream_cache.entity_has_changed(
+                    event.room_id, stream_ordering
+                )
+
+            if event.type == EventTypes.Redaction:
+                self._invalidate_get_event_cache(event.redacts)
+
+            if event.type == EventTypes.Member:
+                self._membership_stream_cache.entity_has_changed(
+                    event.state_key, stream_ordering
+                )
+                self.get_invited_rooms_for_local_user.invalidate((event.state_key,))
+
+            relation = event.content.get("m.relates_to")
+            if isinstance(relation, dict) and "event_id" in relation:
+                relates_to = relation["event_id"]
+                self.get_relations_for_event.invalidate_many((relates_to,))
+                self.get_aggregation_groups_for_event.invalidate_many((relates_to,))
+                self.get_applicable_edit.invalidate((relates_to,))
+
+        if backfilled:
+            return
+
+        # The current state of a room can only have changed if we added a
+        # state event or merged forks of the room.
+        for room_id, events in iteritems(events_by_room):
+            if not any(
+                event.is_state() or len(event.prev_event_ids()) > 1 for event in events
+            ):
+                continue
+
+            members_changed = {
+                event.state_key for event in events if event.type == EventTypes.Member
+            }
+            self._invalidate_state_caches(room_id, members_changed)
+            for member in members_changed:
+                self.get_rooms_for_user_with_stream_ordering.invalidate((member,))
+
+            self._curr_state_delta_stream_cache.entity_has_changed(
+                room_id, events[-1].internal_metadata.stream_ordering
+            )
+
     def get_current_backfill_token(self):
         """The current minimum token that backfilled events have reached"""
         return -self._backfill_id_gen.get_current_token()
@@ -1734,9 +1856,24 @@ class EventsStore(
 
         state_groups = [row[0] for row in txn]
 
+        # The chain cover index links are keyed by chain, so we need to delete
+        # them before we delete the chains of the room's events.
+        logger.info("[purge] removing %s from event_auth_chain_links", room_id)
+        txn.execute(
+            """
+            DELETE FROM event_auth_chain_links WHERE origin_chain_id IN (
+              SELECT chain_id FROM event_auth_chains
+              INNER JOIN events USING (event_id)
+              WHERE room_id = ?
+            )
+            """,
+            (room_id,),
+        )
+
         # Now we delete tables which lack an index on room_id but have one on event_id
         for table in (
             "event_auth",
+            "event_auth_chains",
             "event_edges",
             "event_push_actions_staging",
             "event_reference_hashes",
@@ -1761,6 +1898,7 @@ class EventsStore(
         # and finally, the tables with an index on room_id (or no useful index)
         for table in (
             "current_state_events",
+            "destination_rooms",
             "event_backward_extremities",
             "event_forward_extremities",
             "event_json",
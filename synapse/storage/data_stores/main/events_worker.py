@@ -597,6 +597,10 @@ class EventsWorkerStore(SQLBaseStore):
                 original_ev, redactions, event_map
             )
 
+            # The event may sit in the cache for a long time, so keep it
+            # compact.
+            original_ev.compact()
+
             cache_entry = _EventCacheEntry(
                 event=original_ev, redacted_event=redacted_event
             )
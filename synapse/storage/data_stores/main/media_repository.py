@@ -12,6 +12,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from twisted.internet import defer
+
 from synapse.storage._base import SQLBaseStore
 from synapse.storage.database import Database
 
@@ -146,6 +148,69 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
             desc="store_url_cache",
         )
 
+    @defer.inlineCallbacks
+    def try_acquire_url_preview_lock(
+        self, url, instance_name, lock_token, now_ms, expires_ts
+    ):
+        """Try to take the lock on previewing a URL, so that other processes
+        wait for our preview rather than generating their own.
+
+        Args:
+            url (str)
+            instance_name (str): the name of this process
+            lock_token (str): a random token identifying this attempt
+            now_ms (int): the current time, used to ignore expired locks
+            expires_ts (int): when the lock should expire if it isn't released
+
+        Returns:
+            Deferred[bool]: whether we got the lock
+        """
+
+        def delete_expired_url_preview_lock_txn(txn):
+            txn.execute(
+                "DELETE FROM url_preview_locks WHERE url = ? AND expires_ts <= ?",
+                (url, now_ms),
+            )
+
+        yield self.db.runInteraction(
+            "delete_expired_url_preview_lock", delete_expired_url_preview_lock_txn
+        )
+
+        acquired = yield self.db.simple_insert(
+            "url_preview_locks",
+            {
+                "url": url,
+                "instance_name": instance_name,
+                "lock_token": lock_token,
+                "expires_ts": expires_ts,
+            },
+            or_ignore=True,
+            desc="try_acquire_url_preview_lock",
+        )
+        return acquired
+
+    def release_url_preview_lock(self, url, lock_token):
+        """Release a lock taken with `try_acquire_url_preview_lock`"""
+        return self.db.simple_delete(
+            "url_preview_locks",
+            keyvalues={"url": url, "lock_token": lock_token},
+            desc="release_url_preview_lock",
+        )
+
+    def get_url_preview_lock_expiry(self, url):
+        """Get when the lock on previewing a URL expires.
+
+        Returns:
+            Deferred[int|None]: the expiry time, or None if no-one has the lock
+        """
+        return self.db.simple_select_one_onecol(
+            "url_preview_locks",
+            keyvalues={"url": url},
+            retcol="expires_ts",
+            allow_none=True,
+            desc="get_url_preview_lock_expiry",
+        )
+
     def get_local_media_thumbnails(self, media_id):
         return self.db.simple_select_list(
             "local_media_repository_thumbnails",
@@ -253,6 +318,30 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
 
             txn.executemany(sql, ((time_ms, media_id) for media_id in local_media))
 
+            # Also update the files of the media in the local media cache.
+            sql = (
+                "UPDATE local_media_cache SET last_access_ts = ?"
+                " WHERE media_origin = ? AND filesystem_id IN ("
+                "   SELECT filesystem_id FROM remote_media_cache"
+                "   WHERE media_origin = ? AND media_id = ?"
+                " )"
+            )
+
+            txn.executemany(
+                sql,
+                (
+                    (time_ms, media_origin, media_origin, media_id)
+                    for media_origin, media_id in remote_media
+                ),
+            )
+
+            sql = (
+                "UPDATE local_media_cache SET last_access_ts = ?"
+                " WHERE media_origin IS NULL AND filesystem_id = ?"
+            )
+
+            txn.executemany(sql, ((time_ms, media_id) for media_id in local_media))
+
         return self.db.runInteraction(
             "update_cached_last_access_time", update_cache_txn
         )
@@ -298,6 +387,119 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
             desc="store_remote_media_thumbnail",
         )
 
+    def get_media_by_content_hash(self, content_hash):
+        """Get the media we've stored with the given content hash.
+
+        Args:
+            content_hash (str)
+
+        Returns:
+            Deferred[list[dict]]: the media_origin (None for local media),
+            media_id, filesystem_id and media_type of each piece of media.
+        """
+        return self.db.simple_select_list(
+            "media_content_hashes",
+            {"content_hash": content_hash},
+            ("media_origin", "media_id", "filesystem_id", "media_type"),
+            desc="get_media_by_content_hash",
+        )
+
+    def store_media_content_hash(
+        self, content_hash, media_origin, media_id, filesystem_id, media_type
+    ):
+        return self.db.simple_insert(
+            "media_content_hashes",
+            {
+                "content_hash": content_hash,
+                "media_origin": media_origin,
+                "media_id": media_id,
+                "filesystem_id": filesystem_id,
+                "media_type": media_type,
+            },
+            desc="store_media_content_hash",
+        )
+
+    def record_local_media_cache_file(
+        self, path, media_origin, filesystem_id, length, time_ms
+    ):
+        """Record that a file has been stored in the local media cache.
+
+        Args:
+            path (str): the path of the file, relative to the media store
+            media_origin (str|None): the origin of the media the file is for,
+                or None for local media
+            filesystem_id (str): the filesystem ID of the media the file is for
+            length (int): the size of the file in bytes
+            time_ms (int): the current time in milliseconds
+        """
+        return self.db.simple_upsert(
+            "local_media_cache",
+            keyvalues={"path": path},
+            values={
+                "media_origin": media_origin,
+                "filesystem_id": filesystem_id,
+                "length": length,
+                "last_access_ts": time_ms,
+            },
+            desc="record_local_media_cache_file",
+        )
+
+    def get_local_media_cache_size(self):
+        """Get the total size of the files in the local media cache.
+
+        Returns:
+            Deferred[int]: the size in bytes
+        """
+
+        def get_local_media_cache_size_txn(txn):
+            txn.execute("SELECT COALESCE(SUM(length), 0) FROM local_media_cache")
+            return txn.fetchone()[0]
+
+        return self.db.runInteraction(
+            "get_local_media_cache_size", get_local_media_cache_size_txn
+        )
+
+    def get_least_recently_used_local_media_cache(self, after, limit):
+        """Get the files in the local media cache, least recently used first.
+
+        Args:
+            after (tuple[int, str]|None): the last_access_ts and path of the
+                last file returned by the previous call, to continue from.
+            limit (int): the maximum number of files to return
+
+        Returns:
+            Deferred[list[dict]]: the path, media_origin, filesystem_id,
+            length and last_access_ts of each file.
+        """
+
+        def get_least_recently_used_local_media_cache_txn(txn):
+            sql = (
+                "SELECT path, media_origin, filesystem_id, length, last_access_ts"
+                " FROM local_media_cache"
+            )
+            args = []
+            if after is not None:
+                sql += " WHERE last_access_ts > ? OR (last_access_ts = ? AND path > ?)"
+                args.extend((after[0], after[0], after[1]))
+            sql += " ORDER BY last_access_ts, path LIMIT ?"
+            args.append(limit)
+
+            txn.execute(sql, args)
+            return self.db.cursor_to_dict(txn)
+
+        return self.db.runInteraction(
+            "get_least_recently_used_local_media_cache",
+            get_least_recently_used_local_media_cache_txn,
+        )
+
+    def delete_local_media_cache_file(self, path):
+        """Record that a file has been evicted from the local media cache."""
+        return self.db.simple_delete(
+            "local_media_cache",
+            keyvalues={"path": path},
+            desc="delete_local_media_cache_file",
+        )
+
     def get_remote_media_before(self, before_ts):
         sql = (
             "SELECT media_origin, media_id, filesystem_id"
@@ -311,6 +513,14 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
 
     def delete_remote_media(self, media_origin, media_id):
         def delete_remote_media_txn(txn):
+            txn.execute(
+                "DELETE FROM local_media_cache"
+                " WHERE media_origin = ? AND filesystem_id IN ("
+                "   SELECT filesystem_id FROM remote_media_cache"
+                "   WHERE media_origin = ? AND media_id = ?"
+                " )",
+                (media_origin, media_origin, media_id),
+            )
             self.db.simple_delete_txn(
                 txn,
                 "remote_media_cache",
@@ -321,6 +531,11 @@ class MediaRepositoryStore(MediaRepositoryBackgroundUpdateStore):
                 "remote_media_cache_thumbnails",
                 keyvalues={"media_origin": media_origin, "media_id": media_id},
             )
+            self.db.simple_delete_txn(
+                txn,
+                "media_content_hashes",
+                keyvalues={"media_origin": media_origin, "media_id": media_id},
+            )
 
         return self.db.runInteraction("delete_remote_media", delete_remote_media_txn)
 
@@ -23,7 +23,7 @@ from twisted.internet import defer
 
 from synapse.storage._base import SQLBaseStore, make_in_list_sql_clause
 from synapse.storage.database import Database
-from synapse.storage.util.id_generators import StreamIdGenerator
+from synapse.storage.util.id_generators import build_stream_id_generator
 from synapse.util.caches.descriptors import cached, cachedInlineCallbacks, cachedList
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 
@@ -319,8 +319,15 @@ class ReceiptsStore(ReceiptsWorkerStore):
     def __init__(self, database: Database, db_conn, hs):
         # We instantiate this first as the ReceiptsWorkerStore constructor
         # needs to be able to call get_max_receipt_stream_id
-        self._receipts_id_gen = StreamIdGenerator(
-            db_conn, "receipts_linearized", "stream_id"
+        self._receipts_id_gen = build_stream_id_generator(
+            db_conn,
+            database,
+            "receipts",
+            hs.config.worker.instance_name,
+            hs.config.worker.writers.receipts,
+            "receipts_linearized",
+            "stream_id",
+            "receipts_sequence",
         )
 
         super(ReceiptsStore, self).__init__(database, db_conn, hs)
@@ -460,11 +467,11 @@ class ReceiptsStore(ReceiptsWorkerStore):
                 "insert_receipt_conv", graph_to_linear
             )
 
-        stream_id_manager = self._receipts_id_gen.get_next()
-        with stream_id_manager as stream_id:
-            event_ts = yield self.db.runInteraction(
-                "insert_linearized_receipt",
-                self.insert_linearized_receipt_txn,
+        def insert_receipt_txn(txn):
+            stream_id = self._receipts_id_gen.get_next_txn(txn)
+
+            event_ts = self.insert_linearized_receipt_txn(
+                txn,
                 room_id,
                 receipt_type,
                 user_id,
@@ -472,6 +479,11 @@ class ReceiptsStore(ReceiptsWorkerStore):
                 data,
                 stream_id=stream_id,
             )
+            return stream_id, event_ts
+
+        stream_id, event_ts = yield self.db.runInteraction(
+            "insert_linearized_receipt", insert_receipt_txn
+        )
 
         if event_ts is None:
             return None
@@ -590,6 +590,11 @@ class RoomMemberWorkerStore(EventsWorkerStore):
 
         missing_member_event_ids = []
         for event_id in member_event_ids:
+            if event is not None and event_id == event.event_id:
+                # The event hasn't been persisted yet, so asking the database
+                # about it would cache the wrong answer. It's handled below.
+                continue
+
             ev_entry = event_map.get(event_id)
             if ev_entry:
                 if ev_entry.event.membership == Membership.JOIN:
@@ -1158,7 +1163,8 @@ class RoomMemberStore(RoomMemberWorkerStore, RoomMemberBackgroundUpdateStore):
             " AND replaced_by is NULL"
         )
 
-        def f(txn, stream_ordering):
+        def f(txn):
+            stream_ordering = self._stream_id_gen.get_next_txn(txn)
             txn.execute(sql, (stream_ordering, True, room_id, user_id))
 
             # We also clear this entry from `local_current_membership`.
@@ -1170,8 +1176,7 @@ class RoomMemberStore(RoomMemberWorkerStore, RoomMemberBackgroundUpdateStore):
                 keyvalues={"room_id": room_id, "user_id": user_id},
             )
 
-        with self._stream_id_gen.get_next() as stream_ordering:
-            yield self.db.runInteraction("locally_reject_invite", f, stream_ordering)
+        yield self.db.runInteraction("locally_reject_invite", f)
 
     def forget(self, user_id, room_id):
         """Indicate that user_id wishes to discard history for room_id."""
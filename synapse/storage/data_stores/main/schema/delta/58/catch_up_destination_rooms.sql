@@ -0,0 +1,38 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The position in the events stream of the last event which we successfully
+-- sent to each destination. NULL if we haven't sent it anything since this
+-- was added.
+ALTER TABLE destinations ADD COLUMN last_successful_stream_ordering BIGINT;
+
+-- The latest event in each room which should have been sent to each
+-- destination. If a destination has been unreachable, we use this to send it
+-- the latest event in each room it has missed, rather than everything.
+CREATE TABLE IF NOT EXISTS destination_rooms (
+    destination TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    stream_ordering BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX destination_rooms_destination_room_id
+    ON destination_rooms(destination, room_id);
+
+-- So that we can find the events to send to a destination in order.
+CREATE INDEX destination_rooms_destination_stream_ordering
+    ON destination_rooms(destination, stream_ordering);
+
+-- So that we can delete the rows for a room when it is purged.
+CREATE INDEX destination_rooms_room_id ON destination_rooms(room_id);
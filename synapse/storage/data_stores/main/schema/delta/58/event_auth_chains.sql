@@ -0,0 +1,54 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- A chain cover index of the auth graph of each room, which lets us answer
+-- "what is the auth chain of these events" and "what is the auth chain
+-- difference between these state sets" with a fixed number of queries rather
+-- than walking `event_auth` one hop at a time.
+--
+-- Each state event is assigned a position (chain_id, sequence_number) on a
+-- chain. Every event on a chain is in the auth chain of all events later on
+-- the same chain.
+CREATE TABLE IF NOT EXISTS event_auth_chains (
+    event_id TEXT PRIMARY KEY,
+    chain_id BIGINT NOT NULL,
+    sequence_number BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_auth_chains_c_seq_index ON event_auth_chains (chain_id, sequence_number);
+
+-- Links between chains: a row means that the event at the origin position
+-- (and so every later event on the origin chain) has every event on the
+-- target chain up to and including the target position in its auth chain.
+--
+-- The links are stored transitively, so the full auth chain of an event can
+-- be read off the links from its own chain.
+CREATE TABLE IF NOT EXISTS event_auth_chain_links (
+    origin_chain_id BIGINT NOT NULL,
+    origin_sequence_number BIGINT NOT NULL,
+
+    target_chain_id BIGINT NOT NULL,
+    target_sequence_number BIGINT NOT NULL
+);
+
+CREATE INDEX event_auth_chain_links_idx ON event_auth_chain_links (origin_chain_id, target_chain_id);
+
+-- Whether the state events in the room have been added to the index. New
+-- events are only added to the index (and the index only trusted) for rooms
+-- with this set.
+ALTER TABLE rooms ADD COLUMN has_auth_chain_index BOOLEAN;
+
+INSERT INTO background_updates (update_name, progress_json)
+    VALUES ('event_auth_chain_index', '{}');
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Adds the sequences used to allocate stream orderings (and auth chain IDs) for
+new events on postgres, so that several processes can persist events at once.
+
+Backfilled events have negative stream orderings, which are allocated by
+negating the values from `events_backfill_stream_seq`.
+"""
+
+from synapse.storage.engines import PostgresEngine
+
+
+def _create_sequence(cur, name, sql):
+    cur.execute(sql)
+    row = cur.fetchone()
+
+    start_val = 1
+    if row[0] is not None:
+        start_val = max(row[0] + 1, 1)
+
+    cur.execute("CREATE SEQUENCE %s START WITH %d" % (name, start_val))
+
+
+def run_create(cur, database_engine, *args, **kwargs):
+    if not isinstance(database_engine, PostgresEngine):
+        return
+
+    _create_sequence(
+        cur,
+        "events_stream_seq",
+        """
+        SELECT GREATEST(
+            (SELECT MAX(stream_ordering) FROM events),
+            (SELECT MAX(stream_id) FROM local_invites)
+        )
+        """,
+    )
+    _create_sequence(
+        cur,
+        "events_backfill_stream_seq",
+        """
+        SELECT GREATEST(
+            (SELECT -MIN(stream_ordering) FROM events),
+            (SELECT -MIN(event_stream_ordering) FROM ex_outlier_stream)
+        )
+        """,
+    )
+    _create_sequence(
+        cur, "event_auth_chain_id", "SELECT MAX(chain_id) FROM event_auth_chains"
+    )
+
+
+def run_upgrade(*args, **kwargs):
+    pass
@@ -0,0 +1,29 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The files in the local media store, when its size is bounded by
+-- `media_cache_max_size`, so that the least recently used ones can be evicted
+-- once they are in a storage provider.
+CREATE TABLE IF NOT EXISTS local_media_cache (
+    path TEXT NOT NULL,  -- relative to the media store
+    media_origin TEXT,  -- NULL for local media
+    filesystem_id TEXT NOT NULL,
+    length BIGINT NOT NULL,
+    last_access_ts BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX local_media_cache_path ON local_media_cache(path);
+CREATE INDEX local_media_cache_last_access ON local_media_cache(last_access_ts);
+CREATE INDEX local_media_cache_media ON local_media_cache(media_origin, filesystem_id);
@@ -0,0 +1,28 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The hashes of the content of the media we have stored, so that when media
+-- deduplication is enabled new media with the same content can share the
+-- file (and thumbnails) of the existing media.
+CREATE TABLE IF NOT EXISTS media_content_hashes (
+    content_hash TEXT NOT NULL,  -- hex encoded SHA-256 of the content
+    media_origin TEXT,  -- NULL for local media
+    media_id TEXT NOT NULL,
+    filesystem_id TEXT NOT NULL,
+    media_type TEXT NOT NULL
+);
+
+CREATE INDEX media_content_hashes_hash ON media_content_hashes(content_hash);
+CREATE INDEX media_content_hashes_media ON media_content_hashes(media_origin, media_id);
@@ -0,0 +1,26 @@
+/* Copyright 2020 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The URLs which are currently being previewed, so that only one process
+-- fetches and previews each URL at a time. The others wait for the result to
+-- appear in `local_media_repository_url_cache`.
+CREATE TABLE IF NOT EXISTS url_preview_locks (
+    url TEXT NOT NULL,
+    instance_name TEXT NOT NULL,
+    lock_token TEXT NOT NULL,  -- distinguishes each time the lock is taken
+    expires_ts BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX url_preview_locks_url ON url_preview_locks(url);
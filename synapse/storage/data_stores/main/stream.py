@@ -274,6 +274,13 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
 
         self._stream_order_on_start = self.get_room_max_stream_ordering()
 
+        self._instance_name = hs.config.worker.instance_name
+        self._federation_shard_config = hs.config.worker.federation_shard_config
+
+        # Whether we still need to make sure the rows in
+        # `federation_stream_position` match the configured federation senders.
+        self._need_to_reset_federation_stream_positions = hs.should_send_federation()
+
     @abc.abstractmethod
     def get_room_max_stream_ordering(self):
         raise NotImplementedError()
@@ -787,28 +794,97 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
             if len(rows) == limit:
                 upper_bound = rows[-1][0]
 
-            return upper_bound, [row[1] for row in rows]
+            return upper_bound, rows
 
-        upper_bound, event_ids = yield self.db.runInteraction(
+        upper_bound, rows = yield self.db.runInteraction(
             "get_all_new_events_stream", get_all_new_events_stream_txn
         )
 
-        events = yield self.get_events_as_list(event_ids)
+        events = yield self.get_events_as_list([event_id for _, event_id in rows])
+
+        # Events fetched from the database don't know their stream ordering, but
+        # the federation sender needs it.
+        stream_orderings = {event_id: ordering for ordering, event_id in rows}
+        for event in events:
+            event.internal_metadata.stream_ordering = stream_orderings[event.event_id]
 
         return upper_bound, events
 
+    @defer.inlineCallbacks
+    def _maybe_reset_federation_positions(self):
+        if self._need_to_reset_federation_stream_positions:
+            yield self.db.runInteraction(
+                "_reset_federation_positions_txn", self._reset_federation_positions_txn
+            )
+            self._need_to_reset_federation_stream_positions = False
+
+    def _reset_federation_positions_txn(self, txn):
+        """Makes sure that `federation_stream_position` has a row for each type
+        of stream for each configured federation sender instance, and none for
+        any others.
+
+        New instances start from the minimum position of the existing ones.
+        This may mean that some events and EDUs get sent twice, which is
+        better than not sending them at all.
+        """
+        configured_instances = self._federation_shard_config.instances or [
+            self._instance_name
+        ]
+
+        txn.execute(
+            "SELECT type, MIN(stream_id) FROM federation_stream_position GROUP BY type"
+        )
+        min_positions = dict(txn)
+
+        txn.execute("SELECT type, instance_name FROM federation_stream_position")
+        existing = set(txn)
+
+        for typ, instance_name in existing:
+            if instance_name not in configured_instances:
+                self.db.simple_delete_txn(
+                    txn,
+                    table="federation_stream_position",
+                    keyvalues={"type": typ, "instance_name": instance_name},
+                )
+
+        for typ, stream_id in min_positions.items():
+            for instance_name in configured_instances:
+                if (typ, instance_name) in existing:
+                    continue
+
+                self.db.simple_upsert_txn(
+                    txn,
+                    table="federation_stream_position",
+                    keyvalues={"type": typ, "instance_name": instance_name},
+                    values={},
+                    insertion_values={"stream_id": stream_id},
+                )
+
+    @defer.inlineCallbacks
     def get_federation_out_pos(self, typ):
-        return self.db.simple_select_one_onecol(
+        """Get how far this federation sender instance has got through a
+        stream.
+        """
+        yield self._maybe_reset_federation_positions()
+
+        pos = yield self.db.simple_select_one_onecol(
             table="federation_stream_position",
             retcol="stream_id",
-            keyvalues={"type": typ},
+            keyvalues={"type": typ, "instance_name": self._instance_name},
             desc="get_federation_out_pos",
         )
+        return pos
 
+    @defer.inlineCallbacks
     def update_federation_out_pos(self, typ, stream_id):
-        return self.db.simple_update_one(
+        """Record how far this federation sender instance has got through a
+        stream.
+        """
+        yield self._maybe_reset_federation_positions()
+
+        yield self.db.simple_update_one(
             table="federation_stream_position",
-            keyvalues={"type": typ},
+            keyvalues={"type": typ, "instance_name": self._instance_name},
             updatevalues={"stream_id": stream_id},
             desc="update_federation_out_pos",
         )
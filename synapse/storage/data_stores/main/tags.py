@@ -179,7 +179,9 @@ class TagsStore(TagsWorkerStore):
         """
         content_json = json.dumps(content)
 
-        def add_tag_txn(txn, next_id):
+        def add_tag_txn(txn):
+            next_id = self._account_data_id_gen.get_next_txn(txn)
+
             self.db.simple_upsert_txn(
                 txn,
                 table="room_tags",
@@ -188,8 +190,7 @@ class TagsStore(TagsWorkerStore):
             )
             self._update_revision_txn(txn, user_id, room_id, next_id)
 
-        with self._account_data_id_gen.get_next() as next_id:
-            yield self.db.runInteraction("add_tag", add_tag_txn, next_id)
+        yield self.db.runInteraction("add_tag", add_tag_txn)
 
         self.get_tags_for_user.invalidate((user_id,))
 
@@ -203,7 +204,9 @@ class TagsStore(TagsWorkerStore):
             A deferred that completes once the tag has been removed
         """
 
-        def remove_tag_txn(txn, next_id):
+        def remove_tag_txn(txn):
+            next_id = self._account_data_id_gen.get_next_txn(txn)
+
             sql = (
                 "DELETE FROM room_tags "
                 " WHERE user_id = ? AND room_id = ? AND tag = ?"
@@ -211,8 +214,7 @@ class TagsStore(TagsWorkerStore):
             txn.execute(sql, (user_id, room_id, tag))
             self._update_revision_txn(txn, user_id, room_id, next_id)
 
-        with self._account_data_id_gen.get_next() as next_id:
-            yield self.db.runInteraction("remove_tag", remove_tag_txn, next_id)
+        yield self.db.runInteraction("remove_tag", remove_tag_txn)
 
         self.get_tags_for_user.invalidate((user_id,))
 
@@ -259,6 +259,123 @@ class TransactionStore(SQLBaseStore):
                 },
             )
 
+    def store_destination_rooms_entries(self, destinations, room_id, stream_ordering):
+        """Records that an event in a room should have been sent to some
+        destinations.
+
+        Args:
+            destinations (Iterable[str])
+            room_id (str)
+            stream_ordering (int): the stream ordering of the event
+        """
+        return self.db.runInteraction(
+            "store_destination_rooms_entries",
+            self.db.simple_upsert_many_txn,
+            table="destination_rooms",
+            key_names=("destination", "room_id"),
+            key_values=[(destination, room_id) for destination in destinations],
+            value_names=("stream_ordering",),
+            value_values=[(stream_ordering,) for _ in destinations],
+        )
+
+    def get_destination_last_successful_stream_ordering(self, destination):
+        """Gets the stream ordering of the last event we successfully sent to a
+        destination.
+
+        Args:
+            destination (str)
+
+        Returns:
+            Deferred[int|None]: None if we have no record of sending it
+                anything.
+        """
+        return self.db.simple_select_one_onecol(
+            table="destinations",
+            keyvalues={"destination": destination},
+            retcol="last_successful_stream_ordering",
+            allow_none=True,
+            desc="get_destination_last_successful_stream_ordering",
+        )
+
+    def set_destination_last_successful_stream_ordering(
+        self, destination, last_successful_stream_ordering
+    ):
+        """Records the stream ordering of the last event we successfully sent
+        to a destination.
+
+        Args:
+            destination (str)
+            last_successful_stream_ordering (int)
+        """
+        return self.db.simple_upsert(
+            table="destinations",
+            keyvalues={"destination": destination},
+            values={"last_successful_stream_ordering": last_successful_stream_ordering},
+            desc="set_destination_last_successful_stream_ordering",
+        )
+
+    def get_catch_up_room_event_ids(
+        self, destination, last_successful_stream_ordering, limit=50
+    ):
+        """Gets the latest event in each room which a destination should have
+        been sent since the given position, oldest first.
+
+        Args:
+            destination (str)
+            last_successful_stream_ordering (int): the stream ordering of the
+                last event we successfully sent to the destination
+            limit (int): the maximum number of events to return
+
+        Returns:
+            Deferred[List[Tuple[str, int]]]: a list of (event ID, stream
+                ordering) pairs.
+        """
+
+        def get_catch_up_room_event_ids_txn(txn):
+            sql = """
+                SELECT event_id, stream_ordering FROM destination_rooms
+                INNER JOIN events USING (stream_ordering)
+                WHERE destination = ? AND stream_ordering > ?
+                ORDER BY stream_ordering
+                LIMIT ?
+            """
+            txn.execute(sql, (destination, last_successful_stream_ordering, limit))
+            return txn.fetchall()
+
+        return self.db.runInteraction(
+            "get_catch_up_room_event_ids", get_catch_up_room_event_ids_txn
+        )
+
+    def get_catch_up_outstanding_destinations(self, after_destination, limit=25):
+        """Gets destinations which have events we haven't been able to send
+        them, in order of server name.
+
+        Args:
+            after_destination (str|None): only return destinations after this
+                one, for paginating through them.
+            limit (int): the maximum number of destinations to return
+
+        Returns:
+            Deferred[List[str]]
+        """
+
+        def get_catch_up_outstanding_destinations_txn(txn):
+            sql = """
+                SELECT DISTINCT destination FROM destinations
+                INNER JOIN destination_rooms USING (destination)
+                WHERE stream_ordering > last_successful_stream_ordering
+                AND destination > ?
+                ORDER BY destination
+                LIMIT ?
+            """
+            txn.execute(sql, (after_destination or "", limit))
+            return [destination for (destination,) in txn]
+
+        return self.db.runInteraction(
+            "get_catch_up_outstanding_destinations",
+            get_catch_up_outstanding_destinations_txn,
+        )
+
     def _start_cleanup_transactions(self):
         return run_as_background_process(
             "cleanup_transactions", self._cleanup_transactions
@@ -211,6 +211,21 @@ class EventsPersistenceStorage(object):
         self._event_persist_queue = _EventPeristenceQueue()
         self._state_resolution_handler = hs.get_state_resolution_handler()
 
+        # If event persistence is sharded then the master routes each room's
+        # events to the instance responsible for it.
+        self._instance_name = hs.config.worker.instance_name
+        self._events_shard_config = hs.config.worker.events_shard_config
+        self._send_events_to_writer = None
+        if not hs.config.worker_app and hs.config.worker.writers.events != ["master"]:
+            # Imported here to avoid an import cycle
+            from synapse.replication.http.persist_events import (
+                ReplicationPersistEventsRestServlet,
+            )
+
+            self._send_events_to_writer = ReplicationPersistEventsRestServlet.make_client(
+                hs
+            )
+
     @defer.inlineCallbacks
     def persist_events(
         self,
@@ -271,14 +286,48 @@ class EventsPersistenceStorage(object):
         return (event.internal_metadata.stream_ordering, max_persisted_id)
 
     def _maybe_start_persisting(self, room_id: str):
-        async def persisting_queue(item):
-            with Measure(self._clock, "persist_events"):
-                await self._persist_events(
-                    item.events_and_contexts, backfilled=item.backfilled
-                )
+        writer = self._events_shard_config.get_instance(room_id)
+        if self._send_events_to_writer and writer != self._instance_name:
+
+            async def persisting_queue(item):
+                with Measure(self._clock, "persist_events_via_writer"):
+                    await self._persist_events_via_writer(
+                        writer, item.events_and_contexts, item.backfilled
+                    )
+
+        else:
+
+            async def persisting_queue(item):
+                with Measure(self._clock, "persist_events"):
+                    await self._persist_events(
+                        item.events_and_contexts, backfilled=item.backfilled
+                    )
 
         self._event_persist_queue.handle_queue(room_id, persisting_queue)
 
+    async def _persist_events_via_writer(
+        self,
+        writer: str,
+        events_and_contexts: List[Tuple[FrozenEvent, EventContext]],
+        backfilled: bool,
+    ):
+        """Has the given event persister persist the events, which must all be
+        in a room that it is responsible for.
+        """
+
+        async def send_events():
+            result = await self._send_events_to_writer(
+                instance_name=writer,
+                store=self.main_store,
+                event_and_contexts=events_and_contexts,
+                backfilled=backfilled,
+            )
+            return result["stream_orderings"]
+
+        await self.main_store.persist_events_via_writer(
+            events_and_contexts, backfilled, send_events
+        )
+
     async def _persist_events(
         self,
         events_and_contexts: List[Tuple[FrozenEvent, EventContext]],
@@ -372,16 +372,18 @@ class StateGroupStorage(object):
         return group_to_state
 
     @defer.inlineCallbacks
-    def get_state_ids_for_group(self, state_group):
+    def get_state_ids_for_group(self, state_group, state_filter=StateFilter.all()):
         """Get the event IDs of all the state in the given state group
 
         Args:
             state_group (int)
+            state_filter (StateFilter): The state filter used to fetch state
+                from the database.
 
         Returns:
             Deferred[dict]: Resolves to a map of (type, state_key) -> event_id
         """
-        group_to_state = yield self._get_state_for_groups((state_group,))
+        group_to_state = yield self._get_state_for_groups((state_group,), state_filter)
 
         return group_to_state[state_group]
 
@@ -17,6 +17,11 @@ import contextlib
 import threading
 from collections import deque
 
+from synapse.config._base import ConfigError
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.storage.engines import PostgresEngine
+from synapse.storage.util.sequence import build_sequence_generator
+
 
 class IdGenerator(object):
     def __init__(self, db_conn, table, column):
@@ -139,6 +144,31 @@ class StreamIdGenerator(object):
 
         return manager()
 
+    def get_next_txn(self, txn):
+        """Like `get_next`, but for use inside a transaction. The ID is marked
+        as finished when the transaction completes (or fails).
+
+        Returns:
+            int
+        """
+        return self.get_next_mult_txn(txn, 1)[0]
+
+    def get_next_mult_txn(self, txn, n):
+        """Like `get_next_mult`, but for use inside a transaction. The IDs are
+        marked as finished when the transaction completes (or fails).
+
+        Returns:
+            list[int]
+        """
+        # get_next_mult() returns a context manager which is designed to wrap
+        # the transaction, so we call __enter__ manually and have __exit__
+        # called after the transaction finishes.
+        ctx = self.get_next_mult(n)
+        next_ids = ctx.__enter__()
+        txn.call_on_exception(ctx.__exit__, None, None, None)
+        txn.call_after(ctx.__exit__, None, None, None)
+        return list(next_ids)
+
     def get_current_token(self):
         """Returns the maximum stream id such that all stream ids less than or
         equal to it have been successfully persisted.
@@ -153,6 +183,401 @@ class StreamIdGenerator(object):
             return self._current
 
 
+class MultiWriterIdGenerator(object):
+    """Generates stream ids for a stream which may be written to by several
+    processes at once, such as the events stream when event persistence is
+    sharded.
+
+    IDs are allocated from a postgres sequence (or, on SQLite, which only
+    supports a single writer, from an in-memory counter), inside the
+    transaction that uses them.
+
+    The current token is the maximum stream id such that all stream ids less
+    than or equal to it have been persisted. As well as ids we are persisting
+    ourselves, that takes into account ids being allocated by other processes
+    on our behalf (see `get_next_from_writer`), and positions we have been told
+    about over replication (see `advance`).
+
+    While a writer has ids in flight it records how far it has got in the
+    `stream_positions` table, and it deletes the row again once all its ids
+    have finished. On startup the current token is the minimum position of
+    the other writers which still have a row, as they may be persisting ids
+    below the maximum id in the stream tables. If no other writer has ids in
+    flight then we start from the maximum id.
+
+    Args:
+        db_conn(connection): A database connection to use to fetch the
+            initial value of the generator from.
+        db (Database): the database, used to keep our row in the
+            `stream_positions` table up to date.
+        stream_name(str): The name of the stream, as used in the
+            `stream_positions` table.
+        instance_name(str): The name of this instance.
+        writers(list[str]): The instances which write to the stream.
+        table(str): A database table to read the initial value of the id
+            generator from.
+        column(str): The column of the database table to read the initial
+            value from the id generator from.
+        sequence_name(str): The postgres sequence to allocate ids from.
+        extra_tables(list): List of pairs of database tables and columns to
+            use to source the initial value of the generator from.
+        step(int): which direction the stream ids grow in. +1 to grow
+            upwards, -1 to grow downwards. Ids growing downwards are
+            allocated by negating the values from the sequence.
+
+    Usage:
+        def persist_txn(txn):
+            stream_ids = stream_id_gen.get_next_mult_txn(txn, n)
+            # ... persist events ...
+    """
+
+    def __init__(
+        self,
+        db_conn,
+        db,
+        stream_name,
+        instance_name,
+        writers,
+        table,
+        column,
+        sequence_name,
+        extra_tables=[],
+        step=1,
+    ):
+        assert step in (1, -1)
+        self._lock = threading.Lock()
+        self._db = db
+        self._database_engine = database_engine = db.engine
+        self._stream_name = stream_name
+        self._instance_name = instance_name
+        self._step = step
+
+        # Internally we track everything as positive ids, as allocated by the
+        # sequence, and multiply by `step` on the way in and out.
+
+        # The positions of the other writers which had ids in flight when they
+        # last recorded them. Any row of our own is left over from before we
+        # restarted, and the ids it covered were either persisted or abandoned.
+        self._writer_positions = {
+            instance: stream_id * step
+            for instance, stream_id in _load_stream_positions(
+                db_conn, database_engine, stream_name
+            )
+            if instance in writers and instance != instance_name
+        }
+        _delete_stream_position(db_conn, database_engine, stream_name, instance_name)
+
+        # Whether we're currently deleting our row from `stream_positions`, and
+        # whether we've allocated more ids since we started doing so.
+        self._clearing_position = False
+        self._allocated_while_clearing = False
+
+        # The highest id in the stream tables.
+        max_id = _load_current_id(db_conn, table, column, step)
+        for table, column in extra_tables:
+            max_id = (max if step > 0 else min)(
+                max_id, _load_current_id(db_conn, table, column, step)
+            )
+        max_id *= step
+
+        if self._writer_positions:
+            current = min(self._writer_positions.values())
+        else:
+            current = max_id
+
+        # The maximum id which we know has been persisted (or abandoned).
+        self._persisted_upto = current
+
+        # The ids which we have allocated but not yet finished persisting.
+        self._unfinished_ids = set()
+
+        # For each allocation whose ids we don't know yet (because they're
+        # still being allocated, possibly by another process) the value of
+        # `_persisted_upto` when it started. Any ids it allocates must be
+        # greater than that.
+        self._pending_allocations = {}
+
+        # On SQLite we're the only writer, so carry on from the highest id in
+        # the stream tables rather than the (possibly lower) current position.
+        self._sequence_gen = build_sequence_generator(
+            database_engine, lambda txn: max_id, sequence_name
+        )
+
+        # Ids may have been allocated without the sequence, if the stream
+        # previously only had a single writer.
+        self._sequence_gen.ensure_at_least(db_conn, max_id)
+
+    def get_next_txn(self, txn):
+        """Allocates a single stream id inside the given transaction.
+
+        Returns:
+            int
+        """
+        return self.get_next_mult_txn(txn, 1)[0]
+
+    def get_next_mult_txn(self, txn, n):
+        """Allocates `n` stream ids inside the given transaction. The ids are
+        marked as finished when the transaction completes (or fails).
+
+        Returns:
+            list[int]
+        """
+        with self._pending_allocation() as next_ids:
+            next_ids.extend(self._sequence_gen.get_next_mult_txn(txn, n))
+
+            with self._lock:
+                self._unfinished_ids.update(next_ids)
+
+        txn.call_on_exception(self._mark_finished, next_ids, record=True)
+        txn.call_after(self._mark_finished, next_ids, record=True)
+
+        # Record how far we have got. This lags behind by the ids in this
+        # transaction, as it's written before they are persisted.
+        self._update_stream_positions_table_txn(txn)
+
+        return [i * self._step for i in next_ids]
+
+    def _update_stream_positions_table_txn(self, txn):
+        """Writes our current position to the `stream_positions` table.
+        """
+        position = self.get_current_token()
+
+        if self._database_engine.can_native_upsert:
+            txn.execute(
+                """
+                INSERT INTO stream_positions (stream_name, instance_name, stream_id)
+                VALUES (?, ?, ?)
+                ON CONFLICT (stream_name, instance_name)
+                DO UPDATE SET stream_id = EXCLUDED.stream_id
+                """,
+                (self._stream_name, self._instance_name, position),
+            )
+        else:
+            # Without native upserts we're on an old SQLite, so are the only
+            # process writing and transactions are serialised.
+            txn.execute(
+                "UPDATE stream_positions SET stream_id = ?"
+                " WHERE stream_name = ? AND instance_name = ?",
+                (position, self._stream_name, self._instance_name),
+            )
+            if txn.rowcount == 0:
+                txn.execute(
+                    "INSERT INTO stream_positions (stream_name, instance_name, stream_id)"
+                    " VALUES (?, ?, ?)",
+                    (self._stream_name, self._instance_name, position),
+                )
+
+    @contextlib.contextmanager
+    def get_next_from_writer(self):
+        """Used when ids are allocated and persisted by another process on our
+        behalf, e.g. when events are sent to an event persister.
+
+        Until the context manager exits the current token will not advance
+        past any id which the other process might allocate. Before exiting,
+        the caller should add the ids that were allocated to the yielded list.
+
+        Usage:
+            with stream_id_gen.get_next_from_writer() as stream_ids:
+                result = yield ... ask the writer to persist events ...
+                stream_ids.extend(result["stream_ids"])
+        """
+        with self._pending_allocation() as next_ids:
+            yield next_ids
+
+            next_ids[:] = [i * self._step for i in next_ids]
+            self._mark_finished(next_ids)
+
+    @contextlib.contextmanager
+    def _pending_allocation(self):
+        handle = object()
+        with self._lock:
+            self._pending_allocations[handle] = self._persisted_upto
+
+        next_ids = []
+        try:
+            yield next_ids
+        finally:
+            with self._lock:
+                self._pending_allocations.pop(handle)
+
+    def _mark_finished(self, next_ids, record=False):
+        """Marks the given ids as persisted (or abandoned).
+
+        Args:
+            next_ids (list[int])
+            record (bool): whether we allocated the ids, in which case we
+                delete our row from `stream_positions` if we no longer have any
+                ids in flight.
+        """
+        with self._lock:
+            self._unfinished_ids.difference_update(next_ids)
+            if next_ids:
+                self._persisted_upto = max(self._persisted_upto, max(next_ids))
+
+            if not record or self._unfinished_ids:
+                return
+            if self._clearing_position:
+                self._allocated_while_clearing = True
+                return
+            self._clearing_position = True
+
+        run_as_background_process("clear_stream_position", self._clear_stream_position)
+
+    async def _clear_stream_position(self):
+        """Deletes our row from `stream_positions` while we have no ids in
+        flight, so that other writers don't start from it when they restart.
+        """
+
+        def _clear_stream_position_txn(txn):
+            with self._lock:
+                if self._unfinished_ids:
+                    # We've started allocating ids again, which will have
+                    # updated the row.
+                    return
+            txn.execute(
+                "DELETE FROM stream_positions"
+                " WHERE stream_name = ? AND instance_name = ?",
+                (self._stream_name, self._instance_name),
+            )
+
+        try:
+            while True:
+                with self._lock:
+                    self._allocated_while_clearing = False
+
+                await self._db.runInteraction(
+                    "clear_stream_position", _clear_stream_position_txn
+                )
+
+                # If we allocated (and finished) more ids while we were
+                # deleting the row then it may have been written again.
+                with self._lock:
+                    if not self._allocated_while_clearing:
+                        return
+        finally:
+            with self._lock:
+                self._clearing_position = False
+
+    def advance(self, token):
+        """Called when we learn over replication that all ids up to the given
+        token have been persisted.
+        """
+        with self._lock:
+            self._persisted_upto = max(self._persisted_upto, token * self._step)
+
+    def get_current_token(self):
+        """Returns the maximum stream id such that all stream ids less than or
+        equal to it have been successfully persisted.
+
+        Returns:
+            int
+        """
+        with self._lock:
+            current = self._persisted_upto
+            if self._unfinished_ids:
+                current = min(current, min(self._unfinished_ids) - 1)
+            if self._pending_allocations:
+                current = min(current, min(self._pending_allocations.values()))
+
+            return current * self._step
+
+    def get_positions(self):
+        """Returns the positions the other writers of the stream with ids in
+        flight had recorded when we started, as a map from instance name to
+        stream id.
+
+        Returns:
+            dict[str, int]
+        """
+        return {
+            instance: position * self._step
+            for instance, position in self._writer_positions.items()
+        }
+
+
+def _load_stream_positions(db_conn, database_engine, stream_name):
+    """Loads the positions recorded by the writers of the given stream.
+
+    Returns:
+        list[tuple[str, int]]: pairs of instance name and stream id
+    """
+    sql = database_engine.convert_param_style(
+        "SELECT instance_name, stream_id FROM stream_positions WHERE stream_name = ?"
+    )
+
+    cur = db_conn.cursor()
+    cur.execute(sql, (stream_name,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def _delete_stream_position(db_conn, database_engine, stream_name, instance_name):
+    """Deletes the position recorded by the given instance for the given
+    stream.
+    """
+    sql = database_engine.convert_param_style(
+        "DELETE FROM stream_positions WHERE stream_name = ? AND instance_name = ?"
+    )
+
+    cur = db_conn.cursor()
+    cur.execute(sql, (stream_name, instance_name))
+    cur.close()
+
+
+def build_stream_id_generator(
+    db_conn,
+    db,
+    stream_name,
+    instance_name,
+    writers,
+    table,
+    column,
+    sequence_name,
+    extra_tables=[],
+    step=1,
+):
+    """Builds the id generator for a stream, given the instances configured
+    to write to it.
+
+    If the stream is only written to by the master then ids are allocated in
+    memory by a `StreamIdGenerator`, otherwise they come from the database via
+    a `MultiWriterIdGenerator`. Either way, callers should allocate ids inside
+    their transactions with `get_next_txn` or `get_next_mult_txn`.
+
+    Args:
+        See `MultiWriterIdGenerator`.
+
+    Returns:
+        StreamIdGenerator|MultiWriterIdGenerator
+    """
+    if writers == ["master"]:
+        return StreamIdGenerator(
+            db_conn, table, column, extra_tables=extra_tables, step=step
+        )
+
+    # Only postgres supports several processes allocating ids at once. (The
+    # master may still allocate ids even if it isn't listed as a writer.)
+    if not isinstance(db.engine, PostgresEngine):
+        raise ConfigError(
+            "Writing the %s stream from workers is only supported with PostgreSQL"
+            % (stream_name,)
+        )
+
+    return MultiWriterIdGenerator(
+        db_conn,
+        db,
+        stream_name,
+        instance_name,
+        writers,
+        table,
+        column,
+        sequence_name,
+        extra_tables=extra_tables,
+        step=step,
+    )
+
+
 class ChainedIdGenerator(object):
     """Used to generate new stream ids where the stream must be kept in sync
     with another stream. It generates pairs of IDs, the first element is an
@@ -16,7 +16,7 @@
 
 import logging
 import os
-from typing import Dict
+from typing import Dict, Optional
 
 import six
 from six.moves import intern
@@ -27,6 +27,11 @@ logger = logging.getLogger(__name__)
 
 CACHE_SIZE_FACTOR = float(os.environ.get("SYNAPSE_CACHE_FACTOR", 0.5))
 
+# The approximate number of bytes that the caches may use between them before
+# we start evicting the least recently used entries across all caches. Zero
+# means that there is no limit (beyond the limits on the size of each cache).
+CACHE_MEMORY_BUDGET = int(os.environ.get("SYNAPSE_CACHE_MEMORY_BUDGET", 0))
+
 
 def get_cache_factor_for(cache_name):
     env_var = "SYNAPSE_CACHE_FACTOR_" + cache_name.upper()
@@ -37,6 +42,35 @@ def get_cache_factor_for(cache_name):
     return CACHE_SIZE_FACTOR
 
 
+# How long, in milliseconds, entries in the descriptor caches may go unused
+# before they are expired. None means that entries are only evicted when the
+# cache is full. Set from the `caches` section of the homeserver config.
+_cache_expiry_ms = None  # type: Optional[int]
+_cache_expiry_ms_by_name = {}  # type: Dict[str, int]
+
+
+def set_cache_expiry_times(expiry_ms, expiry_ms_by_name):
+    """Sets how long entries may go unused before they are expired from caches
+    created from now on.
+
+    Args:
+        expiry_ms (int|None): the expiry time for caches not in
+            `expiry_ms_by_name`, or None to not expire their entries.
+        expiry_ms_by_name (dict[str, int]): the expiry times of specific
+            caches, by cache name.
+    """
+    global _cache_expiry_ms, _cache_expiry_ms_by_name
+    _cache_expiry_ms = expiry_ms
+    _cache_expiry_ms_by_name = dict(expiry_ms_by_name)
+
+
+def get_cache_expiry_ms_for(cache_name):
+    """Returns how long, in milliseconds, entries may go unused in the given
+    cache before they are expired, or None if they should not be.
+    """
+    return _cache_expiry_ms_by_name.get(cache_name, _cache_expiry_ms)
+
+
 caches_by_name = {}
 collectors_by_name = {}  # type: Dict
 
@@ -44,6 +78,7 @@ cache_size = Gauge("synapse_util_caches_cache:size", "", ["name"])
 cache_hits = Gauge("synapse_util_caches_cache:hits", "", ["name"])
 cache_evicted = Gauge("synapse_util_caches_cache:evicted_size", "", ["name"])
 cache_total = Gauge("synapse_util_caches_cache:total", "", ["name"])
+cache_memory_usage = Gauge("synapse_util_caches_cache:memory_usage", "", ["name"])
 
 response_cache_size = Gauge("synapse_util_caches_response_cache:size", "", ["name"])
 response_cache_hits = Gauge("synapse_util_caches_response_cache:hits", "", ["name"])
@@ -104,6 +139,8 @@ def register_cache(cache_type, cache_name, cache, collect_callback=None):
                     cache_hits.labels(cache_name).set(self.hits)
                     cache_evicted.labels(cache_name).set(self.evicted_size)
                     cache_total.labels(cache_name).set(self.hits + self.misses)
+                    if getattr(cache, "track_memory", False):
+                        cache_memory_usage.labels(cache_name).set(cache.memory_usage())
                 if collect_callback:
                     collect_callback()
             except Exception as e:
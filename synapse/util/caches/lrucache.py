@@ -14,11 +14,26 @@
 # limitations under the License.
 
 
+import heapq
+import itertools
+import logging
+import sys
 import threading
+import time
+import types
+import weakref
 from functools import wraps
 
+from twisted.internet import defer
+
+from synapse.util import caches
 from synapse.util.caches.treecache import TreeCache
 
+logger = logging.getLogger(__name__)
+
+# How often we look for expired entries in caches with an expiry time.
+EXPIRE_CACHE_ENTRIES_INTERVAL_MS = 30 * 1000
+
 
 def enumerate_leaves(node, depth):
     if depth == 0:
@@ -29,8 +44,205 @@ def enumerate_leaves(node, depth):
                 yield m
 
 
+# Types which we don't count towards the size of a cache entry, as they are
+# either shared singletons or hold references to large parts of the process.
+_UNSIZED_TYPES = (
+    type(None),
+    bool,
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    defer.Deferred,
+)
+
+# Types which don't reference any other objects.
+_LEAF_TYPES = (str, bytes, int, float)
+
+
+def get_size_of(obj, max_objects=10000):
+    """Estimates the number of bytes of memory used by an object and everything
+    it references.
+
+    Objects referenced more than once are only counted once, but objects which
+    are shared with other cache entries (such as interned strings) are counted
+    in full, so this is only an approximation.
+
+    Args:
+        obj: the object to measure
+        max_objects (int): the maximum number of objects to visit, to bound
+            the time spent on very large values.
+
+    Returns:
+        int: the approximate size in bytes
+    """
+    seen = set()
+    size = 0
+    to_visit = [obj]
+    while to_visit and len(seen) < max_objects:
+        o = to_visit.pop()
+        if id(o) in seen or isinstance(o, _UNSIZED_TYPES):
+            continue
+        seen.add(id(o))
+
+        size += sys.getsizeof(o)
+        if isinstance(o, _LEAF_TYPES):
+            continue
+
+        # We call the base class methods directly, as some subclasses (e.g.
+        # UserID) refuse to be iterated.
+        if isinstance(o, dict):
+            to_visit.extend(dict.keys(o))
+            to_visit.extend(dict.values(o))
+        elif isinstance(o, tuple):
+            to_visit.extend(tuple.__iter__(o))
+        elif isinstance(o, list):
+            to_visit.extend(list.__iter__(o))
+        elif isinstance(o, set):
+            to_visit.extend(set.__iter__(o))
+        elif isinstance(o, frozenset):
+            to_visit.extend(frozenset.__iter__(o))
+        else:
+            if hasattr(o, "__dict__"):
+                to_visit.append(o.__dict__)
+            for cls in type(o).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                for slot in slots:
+                    if slot not in ("__dict__", "__weakref__"):
+                        to_visit.append(getattr(o, slot, None))
+
+    return size
+
+
+# The LruCaches which are tracking their memory usage, and so count towards
+# the global memory budget.
+_memory_tracked_caches = weakref.WeakSet()
+
+# The total memory usage of the caches in `_memory_tracked_caches`.
+_total_memory_usage = [0]
+
+# Protects `_memory_tracked_caches` and `_total_memory_usage`.
+_memory_lock = threading.Lock()
+
+# Held while evicting entries to get back under the memory budget.
+_memory_eviction_lock = threading.Lock()
+
+# Used to order accesses to entries across all the caches tracking their
+# memory usage, so that we can tell which entry is the coldest.
+_access_counter = itertools.count()
+
+
+def _update_total_memory_usage(delta):
+    with _memory_lock:
+        _total_memory_usage[0] += delta
+
+
+def get_total_memory_usage():
+    """Returns the approximate number of bytes used by all the caches which are
+    tracking their memory usage.
+    """
+    return _total_memory_usage[0]
+
+
+def evict_for_memory_budget():
+    """Evicts the least recently used entries across all the caches which are
+    tracking their memory usage until they fit within the memory budget.
+    """
+    budget = caches.CACHE_MEMORY_BUDGET
+    if not budget or _total_memory_usage[0] <= budget:
+        return
+
+    # If another thread is already evicting then we leave it to that thread.
+    if not _memory_eviction_lock.acquire(False):
+        return
+
+    try:
+        with _memory_lock:
+            tracked_caches = list(_memory_tracked_caches)
+
+        # A heap of the coldest entry in each cache, so that we can repeatedly
+        # evict the coldest entry across all the caches.
+        heap = []
+        for idx, cache in enumerate(tracked_caches):
+            last_access = cache.coldest_access()
+            if last_access is not None:
+                heap.append((last_access, idx, cache))
+        heapq.heapify(heap)
+
+        while heap and _total_memory_usage[0] > budget:
+            _, idx, cache = heapq.heappop(heap)
+            last_access = cache.evict_coldest()
+            if last_access is not None:
+                heapq.heappush(heap, (last_access, idx, cache))
+    finally:
+        _memory_eviction_lock.release()
+
+
+# The LruCaches which have an expiry time.
+_expiring_caches = weakref.WeakSet()
+
+# Protects `_expiring_caches`.
+_expiring_caches_lock = threading.Lock()
+
+# The time, in milliseconds, as of the last sweep for expired entries. Entries
+# are stamped with this rather than the current time when they are accessed,
+# which saves looking up the time on every access at the cost of expiring
+# entries up to one sweep interval early.
+_current_time_ms = [int(time.time() * 1000)]
+
+
+def expire_lru_cache_entries(now_ms):
+    """Expires the entries in caches with an expiry time which have not been
+    accessed in that time.
+
+    The cost is proportional to the number of expired entries rather than the
+    size of the caches, as each cache's entries are already ordered by when
+    they were last accessed.
+
+    Args:
+        now_ms (int): the current time, in milliseconds
+    """
+    with _expiring_caches_lock:
+        expiring_caches = list(_expiring_caches)
+
+    _current_time_ms[0] = now_ms
+
+    expired = 0
+    for cache in expiring_caches:
+        expired += cache.expire(now_ms - cache.expiry_ms)
+
+    if expired:
+        logger.debug("Expired %d cache entries", expired)
+
+
+def setup_expire_lru_cache_entries(hs):
+    """Starts periodically expiring entries from caches with an expiry time.
+
+    Args:
+        hs (synapse.server.HomeServer)
+    """
+    clock = hs.get_clock()
+    _current_time_ms[0] = clock.time_msec()
+    clock.looping_call(
+        lambda: expire_lru_cache_entries(clock.time_msec()),
+        EXPIRE_CACHE_ENTRIES_INTERVAL_MS,
+    )
+
+
 class _Node(object):
-    __slots__ = ["prev_node", "next_node", "key", "value", "callbacks"]
+    __slots__ = [
+        "prev_node",
+        "next_node",
+        "key",
+        "value",
+        "callbacks",
+        "memory",
+        "last_access",
+        "access_time",
+    ]
 
     def __init__(self, prev_node, next_node, key, value, callbacks=set()):
         self.prev_node = prev_node
@@ -38,6 +250,9 @@ class _Node(object):
         self.key = key
         self.value = value
         self.callbacks = callbacks
+        self.memory = 0
+        self.last_access = 0
+        self.access_time = 0
 
 
 class LruCache(object):
@@ -48,6 +263,15 @@ class LruCache(object):
 
     Can also set callbacks on objects when getting/setting which are fired
     when that key gets invalidated/evicted.
+
+    If tracking memory usage, the cache keeps an estimate of the number of
+    bytes used by each entry. All such caches share the budget given by
+    `synapse.util.caches.CACHE_MEMORY_BUDGET`: when it is exceeded the least
+    recently used entries across all those caches are evicted.
+
+    If given an expiry time, entries which have not been accessed within that
+    time are removed by the periodic sweep started by
+    `setup_expire_lru_cache_entries`.
     """
 
     def __init__(
@@ -57,6 +281,8 @@ class LruCache(object):
         cache_type=dict,
         size_callback=None,
         evicted_callback=None,
+        track_memory=None,
+        expiry_ms=None,
     ):
         """
         Args:
@@ -73,7 +299,21 @@ class LruCache(object):
             evicted_callback (func(int)|None):
                 if not None, called on eviction with the size of the evicted
                 entry
+
+            track_memory (bool|None):
+                whether to track the memory usage of the entries, and count
+                them towards the global memory budget. Defaults to doing so if
+                a memory budget has been configured.
+
+            expiry_ms (int|None):
+                if not None, the time in milliseconds after which entries that
+                have not been accessed are expired.
         """
+        if track_memory is None:
+            track_memory = bool(caches.CACHE_MEMORY_BUDGET)
+        self.track_memory = track_memory
+        self.expiry_ms = expiry_ms
+
         cache = cache_type()
         self.cache = cache  # Used for introspection.
         list_root = _Node(None, None, None, None)
@@ -111,6 +351,14 @@ class LruCache(object):
 
         self.len = synchronized(cache_len)
 
+        memory_usage = [0]
+
+        def set_node_memory(node, memory):
+            delta = memory - node.memory
+            node.memory = memory
+            memory_usage[0] += delta
+            _update_total_memory_usage(delta)
+
         def add_node(key, value, callbacks=set()):
             prev_node = list_root
             next_node = prev_node.next_node
@@ -122,7 +370,19 @@ class LruCache(object):
             if size_callback:
                 cached_cache_len[0] += size_callback(node.value)
 
+            if track_memory:
+                node.last_access = next(_access_counter)
+                set_node_memory(node, get_size_of((key, value)))
+
+            if expiry_ms is not None:
+                node.access_time = _current_time_ms[0]
+
         def move_node_to_front(node):
+            if track_memory:
+                node.last_access = next(_access_counter)
+            if expiry_ms is not None:
+                node.access_time = _current_time_ms[0]
+
             prev_node = node.prev_node
             next_node = node.next_node
             prev_node.next_node = next_node
@@ -145,6 +405,9 @@ class LruCache(object):
                 deleted_len = size_callback(node.value)
                 cached_cache_len[0] -= deleted_len
 
+            if track_memory:
+                set_node_memory(node, 0)
+
             for cb in node.callbacks:
                 cb()
             node.callbacks.clear()
@@ -161,7 +424,7 @@ class LruCache(object):
                 return default
 
         @synchronized
-        def cache_set(key, value, callbacks=[]):
+        def _cache_set(key, value, callbacks=[]):
             node = cache.get(key, None)
             if node is not None:
                 # We sometimes store large objects, e.g. dicts, which cause
@@ -184,13 +447,24 @@ class LruCache(object):
 
                 move_node_to_front(node)
                 node.value = value
+
+                if track_memory:
+                    set_node_memory(node, get_size_of((key, value)))
             else:
                 add_node(key, value, set(callbacks))
 
             evict()
 
+        def cache_set(key, value, callbacks=[]):
+            _cache_set(key, value, callbacks)
+
+            # We do this outside of our lock, as we may need to evict entries
+            # from other caches.
+            if track_memory:
+                evict_for_memory_budget()
+
         @synchronized
-        def cache_set_default(key, value):
+        def _cache_set_default(key, value):
             node = cache.get(key, None)
             if node is not None:
                 return node.value
@@ -199,6 +473,12 @@ class LruCache(object):
                 evict()
                 return value
 
+        def cache_set_default(key, value):
+            value = _cache_set_default(key, value)
+            if track_memory:
+                evict_for_memory_budget()
+            return value
+
         @synchronized
         def cache_pop(key, default=None):
             node = cache.get(key, None)
@@ -230,11 +510,45 @@ class LruCache(object):
             cache.clear()
             if size_callback:
                 cached_cache_len[0] = 0
+            if track_memory:
+                _update_total_memory_usage(-memory_usage[0])
+                memory_usage[0] = 0
 
         @synchronized
         def cache_contains(key):
             return key in cache
 
+        def cache_memory_usage():
+            return memory_usage[0]
+
+        @synchronized
+        def cache_coldest_access():
+            """Returns the access order of the least recently used entry, or
+            None if the cache is empty.
+            """
+            if list_root.prev_node is list_root:
+                return None
+            return list_root.prev_node.last_access
+
+        @synchronized
+        def cache_evict_coldest():
+            """Evicts the least recently used entry.
+
+            Returns:
+                int|None: the access order of the new least recently used
+                entry, or None if the cache is now empty.
+            """
+            node = list_root.prev_node
+            if node is not list_root:
+                evicted_len = delete_node(node)
+                cache.pop(node.key, None)
+                if evicted_callback:
+                    evicted_callback(evicted_len)
+
+            if list_root.prev_node is list_root:
+                return None
+            return list_root.prev_node.last_access
+
         self.sentinel = object()
         self.get = cache_get
         self.set = cache_set
@@ -246,6 +560,40 @@ class LruCache(object):
         self.contains = cache_contains
         self.clear = cache_clear
 
+        @synchronized
+        def cache_expire(cutoff_ms):
+            """Removes the entries which were last accessed before the cutoff.
+
+            Returns:
+                int: the number of entries removed
+            """
+            expired = 0
+            node = list_root.prev_node
+            while node is not list_root and node.access_time < cutoff_ms:
+                evicted_len = delete_node(node)
+                cache.pop(node.key, None)
+                if evicted_callback:
+                    evicted_callback(evicted_len)
+                expired += 1
+                node = list_root.prev_node
+            return expired
+
+        self.memory_usage = cache_memory_usage
+        self.coldest_access = cache_coldest_access
+        self.evict_coldest = cache_evict_coldest
+        self.expire = cache_expire
+
+        if track_memory:
+            with _memory_lock:
+                _memory_tracked_caches.add(self)
+
+            # Stop counting our entries towards the budget once we're gone.
+            weakref.finalize(self, lambda: _update_total_memory_usage(-memory_usage[0]))
+
+        if expiry_ms is not None:
+            with _expiring_caches_lock:
+                _expiring_caches.add(self)
+
     def __getitem__(self, key):
         result = self.get(key, self.sentinel)
         if result is self.sentinel:
@@ -40,7 +40,7 @@ def make_test(main):
         file_out = StringIO()
         with redirect_stderr(file_out):
 
-            d = ensureDeferred(main(reactor, loops))
+            results = []
 
             def on_done(_):
                 if isinstance(_, Failure):
@@ -49,10 +49,18 @@ def make_test(main):
                 reactor.stop()
                 return _
 
-            d.addBoth(on_done)
+            def start():
+                # We only start the benchmark once the reactor is running, so
+                # that benchmarks which complete synchronously can still stop
+                # it.
+                d = ensureDeferred(main(reactor, loops))
+                d.addBoth(on_done)
+                results.append(d)
+
+            reactor.callWhenRunning(start)
             reactor.run()
 
-        return d.result
+        return results[0].result
 
     return _main
 
@@ -1,3 +1,26 @@
-from . import logging
+from . import (
+    event_cache,
+    fanout,
+    logging,
+    presence,
+    push_rules,
+    replication,
+    signatures,
+    state_res,
+)
 
 SUITES = [(logging, 1000), (logging, 10000), (logging, None)]
+
+SUITES += [(suite, None) for suite in push_rules.room_size_suites]
+
+SUITES += [(event_cache, 10000)]
+
+SUITES += [(suite, None) for suite in state_res.forked_room_suites]
+
+SUITES += [(suite, None) for suite in replication.fan_out_suites]
+
+SUITES += [(suite, None) for suite in signatures.verify_events_suites]
+
+SUITES += [(suite, 100) for suite in fanout.fan_out_suites]
+
+SUITES += [(suite, 100) for suite in presence.presence_fan_out_suites]
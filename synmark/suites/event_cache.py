@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks loading events into the event cache.
+
+`bytes_per_event` measures the memory used per cached event, which can be
+used to size `event_cache_size`:
+
+    python -c "from synmark.suites.event_cache import bytes_per_event as b; print(b())"
+"""
+
+import tracemalloc
+
+from canonicaljson import json
+from pyperf import perf_counter
+
+from synapse.api.room_versions import EventFormatVersions
+from synapse.events import event_type_from_format_version
+
+
+def _make_event_json(i):
+    """Make the JSON of a typical message event, as stored in the database.
+    """
+    return json.dumps(
+        {
+            "auth_events": ["$%043d" % (j,) for j in range(3)],
+            "prev_events": ["$%043d" % (i,)],
+            "type": "m.room.message",
+            "room_id": "!room:example.com",
+            "sender": "@user%d:example.com" % (i % 50,),
+            "content": {
+                "msgtype": "m.text",
+                "body": "This is message number %d, with some text" % (i,),
+            },
+            "depth": i,
+            "origin": "example.com",
+            "origin_server_ts": 1590000000000 + i,
+            "hashes": {"sha256": "A" * 43},
+            "signatures": {"example.com": {"ed25519:a_abcd": "B" * 86}},
+            "unsigned": {"age_ts": 1590000000000 + i},
+        }
+    )
+
+
+def _load_events(rows, compact=True):
+    """Builds events from their JSON the same way the events store does."""
+    event_type = event_type_from_format_version(EventFormatVersions.V3)
+
+    events = []
+    for row in rows:
+        event = event_type(event_dict=json.loads(row), internal_metadata_dict={})
+        if compact:
+            event.compact()
+        events.append(event)
+
+    return events
+
+
+def bytes_per_event(count=10000, compact=True):
+    """Measures the memory used by each event in the event cache.
+
+    Args:
+        count (int): The number of events to measure.
+        compact (bool): Whether to compact the events, as the events store
+            does.
+
+    Returns:
+        float: The number of bytes allocated per event.
+    """
+    rows = [_make_event_json(i) for i in range(count)]
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        events = _load_events(rows, compact=compact)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size / len(events)
+
+
+async def main(reactor, loops):
+    """
+    Benchmark how long it takes to load `loops` events into the event cache.
+    """
+    rows = [_make_event_json(i) for i in range(loops)]
+
+    start = perf_counter()
+    _load_events(rows)
+    return perf_counter() - start
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks working out which servers to send each event in a room to, as
+the federation sender does, for a room with users from 500 servers.
+
+The events alternate between messages and state changes which don't affect
+the membership. The hosts are either looked up by state group, or worked out
+from the resolved state at each event.
+"""
+
+from pyperf import perf_counter
+from synmark import make_homeserver
+
+from synapse.api.constants import EventTypes, Membership
+from synapse.api.room_versions import KNOWN_ROOM_VERSIONS
+from synapse.types import create_requester
+
+# The number of events to work out the destinations for each loop.
+NUM_EVENTS = 50
+
+
+async def _make_room(hs, num_servers):
+    """Creates a room with a user from each of `num_servers` servers in it, and
+    sends some events to it.
+
+    Returns:
+        Tuple[str, List[str]]: the room ID and the IDs of the events sent.
+    """
+    store = hs.get_datastore()
+    event_creation_handler = hs.get_event_creation_handler()
+
+    user_id = await hs.get_registration_handler().register_user(localpart="creator")
+    requester = create_requester(user_id)
+    info = await hs.get_room_creation_handler().create_room(
+        requester, {"preset": "public_chat"}, ratelimit=False
+    )
+    room_id = info["room_id"]
+    room_version = KNOWN_ROOM_VERSIONS[await store.get_room_version_id(room_id)]
+
+    for i in range(num_servers):
+        member_id = "@user:server%d.example.com" % (i,)
+        builder = hs.get_event_builder_factory().for_room_version(
+            room_version,
+            {
+                "type": EventTypes.Member,
+                "sender": member_id,
+                "state_key": member_id,
+                "room_id": room_id,
+                "content": {"membership": Membership.JOIN},
+            },
+        )
+        event, context = await event_creation_handler.create_new_client_event(builder)
+        await hs.get_storage().persistence.persist_event(event, context)
+
+    event_ids = []
+    for i in range(NUM_EVENTS):
+        if i % 2:
+            event_dict = {
+                "type": EventTypes.Message,
+                "content": {"msgtype": "m.text", "body": "Message %d" % (i,)},
+            }
+        else:
+            event_dict = {
+                "type": EventTypes.Topic,
+                "state_key": "",
+                "content": {"topic": "Topic %d" % (i,)},
+            }
+        event_dict.update({"room_id": room_id, "sender": user_id})
+        event = await event_creation_handler.create_and_send_nonmember_event(
+            requester, event_dict, ratelimit=False
+        )
+        event_ids.append(event.event_id)
+
+    return room_id, event_ids
+
+
+class FanOutSuite(object):
+    """A benchmark suite for working out the hosts in a room with users from
+    `num_servers` servers at each of a series of events.
+    """
+
+    def __init__(self, num_servers, by_state_group):
+        self.num_servers = num_servers
+        self.by_state_group = by_state_group
+        self.__name__ = "%s_%d%s" % (
+            __name__,
+            num_servers,
+            "" if by_state_group else "_resolved",
+        )
+
+    async def main(self, reactor, loops):
+        """
+        Benchmark how long it takes to work out the hosts in the room at each
+        of `NUM_EVENTS` events, `loops` times.
+        """
+        hs, wait, cleanup = await make_homeserver(reactor)
+        room_id, event_ids = await _make_room(hs, self.num_servers)
+
+        state = hs.get_state_handler()
+        store = hs.get_datastore()
+
+        start = perf_counter()
+
+        for _ in range(loops):
+            for event_id in event_ids:
+                if self.by_state_group:
+                    await state.get_hosts_in_room_at_events(room_id, [event_id])
+                else:
+                    entry = await state.resolve_state_groups_for_events(
+                        room_id, [event_id]
+                    )
+                    await store.get_joined_hosts(room_id, entry)
+
+        end = perf_counter() - start
+
+        cleanup()
+        return end
+
+
+fan_out_suites = [FanOutSuite(500, by_state_group) for by_state_group in (True, False)]
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks working out who should be sent presence updates, as the presence
+handler and federation sender do, for 100k users spread over 500 servers.
+
+Most rooms are DMs or small groups, with a long tail of larger rooms up to a
+few thousand users, and the users in more rooms are more likely to be in any
+given room. The index is either built up from scratch each loop, or already
+loaded.
+"""
+
+import itertools
+import random
+
+from pyperf import perf_counter
+
+from twisted.internet import defer
+
+from synapse.handlers.presence import (
+    PresenceInterestIndex,
+    get_interested_parties,
+    get_interested_remotes,
+)
+from synapse.storage.presence import UserPresenceState
+
+NUM_USERS = 100000
+NUM_SERVERS = 500
+
+# The proportion of the users who are on our server.
+LOCAL_USER_PROPORTION = 0.2
+
+# The number of rooms of each size range.
+ROOM_SIZES = [(15000, 2, 2), (4500, 3, 50), (450, 51, 500), (50, 501, 5000)]
+
+# The number of presence updates to work out the destinations for each loop.
+NUM_STATES = 100
+
+
+class _RoomMemberStore(object):
+    """Returns the rooms each user is in, as the data store does."""
+
+    def __init__(self, rooms):
+        self._users_in_room = rooms
+        self._rooms_for_user = {}
+        for room_id, user_ids in rooms.items():
+            for user_id in user_ids:
+                self._rooms_for_user.setdefault(user_id, set()).add(room_id)
+
+    def get_rooms_for_user(self, user_id):
+        return defer.succeed(frozenset(self._rooms_for_user.get(user_id, ())))
+
+    def get_users_in_room(self, room_id):
+        return defer.succeed(list(self._users_in_room[room_id]))
+
+
+class _HomeServer(object):
+    def __init__(self, store):
+        self._store = store
+
+    def get_datastore(self):
+        return self._store
+
+
+def _make_rooms(rng):
+    """Assigns the users to rooms.
+
+    Returns:
+        Tuple[dict[str, list[str]], list[str]]: the users in each room, and
+        the local users.
+    """
+    user_ids = []
+    local_user_ids = []
+    for i in range(NUM_USERS):
+        if rng.random() < LOCAL_USER_PROPORTION:
+            user_id = "@user%d:example.com" % (i,)
+            local_user_ids.append(user_id)
+        else:
+            # Some servers have many more users than others.
+            server = int(rng.paretovariate(1.0)) % NUM_SERVERS
+            user_id = "@user%d:server%d.example.com" % (i, server)
+        user_ids.append(user_id)
+
+    # Some users are in many more rooms than others.
+    cum_weights = list(itertools.accumulate(rng.paretovariate(2.0) for _ in user_ids))
+
+    sizes = [
+        rng.randint(min_size, max_size)
+        for count, min_size, max_size in ROOM_SIZES
+        for _ in range(count)
+    ]
+    memberships = rng.choices(user_ids, cum_weights=cum_weights, k=sum(sizes))
+
+    rooms = {}
+    for size in sizes:
+        members = set(memberships[-size:])
+        del memberships[-size:]
+
+        # We only know about rooms our users are in.
+        members.add(rng.choice(local_user_ids))
+
+        rooms["!room%d:example.com" % (len(rooms),)] = members
+
+    return rooms, local_user_ids
+
+
+class PresenceFanOutSuite(object):
+    """A benchmark suite for working out where to send the presence of
+    `NUM_STATES` local users.
+    """
+
+    def __init__(self, loaded):
+        self.loaded = loaded
+        self.__name__ = "%s%s" % (__name__, "" if loaded else "_unloaded")
+
+    async def main(self, reactor, loops):
+        """
+        Benchmark how long it takes to work out the local rooms and remote
+        servers to send `NUM_STATES` presence updates to, `loops` times.
+        """
+        rng = random.Random(0)
+        rooms, local_user_ids = _make_rooms(rng)
+        hs = _HomeServer(_RoomMemberStore(rooms))
+
+        batches = [
+            [
+                UserPresenceState.default(user_id)
+                for user_id in rng.sample(local_user_ids, NUM_STATES)
+            ]
+            for _ in range(loops)
+        ]
+
+        index = PresenceInterestIndex(hs)
+        if self.loaded:
+            for states in batches:
+                await get_interested_remotes(index, states)
+
+        start = perf_counter()
+
+        for states in batches:
+            if not self.loaded:
+                index = PresenceInterestIndex(hs)
+            await get_interested_parties(index, states)
+            await get_interested_remotes(index, states)
+
+        return perf_counter() - start
+
+
+presence_fan_out_suites = [PresenceFanOutSuite(loaded) for loaded in (True, False)]
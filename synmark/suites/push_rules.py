@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synapse.events import make_event_from_dict
+from synapse.push.baserules import list_with_base_rules
+from synapse.push.bulk_push_rule_evaluator import evaluate_push_rules_for_users
+from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent
+
+
+class RoomSizeSuite(object):
+    """A benchmark suite for evaluating push rules in a room with a given
+    number of members.
+    """
+
+    def __init__(self, room_size):
+        self.room_size = room_size
+        self.__name__ = "%s_%d" % (__name__, room_size)
+
+    async def main(self, reactor, loops):
+        """
+        Benchmark how long it takes to evaluate the push rules of every
+        member of the room for `loops` messages.
+        """
+        users = []
+        for i in range(self.room_size):
+            raw_rules = []
+
+            # Give some of the users a keyword rule, so that not everyone has
+            # the default rules.
+            if i % 10 == 0:
+                raw_rules.append(
+                    {
+                        "rule_id": "keyword%d" % (i % 50,),
+                        "priority_class": 3,
+                        "conditions": [
+                            {
+                                "kind": "event_match",
+                                "key": "content.body",
+                                "pattern": "keyword%d" % (i % 50,),
+                            }
+                        ],
+                        "actions": ["notify", {"set_tweak": "highlight"}],
+                    }
+                )
+
+            # Each user gets their own copy of the rules, as they would from
+            # the store.
+            rules = list(list_with_base_rules(raw_rules))
+            users.append(("@user%d:test" % (i,), "User %d" % (i,), rules))
+
+        start = perf_counter()
+
+        for i in range(loops):
+            event = make_event_from_dict(
+                {
+                    "event_id": "$event%d:test" % (i,),
+                    "type": "m.room.message",
+                    "sender": "@sender:test",
+                    "room_id": "!room:test",
+                    "content": {"msgtype": "m.text", "body": "Message %d" % (i,)},
+                }
+            )
+            evaluator = PushRuleEvaluatorForEvent(event, self.room_size, 0, {})
+            evaluate_push_rules_for_users(evaluator, users)
+
+        return perf_counter() - start
+
+
+room_size_suites = [RoomSizeSuite(size) for size in (10, 100, 1000, 10000)]
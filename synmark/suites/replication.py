@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the master fanning out replication updates to workers.
+
+Each suite sends batches of events stream rows to a number of connected
+workers, either encoding each batch once for all of them (as the master does),
+or once per worker.
+"""
+
+from pyperf import perf_counter
+
+from synapse.replication.tcp.protocol import (
+    ConnectionStates,
+    EncodedRdataBatch,
+    ServerReplicationStreamProtocol,
+)
+from synapse.util import Clock
+
+# The number of rows in each batch of updates.
+BATCH_SIZE = 100
+
+
+class _CountingTransport(object):
+    """A transport which throws away what is written to it."""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def _make_rows(start):
+    return [
+        (
+            start + i,
+            (
+                "ev",
+                (
+                    "$%043d" % (start + i,),
+                    "!room%d:example.com" % (i % 10,),
+                    "m.room.message",
+                    None,
+                    None,
+                    None,
+                ),
+            ),
+        )
+        for i in range(BATCH_SIZE)
+    ]
+
+
+class FanOutSuite(object):
+    """A benchmark suite for fanning out replication updates to the given
+    number of workers.
+    """
+
+    def __init__(self, num_workers, encode_once):
+        self.num_workers = num_workers
+        self.encode_once = encode_once
+        self.__name__ = "%s_%d%s" % (
+            __name__,
+            num_workers,
+            "" if encode_once else "_per_connection",
+        )
+
+    async def main(self, reactor, loops):
+        """
+        Benchmark how long it takes to send `loops` batches of updates to
+        every worker.
+        """
+        clock = Clock(reactor)
+
+        connections = []
+        for _ in range(self.num_workers):
+            conn = ServerReplicationStreamProtocol("example.com", clock, None)
+            conn.transport = _CountingTransport()
+            conn.state = ConnectionStates.ESTABLISHED
+            conn.replication_streams.add("events")
+            connections.append(conn)
+
+        batches = [_make_rows(i * BATCH_SIZE) for i in range(loops)]
+        max_length = ServerReplicationStreamProtocol.MAX_LENGTH
+
+        start = perf_counter()
+
+        for updates in batches:
+            if self.encode_once:
+                batch = EncodedRdataBatch("events", updates, max_length)
+                for conn in connections:
+                    conn.stream_updates(batch)
+            else:
+                for conn in connections:
+                    conn.stream_updates(
+                        EncodedRdataBatch("events", updates, max_length)
+                    )
+
+        return perf_counter() - start
+
+
+fan_out_suites = [
+    FanOutSuite(num_workers, encode_once)
+    for num_workers in (1, 5, 20, 50)
+    for encode_once in (True, False)
+]
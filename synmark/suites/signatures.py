@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks checking the signatures on the events received over federation,
+for a typical transaction (50 PDUs) and a large `/send_join` response (5000
+events), either in batches on the thread pool or one at a time on the reactor.
+"""
+
+from pyperf import perf_counter
+from signedjson.key import generate_signing_key, get_verify_key
+
+from twisted.internet import defer
+
+from synapse.api.room_versions import RoomVersions
+from synapse.crypto.event_signing import add_hashes_and_signatures
+from synapse.crypto.keyring import KeyFetcher, Keyring
+from synapse.events import make_event_from_dict
+from synapse.federation.federation_base import _check_sigs_on_pdus
+from synapse.logging.context import make_deferred_yieldable
+from synapse.storage.keys import FetchKeyResult
+from synapse.util import Clock
+
+ROOM_VERSION = RoomVersions.V5
+SERVER_NAME = "example.com"
+
+
+class _FakeHomeServer(object):
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self._clock = Clock(reactor)
+
+    def get_reactor(self):
+        return self._reactor
+
+    def get_clock(self):
+        return self._clock
+
+
+class _StaticKeyFetcher(KeyFetcher):
+    """A key fetcher which returns the same key for every request."""
+
+    def __init__(self, key_id, verify_key):
+        self._result = {key_id: FetchKeyResult(verify_key, 2 ** 62)}
+
+    def get_keys(self, keys_to_fetch):
+        return defer.succeed({server: self._result for server in keys_to_fetch})
+
+
+def _make_events(signing_key, count):
+    events = []
+    for i in range(count):
+        event_dict = {
+            "type": "m.room.message",
+            "room_id": "!room:example.com",
+            "sender": "@user%d:example.com" % (i % 50,),
+            "content": {
+                "msgtype": "m.text",
+                "body": "This is message number %d, with some text" % (i,),
+            },
+            "depth": i + 1,
+            "origin": SERVER_NAME,
+            "origin_server_ts": 1590000000000 + i,
+            "auth_events": ["$%043d" % (j,) for j in range(3)],
+            "prev_events": ["$%043d" % (i,)],
+        }
+        add_hashes_and_signatures(ROOM_VERSION, event_dict, SERVER_NAME, signing_key)
+        events.append(make_event_from_dict(event_dict, ROOM_VERSION))
+    return events
+
+
+class VerifyEventsSuite(object):
+    """A benchmark suite for checking the signatures on a given number of
+    events, with or without batching.
+    """
+
+    def __init__(self, num_events, batch_verify):
+        self.num_events = num_events
+        self.batch_verify = batch_verify
+        self.__name__ = "%s_%d%s" % (
+            __name__,
+            num_events,
+            "" if batch_verify else "_inline",
+        )
+
+    async def main(self, reactor, loops):
+        """
+        Benchmark how long it takes to check the signatures on `num_events`
+        events `loops` times.
+        """
+        signing_key = generate_signing_key("1")
+        key_id = "%s:%s" % (signing_key.alg, signing_key.version)
+        keyring = Keyring(
+            _FakeHomeServer(reactor),
+            key_fetchers=(_StaticKeyFetcher(key_id, get_verify_key(signing_key)),),
+            batch_verify=self.batch_verify,
+        )
+        events = _make_events(signing_key, self.num_events)
+
+        start = perf_counter()
+
+        for _ in range(loops):
+            await make_deferred_yieldable(
+                defer.gatherResults(
+                    _check_sigs_on_pdus(keyring, ROOM_VERSION.identifier, events),
+                    consumeErrors=True,
+                )
+            )
+
+        return perf_counter() - start
+
+
+verify_events_suites = [
+    VerifyEventsSuite(num_events, batch_verify)
+    for num_events in (50, 5000)
+    for batch_verify in (True, False)
+]
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from twisted.internet import defer
+
+from synapse.api.constants import EventTypes, JoinRules, Membership
+from synapse.api.room_versions import RoomVersions
+from synapse.events import make_event_from_dict
+from synapse.state import v2
+from synapse.state.pool import StateResolutionPool
+
+ROOM_ID = "!room:test"
+CREATOR = "@creator:test"
+
+
+class _ForkedRoom(object):
+    """A synthetic room with `room_size` members, whose state has forked.
+
+    On one side of the fork the creator kicks a quarter of the members and
+    changes the power levels; on the other a different (overlapping) set of
+    members change their display names.
+    """
+
+    def __init__(self, room_size):
+        self.event_map = {}
+        self._ts = 0
+
+        state = {}
+        self._add_event(state, EventTypes.Create, CREATOR, "", {"creator": CREATOR})
+        self._add_event(
+            state, EventTypes.Member, CREATOR, CREATOR, {"membership": "join"}
+        )
+        self._add_event(
+            state, EventTypes.PowerLevels, CREATOR, "", {"users": {CREATOR: 100}}
+        )
+        self._add_event(
+            state, EventTypes.JoinRules, CREATOR, "", {"join_rule": JoinRules.PUBLIC}
+        )
+
+        members = ["@user%d:test" % (i,) for i in range(room_size)]
+        for user_id in members:
+            self._add_event(
+                state, EventTypes.Member, user_id, user_id, {"membership": "join"}
+            )
+
+        state_a = dict(state)
+        for user_id in members[: room_size // 4]:
+            self._add_event(
+                state_a,
+                EventTypes.Member,
+                CREATOR,
+                user_id,
+                {"membership": Membership.LEAVE},
+            )
+        self._add_event(
+            state_a,
+            EventTypes.PowerLevels,
+            CREATOR,
+            "",
+            {"users": {CREATOR: 100, members[-1]: 50}},
+        )
+
+        state_b = dict(state)
+        for user_id in members[room_size // 8 : room_size // 2]:
+            self._add_event(
+                state_b,
+                EventTypes.Member,
+                user_id,
+                user_id,
+                {"membership": Membership.JOIN, "displayname": "New name"},
+            )
+
+        self.state_sets = [state_a, state_b]
+
+    def _add_event(self, state, event_type, sender, state_key, content):
+        auth_keys = [(EventTypes.Create, ""), (EventTypes.PowerLevels, "")]
+        if event_type == EventTypes.Member:
+            auth_keys.extend(
+                [
+                    (EventTypes.JoinRules, ""),
+                    (EventTypes.Member, sender),
+                    (EventTypes.Member, state_key),
+                ]
+            )
+        else:
+            auth_keys.append((EventTypes.Member, sender))
+
+        self._ts += 1
+        event_id = "$%d:test" % (self._ts,)
+        auth_events = sorted({state[k] for k in auth_keys if k in state})
+        event = make_event_from_dict(
+            {
+                "event_id": event_id,
+                "type": event_type,
+                "sender": sender,
+                "state_key": state_key,
+                "content": content,
+                "room_id": ROOM_ID,
+                "origin_server_ts": self._ts,
+                "auth_events": [(a, {}) for a in auth_events],
+                "prev_events": [],
+            }
+        )
+        self.event_map[event_id] = event
+        state[(event_type, state_key)] = event_id
+
+    def get_events(self, event_ids, allow_rejected=False):
+        return defer.succeed(
+            {eid: self.event_map[eid] for eid in event_ids if eid in self.event_map}
+        )
+
+    def _get_auth_chain(self, event_ids):
+        result = set()
+        stack = list(event_ids)
+        while stack:
+            event_id = stack.pop()
+            if event_id in result:
+                continue
+            result.add(event_id)
+            stack.extend(self.event_map[event_id].auth_event_ids())
+        return result
+
+    def get_auth_chain_difference(self, state_sets):
+        chains = [self._get_auth_chain(s) for s in state_sets]
+        common = chains[0].intersection(*chains[1:])
+        return defer.succeed(chains[0].union(*chains[1:]) - common)
+
+
+class ForkedRoomSuite(object):
+    """A benchmark suite for resolving the state of a forked room with a given
+    number of members, either in the main process or in a pool.
+    """
+
+    def __init__(self, room_size, use_pool):
+        self.room_size = room_size
+        self.use_pool = use_pool
+        self.__name__ = "%s_%d%s" % (__name__, room_size, "_pool" if use_pool else "")
+
+    async def main(self, reactor, loops):
+        """
+        Benchmark how long it takes to resolve the forked state `loops` times.
+        """
+        room = _ForkedRoom(self.room_size)
+
+        pool = None
+        resolve = v2.resolve_events_with_store
+        if self.use_pool:
+            pool = StateResolutionPool(reactor, num_processes=1)
+            resolve = pool.resolve_events_with_store
+
+        async def resolve_once():
+            return await resolve(
+                ROOM_ID,
+                RoomVersions.V2.identifier,
+                room.state_sets,
+                event_map=None,
+                state_res_store=room,
+            )
+
+        try:
+            # Resolve once up front, so that we don't count starting the pool.
+            await resolve_once()
+
+            start = perf_counter()
+
+            for _ in range(loops):
+                await resolve_once()
+
+            return perf_counter() - start
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+
+forked_room_suites = [
+    ForkedRoomSuite(size, use_pool)
+    for size in (100, 1000, 5000)
+    for use_pool in (False, True)
+]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.app.federation_sender import FederationSenderServer
+
+from tests.unittest import HomeserverTestCase
+
+
+class FederationSenderStartupTestCase(HomeserverTestCase):
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.update(
+            {
+                "worker_app": "synapse.app.federation_sender",
+                "worker_name": "sender1",
+                "worker_replication_host": "localhost",
+                "worker_replication_http_port": 8093,
+                "send_federation": True,
+                "federation_sender_instances": ["sender1"],
+            }
+        )
+
+        return self.setup_test_homeserver(
+            config=config, http_client=None, homeserverToUse=FederationSenderServer
+        )
+
+    def test_startup_position(self):
+        """A newly configured federation sender starts from the position the
+        previous one had got to, rather than from scratch.
+        """
+        store = self.hs.get_datastore()
+
+        # The main process was sending federation until now.
+        self.get_success(
+            store.db.simple_upsert(
+                table="federation_stream_position",
+                keyvalues={"type": "federation", "instance_name": "master"},
+                values={"stream_id": 5},
+            )
+        )
+
+        store._need_to_reset_federation_stream_positions = True
+        pos = self.get_success(
+            store.db.runWithConnection(store._get_federation_out_pos)
+        )
+        self.assertEqual(pos, 5)
+
+        rows = self.get_success(
+            store.db.simple_select_list(
+                table="federation_stream_position",
+                keyvalues={"type": "federation"},
+                retcols=("instance_name", "stream_id"),
+            )
+        )
+        self.assertEqual(rows, [{"instance_name": "sender1", "stream_id": 5}])
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import Mock
+
+from twisted.internet import defer
+
+from synapse.api.constants import PresenceState
+from synapse.app.presence_writer import PresenceWriterServer
+
+from tests.unittest import HomeserverTestCase
+
+
+class PresenceWriterTestCase(HomeserverTestCase):
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.update(
+            {
+                "worker_app": "synapse.app.presence_writer",
+                "worker_name": "presence1",
+                "worker_replication_host": "localhost",
+                "worker_replication_http_port": 8093,
+                "stream_writers": {"presence": ["master", "presence1"]},
+                "instance_map": {"presence1": {"host": "localhost", "port": 8034}},
+            }
+        )
+
+        return self.setup_test_homeserver(
+            config=config, http_client=None, homeserverToUse=PresenceWriterServer
+        )
+
+    def prepare(self, reactor, clock, hs):
+        self.presence_handler = hs.get_presence_handler()
+
+        self.updates = []
+        self.presence_handler._send_update = Mock(
+            side_effect=lambda action, states: self._record_update(action, states)
+        )
+
+        self.hs._listen_http(
+            {
+                "port": 8034,
+                "bind_addresses": ["127.0.0.1"],
+                "resources": [{"names": ["replication"]}],
+            }
+        )
+        site = self.reactor.tcpServers[0][1]
+        self.resource = site.resource.children[b"_synapse"].children[b"replication"]
+
+    def _record_update(self, action, states):
+        self.updates.append((action, states))
+        return defer.succeed({})
+
+    def _user_for(self, instance):
+        """Returns a user whose presence is handled by the given instance."""
+        shard_config = self.hs.config.worker.presence_shard_config
+        for i in range(100):
+            user_id = "@user%d:test" % (i,)
+            if shard_config.get_instance(user_id) == instance:
+                return user_id
+
+    def test_set_state(self):
+        user_id = self._user_for("presence1")
+
+        request, channel = self.make_request(
+            "POST",
+            "/_synapse/replication/presence_set_state/%s" % (user_id,),
+            {"state": {"presence": PresenceState.ONLINE}, "ignore_status_msg": False},
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        # We handle the update, and pass it on to the master to persist and
+        # send out.
+        self.assertEqual(len(self.updates), 1)
+        action, states = self.updates[0]
+        self.assertEqual(action, "notify")
+        self.assertEqual([s.user_id for s in states], [user_id])
+        self.assertEqual(states[0].state, PresenceState.ONLINE)
+
+        self.assertEqual(
+            self.presence_handler.user_to_current_state[user_id].state,
+            PresenceState.ONLINE,
+        )
+
+    def test_user_sync(self):
+        user_id = self._user_for("presence1")
+
+        request, channel = self.make_request(
+            "POST",
+            "/_synapse/replication/presence_user_sync/%s" % (user_id,),
+            {
+                "process_id": "synchrotron1",
+                "is_syncing": True,
+                "sync_time_msec": self.clock.time_msec(),
+            },
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        self.assertEqual(self.presence_handler.get_currently_syncing_users(), {user_id})
+        self.assertEqual(self.updates[-1][0], "notify")
+
+        # When the process goes away, the user stops syncing.
+        request, channel = self.make_request(
+            "POST",
+            "/_synapse/replication/presence_clear_syncs/txn1",
+            {"process_id": "synchrotron1"},
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200, channel.result)
+
+        self.assertEqual(self.presence_handler.get_currently_syncing_users(), set())
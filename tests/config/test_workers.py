@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from synapse.config._base import ConfigError
+from synapse.config.homeserver import HomeServerConfig
+
+from tests.unittest import TestCase
+from tests.utils import default_config
+
+
+class WorkerConfigTestCase(TestCase):
+    def _parse(self, **kwargs):
+        config_dict = default_config("test")
+        config_dict.update(kwargs)
+
+        config = HomeServerConfig()
+        config.parse_config_dict(config_dict, "", "")
+        return config.worker
+
+    def test_defaults(self):
+        config = self._parse()
+
+        self.assertEqual(config.instance_name, "master")
+        self.assertEqual(config.writers.events, ["master"])
+        self.assertEqual(
+            config.events_shard_config.get_instance("!room:test"), "master"
+        )
+
+    def test_event_writers(self):
+        config = self._parse(
+            worker_app="synapse.app.event_persister",
+            worker_name="writer1",
+            stream_writers={"events": ["writer1", "writer2"]},
+            instance_map={
+                "writer1": {"host": "localhost", "port": 8034},
+                "writer2": {"host": "localhost", "port": 8035},
+            },
+        )
+
+        self.assertEqual(config.instance_name, "writer1")
+        self.assertEqual(config.instance_map["writer2"].port, 8035)
+
+        # Rooms are spread across the writers, and every process agrees on
+        # which writer has which room.
+        room_ids = ["!room%d:test" % (i,) for i in range(100)]
+        instances = [config.events_shard_config.get_instance(r) for r in room_ids]
+        self.assertEqual(set(instances), {"writer1", "writer2"})
+
+        for room_id, instance in zip(room_ids, instances):
+            self.assertEqual(
+                config.events_shard_config.should_handle(instance, room_id), True
+            )
+
+    def test_event_writer_must_be_in_instance_map(self):
+        with self.assertRaises(ConfigError):
+            self._parse(stream_writers={"events": ["master", "writer1"]})
+
+    def test_presence_writers(self):
+        config = self._parse(
+            stream_writers={"presence": ["master", "presence1"]},
+            instance_map={"presence1": {"host": "localhost", "port": 8034}},
+        )
+
+        user_ids = ["@user%d:test" % (i,) for i in range(100)]
+        instances = [config.presence_shard_config.get_instance(u) for u in user_ids]
+        self.assertEqual(set(instances), {"master", "presence1"})
+
+        with self.assertRaises(ConfigError):
+            self._parse(stream_writers={"presence": ["presence1"]})
+
+    def test_federation_senders(self):
+        config = self._parse(federation_sender_instances=["sender1", "sender2"])
+
+        hosts = ["host%d" % (i,) for i in range(100)]
+        instances = [config.federation_shard_config.get_instance(h) for h in hosts]
+        self.assertEqual(set(instances), {"sender1", "sender2"})
+
+        # Without federation_sender_instances, a single sender handles every
+        # destination.
+        config = self._parse()
+        self.assertTrue(config.federation_shard_config.should_handle("master", "host"))
+
+    def test_redis_requires_worker_name(self):
+        """Workers must each have their own name to publish commands on redis."""
+        redis = {"enabled": True}
+        with self.assertRaises(ConfigError):
+            self._parse(worker_app="synapse.app.generic_worker", redis=redis)
+
+        with self.assertRaises(ConfigError):
+            self._parse(
+                worker_app="synapse.app.generic_worker",
+                worker_name="master",
+                redis=redis,
+            )
+
+        config = self._parse(
+            worker_app="synapse.app.generic_worker", worker_name="worker1", redis=redis
+        )
+        self.assertEqual(config.instance_name, "worker1")
+
+        # The main process doesn't need one.
+        self.assertEqual(self._parse(redis=redis).instance_name, "master")
@@ -325,6 +325,156 @@ class KeyringTestCase(unittest.HomeserverTestCase):
         mock_fetcher1.get_keys.assert_called_once()
         mock_fetcher2.get_keys.assert_called_once()
 
+    def test_verify_json_objects_in_batches(self):
+        """Signatures are checked in batches, with a result for each object."""
+        key1 = signedjson.key.generate_signing_key(1)
+
+        mock_fetcher = keyring.KeyFetcher()
+        mock_fetcher.get_keys = Mock(
+            return_value=defer.succeed(
+                {
+                    "server1": {
+                        get_key_id(key1): FetchKeyResult(get_verify_key(key1), 1200)
+                    }
+                }
+            )
+        )
+        kr = keyring.Keyring(self.hs, key_fetchers=(mock_fetcher,))
+
+        count = keyring.VERIFY_BATCH_SIZE * 2 + 1
+        json_objects = []
+        for i in range(count):
+            json_object = {"i": i}
+            signedjson.sign.sign_json(json_object, "server1", key1)
+            json_objects.append(json_object)
+
+        # tamper with one object in each batch
+        for i in (0, keyring.VERIFY_BATCH_SIZE + 1, count - 1):
+            json_objects[i]["i"] = -1
+
+        results = kr.verify_json_objects_for_server(
+            [("server1", j, 0, "test%d" % (i,)) for i, j in enumerate(json_objects)]
+        )
+        self.assertEqual(len(results), count)
+
+        # the checks happen on the thread pool, so nothing has completed yet
+        self.assertFalse(any(d.called for d in results))
+
+        for i, d in enumerate(results):
+            if json_objects[i]["i"] == -1:
+                e = self.get_failure(d, SynapseError).value
+                self.assertEqual(e.code, 401)
+            else:
+                self.get_success(d)
+
+        mock_fetcher.get_keys.assert_called_once()
+
+    def test_key_cache(self):
+        """Keys are cached across requests, for as long as they are valid."""
+        key1 = signedjson.key.generate_signing_key(1)
+
+        mock_fetcher = keyring.KeyFetcher()
+        mock_fetcher.get_keys = Mock(
+            side_effect=lambda keys_to_fetch: defer.succeed(
+                {
+                    "server1": {
+                        get_key_id(key1): FetchKeyResult(get_verify_key(key1), 1200)
+                    }
+                }
+            )
+        )
+        kr = keyring.Keyring(self.hs, key_fetchers=(mock_fetcher,))
+
+        json1 = {}
+        signedjson.sign.sign_json(json1, "server1", key1)
+
+        self.get_success(_verify_json_for_server(kr, "server1", json1, 500, "test1"))
+        self.get_success(_verify_json_for_server(kr, "server1", json1, 1000, "test2"))
+        mock_fetcher.get_keys.assert_called_once()
+
+        # the cached key isn't valid for long enough for this one
+        self.get_failure(
+            _verify_json_for_server(kr, "server1", json1, 1500, "test3"), SynapseError
+        )
+        self.assertEqual(mock_fetcher.get_keys.call_count, 2)
+
+    def test_refresh_keys(self):
+        """Recently used keys are refreshed before they expire."""
+        key1 = signedjson.key.generate_signing_key(1)
+        now = self.clock.time_msec()
+        valid_until_ts = [now + keyring.KEY_REFRESH_BEFORE_EXPIRY_MS * 2]
+
+        def get_keys(keys_to_fetch):
+            return defer.succeed(
+                {
+                    "server1": {
+                        get_key_id(key1): FetchKeyResult(
+                            get_verify_key(key1), valid_until_ts[0]
+                        )
+                    }
+                }
+            )
+
+        mock_fetcher = keyring.KeyFetcher()
+        mock_fetcher.get_keys = Mock(side_effect=get_keys)
+        kr = keyring.Keyring(self.hs, key_fetchers=(mock_fetcher,))
+
+        json1 = {}
+        signedjson.sign.sign_json(json1, "server1", key1)
+        self.get_success(_verify_json_for_server(kr, "server1", json1, now, "test1"))
+        mock_fetcher.get_keys.assert_called_once()
+
+        # nothing is refreshed until the key is nearly expired
+        self.reactor.advance(keyring.KEY_REFRESH_INTERVAL_MS / 1000)
+        mock_fetcher.get_keys.assert_called_once()
+
+        # the origin server gives us a fresh copy of the key
+        valid_until_ts[0] = now + keyring.KEY_REFRESH_BEFORE_EXPIRY_MS * 10
+        self.reactor.advance(keyring.KEY_REFRESH_BEFORE_EXPIRY_MS / 1000)
+        self.assertEqual(mock_fetcher.get_keys.call_count, 2)
+
+        keys_to_fetch = mock_fetcher.get_keys.call_args[0][0]
+        self.assertGreater(
+            keys_to_fetch["server1"][get_key_id(key1)], self.clock.time_msec()
+        )
+
+        # ... so we don't need to fetch it again to verify something recent
+        self.get_success(
+            _verify_json_for_server(
+                kr, "server1", json1, self.clock.time_msec(), "test2"
+            )
+        )
+        self.assertEqual(mock_fetcher.get_keys.call_count, 2)
+
+    def test_refresh_only_active_keys(self):
+        """Keys which haven't been used recently aren't refreshed."""
+        key1 = signedjson.key.generate_signing_key(1)
+        now = self.clock.time_msec()
+
+        mock_fetcher = keyring.KeyFetcher()
+        mock_fetcher.get_keys = Mock(
+            return_value=defer.succeed(
+                {
+                    "server1": {
+                        get_key_id(key1): FetchKeyResult(
+                            get_verify_key(key1), now + keyring.KEY_ACTIVE_WINDOW_MS * 2
+                        )
+                    }
+                }
+            )
+        )
+        kr = keyring.Keyring(self.hs, key_fetchers=(mock_fetcher,))
+
+        json1 = {}
+        signedjson.sign.sign_json(json1, "server1", key1)
+        self.get_success(_verify_json_for_server(kr, "server1", json1, now, "test1"))
+        mock_fetcher.get_keys.assert_called_once()
+
+        # by the time the key is due for refresh, it hasn't been used for
+        # longer than the active window.
+        self.reactor.advance(keyring.KEY_ACTIVE_WINDOW_MS * 2 / 1000)
+        mock_fetcher.get_keys.assert_called_once()
+
 
 class ServerKeyFetcherTestCase(unittest.HomeserverTestCase):
     def make_homeserver(self, reactor, clock):
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import make_event_from_dict
+
+from tests import unittest
+
+
+def _make_event():
+    return make_event_from_dict(
+        {
+            "type": "m.room.message",
+            "room_id": "!room:test",
+            "sender": "@alice:test",
+            "content": {"msgtype": "m.text", "body": "hello"},
+            "hashes": {"sha256": "abc"},
+            "signatures": {"test": {"ed25519:key": "sig"}},
+            "unsigned": {"age_ts": 1000},
+            "auth_events": [],
+            "prev_events": [],
+            "depth": 5,
+            "origin_server_ts": 1000,
+        },
+        RoomVersions.V5,
+    )
+
+
+class CompactEventTestCase(unittest.TestCase):
+    def test_get_dict_keeps_event_compact(self):
+        event = _make_event()
+        expected = event.get_dict()
+        event_id = event.event_id
+
+        event.compact()
+
+        self.assertEqual(event.get_dict(), expected)
+        self.assertEqual(event.get_pdu_json(), _make_event().get_pdu_json())
+        self.assertIsNotNone(event._compacted_json)
+
+        # Uncompacted fields don't need decoding
+        self.assertEqual(event.type, "m.room.message")
+        self.assertEqual(event.get("depth"), 5)
+        self.assertIsNotNone(event._compacted_json)
+
+        # ... and neither does recomputing the event ID.
+        event._event_id = None
+        self.assertEqual(event.event_id, event_id)
+        self.assertIsNotNone(event._compacted_json)
+
+    def test_content_not_compacted(self):
+        event = _make_event()
+        event.compact()
+
+        content = event.content
+        self.assertEqual(content, {"msgtype": "m.text", "body": "hello"})
+        self.assertIs(event.content, content)
+        self.assertIs(event["content"], content)
+        self.assertIs(event.get("content"), content)
+        self.assertIsNotNone(event._compacted_json)
+
+    def test_access_expands_event(self):
+        event = _make_event()
+        event.compact()
+
+        signatures = event.signatures
+        self.assertEqual(signatures, {"test": {"ed25519:key": "sig"}})
+        self.assertIsNone(event._compacted_json)
+
+        # Reading again gives the same objects back, and changes to them stick.
+        self.assertIs(event.signatures, signatures)
+        hashes = event.hashes
+        self.assertIs(event.hashes, hashes)
+        self.assertIs(event["hashes"], hashes)
+
+        event.signatures["other"] = {"ed25519:key": "sig2"}
+        event.compact()
+        self.assertIn("other", event.get_dict()["signatures"])
+
+    def test_item_access(self):
+        event = _make_event()
+        event.compact()
+        self.assertIn("hashes", event.keys())
+        self.assertEqual(dict(event.items())["hashes"], {"sha256": "abc"})
+        self.assertEqual(event["content"]["body"], "hello")
+
+    def test_set_expands_event(self):
+        event = _make_event()
+        event.compact()
+
+        event.signatures = {"other": {"ed25519:key": "sig2"}}
+        self.assertIsNone(event._compacted_json)
+        self.assertEqual(event.hashes, {"sha256": "abc"})
+
+        # The change sticks when the event is compacted again.
+        event.compact()
+        self.assertEqual(
+            event.get_dict()["signatures"], {"other": {"ed25519:key": "sig2"}}
+        )
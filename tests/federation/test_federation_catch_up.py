@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import Mock
+
+from twisted.internet import defer
+
+from synapse.api.errors import RequestSendFailed
+from synapse.rest import admin
+from synapse.rest.client.v1 import login, room
+
+from tests.unittest import HomeserverTestCase, override_config
+
+
+class FederationCatchUpTestCases(HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def make_homeserver(self, reactor, clock):
+        return self.setup_test_homeserver(
+            federation_transport_client=Mock(spec=["send_transaction"]),
+        )
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        # Pretend that there's another server in every room.
+        hs.get_state_handler().get_hosts_in_room_at_events = Mock(
+            side_effect=lambda room_id, event_ids: defer.succeed(["test", "host2"])
+        )
+
+        # Record the bodies of the messages sent in each transaction.
+        self.sent_pdus = []
+        self.fail_to_send = False
+
+        def send_transaction(transaction, json_data_cb):
+            if self.fail_to_send:
+                return defer.fail(RequestSendFailed(Exception("oops"), True))
+            pdus = json_data_cb()["pdus"]
+            self.sent_pdus.append([pdu["content"].get("body") for pdu in pdus])
+            return defer.succeed({})
+
+        hs.get_federation_transport_client().send_transaction.side_effect = (
+            send_transaction
+        )
+
+    def _send_message(self, body):
+        return self.helper.send(self.room_id, body, tok=self.tok)["event_id"]
+
+    def _stream_ordering(self, event_id):
+        event = self.get_success(self.store.get_event(event_id))
+        return event.internal_metadata.stream_ordering
+
+    def _setup_room(self):
+        self.register_user("u1", "pass")
+        self.tok = self.login("u1", "pass")
+        self.room_id = self.helper.create_room_as("u1", tok=self.tok)
+        self.pump()
+        self.sent_pdus.clear()
+
+    @override_config({"send_federation": True})
+    def test_catch_up_after_failure(self):
+        self._setup_room()
+        sender = self.hs.get_federation_sender()
+
+        event_id_1 = self._send_message("1")
+        self.pump()
+        self.assertEqual(self.sent_pdus, [["1"]])
+        self.assertEqual(
+            self.get_success(
+                self.store.get_destination_last_successful_stream_ordering("host2")
+            ),
+            self._stream_ordering(event_id_1),
+        )
+
+        # Sending fails, so we start catching up and stop queuing PDUs.
+        self.fail_to_send = True
+        self._send_message("2")
+        self.pump()
+        event_id_3 = self._send_message("3")
+        self.pump()
+
+        queue = sender._per_destination_queues["host2"]
+        self.assertTrue(queue._catching_up)
+        self.assertEqual(queue.pending_pdu_count(), 0)
+
+        self.assertEqual(
+            self.get_success(self.store.get_catch_up_outstanding_destinations(None)),
+            ["host2"],
+        )
+
+        # When the destination comes back, it only gets the latest event in the
+        # room.
+        self.fail_to_send = False
+        self.sent_pdus.clear()
+        sender.wake_destination("host2")
+        self.pump()
+
+        self.assertEqual(self.sent_pdus, [["3"]])
+        self.assertFalse(queue._catching_up)
+        self.assertEqual(
+            self.get_success(
+                self.store.get_destination_last_successful_stream_ordering("host2")
+            ),
+            self._stream_ordering(event_id_3),
+        )
+        self.assertEqual(
+            self.get_success(self.store.get_catch_up_outstanding_destinations(None)),
+            [],
+        )
+
+        # And then we go back to sending events as they happen.
+        self._send_message("4")
+        self.pump()
+        self.assertEqual(self.sent_pdus, [["3"], ["4"]])
+
+    @override_config({"send_federation": True})
+    def test_catch_up_on_startup(self):
+        self._setup_room()
+        sender = self.hs.get_federation_sender()
+
+        self._send_message("1")
+        self.pump()
+
+        self.fail_to_send = True
+        self._send_message("2")
+        self.pump()
+
+        # Forget about the queue, as if we had restarted.
+        sender._per_destination_queues.clear()
+        self.fail_to_send = False
+        self.sent_pdus.clear()
+
+        self.get_success(sender._wake_destinations_needing_catchup(), by=1)
+        self.assertEqual(self.sent_pdus, [["2"]])
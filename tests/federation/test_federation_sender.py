@@ -17,6 +17,7 @@ from mock import Mock
 
 from twisted.internet import defer
 
+from synapse.config.workers import ShardedWorkerHandlingConfig
 from synapse.types import ReadReceipt
 
 from tests.unittest import HomeserverTestCase, override_config
@@ -147,3 +148,80 @@ class FederationSenderTestCases(HomeserverTestCase):
                 }
             ],
         )
+
+    @override_config(
+        {"send_federation": True, "federation_sender_instances": ["master", "other"]}
+    )
+    def test_send_receipts_sharded(self):
+        """Each federation sender instance only sends to its own destinations."""
+        hosts = ["host%d" % (i,) for i in range(10)]
+        shard_config = ShardedWorkerHandlingConfig(["master", "other"])
+        our_hosts = {h for h in hosts if shard_config.should_handle("master", h)}
+        self.assertTrue(0 < len(our_hosts) < len(hosts))
+
+        mock_state_handler = self.hs.get_state_handler()
+        mock_state_handler.get_current_hosts_in_room.return_value = ["test"] + hosts
+
+        mock_send_transaction = (
+            self.hs.get_federation_transport_client().send_transaction
+        )
+        mock_send_transaction.return_value = defer.succeed({})
+
+        sender = self.hs.get_federation_sender()
+        receipt = ReadReceipt(
+            "room_id", "m.read", "user_id", ["event_id"], {"ts": 1234}
+        )
+        self.successResultOf(sender.send_read_receipt(receipt))
+        self.pump()
+
+        destinations = {
+            call[0][0].destination for call in mock_send_transaction.call_args_list
+        }
+        self.assertEqual(destinations, our_hosts)
+
+
+class FederationStreamPositionTestCase(HomeserverTestCase):
+    @override_config(
+        {"send_federation": True, "federation_sender_instances": ["master", "other"]}
+    )
+    def test_positions_per_instance(self):
+        """Each federation sender instance tracks its own stream positions,
+        starting from where the existing ones had got to.
+        """
+        store = self.hs.get_datastore()
+
+        pos = self.get_success(store.get_federation_out_pos("events"))
+        self.get_success(store.update_federation_out_pos("events", pos + 10))
+        self.assertEqual(
+            self.get_success(store.get_federation_out_pos("events")), pos + 10
+        )
+
+        other_pos = self.get_success(
+            store.db.simple_select_one_onecol(
+                table="federation_stream_position",
+                keyvalues={"type": "events", "instance_name": "other"},
+                retcol="stream_id",
+            )
+        )
+        self.assertEqual(other_pos, pos)
+
+
+class FederationAckTestCase(HomeserverTestCase):
+    @override_config({"federation_sender_instances": ["sender1", "sender2"]})
+    def test_clear_queue_once_all_acked(self):
+        """The master keeps the federation stream until every federation sender
+        instance has acknowledged it.
+        """
+        send_queue = self.hs.get_federation_sender()
+        send_queue.build_and_send_edu("host1", "m.test", {})
+        send_queue.build_and_send_edu("host2", "m.test", {})
+        token = send_queue.get_current_token()
+
+        send_queue.federation_ack("sender1", token + 1)
+        self.assertEqual(len(send_queue.edus), 2)
+
+        send_queue.federation_ack("sender2", token)
+        self.assertEqual(len(send_queue.edus), 1)
+
+        send_queue.federation_ack("sender2", token + 1)
+        self.assertEqual(len(send_queue.edus), 0)
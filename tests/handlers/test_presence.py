@@ -18,6 +18,8 @@ from mock import Mock, call
 
 from signedjson.key import generate_signing_key
 
+from twisted.internet import defer
+
 from synapse.api.constants import EventTypes, Membership, PresenceState
 from synapse.api.room_versions import KNOWN_ROOM_VERSIONS
 from synapse.events.builder import EventBuilder
@@ -28,6 +30,7 @@ from synapse.handlers.presence import (
     IDLE_TIMER,
     LAST_ACTIVE_GRANULARITY,
     SYNC_ONLINE_TIMEOUT,
+    get_interested_remotes,
     handle_timeout,
     handle_update,
 )
@@ -616,3 +619,223 @@ class PresenceJoinTestCase(unittest.HomeserverTestCase):
         # Check that it was successfully persisted.
         self.get_success(self.store.get_event(event.event_id))
         self.get_success(self.store.get_event(event.event_id))
+
+
+class PresenceInterestIndexTestCase(unittest.HomeserverTestCase):
+    """Tests the index of who shares a room is kept up to date, and used to
+    work out where to send presence.
+    """
+
+    user_id = "@test:server"
+
+    servlets = [room.register_servlets]
+
+    def make_homeserver(self, reactor, clock):
+        hs = self.setup_test_homeserver(
+            "server", http_client=None, federation_sender=Mock()
+        )
+        return hs
+
+    def prepare(self, reactor, clock, hs):
+        self.index = hs.get_presence_interest_index()
+
+    def test_membership_changes(self):
+        room_id = self.helper.create_room_as(self.user_id)
+
+        # Load the entries, so that they need updating as the membership of the
+        # room changes.
+        rooms = self.get_success(self.index.get_rooms_for_user("@test2:server"))
+        self.assertEqual(rooms, set())
+        users = self.get_success(self.index.get_users_in_room(room_id))
+        self.assertEqual(users, {self.user_id})
+
+        self.helper.join(room_id, "@test2:server")
+        self.reactor.pump([0])  # Wait for the state deltas to be handled
+
+        rooms = self.get_success(self.index.get_rooms_for_user("@test2:server"))
+        self.assertEqual(rooms, {room_id})
+        users = self.get_success(self.index.get_users_in_room(room_id))
+        self.assertEqual(users, {self.user_id, "@test2:server"})
+        shared = self.get_success(
+            self.index.get_users_who_share_room_with_user(self.user_id)
+        )
+        self.assertEqual(shared, {self.user_id, "@test2:server"})
+
+        self.helper.leave(room_id, "@test2:server")
+        self.reactor.pump([0])
+
+        rooms = self.get_success(self.index.get_rooms_for_user("@test2:server"))
+        self.assertEqual(rooms, set())
+        users = self.get_success(self.index.get_users_in_room(room_id))
+        self.assertEqual(users, {self.user_id})
+
+    def test_get_interested_remotes(self):
+        room_id1 = self.helper.create_room_as(self.user_id)
+        room_id2 = self.helper.create_room_as(self.user_id)
+
+        # Pretend some remote users join the rooms, once they're loaded.
+        for room_id in (room_id1, room_id2):
+            self.get_success(self.index.get_users_in_room(room_id))
+        self.index.update_membership(room_id1, "@alice:server2", True)
+        self.index.update_membership(room_id2, "@alice:server2", True)
+        self.index.update_membership(room_id2, "@bob:server3", True)
+        self.index.update_membership(room_id2, "@carol:server3", True)
+
+        hosts = self.get_success(self.index.get_hosts_in_room(room_id2))
+        self.assertEqual(set(hosts), {"server", "server2", "server3"})
+
+        # Each server gets the state once, even if it shares several rooms with
+        # the user.
+        state = UserPresenceState.default(self.user_id)
+        states_by_host = self.get_success(get_interested_remotes(self.index, [state]))
+        self.assertEqual(
+            states_by_host, {"server": [state], "server2": [state], "server3": [state]},
+        )
+
+        # The server only stops sharing the room once all its users have left.
+        self.index.update_membership(room_id2, "@bob:server3", False)
+        hosts = self.get_success(self.index.get_hosts_in_room(room_id2))
+        self.assertEqual(set(hosts), {"server", "server2", "server3"})
+
+        self.index.update_membership(room_id2, "@carol:server3", False)
+        hosts = self.get_success(self.index.get_hosts_in_room(room_id2))
+        self.assertEqual(set(hosts), {"server", "server2"})
+
+    def test_change_during_load(self):
+        """Membership changes which arrive while an entry is being loaded from
+        the database are applied to what is loaded.
+        """
+        room_id = self.helper.create_room_as(self.user_id)
+
+        store = self.hs.get_datastore()
+        users_deferred = defer.Deferred()
+        rooms_deferred = defer.Deferred()
+        store.get_users_in_room = Mock(return_value=users_deferred)
+        store.get_rooms_for_user = Mock(return_value=rooms_deferred)
+
+        users_load = self.index.get_users_in_room(room_id)
+        rooms_load = self.index.get_rooms_for_user("@alice:server2")
+
+        self.index.update_membership(room_id, "@alice:server2", True)
+        self.index.update_membership(room_id, self.user_id, False)
+
+        # The database reads return what was there before the changes.
+        users_deferred.callback([self.user_id])
+        rooms_deferred.callback(frozenset())
+
+        self.assertEqual(self.get_success(users_load), {"@alice:server2"})
+        self.assertEqual(self.get_success(rooms_load), {room_id})
+
+        hosts = self.get_success(self.index.get_hosts_in_room(room_id))
+        self.assertEqual(set(hosts), {"server2"})
+
+    def test_ignores_unknown_deltas(self):
+        """Deltas for users and rooms which aren't in the index don't need the
+        event looking up.
+        """
+        store = self.hs.get_datastore()
+        store.get_event = Mock(side_effect=store.get_event)
+
+        self.get_success(
+            self.index.process_membership_delta("!room:server", "@alice:server", "$e")
+        )
+        store.get_event.assert_not_called()
+
+        room_id = self.helper.create_room_as(self.user_id)
+        self.get_success(self.index.get_users_in_room(room_id))
+        store.get_event.reset_mock()
+
+        self.helper.join(room_id, "@test2:server")
+        self.reactor.pump([0])
+        self.assertTrue(store.get_event.called)
+
+
+class PresenceShardingTestCase(unittest.HomeserverTestCase):
+    """Tests the master passes on presence updates for users handled by another
+    presence writer.
+    """
+
+    def default_config(self, name="test"):
+        config = super(PresenceShardingTestCase, self).default_config(name)
+        config["stream_writers"] = {"presence": ["master", "presence1"]}
+        config["instance_map"] = {"presence1": {"host": "localhost", "port": 8034}}
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.presence_handler = hs.get_presence_handler()
+        self.clock = hs.get_clock()
+
+        self.presence_handler._send_set_state = Mock(return_value=defer.succeed(None))
+        self.presence_handler._send_incoming = Mock(return_value=defer.succeed(None))
+
+        self.users = self._users_by_writer("test")
+
+    def _users_by_writer(self, server_name):
+        """Finds a user on the given server for each of the presence writers.
+
+        Returns:
+            dict[str, str]: map from instance name to user ID
+        """
+        shard_config = self.hs.config.worker.presence_shard_config
+        users = {}
+        for i in range(100):
+            user_id = "@user%d:%s" % (i, server_name)
+            users.setdefault(shard_config.get_instance(user_id), user_id)
+        return users
+
+    def test_set_state(self):
+        local_user = self.users["master"]
+        other_user = self.users["presence1"]
+
+        for user_id in (local_user, other_user):
+            self.get_success(
+                self.presence_handler.set_state(
+                    UserID.from_string(user_id), {"presence": PresenceState.ONLINE}
+                )
+            )
+
+        self.presence_handler._send_set_state.assert_called_once_with(
+            instance_name="presence1",
+            user_id=other_user,
+            state={"presence": PresenceState.ONLINE},
+            ignore_status_msg=False,
+        )
+        self.assertIn(local_user, self.presence_handler.user_to_current_state)
+        self.assertNotIn(other_user, self.presence_handler.user_to_current_state)
+
+    def test_update_from_writer(self):
+        other_user = self.users["presence1"]
+
+        state = UserPresenceState.default(other_user).copy_and_replace(
+            state=PresenceState.ONLINE, last_active_ts=self.clock.time_msec()
+        )
+        self.get_success(self.presence_handler.update_from_writer("notify", [state]))
+
+        # We read the presence of users handled by other writers from the
+        # database.
+        new_state = self.get_success(
+            self.presence_handler.get_state(UserID.from_string(other_user))
+        )
+        self.assertEqual(new_state.state, PresenceState.ONLINE)
+        self.assertNotIn(other_user, self.presence_handler.user_to_current_state)
+
+    def test_incoming_presence(self):
+        remote_users = self._users_by_writer("remote")
+        master_user = remote_users["master"]
+        other_user = remote_users["presence1"]
+
+        pushes = [
+            {"user_id": user_id, "presence": PresenceState.ONLINE}
+            for user_id in (master_user, other_user)
+        ]
+        self.get_success(
+            self.presence_handler.incoming_presence("remote", {"push": pushes})
+        )
+
+        self.presence_handler._send_incoming.assert_called_once_with(
+            instance_name="presence1", origin="remote", content={"push": pushes[1:]}
+        )
+        self.assertEqual(
+            self.presence_handler.user_to_current_state[master_user].state,
+            PresenceState.ONLINE,
+        )
@@ -13,9 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import synapse.rest.admin
 from synapse.api.errors import Codes, ResourceLimitError
 from synapse.api.filtering import DEFAULT_FILTER_COLLECTION
 from synapse.handlers.sync import SyncConfig
+from synapse.rest.client.v1 import login, room
 from synapse.types import UserID
 
 import tests.unittest
@@ -25,6 +27,12 @@ import tests.utils
 class SyncTestCase(tests.unittest.HomeserverTestCase):
     """ Tests Sync Handler. """
 
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
     def prepare(self, reactor, clock, hs):
         self.hs = hs
         self.sync_handler = self.hs.get_sync_handler()
@@ -60,6 +68,66 @@ class SyncTestCase(tests.unittest.HomeserverTestCase):
         )
         self.assertEquals(e.value.errcode, Codes.RESOURCE_LIMIT_EXCEEDED)
 
+    def test_reuses_unchanged_rooms(self):
+        """Repeating a sync with the same parameters should reuse the entries of
+        rooms that haven't changed, and recompute the rest.
+        """
+        user_id = self.register_user("user", "pass")
+        tok = self.login("user", "pass")
+        unchanged_room = self.helper.create_room_as(user_id, tok=tok)
+        changed_room = self.helper.create_room_as(user_id, tok=tok)
+
+        sync_config = self._generate_sync_config(user_id)
+
+        result = self.get_success(
+            self.sync_handler.wait_for_sync_for_user(sync_config, full_state=True)
+        )
+        first = {r.room_id: r for r in result.joined}
+        self.assertEqual(set(first), {unchanged_room, changed_room})
+
+        self.helper.send(changed_room, "hello", tok=tok)
+
+        result = self.get_success(
+            self.sync_handler.wait_for_sync_for_user(sync_config, full_state=True)
+        )
+        second = {r.room_id: r for r in result.joined}
+        self.assertEqual(set(second), {unchanged_room, changed_room})
+
+        self.assertIs(second[unchanged_room].state, first[unchanged_room].state)
+        self.assertIs(second[unchanged_room].timeline, first[unchanged_room].timeline)
+
+        self.assertIsNot(second[changed_room].timeline, first[changed_room].timeline)
+        self.assertEqual(
+            second[changed_room].timeline.events[-1].content,
+            {"body": "hello", "msgtype": "m.text"},
+        )
+
+        # A sync with different parameters shouldn't reuse anything.
+        since_token = result.next_batch
+        result = self.get_success(
+            self.sync_handler.wait_for_sync_for_user(
+                sync_config, since_token=since_token, full_state=True
+            )
+        )
+        third = {r.room_id: r for r in result.joined}
+        self.assertIsNot(third[unchanged_room].state, second[unchanged_room].state)
+
+    def test_snapshot_cache_sized_by_rooms(self):
+        """The snapshots in the cache count towards its size by the number of
+        rooms in them.
+        """
+        user_id = self.register_user("user", "pass")
+        tok = self.login("user", "pass")
+        for _ in range(3):
+            self.helper.create_room_as(user_id, tok=tok)
+
+        self.get_success(
+            self.sync_handler.wait_for_sync_for_user(
+                self._generate_sync_config(user_id)
+            )
+        )
+        self.assertEqual(len(self.sync_handler.sync_snapshot_cache), 4)
+
     def _generate_sync_config(self, user_id):
         return SyncConfig(
             user=UserID(user_id.split(":")[0][1:], user_id.split(":")[1]),
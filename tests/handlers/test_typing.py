@@ -73,6 +73,7 @@ class TypingNotificationsTestCase(unittest.HomeserverTestCase):
                 "get_received_txn_response",
                 "set_received_txn_response",
                 "get_destination_retry_timings",
+                "get_destination_last_successful_stream_ordering",
                 "get_devices_by_remote",
                 # Bits that user_directory needs
                 "get_user_directory_stream_pos",
@@ -115,6 +116,10 @@ class TypingNotificationsTestCase(unittest.HomeserverTestCase):
             (0, [])
         )
 
+        self.datastore.get_destination_last_successful_stream_ordering.return_value = defer.succeed(
+            None
+        )
+
         def get_received_txn_response(*args):
             return defer.succeed(None)
 
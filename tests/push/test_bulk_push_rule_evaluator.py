@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.events import make_event_from_dict
+from synapse.push.baserules import list_with_base_rules
+from synapse.push.bulk_push_rule_evaluator import (
+    compile_push_rules,
+    evaluate_push_rules_for_users,
+)
+from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent
+
+from tests import unittest
+
+
+def _evaluate_naively(evaluator, users):
+    """Evaluates the push rules for each user in turn, one condition at a time.
+    """
+    actions_by_user = {}
+    for uid, display_name, rules in users:
+        for rule in rules:
+            if "enabled" in rule and not rule["enabled"]:
+                continue
+
+            if all(
+                evaluator.matches(cond, uid, display_name)
+                for cond in rule["conditions"]
+            ):
+                actions = [x for x in rule["actions"] if x != "dont_notify"]
+                if actions and "notify" in actions:
+                    actions_by_user[uid] = actions
+                break
+
+    return actions_by_user
+
+
+def _keyword_rule(keyword):
+    return {
+        "rule_id": keyword,
+        "priority_class": 3,
+        "conditions": [
+            {"kind": "event_match", "key": "content.body", "pattern": keyword}
+        ],
+        "actions": ["notify", {"set_tweak": "highlight"}],
+    }
+
+
+def _disabled_override(rule_id):
+    return {
+        "rule_id": rule_id,
+        "priority_class": -1,
+        "enabled": False,
+        "conditions": [],
+        "actions": [],
+    }
+
+
+class BulkPushRuleEvaluatorTestCase(unittest.TestCase):
+    def setUp(self):
+        # A mix of users with default rules, keyword rules and some of the
+        # base rules disabled.
+        self.users = []
+        for i in range(20):
+            uid = "@user%d:test" % (i,)
+            raw_rules = []
+            if i % 3 == 1:
+                raw_rules.append(_keyword_rule("lunch"))
+            if i % 5 == 2:
+                raw_rules.append(_disabled_override(".m.rule.contains_display_name"))
+            if i % 7 == 3:
+                raw_rules.append(_disabled_override(".m.rule.member_event"))
+
+            rules = list(list_with_base_rules(raw_rules))
+            self.users.append((uid, "User %d" % (i,), rules))
+
+    def _make_evaluator(self, event_dict, room_member_count=20):
+        event_dict.setdefault("event_id", "$event:test")
+        event_dict.setdefault("sender", "@user0:test")
+        event_dict.setdefault("room_id", "!room:test")
+        event = make_event_from_dict(event_dict)
+        return PushRuleEvaluatorForEvent(
+            event, room_member_count, 100, {"users": {"@user0:test": 100}}
+        )
+
+    def _assert_matches_naive(self, evaluator):
+        actions_by_user = evaluate_push_rules_for_users(evaluator, self.users)
+        self.assertEqual(actions_by_user, _evaluate_naively(evaluator, self.users))
+        return actions_by_user
+
+    def test_message(self):
+        evaluator = self._make_evaluator(
+            {"type": "m.room.message", "content": {"body": "anyone for lunch?"}}
+        )
+        actions_by_user = self._assert_matches_naive(evaluator)
+
+        # Every user should be notified, and those with the keyword rule
+        # should get a highlight.
+        self.assertEqual(len(actions_by_user), 20)
+        self.assertIn({"set_tweak": "highlight"}, actions_by_user["@user1:test"])
+        self.assertNotIn({"set_tweak": "highlight"}, actions_by_user["@user2:test"])
+
+    def test_display_name(self):
+        evaluator = self._make_evaluator(
+            {"type": "m.room.message", "content": {"body": "hello User 2, User 7"}}
+        )
+        self._assert_matches_naive(evaluator)
+
+    def test_one_to_one_room(self):
+        evaluator = self._make_evaluator(
+            {"type": "m.room.message", "content": {"body": "hi"}}, room_member_count=2,
+        )
+        self._assert_matches_naive(evaluator)
+
+    def test_invite(self):
+        evaluator = self._make_evaluator(
+            {
+                "type": "m.room.member",
+                "state_key": "@user4:test",
+                "content": {"membership": "invite"},
+            }
+        )
+        self._assert_matches_naive(evaluator)
+
+    def test_room_notification(self):
+        evaluator = self._make_evaluator(
+            {"type": "m.room.message", "content": {"body": "@room, lunch"}}
+        )
+        self._assert_matches_naive(evaluator)
+
+    def test_identical_rules_share_compiled_rule_set(self):
+        rules_a = list(list_with_base_rules([]))
+        rules_b = list(list_with_base_rules([]))
+        rules_c = list(list_with_base_rules([_keyword_rule("lunch")]))
+
+        self.assertIs(compile_push_rules(rules_a), compile_push_rules(rules_b))
+        self.assertIsNot(compile_push_rules(rules_a), compile_push_rules(rules_c))
@@ -12,6 +12,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from typing import Tuple
+
 from mock import Mock
 
 from synapse.replication.tcp.commands import ReplicateCommand
@@ -25,18 +27,21 @@ from tests.server import FakeTransport
 class BaseStreamTestCase(unittest.HomeserverTestCase):
     """Base class for tests of the replication streams"""
 
+    # The binary modes the client offers the server
+    client_modes = ()  # type: Tuple[str, ...]
+
     def prepare(self, reactor, clock, hs):
         # build a replication server
         server_factory = ReplicationStreamProtocolFactory(self.hs)
         self.streamer = server_factory.streamer
-        server = server_factory.buildProtocol(None)
+        self.server = server = server_factory.buildProtocol(None)
 
         # build a replication client, with a dummy handler
         handler_factory = Mock()
         self.test_handler = TestReplicationClientHandler()
         self.test_handler.factory = handler_factory
         self.client = ClientReplicationStreamProtocol(
-            "client", "test", clock, self.test_handler
+            "client", "test", clock, self.test_handler, self.client_modes
         )
 
         # wire them together
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import zlib
+
+from synapse.replication.tcp.commands import PingCommand, RdataCommand
+from synapse.replication.tcp.framing import (
+    FrameReader,
+    FrameTooLongError,
+    FrameWriter,
+    decode_frame,
+    encode_frame,
+)
+from synapse.replication.tcp.protocol import EncodedRdataBatch
+
+from tests import unittest
+from tests.replication.tcp.streams._base import BaseStreamTestCase
+
+
+class EncodedRdataBatchTestCase(unittest.TestCase):
+    def test_encode(self):
+        batch = EncodedRdataBatch(
+            "presence", [(None, ["@foo:test", "online"]), (5, ["@bar:test"])], 1000
+        )
+
+        self.assertEqual(
+            batch.data,
+            b'RDATA presence batch ["@foo:test", "online"]\n'
+            b'RDATA presence 5 ["@bar:test"]\n',
+        )
+        self.assertEqual(batch.num_lines, 2)
+
+    def test_drop_long_lines(self):
+        batch = EncodedRdataBatch(
+            "presence", [(4, ["@foo:test" * 10]), (5, ["@bar:test"])], 50
+        )
+
+        self.assertEqual(batch.data, b'RDATA presence 5 ["@bar:test"]\n')
+        self.assertEqual(batch.updates, [(5, ["@bar:test"])])
+
+
+def _insert_receipt(hs, user_id):
+    return hs.get_datastore().insert_receipt(
+        "!room:blue", "m.read", user_id, ["$event:blue"], {}
+    )
+
+
+class BackpressureTestCase(BaseStreamTestCase):
+    def _insert_receipt(self, user_id):
+        self.get_success(_insert_receipt(self.hs, user_id))
+
+    def test_paused_connection(self):
+        """Updates are held back while the connection is paused, and sent once
+        it resumes.
+        """
+        self.replicate_stream("receipts", "NOW")
+        self.pump(0.1)
+
+        self.server.pauseProducing()
+        self._insert_receipt("@user1:blue")
+        self._insert_receipt("@user2:blue")
+        self.replicate()
+
+        self.assertEqual(self.test_handler.received_rdata_rows, [])
+
+        self.server.resumeProducing()
+        self.pump(0.1)
+
+        self.assertEqual(
+            [row.user_id for _, _, row in self.test_handler.received_rdata_rows],
+            ["@user1:blue", "@user2:blue"],
+        )
+
+    def test_paused_connection_falls_behind(self):
+        """If a paused connection falls too far behind it is closed."""
+        self.replicate_stream("receipts", "NOW")
+        self.pump(0.1)
+
+        self.server.max_line_buffer = 1
+        self.server.pauseProducing()
+        self._insert_receipt("@user1:blue")
+        self.replicate()
+        self._insert_receipt("@user2:blue")
+        self.replicate()
+
+        self.assertEqual(self.server.state, "closed")
+
+
+class FramingTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        cmd = decode_frame(
+            encode_frame(RdataCommand("presence", None, ["@foo:test"]))[4:]
+        )
+        self.assertIsInstance(cmd, RdataCommand)
+        self.assertEqual(cmd.stream_name, "presence")
+        self.assertIsNone(cmd.token)
+        self.assertEqual(cmd.row, ["@foo:test"])
+
+        cmd = decode_frame(encode_frame(PingCommand("1234"))[4:])
+        self.assertIsInstance(cmd, PingCommand)
+        self.assertEqual(cmd.data, "1234")
+
+    def test_reader(self):
+        for mode in ("binary", "binary-zlib"):
+            writer = FrameWriter(mode)
+            reader = FrameReader(mode, 1000)
+
+            data = writer.write(
+                encode_frame(PingCommand("1")) + encode_frame(PingCommand("2"))
+            )
+
+            # Feed the data in a byte at a time, to check we handle partial
+            # frames.
+            frames = []
+            for i in range(len(data)):
+                frames.extend(reader.feed(data[i : i + 1]))
+
+            self.assertEqual([decode_frame(f).data for f in frames], ["1", "2"])
+
+    def test_compression_spans_writes(self):
+        """Repeated rows should compress well, even when written separately."""
+        writer = FrameWriter("binary-zlib")
+        frame = encode_frame(RdataCommand("events", 1, ["$event:test", "!room:test"]))
+
+        first = writer.write(frame)
+        second = writer.write(frame)
+        self.assertLess(len(second), len(first))
+
+        # The output is a valid zlib stream
+        self.assertEqual(zlib.decompressobj().decompress(first + second), frame * 2)
+
+    def test_frame_too_long(self):
+        reader = FrameReader("binary", 10)
+        with self.assertRaises(FrameTooLongError):
+            reader.feed(encode_frame(PingCommand("a" * 20)))
+
+
+class BinaryModeTestCase(BaseStreamTestCase):
+    client_modes = ("binary-zlib", "binary")
+
+    def test_negotiate(self):
+        self.pump(0.1)
+
+        self.assertEqual(self.server.mode, "binary-zlib")
+        self.assertEqual(self.client.mode, "binary-zlib")
+        self.assertFalse(self.server.line_mode)
+        self.assertFalse(self.client.line_mode)
+
+    def test_replicate(self):
+        """Check that replication works once we've switched mode."""
+        self.replicate_stream("receipts", "NOW")
+        self.pump(0.1)
+
+        self.get_success(_insert_receipt(self.hs, "@user1:blue"))
+        self.get_success(_insert_receipt(self.hs, "@user2:blue"))
+        self.replicate()
+
+        self.assertEqual(
+            [row.user_id for _, _, row in self.test_handler.received_rdata_rows],
+            ["@user1:blue", "@user2:blue"],
+        )
+        self.assertEqual(self.server.state, "established")
+
+
+class TextModeTestCase(BaseStreamTestCase):
+    def test_old_client(self):
+        """Clients which don't offer a binary mode stay in text mode."""
+        self.pump(0.1)
+
+        self.assertIsNone(self.server.mode)
+        self.assertTrue(self.server.line_mode)
+        self.assertTrue(self.client.line_mode)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from fnmatch import fnmatchcase
+
+from mock import Mock, patch
+
+from twisted.internet import defer
+from twisted.internet.protocol import Factory, Protocol
+
+from synapse.replication.tcp.client import ReplicationClientHandler
+from synapse.replication.tcp.commands import (
+    InvalidateCacheCommand,
+    RemoteServerUpCommand,
+    UserSyncCommand,
+)
+from synapse.replication.tcp.redis import (
+    RedisError,
+    RedisPublisher,
+    RedisPubSub,
+    RedisSubscriber,
+    _IncompleteReply,
+    encode_redis_command,
+    parse_redis_reply,
+)
+from synapse.replication.tcp.resource import ReplicationStreamer
+
+from tests import unittest
+from tests.server import FakeTransport
+from tests.unittest import override_config
+
+
+class RedisProtocolTestCase(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(
+            encode_redis_command("PUBLISH", "chan", b"msg"),
+            b"*3\r\n$7\r\nPUBLISH\r\n$4\r\nchan\r\n$3\r\nmsg\r\n",
+        )
+
+    def test_parse(self):
+        buf = b"*3\r\n$8\r\npmessage\r\n:1\r\n*2\r\n+OK\r\n$-1\r\n-ERR oops\r\n"
+
+        reply, pos = parse_redis_reply(buf)
+        self.assertEqual(reply, [b"pmessage", 1, [b"OK", None]])
+
+        reply, pos = parse_redis_reply(buf, pos)
+        self.assertIsInstance(reply, RedisError)
+        self.assertEqual(pos, len(buf))
+
+    def test_parse_incomplete(self):
+        with self.assertRaises(_IncompleteReply):
+            parse_redis_reply(b"*2\r\n$3\r\nfoo\r\n$3\r\nba")
+
+
+class FakeRedisServer(Factory):
+    """A fake redis server which only supports pub/sub."""
+
+    def __init__(self):
+        # Map from connection to the patterns it is subscribed to
+        self.subscribers = {}
+
+    def buildProtocol(self, addr):
+        return FakeRedisConnection(self)
+
+
+class FakeRedisConnection(Protocol):
+    def __init__(self, server):
+        self.server = server
+        self._buffer = b""
+
+    def dataReceived(self, data):
+        self._buffer += data
+        while self._buffer:
+            try:
+                args, pos = parse_redis_reply(self._buffer)
+            except _IncompleteReply:
+                return
+            self._buffer = self._buffer[pos:]
+            self.handle_command(args[0].decode("ascii").upper(), args[1:])
+
+    def handle_command(self, name, args):
+        if name == "AUTH":
+            self.send_reply(b"+OK\r\n")
+        elif name == "PSUBSCRIBE":
+            patterns = self.server.subscribers.setdefault(self, [])
+            for pattern in args:
+                patterns.append(pattern)
+                self.send_reply(
+                    encode_redis_command("psubscribe", pattern, len(patterns))
+                )
+        elif name == "PUBLISH":
+            channel, message = args
+            received = 0
+            for conn, patterns in self.server.subscribers.items():
+                for pattern in patterns:
+                    if fnmatchcase(channel.decode(), pattern.decode()):
+                        conn.send_reply(
+                            encode_redis_command("pmessage", pattern, channel, message)
+                        )
+                        received += 1
+            self.send_reply(b":%d\r\n" % (received,))
+        else:
+            self.send_reply(b"-ERR unknown command\r\n")
+
+    def send_reply(self, data):
+        self.transport.write(data)
+
+
+class RecordingHandler(object):
+    def __init__(self):
+        self.received = []
+
+    async def on_pubsub_command(self, instance_name, cmd):
+        self.received.append((instance_name, cmd))
+
+
+class RedisPubSubTestCase(unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.redis_server = FakeRedisServer()
+
+    def make_pubsub(self, instance_name, handler):
+        hs = Mock()
+        hs.config.server_name = "test"
+        hs.config.instance_name = instance_name
+        hs.get_reactor.return_value = self.reactor
+        return RedisPubSub(hs, handler)
+
+    def connect(self, pubsub):
+        """Connect the pub/sub transport to the fake redis server."""
+        for protocol_class in (RedisSubscriber, RedisPublisher):
+            client = protocol_class(pubsub)
+            server = self.redis_server.buildProtocol(None)
+            client.makeConnection(FakeTransport(server, self.reactor))
+            server.makeConnection(FakeTransport(client, self.reactor))
+        self.pump()
+
+    def test_commands_sent_to_other_processes(self):
+        master_handler = RecordingHandler()
+        master = self.make_pubsub("master", master_handler)
+        self.connect(master)
+
+        worker_handler = RecordingHandler()
+        worker = self.make_pubsub("worker1", worker_handler)
+        self.connect(worker)
+
+        worker.send_command(UserSyncCommand("@user:test", True, 1000))
+        self.pump()
+
+        # The master gets the command, tagged with the instance which sent it,
+        # but the worker doesn't get its own command back.
+        self.assertEqual(len(master_handler.received), 1)
+        instance_name, cmd = master_handler.received[0]
+        self.assertEqual(instance_name, "worker1")
+        self.assertIsInstance(cmd, UserSyncCommand)
+        self.assertEqual(cmd.user_id, "@user:test")
+        self.assertTrue(cmd.is_syncing)
+
+        self.assertEqual(worker_handler.received, [])
+
+    def test_queues_until_connected(self):
+        master_handler = RecordingHandler()
+        master = self.make_pubsub("master", master_handler)
+        self.connect(master)
+
+        worker = self.make_pubsub("worker1", RecordingHandler())
+        worker.send_command(RemoteServerUpCommand("remote"))
+        self.pump()
+        self.assertEqual(master_handler.received, [])
+
+        self.connect(worker)
+        self.assertEqual(len(master_handler.received), 1)
+        self.assertEqual(master_handler.received[0][1].data, "remote")
+
+    def test_pending_commands_capped(self):
+        """Only the most recent commands are kept while we're disconnected."""
+        master_handler = RecordingHandler()
+        master = self.make_pubsub("master", master_handler)
+        self.connect(master)
+
+        with patch.object(RedisPubSub, "max_pending_commands", 2):
+            worker = self.make_pubsub("worker1", RecordingHandler())
+
+        for i in range(3):
+            worker.send_command(RemoteServerUpCommand("remote%d" % (i,)))
+
+        self.connect(worker)
+        self.assertEqual(
+            [cmd.data for _, cmd in master_handler.received], ["remote1", "remote2"]
+        )
+
+    def test_worker_to_worker(self):
+        """Workers send commands to each other directly, rather than via the
+        master's replication connections.
+        """
+        self.connect(self.make_pubsub("master", RecordingHandler()))
+
+        sender = ReplicationClientHandler(Mock())
+        sender.pubsub = self.make_pubsub("worker1", sender)
+        self.connect(sender.pubsub)
+
+        store = Mock()
+        receiver = ReplicationClientHandler(store)
+        receiver.on_remote_server_up = Mock()
+        receiver.pubsub = self.make_pubsub("worker2", receiver)
+        self.connect(receiver.pubsub)
+
+        sender.send_invalidate_cache("get_user_by_id", ["@user:test"])
+        sender.send_remote_server_up("remote")
+        self.pump()
+
+        # Neither was queued up for a replication connection to the master.
+        self.assertEqual(sender.pending_commands, [])
+
+        store._attempt_to_invalidate_cache.assert_called_once_with(
+            "get_user_by_id", ("@user:test",)
+        )
+        receiver.on_remote_server_up.assert_called_once_with("remote")
+
+    def test_invalid_command_ignored(self):
+        master_handler = RecordingHandler()
+        master = self.make_pubsub("master", master_handler)
+        self.connect(master)
+
+        master.on_message(b"test/worker1", b"RDATA events 1 []")
+        master.on_message(
+            b"test/worker1",
+            b"INVALIDATE_CACHE "
+            + InvalidateCacheCommand("f", ["k"]).to_line().encode(),
+        )
+        self.pump()
+
+        self.assertEqual(len(master_handler.received), 1)
+        self.assertIsInstance(master_handler.received[0][1], InvalidateCacheCommand)
+
+    @override_config({"redis": {"enabled": True}})
+    def test_master_handles_worker_commands(self):
+        streamer = ReplicationStreamer(self.hs)
+        streamer.presence_handler = Mock()
+        streamer.presence_handler.update_external_syncs_row.return_value = defer.succeed(
+            None
+        )
+
+        # The streamer should have started connecting to redis.
+        factories = [client[2] for client in self.reactor.tcpClients]
+        self.assertEqual(len(factories), 2)
+        for factory in factories:
+            client = factory.buildProtocol(None)
+            server = self.redis_server.buildProtocol(None)
+            client.makeConnection(FakeTransport(server, self.reactor))
+            server.makeConnection(FakeTransport(client, self.reactor))
+        self.pump()
+
+        worker = self.make_pubsub("worker1", RecordingHandler())
+        self.connect(worker)
+
+        worker.send_command(UserSyncCommand("@user:test", True, 1000))
+        self.pump()
+
+        # Syncs are tracked against the name of the worker.
+        streamer.presence_handler.update_external_syncs_row.assert_called_once_with(
+            "worker1", "@user:test", True, 1000
+        )
@@ -13,7 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from synapse.rest.media.v1._base import get_filename_from_headers
+from synapse.rest.media.v1._base import (
+    UnsatisfiableRangeError,
+    get_filename_from_headers,
+    parse_byte_range,
+)
 
 from tests import unittest
 
@@ -37,3 +41,29 @@ class GetFileNameFromHeadersTests(unittest.TestCase):
                 expected,
                 "expected output for %s to be %s but was %s" % (hdr, expected, res),
             )
+
+
+class ParseByteRangeTests(unittest.TestCase):
+    # input -> expected (offset, length) for a 100 byte file
+    TEST_CASES = {
+        None: None,
+        b"bytes=0-9": (0, 10),
+        b"bytes=90-": (90, 10),
+        b"bytes=90-1000": (90, 10),
+        b"bytes=-10": (90, 10),
+        b"bytes=-1000": (0, 100),
+        # Things we ignore, and send the whole file instead
+        b"bytes=0-9,20-29": None,
+        b"bytes=9-0": None,
+        b"bytes=abc": None,
+        b"lines=0-9": None,
+    }
+
+    def tests(self):
+        for hdr, expected in self.TEST_CASES.items():
+            self.assertEqual(parse_byte_range(hdr, 100), expected, hdr)
+
+    def test_unsatisfiable(self):
+        for hdr in (b"bytes=100-", b"bytes=-0"):
+            with self.assertRaises(UnsatisfiableRangeError):
+                parse_byte_range(hdr, 100)
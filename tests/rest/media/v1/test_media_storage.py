@@ -14,6 +14,7 @@
 # limitations under the License.
 
 
+import io
 import os
 import shutil
 import tempfile
@@ -27,10 +28,12 @@ from twisted.internet.defer import Deferred
 from synapse.logging.context import make_deferred_yieldable
 from synapse.rest.media.v1._base import FileInfo
 from synapse.rest.media.v1.filepath import MediaFilePaths
-from synapse.rest.media.v1.media_storage import MediaStorage
+from synapse.rest.media.v1.media_storage import MediaStorage, ThreadedFileSender
 from synapse.rest.media.v1.storage_provider import FileStorageProviderBackend
+from synapse.types import UserID
 
 from tests import unittest
+from tests.unittest import override_config
 
 
 class MediaStorageTests(unittest.HomeserverTestCase):
@@ -93,6 +96,281 @@ class MediaStorageTests(unittest.HomeserverTestCase):
 
         self.assertEqual(test_body, body)
 
+    def test_store_over_link(self):
+        """Storing a file where we've linked to another file doesn't change the
+        other file.
+        """
+        source_info = FileInfo(None, "source_media")
+        dest_info = FileInfo(None, "dest_media")
+
+        x = self.media_storage.store_file(io.BytesIO(b"source"), source_info)
+        self.wait_on_thread(x)
+        self.get_success(x)
+
+        x = self.media_storage.link_file(source_info, dest_info)
+        self.wait_on_thread(x)
+        self.assertTrue(self.get_success(x))
+
+        x = self.media_storage.store_file(io.BytesIO(b"dest"), dest_info)
+        self.wait_on_thread(x)
+        self.get_success(x)
+
+        with open(self.filepaths.local_media_filepath("source_media"), "rb") as f:
+            self.assertEqual(f.read(), b"source")
+        with open(self.filepaths.local_media_filepath("dest_media"), "rb") as f:
+            self.assertEqual(f.read(), b"dest")
+
+
+class LocalMediaCacheTests(unittest.HomeserverTestCase):
+
+    needs_threadpool = True
+
+    def make_homeserver(self, reactor, clock):
+        self.media_store_path = self.mktemp()
+        self.storage_path = self.mktemp()
+        os.mkdir(self.storage_path)
+
+        config = self.default_config()
+        config["media_store_path"] = self.media_store_path
+        config["media_storage_providers"] = [
+            {
+                "module": "file_system",
+                "store_local": True,
+                "store_synchronous": True,
+                "config": {"directory": self.storage_path},
+            }
+        ]
+        config["media_cache_max_size"] = 25
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.media_storage = hs.get_media_repository().media_storage
+        self.filepaths = self.media_storage.filepaths
+        self.store = hs.get_datastore()
+
+    def _wait(self, d):
+        self.wait_on_thread(d)
+        return self.get_success(d)
+
+    def _store(self, media_id):
+        self._wait(
+            self.media_storage.store_file(
+                io.BytesIO(b"0123456789"), FileInfo(None, media_id)
+            )
+        )
+        self.reactor.advance(1)
+
+    def _cached(self, media_id):
+        return os.path.exists(self.filepaths.local_media_filepath(media_id))
+
+    def test_evict_least_recently_used(self):
+        for media_id in ("media1", "media2", "media3"):
+            self._store(media_id)
+
+        # media1 has been accessed since media2 was stored
+        self.get_success(
+            self.store.update_cached_last_access_time(
+                ["media1"], [], self.clock.time_msec()
+            )
+        )
+
+        freed = self._wait(self.media_storage.evict_local_cache())
+        self.assertEqual(freed, 10)
+
+        self.assertTrue(self._cached("media1"))
+        self.assertFalse(self._cached("media2"))
+        self.assertTrue(self._cached("media3"))
+
+        # media2 can still be fetched from the storage provider.
+        responder = self._wait(self.media_storage.fetch_media(FileInfo(None, "media2")))
+        self.assertIsNotNone(responder)
+        with responder:
+            pass
+
+        # and it's back in the local cache if we need it.
+        self._wait(
+            self.media_storage.ensure_media_is_in_local_cache(FileInfo(None, "media2"))
+        )
+        self.assertTrue(self._cached("media2"))
+        self.assertEqual(self.get_success(self.store.get_local_media_cache_size()), 30)
+
+    def test_keep_files_not_in_provider(self):
+        for media_id in ("media1", "media2", "media3"):
+            self._store(media_id)
+
+        os.remove(
+            os.path.join(
+                self.storage_path, self.filepaths.local_media_filepath_rel("media1")
+            )
+        )
+
+        self._wait(self.media_storage.evict_local_cache())
+
+        self.assertTrue(self._cached("media1"))
+        self.assertFalse(self._cached("media2"))
+        self.assertTrue(self._cached("media3"))
+
+    def test_linked_files(self):
+        """Deleting a file which is hard linked to another doesn't count as
+        freeing any space.
+        """
+        self._store("media1")
+        self._wait(
+            self.media_storage.link_file(
+                FileInfo(None, "media1"), FileInfo(None, "media2")
+            )
+        )
+        self.reactor.advance(1)
+        self._store("media3")
+
+        freed = self._wait(self.media_storage.evict_local_cache())
+        self.assertEqual(freed, 10)
+
+        self.assertFalse(self._cached("media1"))
+        self.assertFalse(self._cached("media2"))
+        self.assertTrue(self._cached("media3"))
+
+
+class MediaDeduplicationTests(unittest.HomeserverTestCase):
+    def make_homeserver(self, reactor, clock):
+        self.media_store_path = self.mktemp()
+        config = self.default_config()
+        config["media_store_path"] = self.media_store_path
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.media_repo = hs.get_media_repository()
+        self.store = hs.get_datastore()
+
+        # smol png
+        self.content = unhexlify(
+            b"89504e470d0a1a0a0000000d4948445200000001000000010806"
+            b"0000001f15c4890000000a49444154789c63000100000500010d"
+            b"0a2db40000000049454e44ae426082"
+        )
+
+    def _upload(self, content):
+        mxc = self.get_success(
+            self.media_repo.create_content(
+                "image/png",
+                "test.png",
+                io.BytesIO(content),
+                len(content),
+                UserID.from_string("@user:test"),
+            )
+        )
+        return mxc.rsplit("/", 1)[1]
+
+    def _inodes(self, media_id):
+        """Get the inodes of the file and thumbnails of some local media"""
+        filepaths = self.media_repo.filepaths
+        inodes = [os.stat(filepaths.local_media_filepath(media_id)).st_ino]
+
+        thumbnails = self.get_success(self.store.get_local_media_thumbnails(media_id))
+        for t in sorted(
+            thumbnails, key=lambda t: (t["thumbnail_width"], t["thumbnail_height"])
+        ):
+            path = filepaths.local_media_thumbnail(
+                media_id,
+                t["thumbnail_width"],
+                t["thumbnail_height"],
+                t["thumbnail_type"],
+                t["thumbnail_method"],
+            )
+            inodes.append(os.stat(path).st_ino)
+
+        return inodes
+
+    @override_config({"enable_media_deduplication": True})
+    def test_duplicate_content_is_linked(self):
+        first = self._upload(self.content)
+        second = self._upload(self.content)
+        different = self._upload(self.content + b"\0")
+
+        first_inodes = self._inodes(first)
+        self.assertGreater(len(first_inodes), 1)
+
+        # The second upload shares the file and thumbnails of the first.
+        self.assertEqual(self._inodes(second), first_inodes)
+
+        # But different content doesn't.
+        self.assertFalse(set(self._inodes(different)) & set(first_inodes))
+
+    def test_disabled(self):
+        first = self._upload(self.content)
+        second = self._upload(self.content)
+
+        self.assertFalse(set(self._inodes(first)) & set(self._inodes(second)))
+
+
+class RecordingConsumer(object):
+    """A consumer which records what is written to it, and pauses its
+    producer after each write until told to resume it.
+    """
+
+    def __init__(self):
+        self.producer = None
+        self.written = []
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+        self.producer.pauseProducing()
+
+
+class ThreadedFileSenderTests(unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.contents = bytes(range(256)) * 1024
+        self.consumer = RecordingConsumer()
+        self.sender = ThreadedFileSender(reactor)
+        self.sender.CHUNK_SIZE = 100000
+
+    def test_send_file(self):
+        d = self.sender.beginFileTransfer(io.BytesIO(self.contents), self.consumer)
+
+        # We don't read any more of the file until the consumer resumes us.
+        self.pump()
+        self.assertEqual(len(self.consumer.written), 1)
+
+        while self.consumer.producer:
+            self.consumer.producer.resumeProducing()
+            self.pump()
+
+        self.successResultOf(d)
+        self.assertEqual(
+            [len(c) for c in self.consumer.written], [100000] * 2 + [62144]
+        )
+        self.assertEqual(b"".join(self.consumer.written), self.contents)
+
+    def test_send_range(self):
+        d = self.sender.beginFileTransfer(
+            io.BytesIO(self.contents), self.consumer, offset=1000, length=150000
+        )
+
+        self.pump()
+        while self.consumer.producer:
+            self.consumer.producer.resumeProducing()
+            self.pump()
+
+        self.successResultOf(d)
+        self.assertEqual(b"".join(self.consumer.written), self.contents[1000:151000])
+
+    def test_stop(self):
+        d = self.sender.beginFileTransfer(io.BytesIO(self.contents), self.consumer)
+        self.pump()
+
+        self.sender.stopProducing()
+        self.sender.resumeProducing()
+        self.pump()
+
+        self.failureResultOf(d)
+        self.assertEqual(len(self.consumer.written), 1)
+
 
 class MediaRepoTests(unittest.HomeserverTestCase):
 
@@ -231,6 +509,38 @@ class MediaRepoTests(unittest.HomeserverTestCase):
         self.assertEqual(headers.getRawHeaders(b"Content-Type"), [b"image/png"])
         self.assertEqual(headers.getRawHeaders(b"Content-Disposition"), None)
 
+    def test_range_request(self):
+        """
+        Once the media has been downloaded, a client can request part of it.
+        """
+        channel = self._req(None)
+        self.assertEqual(channel.headers.getRawHeaders(b"Accept-Ranges"), [b"bytes"])
+
+        request, channel = self.make_request("GET", self.media_id, shorthand=False)
+        request.requestHeaders.addRawHeader(b"Range", b"bytes=10-19")
+        request.render(self.download_resource)
+        self.pump()
+
+        self.assertEqual(channel.code, 206)
+        self.assertEqual(channel.result["body"], self.end_content[10:20])
+        self.assertEqual(
+            channel.headers.getRawHeaders(b"Content-Range"),
+            [b"bytes 10-19/%d" % (len(self.end_content),)],
+        )
+        self.assertEqual(channel.headers.getRawHeaders(b"Content-Length"), [b"10"])
+
+        # A range past the end of the file can't be satisfied.
+        request, channel = self.make_request("GET", self.media_id, shorthand=False)
+        request.requestHeaders.addRawHeader(b"Range", b"bytes=1000-")
+        request.render(self.download_resource)
+        self.pump()
+
+        self.assertEqual(channel.code, 416)
+        self.assertEqual(
+            channel.headers.getRawHeaders(b"Content-Range"),
+            [b"bytes */%d" % (len(self.end_content),)],
+        )
+
     def test_thumbnail_crop(self):
         expected_body = unhexlify(
             b"89504e470d0a1a0a0000000d4948445200000020000000200806"
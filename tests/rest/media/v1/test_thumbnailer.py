@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from io import BytesIO
+
+import PIL.Image as Image
+
+from synapse.rest.media.v1.thumbnailer import (
+    EXIF_ORIENTATION_TAG,
+    Thumbnailer,
+    generate_thumbnails,
+)
+
+from tests import unittest
+from tests.unittest import override_config
+
+
+def _make_jpeg(path, width, height, orientation=None):
+    image = Image.new("RGB", (width, height), (200, 100, 50))
+    kwargs = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION_TAG] = orientation
+        kwargs["exif"] = exif.tobytes()
+    image.save(path, "JPEG", **kwargs)
+
+
+def _sizes(thumbnails):
+    return [Image.open(BytesIO(t)).size for t in thumbnails]
+
+
+class ThumbnailerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp() + ".jpg"
+        _make_jpeg(self.path, 640, 480)
+
+    def test_generate_thumbnails(self):
+        thumbnails = generate_thumbnails(
+            self.path,
+            [
+                (32, 32, "crop", "image/png"),
+                (320, 240, "scale", "image/jpeg"),
+                (96, 72, "scale", "image/png"),
+                (800, 600, "crop", "image/jpeg"),
+            ],
+        )
+
+        # The thumbnails come back in the order they were asked for.
+        self.assertEqual(
+            _sizes(thumbnails), [(32, 32), (320, 240), (96, 72), (800, 600)]
+        )
+        self.assertEqual(Image.open(BytesIO(thumbnails[0])).format, "PNG")
+        self.assertEqual(Image.open(BytesIO(thumbnails[1])).format, "JPEG")
+
+    def test_draft(self):
+        """JPEGs are decoded at a reduced size if that's big enough."""
+        thumbnailer = Thumbnailer(self.path)
+        thumbnailer._draft(100, 100)
+        self.assertEqual(thumbnailer.image.size, (160, 120))
+
+    def test_transposed(self):
+        _make_jpeg(self.path, 640, 480, orientation=6)
+
+        thumbnailer = Thumbnailer(self.path)
+        self.assertEqual(thumbnailer.transposed_size(), (480, 640))
+        self.assertEqual(thumbnailer.aspect(96, 96), (72, 96))
+
+        thumbnails = generate_thumbnails(
+            self.path, [(72, 96, "scale", "image/jpeg"), (32, 64, "crop", "image/png")],
+        )
+        self.assertEqual(_sizes(thumbnails), [(72, 96), (32, 64)])
+
+
+class ThumbnailProcessPoolTestCase(unittest.HomeserverTestCase):
+    @override_config({"thumbnail_processes": 1})
+    def test_process_pool(self):
+        path = self.mktemp() + ".jpg"
+        _make_jpeg(path, 640, 480)
+
+        media_repo = self.hs.get_media_repository()
+        self.addCleanup(media_repo._thumbnail_pool.shutdown)
+
+        d = media_repo._run_thumbnailer(path, [(32, 32, "crop", "image/png")])
+        self.wait_on_thread(d)
+        thumbnails = self.successResultOf(d)
+        self.assertEqual(_sizes(thumbnails), [(32, 32)])
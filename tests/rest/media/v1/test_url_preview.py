@@ -17,6 +17,7 @@ import os
 
 import attr
 
+from twisted.internet import defer
 from twisted.internet._resolver import HostResolution
 from twisted.internet.address import IPv4Address, IPv6Address
 from twisted.internet.error import DNSLookupError
@@ -507,3 +508,125 @@ class URLPreviewTests(unittest.HomeserverTestCase):
         self.pump()
         self.assertEqual(channel.code, 200)
         self.assertEqual(channel.json_body, {})
+
+    def test_waits_for_other_process(self):
+        """If another process is previewing the URL, we wait for its result
+        rather than fetching the URL ourselves.
+        """
+        self.lookups["matrix.org"] = [(IPv4Address, "8.8.8.8")]
+        store = self.hs.get_datastore()
+
+        now = self.clock.time_msec()
+        self.get_success(
+            store.try_acquire_url_preview_lock(
+                "http://matrix.org", "other_worker", "token", now, now + 60 * 1000
+            )
+        )
+
+        request, channel = self.make_request(
+            "GET", "url_preview?url=http://matrix.org", shorthand=False
+        )
+        request.render(self.preview_url)
+        self.pump(0.1)
+
+        self.assertEqual(self.reactor.tcpClients, [])
+        self.assertFalse(channel.result)
+
+        # The other process stores its preview and releases the lock.
+        self.get_success(
+            store.store_url_cache(
+                "http://matrix.org",
+                200,
+                None,
+                now + 60 * 60 * 1000,
+                '{"og:title": "other"}',
+                "media_id",
+                now,
+            )
+        )
+        self.get_success(store.release_url_preview_lock("http://matrix.org", "token"))
+        self.pump(0.1)
+
+        self.assertEqual(self.reactor.tcpClients, [])
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.json_body, {"og:title": "other"})
+
+    def test_preview_stored_before_lock_acquired(self):
+        """If another process stores its preview just before we take the lock,
+        we use that rather than fetching the URL again.
+        """
+        self.lookups["matrix.org"] = [(IPv4Address, "8.8.8.8")]
+        store = self.hs.get_datastore()
+        now = self.clock.time_msec()
+
+        try_acquire_url_preview_lock = store.try_acquire_url_preview_lock
+
+        @defer.inlineCallbacks
+        def _try_acquire_url_preview_lock(*args):
+            # The other process finishes and releases its lock.
+            yield store.store_url_cache(
+                "http://matrix.org",
+                200,
+                None,
+                now + 60 * 60 * 1000,
+                '{"og:title": "other"}',
+                "media_id",
+                now,
+            )
+            acquired = yield try_acquire_url_preview_lock(*args)
+            return acquired
+
+        store.try_acquire_url_preview_lock = _try_acquire_url_preview_lock
+
+        request, channel = self.make_request(
+            "GET", "url_preview?url=http://matrix.org", shorthand=False
+        )
+        request.render(self.preview_url)
+        self.pump()
+
+        self.assertEqual(self.reactor.tcpClients, [])
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.json_body, {"og:title": "other"})
+
+    def test_lock_expiry(self):
+        """If the other process's lock expires, we preview the URL ourselves."""
+        self.lookups["matrix.org"] = [(IPv4Address, "8.8.8.8")]
+        store = self.hs.get_datastore()
+
+        now = self.clock.time_msec()
+        self.get_success(
+            store.try_acquire_url_preview_lock(
+                "http://matrix.org", "other_worker", "token", now, now + 60 * 1000
+            )
+        )
+
+        request, channel = self.make_request(
+            "GET", "url_preview?url=http://matrix.org", shorthand=False
+        )
+        request.render(self.preview_url)
+        self.pump(0.1)
+        self.assertEqual(self.reactor.tcpClients, [])
+
+        self.reactor.advance(60)
+        self.pump()
+
+        client = self.reactor.tcpClients[0][2].buildProtocol(None)
+        server = AccumulatingProtocol()
+        server.makeConnection(FakeTransport(client, self.reactor))
+        client.makeConnection(FakeTransport(server, self.reactor))
+        client.dataReceived(
+            b"HTTP/1.0 200 OK\r\nContent-Length: %d\r\nContent-Type: text/html\r\n\r\n"
+            % (len(self.end_content),)
+            + self.end_content
+        )
+
+        self.pump()
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.json_body, {"og:title": "~matrix~", "og:description": "hi"}
+        )
+
+        # We released our own lock when we were done.
+        self.assertIsNone(
+            self.get_success(store.get_url_preview_lock_expiry("http://matrix.org"))
+        )
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import Future
+
+from mock import patch
+
+from twisted.internet import defer
+
+from synapse.api.room_versions import RoomVersions
+from synapse.state import pool
+from synapse.state.pool import StateResolutionPool
+
+from tests.state import test_v2
+
+
+class _InlineExecutor(object):
+    """An executor which runs everything immediately, in-process."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def submit(self, f, *args):
+        self.calls += 1
+        future = Future()
+        try:
+            future.set_result(f(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class _InlineReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class _PoolTestMixin(object):
+    def setUp(self):
+        self.executor = _InlineExecutor()
+        self.pool = StateResolutionPool(_InlineReactor(), executor=self.executor)
+
+        # Send even the smallest conflicts to the pool.
+        patcher = patch.object(pool, "MIN_EVENTS_FOR_POOL", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class PoolStateTestCase(_PoolTestMixin, test_v2.StateTestCase):
+    """Runs the v2 state resolution tests through the pool."""
+
+    def setUp(self):
+        super(PoolStateTestCase, self).setUp()
+
+        patcher = patch.object(
+            test_v2, "resolve_events_with_store", self.pool.resolve_events_with_store
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def do_check(self, events, edges, expected_state_ids):
+        super(PoolStateTestCase, self).do_check(events, edges, expected_state_ids)
+        self.assertGreater(self.executor.calls, 0)
+
+
+class PoolSimpleParamStateTestCase(_PoolTestMixin, test_v2.SimpleParamStateTestCase):
+    def setUp(self):
+        _PoolTestMixin.setUp(self)
+        test_v2.SimpleParamStateTestCase.setUp(self)
+
+    def test_pool_event_map_none(self):
+        state_d = self.pool.resolve_events_with_store(
+            test_v2.ROOM_ID,
+            RoomVersions.V2.identifier,
+            [self.state_at_bob, self.state_at_charlie],
+            event_map=None,
+            state_res_store=test_v2.TestStateResolutionStore(self.event_map),
+        )
+
+        state = self.successResultOf(state_d)
+
+        self.assertEqual(self.expected_combined_state, state)
+        self.assertEqual(self.executor.calls, 1)
+
+    def test_fetches_missing_events(self):
+        # If we don't send the worker the events it needs up front, it asks for
+        # them and we try again.
+        with patch.object(
+            StateResolutionPool, "_prefetch_events", lambda *args: defer.succeed(None),
+        ):
+            state_d = self.pool.resolve_events_with_store(
+                test_v2.ROOM_ID,
+                RoomVersions.V2.identifier,
+                [self.state_at_bob, self.state_at_charlie],
+                event_map=None,
+                state_res_store=test_v2.TestStateResolutionStore(self.event_map),
+            )
+
+        state = self.successResultOf(state_d)
+
+        self.assertEqual(self.expected_combined_state, state)
+        self.assertGreater(self.executor.calls, 1)
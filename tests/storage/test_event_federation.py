@@ -15,6 +15,10 @@
 
 from twisted.internet import defer
 
+import synapse.rest.admin
+from synapse.api.constants import EventTypes
+from synapse.rest.client.v1 import login, room
+
 import tests.unittest
 import tests.utils
 
@@ -108,3 +112,152 @@ class EventFederationWorkerStoreTestCase(tests.unittest.TestCase):
 
         r = yield self.store.get_rooms_with_many_extremities(5, 1, [room1])
         self.assertTrue(r == [room2] or r == [room3])
+
+
+class EventAuthChainIndexTestCase(tests.unittest.HomeserverTestCase):
+    """Tests that the chain cover index gives the same answers as walking the
+    `event_auth` table.
+    """
+
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.state_store = hs.get_storage().state
+
+        self.user_id = self.register_user("alice", "pass")
+        self.tok = self.login("alice", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        # Build up some history with members and power level changes, taking
+        # a snapshot of the state as we go.
+        self.state_sets = []
+        for i in range(4):
+            user_id = self.register_user("user%d" % (i,), "pass")
+            tok = self.login("user%d" % (i,), "pass")
+            self.helper.join(self.room_id, user_id, tok=tok)
+
+            self.helper.send_state(
+                self.room_id,
+                EventTypes.PowerLevels,
+                {"users": {self.user_id: 100, user_id: 50}},
+                tok=self.tok,
+            )
+            self.helper.send_state(
+                self.room_id, EventTypes.Topic, {"topic": "topic %d" % (i,)}, tok=tok,
+            )
+
+            state = self.get_success(self.store.get_current_state_ids(self.room_id))
+            self.state_sets.append(set(state.values()))
+
+        self.state_event_ids = self.get_success(
+            self.store.db.simple_select_onecol(
+                "state_events", {"room_id": self.room_id}, "event_id"
+            )
+        )
+
+    def _clear_index(self):
+        def _clear_index_txn(txn):
+            txn.execute("DELETE FROM event_auth_chains")
+            txn.execute("DELETE FROM event_auth_chain_links")
+            txn.execute("UPDATE rooms SET has_auth_chain_index = ?", (False,))
+
+        self.get_success(self.store.db.runInteraction("clear", _clear_index_txn))
+
+    def _get_auth_chains(self):
+        return {
+            event_id: set(self.get_success(self.store.get_auth_chain_ids([event_id])))
+            for event_id in self.state_event_ids
+        }
+
+    def _get_differences(self):
+        return [
+            self.get_success(self.store.get_auth_chain_difference([a, b]))
+            for a in self.state_sets
+            for b in self.state_sets
+        ]
+
+    def test_events_are_indexed(self):
+        chain_positions = self.get_success(
+            self.store.db.runInteraction(
+                "test", self.store._get_event_chain_positions_txn, self.state_event_ids,
+            )
+        )
+        self.assertEqual(set(chain_positions), set(self.state_event_ids))
+
+    def test_matches_event_auth(self):
+        indexed_chains = self._get_auth_chains()
+        indexed_differences = self._get_differences()
+
+        self._clear_index()
+
+        self.assertEqual(self._get_auth_chains(), indexed_chains)
+        self.assertEqual(self._get_differences(), indexed_differences)
+
+        # The later state sets have more in their auth chains.
+        self.assertTrue(indexed_differences[1])
+
+    def test_background_update(self):
+        indexed_chains = self._get_auth_chains()
+        indexed_differences = self._get_differences()
+
+        self._clear_index()
+
+        self.get_success(
+            self.store.db.simple_insert(
+                "background_updates",
+                {"update_name": "event_auth_chain_index", "progress_json": "{}"},
+            )
+        )
+        self.store.db.updates._all_done = False
+        while not self.get_success(
+            self.store.db.updates.has_completed_background_updates()
+        ):
+            self.get_success(
+                self.store.db.updates.do_next_background_update(100), by=0.1
+            )
+
+        # Everything should be back in the index.
+        self.test_events_are_indexed()
+
+        self.assertEqual(self._get_auth_chains(), indexed_chains)
+        self.assertEqual(self._get_differences(), indexed_differences)
+
+    def test_partially_indexed_room(self):
+        """New events in a room that is flagged as indexed pull in any auth
+        events that are missing from the index.
+        """
+        self._clear_index()
+        self.get_success(
+            self.store.db.simple_update(
+                "rooms",
+                {"room_id": self.room_id},
+                {"has_auth_chain_index": True},
+                desc="test",
+            )
+        )
+
+        event_id = self.helper.send_state(
+            self.room_id, EventTypes.Topic, {"topic": "new topic"}, tok=self.tok
+        )["event_id"]
+
+        indexed_chain = set(self.get_success(self.store.get_auth_chain_ids([event_id])))
+
+        chain_positions = self.get_success(
+            self.store.db.runInteraction(
+                "test",
+                self.store._get_event_chain_positions_txn,
+                indexed_chain | {event_id},
+            )
+        )
+        self.assertEqual(set(chain_positions), indexed_chain | {event_id})
+
+        self._clear_index()
+        self.assertEqual(
+            set(self.get_success(self.store.get_auth_chain_ids([event_id]))),
+            indexed_chain,
+        )
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from synapse.storage.util.id_generators import MultiWriterIdGenerator
+
+from tests.unittest import HomeserverTestCase
+
+
+class MultiWriterIdGeneratorTestCase(HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.db = self.store.db
+
+        self.get_success(
+            self.db.runInteraction(
+                "create",
+                lambda txn: txn.execute(
+                    "CREATE TABLE foobar (stream_id BIGINT NOT NULL)"
+                ),
+            )
+        )
+
+    def _create_id_generator(self, step=1, instance_name="master", writers=["master"]):
+        def _create(conn):
+            return MultiWriterIdGenerator(
+                conn,
+                self.db,
+                "test_stream",
+                instance_name,
+                writers,
+                "foobar",
+                "stream_id",
+                "foobar_seq",
+                step=step,
+            )
+
+        return self.get_success(self.db.runWithConnection(_create))
+
+    def _insert_rows(self, stream_ids):
+        def _insert(txn):
+            for stream_id in stream_ids:
+                txn.execute("INSERT INTO foobar VALUES (?)", (stream_id,))
+
+        self.get_success(self.db.runInteraction("insert", _insert))
+
+    def test_load_existing(self):
+        self._insert_rows([1, 2, 3, 7])
+        id_gen = self._create_id_generator()
+
+        self.assertEqual(id_gen.get_current_token(), 7)
+
+    def test_get_next_txn(self):
+        self._insert_rows([1, 2])
+        id_gen = self._create_id_generator()
+
+        def _get_next(txn):
+            stream_ids = id_gen.get_next_mult_txn(txn, 2)
+            self.assertEqual(stream_ids, [3, 4])
+
+            # The ids aren't visible until the transaction completes.
+            self.assertEqual(id_gen.get_current_token(), 2)
+
+        self.get_success(self.db.runInteraction("test", _get_next))
+
+        self.assertEqual(id_gen.get_current_token(), 4)
+
+    def test_failed_txn(self):
+        """Ids allocated in a failed transaction are skipped."""
+        id_gen = self._create_id_generator()
+
+        def _fail(txn):
+            id_gen.get_next_txn(txn)
+            raise Exception("Boom")
+
+        self.get_failure(self.db.runInteraction("test", _fail), Exception)
+        self.assertEqual(id_gen.get_current_token(), 2)
+
+        self.get_success(self.db.runInteraction("test", id_gen.get_next_txn))
+        self.assertEqual(id_gen.get_current_token(), 3)
+
+    def test_get_next_from_writer(self):
+        self._insert_rows([1, 2, 3])
+        id_gen = self._create_id_generator()
+
+        with id_gen.get_next_from_writer() as stream_ids:
+            # Other processes persist ids past the one the writer will use,
+            # but we mustn't say they're all persisted until we hear back.
+            id_gen.advance(6)
+            self.assertEqual(id_gen.get_current_token(), 3)
+
+            stream_ids.extend([4, 5])
+
+        self.assertEqual(id_gen.get_current_token(), 6)
+
+    def test_get_next_from_writer_failed(self):
+        id_gen = self._create_id_generator()
+
+        with self.assertRaises(Exception):
+            with id_gen.get_next_from_writer():
+                raise Exception("Boom")
+
+        self.assertEqual(id_gen.get_current_token(), 1)
+
+        id_gen.advance(5)
+        self.assertEqual(id_gen.get_current_token(), 5)
+
+    def test_backwards(self):
+        """Ids grow downwards if step is -1, as they do for backfill."""
+        self._insert_rows([-1, -2, -3])
+        id_gen = self._create_id_generator(step=-1)
+
+        self.assertEqual(id_gen.get_current_token(), -3)
+
+        def _get_next(txn):
+            self.assertEqual(id_gen.get_next_mult_txn(txn, 2), [-4, -5])
+            self.assertEqual(id_gen.get_current_token(), -3)
+
+        self.get_success(self.db.runInteraction("test", _get_next))
+        self.assertEqual(id_gen.get_current_token(), -5)
+
+        with id_gen.get_next_from_writer() as stream_ids:
+            id_gen.advance(-7)
+            self.assertEqual(id_gen.get_current_token(), -5)
+            stream_ids.append(-6)
+
+        self.assertEqual(id_gen.get_current_token(), -7)
+
+    def _insert_positions(self, positions):
+        def _insert(txn):
+            for instance_name, stream_id in positions.items():
+                txn.execute(
+                    "INSERT INTO stream_positions VALUES (?, ?, ?)",
+                    ("test_stream", instance_name, stream_id),
+                )
+
+        self.get_success(self.db.runInteraction("insert_positions", _insert))
+
+    def _get_positions(self):
+        rows = self.get_success(
+            self.db.simple_select_list(
+                "stream_positions",
+                {"stream_name": "test_stream"},
+                ["instance_name", "stream_id"],
+            )
+        )
+        return {row["instance_name"]: row["stream_id"] for row in rows}
+
+    def _persist_next(self, id_gen):
+        """Allocates an id and inserts it into the stream table."""
+
+        def _persist(txn):
+            stream_id = id_gen.get_next_txn(txn)
+            txn.execute("INSERT INTO foobar VALUES (?)", (stream_id,))
+
+        self.get_success(self.db.runInteraction("persist", _persist))
+
+    def test_records_position(self):
+        """Writers record their position while they have ids in flight, and
+        delete it once they've finished.
+        """
+        self._insert_rows([1, 2])
+        id_gen = self._create_id_generator(
+            instance_name="writer1", writers=["writer1", "writer2"]
+        )
+
+        def _get_next(txn):
+            id_gen.get_next_txn(txn)
+
+            # The position is written before the id is persisted, so lags
+            # behind by one.
+            txn.execute("SELECT instance_name, stream_id FROM stream_positions")
+            self.assertEqual(txn.fetchall(), [("writer1", 2)])
+
+        self.get_success(self.db.runInteraction("test", _get_next))
+        self.pump()
+
+        self.assertEqual(self._get_positions(), {})
+
+    def test_restart_with_idle_writer(self):
+        """A writer which has finished persisting its ids doesn't hold back the
+        current token when another writer restarts.
+        """
+        self._insert_rows([1, 2])
+        writers = ["writer1", "writer2"]
+
+        # writer2 persists an id and then goes idle, while writer1 carries on.
+        id_gen = self._create_id_generator(instance_name="writer2", writers=writers)
+        self._persist_next(id_gen)
+
+        id_gen = self._create_id_generator(instance_name="writer1", writers=writers)
+        for _ in range(3):
+            self._persist_next(id_gen)
+        self.pump()
+        self.assertEqual(id_gen.get_current_token(), 6)
+
+        id_gen = self._create_id_generator(instance_name="writer1", writers=writers)
+        self.assertEqual(id_gen.get_positions(), {})
+        self.assertEqual(id_gen.get_current_token(), 6)
+
+    def test_load_min_of_writer_positions(self):
+        """On startup the current token is the minimum position across the
+        other writers with ids in flight, ignoring instances which no longer
+        write to the stream.
+        """
+        self._insert_rows([1, 2, 3, 4, 5, 6, 7, 8])
+        self._insert_positions({"writer1": 8, "writer2": 5, "old_writer": 2})
+
+        id_gen = self._create_id_generator(
+            instance_name="writer1", writers=["writer1", "writer2"]
+        )
+        self.assertEqual(id_gen.get_current_token(), 5)
+
+        # New ids carry on from the highest in use.
+        def _get_next(txn):
+            self.assertEqual(id_gen.get_next_txn(txn), 9)
+
+        self.get_success(self.db.runInteraction("test", _get_next))
+        self.assertEqual(id_gen.get_current_token(), 9)
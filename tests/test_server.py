@@ -15,8 +15,11 @@
 import logging
 import re
 
+from mock import Mock
 from six import StringIO
 
+from canonicaljson import encode_canonical_json
+
 from twisted.internet.defer import Deferred
 from twisted.python.failure import Failure
 from twisted.test.proto_helpers import AccumulatingProtocol
@@ -167,6 +170,34 @@ class JsonResourceTests(unittest.TestCase):
         self.assertEqual(channel.json_body["error"], "Unrecognized request")
         self.assertEqual(channel.json_body["errcode"], "M_UNRECOGNIZED")
 
+    def test_streaming_response(self):
+        """
+        Streamed responses are written out in several chunks, and decode to the
+        same JSON as the returned object.
+        """
+        response = {"events": [{"body": "\N{SNOWMAN} %d" % (i,)} for i in range(10000)]}
+
+        def _callback(request, **kwargs):
+            return 200, response
+
+        res = JsonResource(self.homeserver)
+        res.register_paths(
+            "GET",
+            [re.compile("^/_matrix/foo$")],
+            _callback,
+            "test_servlet",
+            streaming=True,
+        )
+
+        request, channel = make_request(self.reactor, b"GET", b"/_matrix/foo")
+        request.write = Mock(wraps=request.write)
+        render(request, res, self.reactor)
+
+        self.assertEqual(channel.result["code"], b"200")
+        self.assertEqual(channel.result["body"], encode_canonical_json(response))
+        self.assertIsNone(channel.headers.getRawHeaders(b"Content-Length"))
+        self.assertGreater(request.write.call_count, 1)
+
 
 class WrapHtmlRequestHandlerTests(unittest.TestCase):
     class TestResource(DirectServeResource):
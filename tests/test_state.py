@@ -19,9 +19,11 @@ from twisted.internet import defer
 
 from synapse.api.auth import Auth
 from synapse.api.constants import EventTypes, Membership
-from synapse.api.room_versions import RoomVersions
+from synapse.api.room_versions import KNOWN_ROOM_VERSIONS, RoomVersions
 from synapse.events import make_event_from_dict
 from synapse.events.snapshot import EventContext
+from synapse.rest import admin
+from synapse.rest.client.v1 import login, room
 from synapse.state import StateHandler, StateResolutionHandler
 
 from tests import unittest
@@ -703,3 +705,60 @@ class StateTestCase(unittest.TestCase):
         self.store.register_event_id_state_group(prev_event_id_2, sg2)
 
         return self.state.compute_event_context(event)
+
+
+class HostsInRoomTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.state = hs.get_state_handler()
+
+        self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as("user", tok=self.tok)
+
+    def _inject_membership(self, user_id, membership):
+        room_version = self.get_success(self.store.get_room_version_id(self.room_id))
+        builder = self.hs.get_event_builder_factory().for_room_version(
+            KNOWN_ROOM_VERSIONS[room_version],
+            {
+                "type": EventTypes.Member,
+                "sender": user_id,
+                "state_key": user_id,
+                "room_id": self.room_id,
+                "content": {"membership": membership},
+            },
+        )
+        event, context = self.get_success(
+            self.hs.get_event_creation_handler().create_new_client_event(builder)
+        )
+        self.get_success(
+            self.hs.get_storage().persistence.persist_event(event, context)
+        )
+        return event.event_id
+
+    def _hosts_after(self, event_id):
+        return self.get_success(
+            self.state.get_hosts_in_room_at_events(self.room_id, [event_id])
+        )
+
+    def test_hosts_in_room(self):
+        join_id = self._inject_membership("@remote:other", Membership.JOIN)
+        topic_id = self.helper.send_state(
+            self.room_id, EventTypes.Topic, {"topic": "Topic"}, tok=self.tok
+        )["event_id"]
+
+        hosts_after_join = self._hosts_after(join_id)
+        self.assertEqual(set(hosts_after_join), {"test", "other"})
+
+        # The topic change didn't change the membership, so it shares the hosts
+        # from the join.
+        self.assertIs(self._hosts_after(topic_id), hosts_after_join)
+
+        leave_id = self._inject_membership("@remote:other", Membership.LEAVE)
+        self.assertEqual(set(self._hosts_after(leave_id)), {"test"})
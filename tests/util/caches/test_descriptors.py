@@ -26,7 +26,7 @@ from synapse.logging.context import (
     PreserveLoggingContext,
     make_deferred_yieldable,
 )
-from synapse.util.caches import descriptors
+from synapse.util.caches import descriptors, set_cache_expiry_times
 from synapse.util.caches.descriptors import cached
 
 from tests import unittest
@@ -82,6 +82,13 @@ class CacheTestCase(unittest.TestCase):
         d1.callback("result1")
         self.assertIsNone(cache.get("key1", None))
 
+    def test_expiry_time_from_config(self):
+        set_cache_expiry_times(60000, {"testcache": 1000})
+        self.addCleanup(set_cache_expiry_times, None, {})
+
+        self.assertEqual(descriptors.Cache("testcache").cache.expiry_ms, 1000)
+        self.assertEqual(descriptors.Cache("othercache").cache.expiry_ms, 60000)
+
 
 class DescriptorTestCase(unittest.TestCase):
     @defer.inlineCallbacks
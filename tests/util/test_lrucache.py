@@ -14,9 +14,13 @@
 # limitations under the License.
 
 
-from mock import Mock
+import weakref
 
-from synapse.util.caches.lrucache import LruCache
+from mock import Mock, patch
+
+from synapse.util import caches
+from synapse.util.caches import lrucache
+from synapse.util.caches.lrucache import LruCache, expire_lru_cache_entries, get_size_of
 from synapse.util.caches.treecache import TreeCache
 
 from .. import unittest
@@ -255,3 +259,94 @@ class LruCacheSizedTestCase(unittest.TestCase):
         self.assertEquals(cache["key3"], [3])
         self.assertEquals(cache["key4"], [4])
         self.assertEquals(cache["key5"], [5, 6])
+
+
+class LruCacheMemoryTestCase(unittest.TestCase):
+    def test_memory_usage(self):
+        cache = LruCache(5, track_memory=True)
+        self.assertEquals(cache.memory_usage(), 0)
+
+        cache["key1"] = "x" * 1000
+        self.assertEquals(cache.memory_usage(), get_size_of(("key1", "x" * 1000)))
+
+        cache["key2"] = {"a": ["x" * 1000]}
+        self.assertGreater(cache.memory_usage(), 2000)
+
+        cache.pop("key1")
+        self.assertEquals(
+            cache.memory_usage(), get_size_of(("key2", {"a": ["x" * 1000]}))
+        )
+
+        cache.clear()
+        self.assertEquals(cache.memory_usage(), 0)
+
+    def test_untracked(self):
+        cache = LruCache(5, track_memory=False)
+        cache["key1"] = "x" * 1000
+        self.assertEquals(cache.memory_usage(), 0)
+
+    @patch.object(lrucache, "_memory_tracked_caches", weakref.WeakSet())
+    @patch.object(lrucache, "_total_memory_usage", [0])
+    def test_evict_coldest_across_caches(self):
+        cache_a = LruCache(10, track_memory=True)
+        cache_b = LruCache(10, track_memory=True)
+
+        entry_size = get_size_of(("a1", "x" * 1000))
+        budget = int(3.5 * entry_size)
+
+        with patch.object(caches, "CACHE_MEMORY_BUDGET", budget):
+            cache_a["a1"] = "x" * 1000
+            cache_b["b1"] = "x" * 1000
+            cache_a["a2"] = "x" * 1000
+            cache_a.get("a1")
+
+            # This takes us over the budget, so the coldest entry goes.
+            cache_b["b2"] = "x" * 1000
+            self.assertNotIn("b1", cache_b)
+            self.assertIn("a1", cache_a)
+            self.assertIn("a2", cache_a)
+            self.assertIn("b2", cache_b)
+
+            cache_a["a3"] = "x" * 1000
+            self.assertNotIn("a2", cache_a)
+            self.assertIn("a1", cache_a)
+            self.assertIn("a3", cache_a)
+            self.assertIn("b2", cache_b)
+
+        # Empty the caches so that they don't affect the real total when
+        # they're collected.
+        cache_a.clear()
+        cache_b.clear()
+
+
+class LruCacheExpiryTestCase(unittest.TestCase):
+    def test_expiry(self):
+        now = lrucache._current_time_ms[0]
+        evicted = Mock()
+
+        cache = LruCache(10, expiry_ms=1000, evicted_callback=evicted)
+        cache["key1"] = 1
+        cache["key2"] = 2
+
+        expire_lru_cache_entries(now + 600)
+        self.assertEquals(len(cache), 2)
+
+        # Accessing an entry keeps it alive.
+        self.assertEquals(cache.get("key1"), 1)
+
+        expire_lru_cache_entries(now + 1200)
+        self.assertEquals(cache.get("key1"), 1)
+        self.assertEquals(cache.get("key2"), None)
+        self.assertEquals(evicted.call_count, 1)
+
+        expire_lru_cache_entries(now + 2400)
+        self.assertEquals(len(cache), 0)
+
+    def test_no_expiry(self):
+        now = lrucache._current_time_ms[0]
+
+        cache = LruCache(10)
+        cache["key1"] = 1
+
+        expire_lru_cache_entries(now + 1000 * 1000)
+        self.assertEquals(cache.get("key1"), 1)
@@ -113,6 +113,9 @@ def default_config(name, parse=False):
         "send_federation": False,
         "media_store_path": "media",
         "uploads_path": "uploads",
+        # generate thumbnails on the (fake) threadpool rather than in other
+        # processes
+        "thumbnail_processes": 0,
         # the test signing key is just an arbitrary ed25519 key to keep the config
         # parser happy
         "signing_key": "ed25519 a_lPym qvioDNmfExFBRPgdTU+wtFYKq4JfwFRv7sYVgWvmgJg",
@@ -453,7 +456,9 @@ class MockHttpResource(HttpServer):
 
         raise KeyError("No event can handle %s" % path)
 
-    def register_paths(self, method, path_patterns, callback, servlet_name):
+    def register_paths(
+        self, method, path_patterns, callback, servlet_name, streaming=False
+    ):
         for path_pattern in path_patterns:
             self.callbacks.append((method, path_pattern, callback))
 